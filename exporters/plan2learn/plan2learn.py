@@ -55,8 +55,8 @@ ACTIVE_JOB_FUNCTIONS = []  # Liste over aktive engagementer som skal eksporteres
 
 
 def get_e_address(e_uuid, scope, lc_historic):
-    lora_addresses = lc_historic.addresses.values()
-    # Retrieving all addresses and flattening the list by one link.
+    lora_addresses = lc_historic.lookup("addresses", "user", e_uuid)
+    # Retrieving the user's addresses and flattening the list by one link.
     lora_addresses = flatten(lora_addresses)
     # Iterator of all addresses for the current user
     lora_addresses = filter(lambda address: address["user"] == e_uuid, lora_addresses)
@@ -157,9 +157,7 @@ def construct_bruger_row(user_uuid, cpr, name, email, phone):
 
 
 def export_bruger_lc(settings: Settings, node, used_cprs, lc, lc_historic):
-    # TODO: If this is to run faster, we need to pre-sort into units,
-    # to avoid iterating all engagements for each unit.
-    lora_engagements = lc_historic.engagements.values()
+    lora_engagements = lc_historic.lookup("engagements", "unit", node.name)
     lora_engagements = flatten(lora_engagements)
     lora_engagements = filter(lambda engv: engv["unit"] == node.name, lora_engagements)
     lora_engagements = filter(
@@ -204,7 +202,9 @@ def export_bruger_lc(settings: Settings, node, used_cprs, lc, lc_historic):
         if settings.plan2learn_variant == Variant.rsd:
             # For Viborg this is handled during "export_engagements"
             user_engagements = [
-                e for e in flatten(lc.engagements.values()) if e["user"] == user_uuid
+                e
+                for e in flatten(lc.lookup("engagements", "user", user_uuid))
+                if e["user"] == user_uuid
             ]
             # Ensure the same engagement is selected each time by sorting on user_key
             # Assumes the user-key has a prefix of a 2 digit institution identifier
@@ -284,7 +284,7 @@ def export_organisation(settings: Settings, mh, nodes, lc=None) -> list[dict]:
     rows = []
     for node in PreOrderIter(nodes["root"]):
         if lc:
-            for unit in lc.units.values():
+            for unit in lc.lookup("units", "uuid", node.name):
                 # Units are never terminated, we can safely take first value
                 unitv = unit[0]
                 if unitv["uuid"] != node.name:
@@ -299,7 +299,7 @@ def export_organisation(settings: Settings, mh, nodes, lc=None) -> list[dict]:
                 over_uuid = unitv["parent"] if unitv["parent"] else ""
 
                 address = None
-                for raw_address in lc.addresses.values():
+                for raw_address in lc.lookup("addresses", "unit", unitv["uuid"]):
                     if raw_address[0]["unit"] == unitv["uuid"]:
                         if raw_address[0]["scope"] == "DAR":
                             address = raw_address[0]["value"]
@@ -593,7 +593,7 @@ def export_leder_rsd(nodes, eksporterede_afdelinger, lc: GQLLoraCache):
 
         managers = [
             manager
-            for manager in flatten(lc.managers.values())
+            for manager in flatten(lc.lookup("managers", "unit", node.name))
             if manager["unit"] == node.name
         ]
         if not managers:
@@ -0,0 +1,105 @@
+"""Benchmark of writing the SQL export work tables.
+
+Exports the users, engagements and addresses of a synthetic organisation to a
+SQLite file, once adding ORM instances to a session and committing every
+`chunk_size` rows, as `SqlExport` used to, and once with the bulk Core inserts of
+`SqlExport._insert_rows`.
+
+Run with: python -m sql_export.benchmarks.bulk_insert --employees 100000
+"""
+
+import random
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import click
+from more_itertools import ichunked
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from ..sql_export import SqlExport
+from ..sql_table_defs import Base
+from ..sql_table_defs import WAdresse
+from ..sql_table_defs import WBruger
+from ..sql_table_defs import WEngagement
+from .record_memory import synthetic_caches
+
+
+class BenchmarkSqlExport(SqlExport):
+    def __init__(self, path: Path, lc: SimpleNamespace):
+        self.path = path
+        super().__init__(force_sqlite=True, settings={})
+        self.lc = lc
+
+    def _get_engine(self):
+        return create_engine(f"sqlite:///{self.path}")
+
+
+def synthetic_lc(employees: int) -> SimpleNamespace:
+    caches = synthetic_caches(employees, units=2_000)
+    class_uuids = {
+        v[field]
+        for field, collection in (
+            ("engagement_type", "engagements"),
+            ("primary_type", "engagements"),
+            ("job_function", "engagements"),
+            ("adresse_type", "addresses"),
+            ("visibility", "addresses"),
+        )
+        for (v,) in caches[collection].values()
+    }
+    classes = {
+        uuid: {"title": uuid[:8], "user_key": uuid[:8], "scope": "PUBLIC"}
+        for uuid in class_uuids
+    }
+    return SimpleNamespace(**caches, classes=classes)
+
+
+def orm_export(sql_export: BenchmarkSqlExport) -> None:
+    """Write the tables the way `SqlExport` did before bulk inserts."""
+    session = Session(sql_export.engine, autoflush=False)
+    for collection, generate, model in (
+        ("users", sql_export._generate_sql_users, WBruger),
+        ("engagements", sql_export._generate_sql_engagements, WEngagement),
+        ("addresses", sql_export._generate_sql_addresses, WAdresse),
+    ):
+        items = getattr(sql_export.lc, collection).items()
+        for chunk in ichunked(items, sql_export.chunk_size):
+            for uuid, validities in chunk:
+                for info in validities:
+                    session.add(generate(uuid, info, model))  # type: ignore
+            session.commit()
+    session.close()
+
+
+def bulk_export(sql_export: BenchmarkSqlExport) -> None:
+    sql_export._commit_batches = False
+    with sql_export.engine.connect() as sql_export.connection:
+        sql_export._add_users()
+        sql_export._add_engagements()
+        sql_export._add_addresses()
+        sql_export.connection.commit()
+
+
+@click.command()
+@click.option("--employees", default=100_000)
+def cli(employees: int) -> None:
+    random.seed(0)
+    lc = synthetic_lc(employees)
+    rows = len(lc.users) + len(lc.engagements) + len(lc.addresses)
+
+    click.echo(f"Synthetic organisation with {employees} employees, {rows} rows")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, export in (("ORM", orm_export), ("bulk", bulk_export)):
+            sql_export = BenchmarkSqlExport(Path(tmp) / f"{name}.db", lc)
+            Base.metadata.create_all(sql_export.engine)
+            start = time.perf_counter()
+            export(sql_export)
+            elapsed = time.perf_counter() - start
+            click.echo(f"{name:<8}{elapsed:>8.2f}s{rows / elapsed:>10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    cli()
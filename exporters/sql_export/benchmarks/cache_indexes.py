@@ -0,0 +1,115 @@
+"""Benchmark of LoRa cache lookups with and without reverse indexes.
+
+Runs the LoRa cache parts of an AD writer sync (`LoraCacheSource`) and of a
+plan2learn user export against a synthetic organisation, once scanning whole
+collections for every lookup, as before `CacheIndexes`, and once using the indexes.
+
+Run from the repository root with:
+python -m exporters.sql_export.benchmarks.cache_indexes --employees 5000
+"""
+
+import random
+import time
+from types import SimpleNamespace
+from typing import Any
+from uuid import UUID
+
+import click
+from anytree import Node
+
+from exporters.plan2learn.plan2learn import export_bruger_lc
+from exporters.plan2learn.plan2learn_settings import Variant
+from integrations.ad_integration.ad_writer import LoraCacheSource
+
+from ..cache_indexes import CacheIndexes
+from .record_memory import synthetic_caches
+
+
+class SyntheticCache(CacheIndexes):
+    def __init__(self, collections: dict[str, dict]):
+        vars(self).update(collections)
+
+
+class ScanningCache(SyntheticCache):
+    def lookup(self, collection: str, field: str, value: Any) -> list[list[dict]]:
+        return [
+            validities
+            for validities in getattr(self, collection).values()
+            if any(v.get(field) == value for v in validities)
+        ]
+
+
+def synthetic_organisation(employees: int, units: int) -> dict[str, dict]:
+    caches: dict[str, dict] = synthetic_caches(employees, units)
+    class_uuids = {
+        v[field]
+        for field, collection in (
+            ("engagement_type", "engagements"),
+            ("job_function", "engagements"),
+            ("adresse_type", "addresses"),
+            ("visibility", "addresses"),
+        )
+        for (v,) in caches[collection].values()
+    }
+    caches["classes"] = {
+        uuid: {"uuid": uuid, "title": uuid[:8], "scope": "PUBLIC"}
+        for uuid in class_uuids
+    }
+    caches["units"] = {
+        uuid: [{"uuid": uuid, "name": uuid[:8], "parent": None}]
+        for uuid in {v["unit"] for (v,) in caches["engagements"].values()}
+    }
+    return caches
+
+
+def ad_writer_sync(lc: CacheIndexes) -> None:
+    source = LoraCacheSource(lc, lc, mo_rest_source=None)
+    for uuid in lc.users:  # type: ignore
+        source.read_user(uuid)
+        source.get_email_address(uuid)
+        source.find_primary_engagement(uuid)
+        source.get_it_systems(uuid)
+
+
+def plan2learn_users(lc: CacheIndexes) -> None:
+    class_uuids = [UUID(uuid) for uuid in lc.classes]  # type: ignore
+    settings = SimpleNamespace(
+        exporters_plan2learn_allowed_engagement_types=set(class_uuids),
+        plan2learn_phone_priority=class_uuids,
+        plan2learn_email_priority=class_uuids,
+        plan2learn_variant=Variant.rsd,
+    )
+    used_cprs: set[str] = set()
+    for unit in lc.units:  # type: ignore
+        _, used_cprs = export_bruger_lc(
+            settings,  # type: ignore
+            Node(unit),
+            used_cprs,
+            lc,
+            lc,
+        )
+
+
+def timed(func, lc: CacheIndexes) -> float:
+    start = time.perf_counter()
+    func(lc)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--employees", default=5_000)
+@click.option("--units", default=500)
+def cli(employees: int, units: int) -> None:
+    random.seed(0)
+    collections = synthetic_organisation(employees, units)
+
+    click.echo(f"Synthetic organisation with {employees} employees")
+    click.echo(f"{'':<16}{'scanning':>12}{'indexed':>12}")
+    for name, func in (("AD writer", ad_writer_sync), ("plan2learn", plan2learn_users)):
+        scanning = timed(func, ScanningCache(collections))
+        indexed = timed(func, SyntheticCache(collections))
+        click.echo(f"{name:<16}{scanning:>11.2f}s{indexed:>11.2f}s")
+
+
+if __name__ == "__main__":
+    cli()
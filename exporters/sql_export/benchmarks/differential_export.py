@@ -0,0 +1,117 @@
+"""Benchmark of the full export, rebuilding the tables or writing only the changes.
+
+Exports the users, engagements and addresses of a synthetic organisation to a
+SQLite file, changes a fraction of the users and engagements, and exports them
+again, once rebuilding the work tables and swapping them with the current tables,
+and once with the `differential` setting, which applies only the changed rows to
+the current tables. The database is in WAL mode without automatic checkpoints, so
+the size of the WAL file is the volume of the transaction log of each export.
+
+Run with: python -m sql_export.benchmarks.differential_export --employees 100000
+"""
+
+import copy
+import random
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import click
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import text
+
+from ..sql_export import SqlExport
+from .bulk_insert import synthetic_lc
+
+COLLECTIONS = (
+    "units",
+    "dar_cache",
+    "associations",
+    "leaves",
+    "managers",
+    "itsystems",
+    "it_connections",
+    "kles",
+    "related",
+)
+
+
+class BenchmarkSqlExport(SqlExport):
+    def __init__(self, path: Path, differential: bool):
+        self.path = path
+        super().__init__(
+            force_sqlite=True,
+            settings={
+                "exporters.actual_state.differential": differential,
+                "exporters.actual_state.derived_tables": False,
+            },
+        )
+
+    def _get_engine(self):
+        engine = create_engine(f"sqlite:///{self.path}")
+
+        @event.listens_for(engine, "connect")
+        def connect(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
+            dbapi_connection.execute("PRAGMA wal_autocheckpoint=0")
+
+        return engine
+
+    def checkpoint(self) -> None:
+        with self.engine.connect() as connection:
+            connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+
+    def wal_size(self) -> int:
+        wal = self.path.with_name(self.path.name + "-wal")
+        return wal.stat().st_size if wal.exists() else 0
+
+
+def changed_lc(lc: SimpleNamespace, changes: float) -> SimpleNamespace:
+    """A copy of `lc`, with a fraction of its users and engagements changed."""
+    changed = copy.deepcopy(lc)
+    for collection, field in (("users", "efternavn"), ("engagements", "user_key")):
+        objects = getattr(changed, collection)
+        for uuid in random.sample(list(objects), int(len(objects) * changes)):
+            objects[uuid][0][field] += " (ændret)"
+    return changed
+
+
+def export(sql_export: BenchmarkSqlExport, lc: SimpleNamespace) -> tuple[float, int]:
+    """Export `lc`, returning the seconds taken and the bytes of WAL written."""
+    sql_export.lc = lc
+    sql_export.checkpoint()
+    start = time.perf_counter()
+    sql_export.export(resolve_dar=False, use_pickle=False)
+    return time.perf_counter() - start, sql_export.wal_size()
+
+
+@click.command()
+@click.option("--employees", default=100_000)
+@click.option("--changes", default=0.01, help="Fraction of objects changed")
+def cli(employees: int, changes: float) -> None:
+    random.seed(0)
+    lc = synthetic_lc(employees)
+    for collection in COLLECTIONS:
+        setattr(lc, collection, {})
+    lc.facets = {"facet": {"user_key": "facet"}}
+    for klasse in lc.classes.values():
+        klasse["facet"] = "facet"
+    changed = changed_lc(lc, changes)
+    rows = len(lc.users) + len(lc.engagements) + len(lc.addresses)
+
+    click.echo(f"Synthetic organisation with {rows} rows, {changes:.1%} changed")
+    click.echo(f"{'':<14}{'runtime':>10}{'WAL':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, differential in (("rebuild+swap", False), ("differential", True)):
+            sql_export = BenchmarkSqlExport(Path(tmp) / f"{name}.db", differential)
+            # The first export always rebuilds, as there are no current tables
+            export(sql_export, lc)
+            elapsed, wal = export(sql_export, changed)
+            assert sql_export._differential == differential
+            click.echo(f"{name:<14}{elapsed:>9.2f}s{wal / 2**20:>9.1f} MiB")
+
+
+if __name__ == "__main__":
+    cli()
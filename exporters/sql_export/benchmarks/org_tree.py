@@ -0,0 +1,121 @@
+"""Benchmark of walking the tree of units, with and without `OrgTree`.
+
+Builds a synthetic tree of units down to the given depth, and for the unit of
+every employee finds its location, the unit of a given level above it, as
+`ADWriter._find_unit_info` does, and whether it is below one of a few allowed root
+units, as `AdLifeCycle._find_user_unit_tree` does. It does so once walking the
+parents of the unit every time, as before `OrgTree`, and once with a tree built
+once for the cache.
+
+Run with: python -m sql_export.benchmarks.org_tree --units 20000 --depth 10
+"""
+
+import random
+import time
+from collections.abc import Callable
+from uuid import uuid4
+
+import click
+
+from ..org_tree import OrgTree
+
+
+def synthetic_units(units: int, depth: int) -> dict[str, list[dict]]:
+    """A tree of `units` units, with `depth` levels below a single root."""
+    root = str(uuid4())
+    levels = [[root]]
+    tree = {root: [{"uuid": root, "name": "Kommune", "parent": None, "level": 0}]}
+    per_level = (units - 1) // depth
+    for level in range(1, depth + 1):
+        levels.append([])
+        for _ in range(per_level):
+            uuid = str(uuid4())
+            parent = random.choice(levels[level - 1])
+            tree[uuid] = [
+                {"uuid": uuid, "name": uuid[:8], "parent": parent, "level": level}
+            ]
+            levels[level].append(uuid)
+    return tree
+
+
+def walk_locations(units: dict, lookups: list[str]) -> None:
+    for uuid in lookups:
+        location = units[uuid][0]["name"]
+        parent = units[uuid][0]["parent"]
+        while parent is not None:
+            location = units[parent][0]["name"] + "\\" + location
+            parent = units[parent][0]["parent"]
+
+
+def tree_locations(tree: OrgTree, lookups: list[str]) -> None:
+    for uuid in lookups:
+        tree.location(uuid)
+
+
+def walk_level(units: dict, lookups: list[str]) -> None:
+    for uuid in lookups:
+        level2orgunit = None
+        while uuid is not None:
+            if units[uuid][0]["level"] == 2:
+                level2orgunit = uuid
+            uuid = units[uuid][0]["parent"]
+        del level2orgunit
+
+
+def tree_level(units: dict, tree: OrgTree, lookups: list[str]) -> None:
+    for uuid in lookups:
+        next((u for u in tree.path(uuid) if units[u][0]["level"] == 2), None)
+
+
+def walk_roots(units: dict, roots: set[str], lookups: list[str]) -> None:
+    for uuid in lookups:
+        while uuid is not None and uuid not in roots:
+            uuid = units[uuid][0]["parent"]
+
+
+def tree_roots(tree: OrgTree, roots: set[str], lookups: list[str]) -> None:
+    for uuid in lookups:
+        any(tree.is_descendant(uuid, root) for root in roots)
+
+
+@click.command()
+@click.option("--units", default=20_000)
+@click.option("--depth", default=10)
+@click.option("--employees", default=100_000, help="Lookups, one per employee")
+def cli(units: int, depth: int, employees: int) -> None:
+    random.seed(0)
+    tree = synthetic_units(units, depth)
+    roots = set(random.sample([u for u, (v,) in tree.items() if v["level"] == 3], 5))
+    lookups = random.choices(list(tree), k=employees)
+
+    click.echo(f"Synthetic tree of {len(tree)} units, {depth} levels deep")
+    start = time.perf_counter()
+    org_tree = OrgTree.from_units(tree)
+    click.echo(f"Building the OrgTree took {time.perf_counter() - start:.3f}s")
+
+    click.echo(f"{f'{employees} lookups':<16}{'walk':>10}{'OrgTree':>10}")
+    benchmarks: dict[str, tuple[Callable[[], None], Callable[[], None]]] = {
+        "locations": (
+            lambda: walk_locations(tree, lookups),
+            lambda: tree_locations(org_tree, lookups),
+        ),
+        "level2orgunit": (
+            lambda: walk_level(tree, lookups),
+            lambda: tree_level(tree, org_tree, lookups),
+        ),
+        "user trees": (
+            lambda: walk_roots(tree, roots, lookups),
+            lambda: tree_roots(org_tree, roots, lookups),
+        ),
+    }
+    for name, (walk, with_tree) in benchmarks.items():
+        timings = []
+        for run in (walk, with_tree):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        click.echo(f"{name:<16}{timings[0]:>9.3f}s{timings[1]:>9.3f}s")
+
+
+if __name__ == "__main__":
+    cli()
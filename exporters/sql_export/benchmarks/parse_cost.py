@@ -0,0 +1,84 @@
+"""Micro-benchmark of the cost of parsing the LoRa cache GraphQL queries.
+
+Compares parsing the query text for every page, as `_execute_query` used to do,
+with looking up the document in the `compile_query` cache.
+
+Run with: python -m sql_export.benchmarks.parse_cost --pages 1000
+"""
+
+import asyncio
+import timeit
+from unittest.mock import AsyncMock
+
+import click
+from gql import gql
+from graphql import ExecutionResult
+
+from .. import gql_lora_cache_async
+from ..gql_lora_cache_async import GQLLoraCache
+from ..gql_lora_cache_async import collection_name
+from ..gql_lora_cache_async import compile_query
+
+
+def collect_queries(full_history: bool) -> list[str]:
+    """Run every `_fetch_*` method against a fake session, recording the queries."""
+    lc = GQLLoraCache(full_history=full_history)
+    lc._get_org_uuid = AsyncMock(return_value="org")  # type: ignore
+    session = AsyncMock()
+    session.execute.return_value = ExecutionResult(
+        data={"page": {"objects": [], "page_info": {"next_cursor": None}}}
+    )
+    lc.gql_client_session = AsyncMock(return_value=session)  # type: ignore
+
+    queries: list[str] = []
+    original = compile_query.__wrapped__
+
+    async def fetch_all() -> None:
+        for fetch in (
+            lc._fetch_facets,
+            lc._fetch_classes,
+            lc._fetch_itsystems,
+            lc._fetch_users,
+            lc._fetch_units,
+            lc._fetch_engagements,
+            lc._fetch_leaves,
+            lc._fetch_it_connections,
+            lc._fetch_kles,
+            lc._fetch_related,
+            lc._fetch_managers,
+            lc._fetch_associations,
+            lc._fetch_address,
+        ):
+            await fetch()
+
+    def record(query: str):
+        queries.append(query)
+        return original(query)
+
+    gql_lora_cache_async.compile_query = record  # type: ignore
+    try:
+        asyncio.run(fetch_all())
+    finally:
+        gql_lora_cache_async.compile_query = compile_query  # type: ignore
+    return queries
+
+
+@click.command()
+@click.option("--pages", default=1000, help="Number of pages fetched per collection")
+@click.option("--historic/--no-historic", default=True)
+def cli(pages: int, historic: bool) -> None:
+    queries = collect_queries(historic)
+    total_uncached = total_cached = 0.0
+    click.echo(f"{'collection':<16}{'gql() per page':>18}{'compile_query':>18}")
+    for query in queries:
+        uncached = timeit.timeit(lambda: gql(query), number=pages)
+        compile_query.cache_clear()
+        cached = timeit.timeit(lambda: compile_query(query), number=pages)
+        total_uncached += uncached
+        total_cached += cached
+        click.echo(f"{collection_name(query):<16}{uncached:>17.4f}s{cached:>17.4f}s")
+    click.echo(f"{'total':<16}{total_uncached:>17.4f}s{total_cached:>17.4f}s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,153 @@
+"""Memory benchmark of compact LoRa cache records.
+
+Builds the user, engagement, address and IT user collections of a synthetic
+organisation, the way `GQLLoraCache` stores them, and measures their memory use
+as dicts and as compact records.
+
+Run with: python -m sql_export.benchmarks.record_memory --employees 100000
+"""
+
+import gc
+import random
+import time
+import tracemalloc
+from uuid import uuid4
+
+import click
+
+from ..compact_records import compact_collection
+
+
+def _uuid() -> str:
+    return str(uuid4())
+
+
+def _dates() -> dict[str, str]:
+    year = random.randint(1990, 2023)
+    return {"from_date": f"{year}-01-01", "to_date": "9999-12-31"}
+
+
+def synthetic_caches(employees: int, units: int) -> dict[str, dict[str, list]]:
+    unit_uuids = [_uuid() for _ in range(units)]
+    classes = [_uuid() for _ in range(50)]
+    itsystem = _uuid()
+
+    users: dict[str, list] = {}
+    engagements: dict[str, list] = {}
+    addresses: dict[str, list] = {}
+    it_connections: dict[str, list] = {}
+    for i in range(employees):
+        user_uuid = _uuid()
+        users[user_uuid] = [
+            {
+                "uuid": user_uuid,
+                "cpr": f"{i:010d}",
+                "user_key": f"user{i}",
+                "navn": f"Fornavn{i} Efternavn{i}",
+                "fornavn": f"Fornavn{i}",
+                "efternavn": f"Efternavn{i}",
+                "kaldenavn": "",
+                "kaldenavn_fornavn": "",
+                "kaldenavn_efternavn": "",
+                **_dates(),
+            }
+        ]
+        engagement_uuid = _uuid()
+        unit_uuid = random.choice(unit_uuids)
+        engagements[engagement_uuid] = [
+            {
+                "uuid": engagement_uuid,
+                "user": user_uuid,
+                "unit": unit_uuid,
+                "fraction": None,
+                "user_key": f"{i}",
+                "engagement_type": random.choice(classes),
+                "primary_type": random.choice(classes),
+                "primary_boolean": True,
+                "job_function": random.choice(classes),
+                "extensions": {f"udvidelse_{n}": None for n in range(1, 11)},
+                **_dates(),
+            }
+        ]
+        for scope, value in (
+            ("E-mail", f"user{i}@kommune.dk"),
+            ("Telefon", "12345678"),
+        ):
+            address_uuid = _uuid()
+            addresses[address_uuid] = [
+                {
+                    "uuid": address_uuid,
+                    "user": user_uuid,
+                    "unit": None,
+                    "engagement": engagement_uuid,
+                    "ituser": None,
+                    "adresse_type": random.choice(classes),
+                    "visibility": random.choice(classes),
+                    "value": value,
+                    "user_key": value,
+                    "scope": scope,
+                    "dar_uuid": None,
+                    **_dates(),
+                }
+            ]
+        it_uuid = _uuid()
+        it_connections[it_uuid] = [
+            {
+                "uuid": it_uuid,
+                "user": user_uuid,
+                "unit": None,
+                "username": f"user{i}",
+                "external_id": None,
+                "itsystem": itsystem,
+                "primary_boolean": None,
+                "engagement_uuids": [engagement_uuid],
+                **_dates(),
+            }
+        ]
+    return {
+        "users": users,
+        "engagements": engagements,
+        "addresses": addresses,
+        "it_connections": it_connections,
+    }
+
+
+def read_all(caches: dict[str, dict[str, list]]) -> float:
+    start = time.perf_counter()
+    for cache in caches.values():
+        for validities in cache.values():
+            for validity in validities:
+                validity["uuid"]
+                validity["from_date"]
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--employees", default=100_000)
+@click.option("--units", default=2_000)
+def cli(employees: int, units: int) -> None:
+    random.seed(0)
+    tracemalloc.start()
+    caches = synthetic_caches(employees, units)
+    gc.collect()
+    as_dicts, _ = tracemalloc.get_traced_memory()
+    dict_read = read_all(caches)
+
+    for name, cache in caches.items():
+        compact_collection(name, cache)
+    gc.collect()
+    as_records, _ = tracemalloc.get_traced_memory()
+    record_read = read_all(caches)
+    tracemalloc.stop()
+
+    mb = 1024 * 1024
+    click.echo(f"Synthetic organisation with {employees} employees")
+    click.echo(f"{'':<16}{'memory':>12}{'read all':>12}")
+    click.echo(f"{'dicts':<16}{as_dicts / mb:>10.1f}MB{dict_read:>11.2f}s")
+    click.echo(
+        f"{'compact records':<16}{as_records / mb:>10.1f}MB{record_read:>11.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,270 @@
+"""Benchmark of the report queries on the exported tables, with and without indexes.
+
+Writes the work tables of a synthetic organisation to a SQLite file, as read by the
+reports of `reports/query_actualstate.py`, and runs the queries of its
+`set_of_org_units`, `list_employees` and `list_MED_members`, first on the bare
+tables and then after `SqlExport.create_indexes`. The queries are rebuilt here, as
+the report module needs pandas and a MO to import, and the query plans SQLite
+chooses are printed alongside the timings.
+
+Run with: python -m sql_export.benchmarks.report_indexes --employees 20000
+"""
+
+import random
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from uuid import uuid4
+
+import click
+from sqlalchemy import create_engine
+from sqlalchemy import insert
+from sqlalchemy import or_
+from sqlalchemy import text
+from sqlalchemy.orm import Query
+from sqlalchemy.orm import Session
+
+from ..sql_export import SqlExport
+from ..sql_table_defs import Base
+from ..sql_table_defs import WAdresse as Adresse
+from ..sql_table_defs import WBruger as Bruger
+from ..sql_table_defs import WEngagement as Engagement
+from ..sql_table_defs import WEnhed as Enhed
+from ..sql_table_defs import WTilknytning as Tilknytning
+
+DATES = {"startdato": "2020-01-01", "slutdato": "9999-12-31"}
+
+
+class BenchmarkSqlExport(SqlExport):
+    def __init__(self, path: Path):
+        self.path = path
+        super().__init__(force_sqlite=True, settings={})
+
+    def _get_engine(self):
+        return create_engine(f"sqlite:///{self.path}")
+
+
+def _uuid() -> str:
+    return str(uuid4())
+
+
+def write_organisation(sql_export: SqlExport, employees: int, units: int) -> None:
+    """Write a tree of `units` under the units "Løn" and "MED", and employees."""
+    roots = {"Løn": _uuid(), "MED": _uuid()}
+    unit_rows = [
+        {"uuid": uuid, "navn": name, "bvn": name, "forældreenhed_uuid": None}
+        for name, uuid in roots.items()
+    ]
+    trees: dict[str, list[str]] = {name: [uuid] for name, uuid in roots.items()}
+    for i in range(units):
+        tree = trees["Løn" if i % 4 else "MED"]
+        uuid = _uuid()
+        unit_rows.append(
+            {
+                "uuid": uuid,
+                "navn": f"Enhed {i}",
+                "bvn": f"{i}",
+                "forældreenhed_uuid": random.choice(tree[-50:]),
+            }
+        )
+        tree.append(uuid)
+
+    users, engagements, addresses, associations = [], [], [], []
+    for i in range(employees):
+        user = _uuid()
+        users.append(
+            {"uuid": user, "bvn": f"{i}", "fornavn": "Fornavn", "efternavn": f"{i}"}
+        )
+        engagements.append(
+            {
+                "uuid": _uuid(),
+                "bruger_uuid": user,
+                "enhed_uuid": random.choice(trees["Løn"]),
+                "bvn": f"{i}",
+                "engagementstype_titel": "Ansat",
+                "stillingsbetegnelse_titel": "Stilling",
+            }
+        )
+        for address_type, value in (
+            ("AD-Email", f"user{i}@kommune.dk"),
+            ("AD-Telefonnummer", "12345678"),
+            ("Postadresse", "Vej 1"),
+        ):
+            addresses.append(
+                {
+                    "uuid": _uuid(),
+                    "bruger_uuid": user,
+                    "værdi": value,
+                    "adressetype_bvn": address_type,
+                    "adressetype_scope": "TEXT",
+                    "adressetype_titel": address_type,
+                    "synlighed_titel": None,
+                }
+            )
+        if i % 10 == 0:
+            associations.append(
+                {
+                    "uuid": _uuid(),
+                    "bvn": f"{i}",
+                    "bruger_uuid": user,
+                    "enhed_uuid": random.choice(trees["MED"]),
+                    "tilknytningstype_titel": "Medlem",
+                }
+            )
+
+    with sql_export.engine.begin() as connection:
+        for model, rows in (
+            (Enhed, [{**row, "enhedstype_titel": "Enhed"} for row in unit_rows]),
+            (Bruger, users),
+            (Engagement, engagements),
+            (Adresse, addresses),
+            (Tilknytning, associations),
+        ):
+            connection.execute(insert(model), [{**row, **DATES} for row in rows])
+
+
+def set_of_org_units(session: Session, org_name: str) -> set:
+    (root,) = session.query(Enhed.uuid).filter(Enhed.navn == org_name).one()
+    units = children = {root}
+    while children:
+        children = {
+            uuid
+            for (uuid,) in session.query(Enhed.uuid).filter(
+                Enhed.forældreenhed_uuid.in_(children)
+            )
+        }
+        units |= children
+    return units
+
+
+def _addresses(session: Session, address_type: str):
+    return (
+        session.query(Adresse.værdi, Adresse.bruger_uuid)
+        .filter(
+            Adresse.adressetype_titel == address_type,
+            or_(
+                Adresse.synlighed_titel.is_(None),
+                Adresse.synlighed_titel != "Hemmelig",
+            ),
+        )
+        .subquery()
+    )
+
+
+def list_employees(session: Session, units: set) -> Query:
+    emails = _addresses(session, "AD-Email")
+    phones = _addresses(session, "AD-Telefonnummer")
+    return (
+        session.query(
+            Bruger.uuid,
+            Bruger.fornavn + " " + Bruger.efternavn,
+            emails.c.værdi,
+            phones.c.værdi,
+            Enhed.navn,
+            Engagement.stillingsbetegnelse_titel,
+        )
+        .filter(
+            Enhed.uuid == Engagement.enhed_uuid,
+            Engagement.enhed_uuid.in_(units),
+            Engagement.bruger_uuid == Bruger.uuid,
+        )
+        .join(emails, emails.c.bruger_uuid == Bruger.uuid, isouter=True)
+        .join(phones, phones.c.bruger_uuid == Bruger.uuid, isouter=True)
+        .order_by(Bruger.efternavn)
+    )
+
+
+def list_MED_members(session: Session, units: set, med_units: set) -> Query:
+    emails = _addresses(session, "AD-Email")
+    phones = _addresses(session, "AD-Telefonnummer")
+    eng_unit = (
+        session.query(Enhed.navn, Engagement.bruger_uuid)
+        .filter(
+            Enhed.uuid == Engagement.enhed_uuid,
+            Engagement.enhed_uuid.in_(units),
+            Engagement.bruger_uuid == Bruger.uuid,
+        )
+        .subquery()
+    )
+    return (
+        session.query(
+            Tilknytning.uuid,
+            Bruger.fornavn + " " + Bruger.efternavn,
+            emails.c.værdi,
+            phones.c.værdi,
+            Tilknytning.tilknytningstype_titel,
+            Enhed.navn,
+            eng_unit.c.navn,
+        )
+        .filter(
+            Enhed.uuid == Tilknytning.enhed_uuid,
+            Tilknytning.enhed_uuid.in_(med_units),
+            Tilknytning.bruger_uuid == Bruger.uuid,
+        )
+        .join(emails, emails.c.bruger_uuid == Bruger.uuid, isouter=True)
+        .join(phones, phones.c.bruger_uuid == Bruger.uuid, isouter=True)
+        .join(eng_unit, eng_unit.c.bruger_uuid == Bruger.uuid)
+        .order_by(Bruger.efternavn)
+    )
+
+
+def query_plan(session: Session, query: Query) -> list[str]:
+    statement = query.statement.compile(
+        session.get_bind(), compile_kwargs={"literal_binds": True}
+    )
+    rows = session.execute(text(f"EXPLAIN QUERY PLAN {statement}"))
+    return [detail for _, _, _, detail in rows]
+
+
+def run_reports(session: Session, plans: bool) -> None:
+    units = set_of_org_units(session, "Løn")
+    med_units = set_of_org_units(session, "MED")
+    queries: dict[str, Callable[[], Query]] = {
+        "list_employees": lambda: list_employees(session, units),
+        "list_MED_members": lambda: list_MED_members(session, units, med_units),
+    }
+
+    start = time.perf_counter()
+    set_of_org_units(session, "Løn")
+    click.echo(f"  {'set_of_org_units':<20}{time.perf_counter() - start:>8.2f}s")
+    for name, query in queries.items():
+        start = time.perf_counter()
+        rows = query().all()
+        elapsed = time.perf_counter() - start
+        click.echo(f"  {name:<20}{elapsed:>8.2f}s{len(rows):>10} rows")
+        if plans:
+            for detail in query_plan(session, query()):
+                click.echo(f"    {detail}")
+
+
+@click.command()
+@click.option("--employees", default=20_000)
+@click.option("--units", default=2_000)
+@click.option("--plans/--no-plans", default=True, help="Print the query plans")
+def cli(employees: int, units: int, plans: bool) -> None:
+    random.seed(0)
+    click.echo(f"Synthetic organisation with {employees} employees, {units} units")
+    with tempfile.TemporaryDirectory() as tmp:
+        sql_export = BenchmarkSqlExport(Path(tmp) / "reports.db")
+        Base.metadata.create_all(
+            sql_export.engine,
+            tables=[Base.metadata.tables[name] for name in sql_export._work_tables()],
+        )
+        write_organisation(sql_export, employees, units)
+
+        click.echo("Without indexes")
+        with Session(sql_export.engine) as session:
+            run_reports(session, plans)
+
+        start = time.perf_counter()
+        sql_export.create_indexes(sql_export._work_tables())
+        click.echo(f"Creating indexes took {time.perf_counter() - start:.2f}s")
+
+        click.echo("With indexes")
+        with Session(sql_export.engine) as session:
+            run_reports(session, plans)
+
+
+if __name__ == "__main__":
+    cli()
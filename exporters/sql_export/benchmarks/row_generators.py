@@ -0,0 +1,148 @@
+"""Profile of the row generators of `SqlExport`, with and without prepared lookups.
+
+Generates the rows of every collection of a synthetic organisation, without writing
+them anywhere, once looking up classes and units in the LoRa cache, as the
+event-driven export does, and once with the `PreparedLookups` of a full export,
+and reports the time spent in every generator.
+
+Run with: python -m sql_export.benchmarks.row_generators --employees 100000
+"""
+
+import random
+import time
+from collections import deque
+from collections.abc import Callable
+from collections.abc import Iterable
+from itertools import chain
+from itertools import starmap
+from types import SimpleNamespace
+from uuid import uuid4
+
+import click
+from sqlalchemy import create_engine
+
+from ..org_tree import OrgTree
+from ..prepared_lookups import PreparedLookups
+from ..sql_export import SqlExport
+from .bulk_insert import synthetic_lc
+
+
+class BenchmarkSqlExport(SqlExport):
+    def __init__(self, lc: SimpleNamespace):
+        super().__init__(force_sqlite=True, settings={})
+        self.lc = lc
+
+    def _get_engine(self):
+        return create_engine("sqlite://")
+
+
+def _dates() -> dict[str, str | None]:
+    return {"from_date": "2020-01-01", "to_date": None}
+
+
+def add_units_and_managers(lc: SimpleNamespace, units: int) -> None:
+    """Add a tree of units, with a manager and a KLE each, and their unit paths."""
+    classes = list(lc.classes)
+    unit_uuids = list({v["unit"] for (v,) in lc.engagements.values()})[:units]
+    lc.units, lc.managers, lc.kles = {}, {}, {}
+    for i, uuid in enumerate(unit_uuids):
+        lc.units[uuid] = [
+            {
+                "uuid": uuid,
+                "name": f"Enhed {i}",
+                "user_key": f"{i}",
+                "parent": random.choice(unit_uuids[:i]) if i else None,
+                "unit_type": random.choice(classes),
+                "level": random.choice(classes),
+                "time_planning": random.choice(classes),
+                "org_unit_hierarchy": None,
+                "location": "",
+                **_dates(),
+            }
+        ]
+        manager = str(uuid4())
+        lc.managers[manager] = [
+            {
+                "uuid": manager,
+                "user": random.choice(list(lc.users)),
+                "unit": uuid,
+                "manager_type": random.choice(classes),
+                "manager_level": random.choice(classes),
+                "manager_responsibility": random.sample(classes, 2),
+                **_dates(),
+            }
+        ]
+        kle = str(uuid4())
+        lc.kles[kle] = [
+            {
+                "uuid": kle,
+                "unit": uuid,
+                "kle_aspect": random.choice(classes),
+                "kle_number": random.choice(classes),
+                **_dates(),
+            }
+        ]
+    tree = OrgTree.from_units(lc.units)
+    lc.unit_paths = {uuid: list(tree.path(uuid)) for uuid in lc.units}
+
+
+def generators(sql_export: SqlExport) -> dict[str, Callable[[], Iterable]]:
+    lc = sql_export.lc
+    return {
+        "units": lambda: starmap(sql_export._unit_rows, lc.units.items()),
+        "users": lambda: starmap(sql_export._user_rows, lc.users.items()),
+        "engagements": lambda: starmap(
+            sql_export._engagement_rows, lc.engagements.items()
+        ),
+        "addresses": lambda: starmap(sql_export._address_rows, lc.addresses.items()),
+        "managers": lambda: starmap(sql_export._manager_rows, lc.managers.items()),
+        "it users": lambda: starmap(
+            sql_export._it_user_rows, lc.it_connections.items()
+        ),
+        "kles": lambda: starmap(sql_export._kle_rows, lc.kles.items()),
+        "unit paths": lambda: starmap(
+            sql_export._unit_path_rows, lc.unit_paths.items()
+        ),
+    }
+
+
+def run(rows: Callable[[], Iterable]) -> tuple[int, float]:
+    """Generate all the rows, returning their number and the seconds taken."""
+    start = time.perf_counter()
+    counted = deque(enumerate(chain.from_iterable(rows()), start=1), maxlen=1)
+    elapsed = time.perf_counter() - start
+    return (counted[0][0] if counted else 0), elapsed
+
+
+@click.command()
+@click.option("--employees", default=100_000)
+@click.option("--units", default=2_000)
+def cli(employees: int, units: int) -> None:
+    random.seed(0)
+    lc = synthetic_lc(employees)
+    lc.facets = {"facet": {"user_key": "facet"}}
+    for klasse in lc.classes.values():
+        klasse["facet"] = "facet"
+    add_units_and_managers(lc, units)
+    sql_export = BenchmarkSqlExport(lc)
+
+    start = time.perf_counter()
+    prepared = PreparedLookups(lc)
+    click.echo(f"Preparing the lookups took {time.perf_counter() - start:.3f}s")
+
+    click.echo(
+        f"{'generator':<14}{'rows':>9}{'cache':>10}{'prepared':>10}{'µs/row':>8}"
+    )
+    for name, rows in generators(sql_export).items():
+        sql_export._lookups = None
+        count, cached = run(rows)
+        sql_export._lookups = prepared
+        _, elapsed = run(rows)
+        per_row = elapsed / count * 1e6 if count else 0
+        click.echo(
+            f"{name:<14}{count:>9}{cached:>9.3f}s{elapsed:>9.3f}s{per_row:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    cli()
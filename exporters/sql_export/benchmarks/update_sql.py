@@ -0,0 +1,108 @@
+"""Benchmark of updating the rows of a single object from an AMQP event.
+
+Updates the KLE rows of a synthetic unit with `SqlExport.update_sql`, once with the
+list membership diff `update_sql` used to do, comparing copies of the instance
+dicts and deleting and adding rows one at a time, and once with the set-based diff
+and bulk statements.
+
+Run with: python -m sql_export.benchmarks.update_sql --kles 5000
+"""
+
+import tempfile
+import time
+from pathlib import Path
+from uuid import uuid4
+
+import click
+from sqlalchemy import create_engine
+from sqlalchemy import select
+
+from ..sql_export import SqlExport
+from ..sql_table_defs import KLE
+from ..sql_table_defs import Base
+
+
+class BenchmarkSqlExport(SqlExport):
+    def __init__(self, path: Path):
+        self.path = path
+        super().__init__(force_sqlite=True, settings={})
+        self.session = self._get_db_session()
+
+    def _get_engine(self):
+        return create_engine(f"sqlite:///{self.path}")
+
+
+def _legacy_eq(left_row, right_row) -> bool:
+    left = dict(left_row.__dict__)
+    left.pop("id", None)
+    left.pop("_sa_instance_state", None)
+    right = dict(right_row.__dict__)
+    right.pop("id", None)
+    right.pop("_sa_instance_state", None)
+    return left == right
+
+
+def legacy_update_sql(
+    sql_export: SqlExport, uuid: str, objects: list[KLE], table: type[KLE]
+) -> None:
+    """Update the rows the way `update_sql` did before the set-based diff."""
+    session = sql_export.session
+    current_objects = session.scalars(select(table).where(table.uuid == uuid)).all()
+
+    def contains(rows, row) -> bool:
+        return any(_legacy_eq(row, r) for r in rows)
+
+    for r in [r for r in current_objects if not contains(objects, r)]:
+        session.delete(r)
+    for n in [n for n in objects if not contains(current_objects, n)]:
+        session.add(n)
+    session.commit()
+
+
+def synthetic_kles(uuid: str, unit: str, kles: int, changed: int) -> list[KLE]:
+    return [
+        KLE(
+            uuid=uuid,
+            enhed_uuid=unit,
+            kle_aspekt_uuid=str(i),
+            kle_aspekt_titel="Udførende",
+            kle_nummer_uuid=str(i),
+            kle_nummer_titel=f"00.{i:05}" + ("x" if i < changed else ""),
+            startdato="2020-01-01",
+            slutdato="9999-12-31",
+        )
+        for i in range(kles)
+    ]
+
+
+@click.command()
+@click.option("--kles", default=5_000)
+@click.option("--changed", default=50)
+def cli(kles: int, changed: int) -> None:
+    uuid = str(uuid4())
+    unit = str(uuid4())
+
+    click.echo(f"Synthetic unit with {kles} KLE rows")
+    click.echo(f"{'':<16}{'unchanged':>12}{f'{changed} changed':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, update in (
+            ("list diff", legacy_update_sql),
+            ("set diff", SqlExport.update_sql),
+        ):
+            sql_export = BenchmarkSqlExport(Path(tmp) / f"{name}.db")
+            Base.metadata.create_all(sql_export.engine)
+            sql_export.session.add_all(synthetic_kles(uuid, unit, kles, 0))
+            sql_export.session.commit()
+
+            timings = []
+            for n in (0, changed):
+                objects = synthetic_kles(uuid, unit, kles, n)
+                start = time.perf_counter()
+                update(sql_export, uuid, objects, KLE)  # type: ignore
+                timings.append(time.perf_counter() - start)
+            unchanged, updated = timings
+            click.echo(f"{name:<16}{unchanged:>11.2f}s{updated:>11.2f}s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,53 @@
+"""Reverse indexes over LoRa cache collections.
+
+The collections of the LoRa cache map uuids to lists of validities, so finding
+e.g. the addresses of a single user means scanning every address in the cache.
+`CacheIndexes` builds reverse indexes from the value of a field to the uuids of the
+objects holding it, the first time they are needed, turning such lookups into
+dict lookups. Likewise, `org_tree` builds the tree of the units, see `OrgTree`.
+
+Indexes are not maintained when a collection changes; call `invalidate_indexes`
+after modifying the cache.
+"""
+
+from collections import defaultdict
+from typing import Any
+
+from .org_tree import OrgTree
+
+
+class CacheIndexes:
+    def index(self, collection: str, field: str) -> dict[Any, list[str]]:
+        """Get the index of `collection` by `field`, building it if needed.
+
+        Returns:
+            Mapping from every value of `field` in any validity of the collection
+            to the uuids of the objects with that value, in collection order.
+        """
+        indexes = vars(self).setdefault("_indexes", {})
+        if (key := (collection, field)) not in indexes:
+            index: dict[Any, list[str]] = defaultdict(list)
+            for uuid, validities in getattr(self, collection).items():
+                for value in dict.fromkeys(v.get(field) for v in validities):
+                    index[value].append(uuid)
+            indexes[key] = dict(index)
+        return indexes[key]
+
+    def lookup(self, collection: str, field: str, value: Any) -> list[list[dict]]:
+        """Find the objects of `collection` with a validity where `field` is `value`.
+
+        Returns:
+            The validities of each matching object, in collection order.
+        """
+        cache = getattr(self, collection)
+        return [cache[uuid] for uuid in self.index(collection, field).get(value, ())]
+
+    def org_tree(self) -> OrgTree:
+        """Get the tree of the units of the cache, building it if needed."""
+        indexes = vars(self).setdefault("_indexes", {})
+        if "org_tree" not in indexes:
+            indexes["org_tree"] = OrgTree.from_units(getattr(self, "units"))
+        return indexes["org_tree"]
+
+    def invalidate_indexes(self) -> None:
+        vars(self).pop("_indexes", None)
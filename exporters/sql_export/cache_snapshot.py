@@ -0,0 +1,106 @@
+"""Persisted LoRa cache snapshots.
+
+A snapshot is a single SQLite file holding a header, describing what the cache was
+built with, and every object of every cache collection, keyed by collection and
+uuid. Collections are stored independently, so a consumer only deserialises the
+collections it actually uses.
+"""
+
+import json
+import logging
+import os
+import pickle
+import sqlite3
+from collections.abc import Iterable
+from contextlib import closing
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the snapshot file changes
+SNAPSHOT_VERSION = 1
+
+
+class CacheSnapshot:
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+
+    def __repr__(self) -> str:
+        return f"CacheSnapshot({str(self.path)!r})"
+
+    def _connect(self, path: Path | None = None) -> sqlite3.Connection:
+        return sqlite3.connect(path or self.path)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def read_header(self) -> dict[str, Any] | None:
+        """Read the header of the snapshot.
+
+        Returns:
+            The header, or None if there is no snapshot, or it was written in
+            another layout than the current.
+        """
+        if not self.exists():
+            return None
+        try:
+            with closing(self._connect()) as connection:
+                rows = connection.execute("SELECT key, value FROM header").fetchall()
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"Unable to read {self}: {e}")
+            return None
+        header = {key: json.loads(value) for key, value in rows}
+        if header.pop("snapshot_version", None) != SNAPSHOT_VERSION:
+            logger.info(f"Ignoring {self} written in another layout")
+            return None
+        return header
+
+    def load(self, collection: str) -> dict:
+        """Deserialise a single collection of the snapshot."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT key, value FROM objects WHERE collection = ?", (collection,)
+            )
+            return {key: pickle.loads(value) for key, value in rows}
+
+    def write(self, header: dict[str, Any], collections: dict[str, dict]) -> None:
+        """Write the snapshot, replacing any previous snapshot atomically."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.unlink(missing_ok=True)
+
+        def rows(name: str, collection: dict) -> Iterable[tuple[str, str, bytes]]:
+            for key, value in collection.items():
+                yield name, key, pickle.dumps(value, pickle.DEFAULT_PROTOCOL)
+
+        with closing(self._connect(tmp_path)) as connection:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE header (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+                connection.execute("CREATE TABLE collections (name TEXT PRIMARY KEY)")
+                connection.execute(
+                    "CREATE TABLE objects ("
+                    " collection TEXT NOT NULL,"
+                    " key TEXT NOT NULL,"
+                    " value BLOB NOT NULL,"
+                    " PRIMARY KEY (collection, key)"
+                    ")"
+                )
+                connection.executemany(
+                    "INSERT INTO header VALUES (?, ?)",
+                    [
+                        (key, json.dumps(value))
+                        for key, value in {
+                            **header,
+                            "snapshot_version": SNAPSHOT_VERSION,
+                        }.items()
+                    ],
+                )
+                for name, collection in collections.items():
+                    logger.debug(f"writing {name}")
+                    connection.execute("INSERT INTO collections VALUES (?)", (name,))
+                    connection.executemany(
+                        "INSERT INTO objects VALUES (?, ?, ?)", rows(name, collection)
+                    )
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,134 @@
+"""Compact, read-only representation of LoRa cache validities.
+
+Every validity in the cache is a dict, repeating its keys and storing dates as
+strings. For big historic caches, this adds up to many GBs. The records here store
+the same values in `__slots__`, with one record class per collection and set of
+keys. Short strings, which are mostly uuids, dates and class values, are interned,
+so e.g. every reference to the same unit, and every "9999-12-31", shares a single
+string.
+
+Records implement the read-only `Mapping` interface, returning the same values as
+the dicts they replace, so consumers of the cache need not know the difference.
+"""
+
+import keyword
+import sys
+from collections.abc import Iterator
+from collections.abc import Mapping
+from typing import Any
+
+# Collections of `GQLLoraCache` which map uuids to lists of validities
+VALIDITY_COLLECTIONS = (
+    "users",
+    "units",
+    "addresses",
+    "engagements",
+    "managers",
+    "associations",
+    "leaves",
+    "it_connections",
+    "kles",
+    "related",
+)
+
+# Strings up to this length are interned; uuids are 36 characters long
+INTERN_MAX_LENGTH = 36
+
+
+class CompactRecord(Mapping):
+    __slots__ = ()
+    _collection: str
+    _fields: tuple[str, ...]
+    _slots: dict[str, Any]
+
+    def __getitem__(self, key: str) -> Any:
+        return self._slots[key].__get__(self)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def __reduce__(self):
+        values = tuple(getattr(self, field) for field in self._fields)
+        return _restore_record, (self._collection, self._fields, values)
+
+
+_record_classes: dict[tuple[str, tuple[str, ...]], type[CompactRecord]] = {}
+
+
+def record_class(collection: str, fields: tuple[str, ...]) -> type[CompactRecord]:
+    """Get the record class of a collection with the given keys."""
+    key = (collection, fields)
+    if (cls := _record_classes.get(key)) is None:
+        name = "".join(part.title() for part in collection.split("_")) + "Record"
+        cls = _record_classes[key] = type(
+            name,
+            (CompactRecord,),
+            {"__slots__": fields, "_collection": collection, "_fields": fields},
+        )
+        # The member descriptors of the slots, for fast lookups by key
+        cls._slots = {field: cls.__dict__[field] for field in fields}
+    return cls
+
+
+def _restore_record(
+    collection: str, fields: tuple[str, ...], values: tuple
+) -> CompactRecord:
+    cls = record_class(collection, fields)
+    record = cls.__new__(cls)
+    for field, value in zip(fields, values):
+        object.__setattr__(record, field, value)
+    return record
+
+
+def _can_be_slot(field: str) -> bool:
+    return (
+        field.isidentifier()
+        and not keyword.iskeyword(field)
+        and not field.startswith("_")
+        and not hasattr(CompactRecord, field)
+    )
+
+
+def _intern(value: Any) -> Any:
+    if isinstance(value, str) and len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    return value
+
+
+def _compact_value(collection: str, field: str, value: Any) -> Any:
+    if isinstance(value, dict):
+        return compact_record(f"{collection}_{field}", value)
+    if isinstance(value, list):
+        return [_intern(v) for v in value]
+    return _intern(value)
+
+
+def compact_record(collection: str, obj: Mapping) -> Mapping:
+    """Convert a single validity to a compact record.
+
+    Validities which cannot be represented by slots are returned unchanged.
+    """
+    if isinstance(obj, CompactRecord):
+        return obj
+    fields = tuple(obj.keys())
+    if not all(map(_can_be_slot, fields)):
+        return obj
+    cls = record_class(collection, fields)
+    record = cls.__new__(cls)
+    for field, value in obj.items():
+        object.__setattr__(record, field, _compact_value(collection, field, value))
+    return record
+
+
+def compact_collection(collection: str, cache: dict[str, list]) -> dict[str, list]:
+    """Convert the validities of a cache collection to compact records, in place."""
+    for uuid in list(cache):
+        validities = cache.pop(uuid)
+        cache[sys.intern(uuid)] = [compact_record(collection, v) for v in validities]
+    return cache
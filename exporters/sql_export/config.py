@@ -21,6 +21,11 @@ class GqlLoraCacheSettings(JobSettings):  # type: ignore
     prometheus_pushgateway: str = "pushgateway"
     mox_base: str = "http://mo:5000/lora"
     std_page_size: int = 300
+    # Number of pages to fetch ahead of the page currently being processed.
+    # 0 disables prefetching, fetching pages strictly one after another.
+    page_prefetch_depth: int = 0
+    # Store validities as compact, read-only records instead of dicts
+    compact_records: bool = False
 
     def to_old_settings(self) -> dict[str, Any]:
         """Convert our DatabaseSettings to a settings.json format.
@@ -79,6 +84,14 @@ class DatabaseSettings(JobSettings):
     historic_state: DatabaseConfiguration | None
     use_new_cache: bool = False
     primary_manager_responsibility: str | None = None
+    # Number of work tables to write concurrently in the full export
+    export_workers: int = 1
+    # Write only the changed rows to the current tables in the full export. The
+    # tables are then created with a hash column, to compare the rows by
+    differential_export: bool = False
+    # Write the unit paths, primary engagements and manager chains of the actual
+    # state in the full export
+    derived_tables: bool = False
 
     def to_old_settings(self) -> dict[str, Any]:
         """Convert our DatabaseSettings to a settings.json format.
@@ -111,6 +124,9 @@ class DatabaseSettings(JobSettings):
             ),
             "primary_manager_responsibility": self.primary_manager_responsibility,
             "exporters.actual_state.manager_responsibility_class": self.primary_manager_responsibility,
+            "exporters.actual_state.export_workers": self.export_workers,
+            "exporters.actual_state.differential": self.differential_export,
+            "exporters.actual_state.derived_tables": self.derived_tables,
             "use_new_cache": self.use_new_cache,
         }
         if self.historic_state is not None:
@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Collapsing of duplicate events of the event-driven SQL export.
+
+Changing a single object in MO often emits several events for it within seconds,
+each of which would fetch and write the same object again. `EventDebouncer` holds
+the first event of an object for a short interval, and collapses the events of the
+same type and uuid arriving meanwhile into it. Every collapsed event waits for the
+single fetch-and-write and shares its outcome, so all of them are acknowledged once
+the object has been written, or requeued if it could not be.
+"""
+
+import asyncio
+from collections.abc import Awaitable
+from collections.abc import Callable
+from uuid import UUID
+
+from prometheus_client import Counter
+
+events = Counter(
+    name="sql_export_events",
+    documentation=(
+        "Events received, by whether they were handled or collapsed into another "
+        "event of the same object."
+    ),
+    labelnames=["state", "type", "outcome"],
+)
+
+
+class EventDebouncer:
+    def __init__(self, interval: float = 0.5, state: str = "actual"):
+        self.interval = interval
+        self.state = state
+        self._pending: dict[tuple[str, UUID], asyncio.Future] = {}
+
+    async def handle(
+        self, type_: str, uuid: UUID, handler: Callable[[], Awaitable[None]]
+    ) -> None:
+        """Handle the event of the object `uuid` of `type_`, unless already pending.
+
+        The object is fetched and written by `handler` after `interval` seconds. Events
+        of the same object arriving before then share the outcome of that call, while
+        later events fetch the object again, as it may have changed since.
+        """
+        key = (type_, uuid)
+        if (pending := self._pending.get(key)) is not None:
+            events.labels(self.state, type_, "collapsed").inc()
+            return await asyncio.shield(pending)
+
+        events.labels(self.state, type_, "handled").inc()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            try:
+                await asyncio.sleep(self.interval)
+            finally:
+                del self._pending[key]
+            await handler()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Only the collapsed events need the exception, if there are any
+            future.exception()
+            raise
+        future.set_result(None)
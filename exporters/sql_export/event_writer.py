@@ -0,0 +1,182 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Batched database writes of the event-driven SQL export.
+
+The event handlers fetch the changed objects from MO and pass their rows to an
+`EventWriter` instead of writing them from the event loop. The writer collects the
+changes arriving within `max_latency` seconds, up to `max_batch_size` objects,
+keeping only the latest rows of an object changed more than once, and writes every
+batch in a single transaction in a worker thread. The handlers wait for the commit
+of their batch, so an event is only acknowledged once it has been written. If a
+batch fails, its objects are written one by one, so only the changes of an object
+that cannot be written fail.
+"""
+
+import asyncio
+import logging
+from types import TracebackType
+from typing import Type
+from uuid import UUID
+
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+from .sql_export import SqlExport
+from .sql_table_defs import sql_type
+
+logger = logging.getLogger(__name__)
+
+queue_depth = Gauge(
+    name="sql_export_event_queue_depth",
+    documentation="Number of changes waiting to be written to the database.",
+    labelnames=["state"],
+)
+commit_latency = Histogram(
+    name="sql_export_event_commit_latency_seconds",
+    documentation="Time spent writing and committing a batch of changes.",
+    labelnames=["state"],
+)
+batch_size = Histogram(
+    name="sql_export_event_batch_size",
+    documentation="Number of objects written in a single transaction.",
+    labelnames=["state"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+
+# The rows of an object in a table
+Key = tuple[Type[sql_type], UUID]
+# The latest rows of an object and the futures of every change to it
+Batch = dict[Key, tuple[list[sql_type], list[asyncio.Future]]]
+
+
+class EventWriter:
+    def __init__(
+        self,
+        sql_exporter: SqlExport,
+        max_latency: float = 0.1,
+        max_batch_size: int = 100,
+        state: str = "actual",
+    ):
+        self.sql_exporter = sql_exporter
+        self.max_latency = max_latency
+        self.max_batch_size = max_batch_size
+        self.state = state
+        self._queue: asyncio.Queue[tuple[Key, list[sql_type], asyncio.Future]] = (
+            asyncio.Queue()
+        )
+        self._task: asyncio.Task | None = None
+
+    async def __aenter__(self) -> "EventWriter":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def update_sql(
+        self, uuid: UUID, objects: list[sql_type], table: Type[sql_type]
+    ) -> None:
+        """Write the rows of an object in the next batch, see `SqlExport.update_sql`.
+
+        Returns once the batch has been committed, raising if it could not be.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(((table, uuid), objects, future))
+        queue_depth.labels(self.state).set(self._queue.qsize())
+        await future
+
+    async def _collect(self, batch: Batch) -> None:
+        """Collect the changes of the next batch, waiting for the first one."""
+        loop = asyncio.get_running_loop()
+        change = await self._queue.get()
+        deadline = loop.time() + self.max_latency
+        while True:
+            key, objects, future = change
+            _, futures = batch.get(key, (objects, []))
+            batch[key] = (objects, [*futures, future])
+            if len(batch) >= self.max_batch_size:
+                break
+            try:
+                async with asyncio.timeout_at(deadline):
+                    change = await self._queue.get()
+            except TimeoutError:
+                break
+        queue_depth.labels(self.state).set(self._queue.qsize())
+
+    def _write(self, batch: Batch) -> None:
+        session = self.sql_exporter.session
+        try:
+            for (table, uuid), (objects, _) in batch.items():
+                self.sql_exporter.update_sql(uuid, objects, table, commit=False)
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+
+    async def _run(self) -> None:
+        while True:
+            batch: Batch = {}
+            try:
+                await self._collect(batch)
+                await self._commit(batch)
+            except asyncio.CancelledError:
+                for _, futures in batch.values():
+                    for future in futures:
+                        future.cancel()
+                raise
+
+    async def _try_write(self, batch: Batch) -> Exception | None:
+        """Write a batch in a worker thread, returning the error if it failed."""
+        try:
+            with commit_latency.labels(self.state).time():
+                await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            return e
+        return None
+
+    async def _commit(self, batch: Batch) -> None:
+        """Write a batch, or each of its objects on its own if the batch fails, so
+        only the changes of an object that cannot be written fail."""
+        batch_size.labels(self.state).observe(len(batch))
+        futures = [future for _, futures in batch.values() for future in futures]
+        logger.debug(f"Writing {len(batch)} objects from {len(futures)} changes")
+        error = await self._try_write(batch)
+        if error is None or len(batch) == 1:
+            if error is not None:
+                logger.error("Writing changes failed", exc_info=error)
+            _resolve(batch, error)
+            return
+        logger.warning(
+            f"Writing batch of {len(batch)} objects failed, writing them one by one",
+            exc_info=error,
+        )
+        for (table, uuid), change in batch.items():
+            single: Batch = {(table, uuid): change}
+            error = await self._try_write(single)
+            if error is not None:
+                logger.error(f"Writing {table.__name__} {uuid} failed", exc_info=error)
+            _resolve(single, error)
+
+
+def _resolve(batch: Batch, error: Exception | None) -> None:
+    """Complete the futures of every change of a batch, failing them with `error`."""
+    for _, futures in batch.values():
+        for future in futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
@@ -0,0 +1,121 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Batching of the single object fetches of the event-driven SQL export.
+
+Every event fetches the object it is about from MO with a `_fetch_*` method of
+`GQLLoraCache`, costing a GraphQL round-trip per event. A `FetchBatcher` collects
+the uuids requested from the same `_fetch_*` method of the same cache within
+`delay` seconds, fetches them with a single query filtering on all of them, and
+hands every caller the part of the result for its uuid, as a DataLoader would.
+
+The batcher can be shared by several caches, e.g. the actual state and the full
+history cache, which are still queried separately.
+"""
+
+import asyncio
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Hashable
+from functools import wraps
+from typing import Any
+from typing import TypeVar
+from typing import cast
+from uuid import UUID
+
+from prometheus_client import Histogram
+
+batch_size = Histogram(
+    name="sql_export_fetch_batch_size",
+    documentation="Number of objects fetched from MO in a single batched query.",
+    labelnames=["fetch"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+Fetch = Callable[[list[UUID]], Awaitable[dict]]
+FetchMethod = TypeVar("FetchMethod", bound=Callable[..., Awaitable[dict]])
+
+
+class _Batch:
+    def __init__(self, fetch: Fetch, name: str):
+        self.fetch = fetch
+        self.name = name
+        self.futures: dict[UUID, list[asyncio.Future]] = {}
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class FetchBatcher:
+    def __init__(self, delay: float = 0.005, max_batch_size: int = 100):
+        self.delay = delay
+        self.max_batch_size = max_batch_size
+        self._batches: dict[Hashable, _Batch] = {}
+        # Strong references to the running fetches, see `asyncio.create_task`
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable, fetch: Fetch, uuid: UUID, name: str) -> dict:
+        """Fetch `uuid` with the next batched call of `fetch`.
+
+        Args:
+            key: Identifies the fetch; uuids with the same key are fetched together.
+            fetch: Fetches a list of uuids, returning the objects by uuid.
+            uuid: The object to fetch.
+            name: Name of the fetch, for metrics.
+
+        Returns:
+            The part of the result of `fetch` for `uuid`, like fetching it alone.
+        """
+        loop = asyncio.get_running_loop()
+        if (batch := self._batches.get(key)) is None:
+            batch = self._batches[key] = _Batch(fetch, name)
+            batch.timer = loop.call_later(self.delay, self._dispatch, key)
+
+        future = loop.create_future()
+        batch.futures.setdefault(uuid, []).append(future)
+        if len(batch.futures) >= self.max_batch_size:
+            self._dispatch(key)
+        return await asyncio.shield(future)
+
+    def _dispatch(self, key: Hashable) -> None:
+        batch = self._batches.pop(key)
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._fetch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: _Batch) -> None:
+        batch_size.labels(batch.name).observe(len(batch.futures))
+        try:
+            result = await batch.fetch(list(batch.futures))
+        except Exception as e:
+            for futures in batch.futures.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for uuid, futures in batch.futures.items():
+            objects = {str(uuid): result[str(uuid)]} if str(uuid) in result else {}
+            for future in futures:
+                if not future.done():
+                    future.set_result(objects)
+
+
+def batched(fetch: FetchMethod) -> FetchMethod:
+    """Batch the single uuid calls of a `_fetch_*` method with the cache batcher.
+
+    Calls fetching everything or a list of uuids, or made while the cache has no
+    `batcher`, are passed on unchanged.
+    """
+
+    @wraps(fetch)
+    async def wrapper(self: Any, uuid: UUID | list[UUID] | None = None) -> dict:
+        if self.batcher is None or not isinstance(uuid, UUID):
+            return await fetch(self, uuid)
+        return await self.batcher.load(
+            key=(fetch, self),
+            fetch=lambda uuids: fetch(self, uuids),
+            uuid=uuid,
+            name=fetch.__name__,
+        )
+
+    return cast(FetchMethod, wrapper)
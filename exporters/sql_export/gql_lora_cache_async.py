@@ -1,8 +1,14 @@
 import asyncio
+import contextlib
 import datetime
 import logging
 import os
 import pickle
+import re
+from collections import defaultdict
+from collections.abc import Callable
+from collections.abc import Collection
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 from typing import AsyncIterator
@@ -12,19 +18,101 @@ from fastramqpi.ra_utils.async_to_sync import async_to_sync
 from fastramqpi.raclients.graph.client import GraphQLClient
 from gql import gql
 from gql.client import AsyncClientSession
+from graphql import DocumentNode
+from graphql import ExecutionResult
+from more_itertools import chunked
 from more_itertools import first
-from tenacity import Retrying
+from prometheus_client import Histogram
+from tenacity import AsyncRetrying
 from tenacity import stop_after_delay
 from tenacity import wait_random_exponential
 
+from .cache_indexes import CacheIndexes
+from .cache_snapshot import CacheSnapshot
+from .compact_records import VALIDITY_COLLECTIONS
+from .compact_records import compact_collection
 from .config import GqlLoraCacheSettings
 from .config import get_gql_cache_settings
+from .fetch_batcher import FetchBatcher
+from .fetch_batcher import batched
+from .org_tree import OrgTree
 
 RETRY_MAX_TIME = 5 * 60
 
+# Bump when the format of the persisted caches changes, to force a full rebuild
+CACHE_VERSION = 1
+
+# Cache attributes persisted by `populate_cache_async`, and the names of the pickle
+# files they were persisted in before snapshots were introduced
+CACHE_FILES = {
+    "facets": "facets",
+    "classes": "classes",
+    "users": "users",
+    "units": "units",
+    "addresses": "addresses",
+    "engagements": "engagements",
+    "managers": "managers",
+    "associations": "associations",
+    "leaves": "leaves",
+    "itsystems": "itsystems",
+    "it_connections": "it_connections",
+    "kles": "kles",
+    "related": "related",
+    "dar_cache": "dar",
+}
+
+# Collections refreshed by the objects changed since the previous cache, by their
+# cache attribute: The model of their registrations, and their GraphQL root field
+# and filter type.
+INCREMENTAL_COLLECTIONS = {
+    "users": ("employee", "employees", "EmployeeFilter"),
+    "engagements": ("engagement", "engagements", "EngagementFilter"),
+    "addresses": ("address", "addresses", "AddressFilter"),
+    "managers": ("manager", "managers", "ManagerFilter"),
+    "associations": ("association", "associations", "AssociationFilter"),
+    "leaves": ("leave", "leaves", "LeaveFilter"),
+    "it_connections": ("ituser", "itusers", "ITUserFilter"),
+    "kles": ("kle", "kles", "KLEFilter"),
+    "related": ("related_unit", "related_units", "RelatedUnitFilter"),
+}
+# Registered models which are always fetched in full, or not cached at all
+REFETCHED_MODELS = {"facet", "class", "itsystem", "org_unit"}
+UNCACHED_MODELS = {"owner", "role", "rolebinding"}
+
 
 logger = logging.getLogger(__name__)
 
+page_latency = Histogram(
+    name="sql_export_lora_cache_page_latency_seconds",
+    documentation="Time spent fetching a single page of a LoRa cache collection.",
+    labelnames=["collection"],
+)
+
+
+def collection_name(query: str) -> str:
+    """Find the name of the collection queried as `page` in a paged query."""
+    match = re.search(r"page:\s*(\w+)", query)
+    return match.group(1) if match else "unknown"
+
+
+@lru_cache(maxsize=None)
+def compile_query(query: str) -> DocumentNode:
+    """Parse a GraphQL query once and reuse the document for every page and event.
+
+    The query texts are constant per `_fetch_*` method and history mode, so the
+    cache stays small, while saving a parse of the (large) query text per request.
+    """
+    return gql(query)
+
+
+def uuids_filter(uuid: UUID | list[UUID] | None) -> list[str] | None:
+    """Convert the uuid(s) given to a `_fetch_*` method to a GraphQL uuids filter."""
+    if uuid is None:
+        return None
+    if isinstance(uuid, list):
+        return [str(u) for u in uuid]
+    return [str(uuid)]
+
 
 # used to correctly insert the object into the cache
 def insert_obj(obj: dict, cache: dict) -> None:
@@ -38,6 +126,24 @@ def insert_obj(obj: dict, cache: dict) -> None:
         cache[obj["uuid"]] = obj["obj"]
 
 
+# Receives the objects of a streamed collection, see `GQLLoraCache.stream_caches`
+Sink = Callable[[str, list[dict]], None]
+
+# Collections fetched and kept before streaming, as the other collections refer to them
+CLASSIFICATION_COLLECTIONS = ("facets", "classes", "itsystems")
+
+
+class CollectionSink(dict):
+    """Result of a `_fetch_*` method passing its objects on instead of keeping them."""
+
+    def __init__(self, sink: Sink):
+        super().__init__()
+        self.sink = sink
+
+    def __setitem__(self, uuid: str, validities: list[dict]) -> None:
+        self.sink(uuid, validities)
+
+
 # when getting a query using current, the object is a single dict. When getting a
 # historic query it is a list of dicts. in order to uniformly process the two states
 # we wrap the current object in a list
@@ -96,13 +202,14 @@ def convert_dict(
     return {uuid: replace(query_res["obj"], replace_dict)}
 
 
-class GQLLoraCache:
+class GQLLoraCache(CacheIndexes):
     def __init__(
         self,
         resolve_dar: bool = True,
         full_history: bool = False,
         skip_past: bool = False,
         settings=None,
+        batcher: FetchBatcher | None = None,
     ):
         logger.info(
             f"Initialising LoRa cache, {resolve_dar=}, {full_history=}, {skip_past=}"
@@ -130,8 +237,17 @@ class GQLLoraCache:
         self.kles: dict = {}
         self.related: dict = {}
         self.dar_cache: dict = {}
+        # Derived from the collections above, see `calculate_derived_unit_data` and
+        # `calculate_primary_engagements`
+        self.unit_paths: dict[str, list[str]] = {}
+        self.manager_chains: dict[str, list[str]] = {}
+        self.primary_engagements: dict[str, str] = {}
 
         self._gql_client_session: AsyncClientSession | None = None
+        self._sinks: dict[str, Sink] = {}
+        self._org_uuid: str | None = None
+        # Batches the single object fetches of events, see `fetch_batcher`
+        self.batcher = batcher
 
     def make_client(self) -> GraphQLClient:
         return GraphQLClient(
@@ -152,44 +268,93 @@ class GQLLoraCache:
         session = self._gql_client_session = await client.__aenter__()
         return session
 
-    async def _execute_query(
+    async def _fetch_page(
         self,
+        session: AsyncClientSession,
         query: str,
-        variable_values: dict | None = None,
-        do_paged: bool = True,
-    ) -> AsyncIterator[dict[str, Any]]:
-        next_cursor = None
-        session = await self.gql_client_session()
-        while True:
-            for attempt in Retrying(
-                wait=wait_random_exponential(multiplier=2, max=30),
-                stop=stop_after_delay(RETRY_MAX_TIME),
-                reraise=True,
-            ):
-                with attempt:
-                    if do_paged:
-                        limit = self.page_size
-                        cursor = next_cursor
-                    else:
-                        limit = None
-                        cursor = None
+        variable_values: dict | None,
+        cursor: str | None,
+        do_paged: bool,
+    ) -> ExecutionResult:
+        collection = collection_name(query)
+        document = compile_query(query)
+        async for attempt in AsyncRetrying(
+            wait=wait_random_exponential(multiplier=2, max=30),
+            stop=stop_after_delay(RETRY_MAX_TIME),
+            reraise=True,
+        ):
+            with attempt:
+                with page_latency.labels(collection).time():
                     result = await session.execute(
-                        document=gql(query),
+                        document=document,
                         variable_values=dict(
-                            limit=limit,
-                            cursor=cursor,
+                            limit=self.page_size if do_paged else None,
+                            cursor=cursor if do_paged else None,
                             **(variable_values or {}),
                         ),
                         get_execution_result=True,
                     )
-            for obj in result.data["page"]["objects"]:  # type: ignore
-                yield obj
-            next_cursor = result.data["page"]["page_info"]["next_cursor"]  # type: ignore
-            if next_cursor is None:
-                break
+        return result
+
+    async def _execute_query(
+        self,
+        query: str,
+        variable_values: dict | None = None,
+        do_paged: bool = True,
+    ) -> AsyncIterator[dict[str, Any]]:
+        session = await self.gql_client_session()
+        prefetch_depth = self.settings.page_prefetch_depth
+        if not do_paged or prefetch_depth <= 0:
+            next_cursor = None
+            while True:
+                result = await self._fetch_page(
+                    session, query, variable_values, next_cursor, do_paged
+                )
+                for obj in result.data["page"]["objects"]:  # type: ignore
+                    yield obj
+                next_cursor = result.data["page"]["page_info"]["next_cursor"]  # type: ignore
+                if next_cursor is None:
+                    break
+            return
+
+        # Fetch pages in a background task, so the next page is requested as soon
+        # as its cursor is known, while the caller is still processing the current
+        # page. The bounded queue limits how far ahead of the caller we may get.
+        # The producer ends the stream with `None`, or with the exception it failed.
+        pages: asyncio.Queue[ExecutionResult | BaseException | None] = asyncio.Queue(
+            maxsize=prefetch_depth
+        )
+
+        async def produce_pages() -> None:
+            next_cursor = None
+            try:
+                while True:
+                    result = await self._fetch_page(
+                        session, query, variable_values, next_cursor, do_paged
+                    )
+                    await pages.put(result)
+                    next_cursor = result.data["page"]["page_info"]["next_cursor"]  # type: ignore
+                    if next_cursor is None:
+                        break
+            except Exception as e:
+                await pages.put(e)
+                return
+            await pages.put(None)
+
+        producer = asyncio.create_task(produce_pages())
+        try:
+            while (page := await pages.get()) is not None:
+                if isinstance(page, BaseException):
+                    raise page
+                for obj in page.data["page"]["objects"]:  # type: ignore
+                    yield obj
+        finally:
+            producer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
 
     async def _get_org_uuid(self) -> str:
-        root_org_query = gql(
+        root_org_query = compile_query(
             """
             query {
                 org {
@@ -198,19 +363,31 @@ class GQLLoraCache:
             }
             """
         )
-        session = await self.gql_client_session()
-        res = await session.execute(root_org_query)
-        return res["org"]["uuid"]
+        # The root organisation never changes, so it is only fetched once
+        if self._org_uuid is None:
+            session = await self.gql_client_session()
+            res = await session.execute(root_org_query)
+            self._org_uuid = res["org"]["uuid"]
+        return self._org_uuid
 
     async def _cache_lora_facets(self):
         obj = await self._fetch_facets()
         self.facets.update(obj)
 
-    async def _fetch_facets(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_facets(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching facets")
         query = """
-            query ($limit: int, $cursor: Cursor) {
-                page: facets(limit: $limit, cursor: $cursor) {
+            query (
+                $filter: FacetFilter
+                $limit: int
+                $cursor: Cursor
+            ) {
+                page: facets(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {
                     objects {
                         uuid
                         obj: current {
@@ -226,13 +403,13 @@ class GQLLoraCache:
         """
         variables = {
             "filter": {
-                "uuids": str(uuid) if uuid is not None else None,
+                "uuids": uuids_filter(uuid),
             },
         }
 
         res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -244,11 +421,20 @@ class GQLLoraCache:
         obj = await self._fetch_classes()
         self.classes.update(obj)
 
-    async def _fetch_classes(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_classes(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching classes")
         query = """
-            query ($limit: int, $cursor: Cursor) {
-                page: classes(limit: $limit, cursor: $cursor) {
+            query (
+                $filter: ClassFilter
+                $limit: int
+                $cursor: Cursor
+            ) {
+                page: classes(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {
                     objects {
                         uuid
                         obj: current {
@@ -267,14 +453,14 @@ class GQLLoraCache:
         """
         variables = {
             "filter": {
-                "uuids": str(uuid) if uuid is not None else None,
+                "uuids": uuids_filter(uuid),
             },
         }
         dictionary = {"name": "title", "facet_uuid": "facet"}
 
         res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -291,11 +477,20 @@ class GQLLoraCache:
         obj = await self._fetch_itsystems()
         self.itsystems.update(obj)
 
-    async def _fetch_itsystems(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_itsystems(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching it systems")
         query = """
-            query ($limit: int, $cursor: Cursor) {
-                page: itsystems(limit: $limit, cursor: $cursor) {
+            query (
+                $filter: ITSystemFilter
+                $limit: int
+                $cursor: Cursor
+            ) {
+                page: itsystems(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {
                     objects {
                         uuid
                         obj: current {
@@ -312,13 +507,13 @@ class GQLLoraCache:
         """
         variables = {
             "filter": {
-                "uuids": str(uuid) if uuid is not None else None,
+                "uuids": uuids_filter(uuid),
             },
         }
 
         res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -330,7 +525,8 @@ class GQLLoraCache:
         obj = await self._fetch_users()
         self.users.update(obj)
 
-    async def _fetch_users(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_users(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching users")
         if self.full_history:
             query = """
@@ -370,7 +566,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -413,7 +609,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
@@ -427,10 +623,10 @@ class GQLLoraCache:
             "nickname_surname": "kaldenavn_efternavn",
         }
 
-        res: dict = {}
+        res: dict = self._new_collection("users")
 
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -445,7 +641,8 @@ class GQLLoraCache:
         obj = await self._fetch_units()
         self.units.update(obj)
 
-    async def _fetch_units(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_units(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching org units")
 
         org_uuid = await self._get_org_uuid()
@@ -486,7 +683,9 @@ class GQLLoraCache:
                     else:
                         man["acting_manager_uuid"] = None
 
-                    ancestors = man.pop("ancestors")
+                    ancestors = man.pop("ancestors", None)
+                    if ancestors is None:
+                        continue
                     location = man["name"]
                     for ancestor in ancestors:
                         location = ancestor["name"] + "\\" + location
@@ -494,6 +693,10 @@ class GQLLoraCache:
                     man["location"] = location
             return qr
 
+        # When fetching all units at once, their locations are derived from their
+        # parents afterwards, instead of MO finding the ancestors of every unit
+        locate = not self.full_history and uuid is None and "units" not in self._sinks
+
         if self.full_history:
             query = """
                 query (
@@ -529,9 +732,9 @@ class GQLLoraCache:
                     }
                 }
             """
-            variables = {
+            variables: dict[str, Any] = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -542,6 +745,7 @@ class GQLLoraCache:
                     $filter: OrganisationUnitFilter
                     $limit: int
                     $cursor: Cursor
+                    $ancestors: Boolean!
                 ) {
                     page: org_units(
                         filter: $filter
@@ -569,7 +773,7 @@ class GQLLoraCache:
                                     responsibility_uuids
                                     uuid
                                 }
-                                ancestors {
+                                ancestors @include(if: $ancestors) {
                                     name
                                     uuid
                                 }
@@ -587,8 +791,9 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
+                "ancestors": not locate,
             }
 
         dictionary = {
@@ -598,9 +803,9 @@ class GQLLoraCache:
             "unit_type_uuid": "unit_type",
             "time_planning_uuid": "time_planning",
         }
-        res: dict = {}
+        res: dict = self._new_collection("units")
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -615,13 +820,20 @@ class GQLLoraCache:
 
             obj = convert_dict(obj, replace_dict=dictionary)
             insert_obj(obj, res)
+
+        if locate:
+            tree = OrgTree.from_units(res)
+            for unit_uuid, validities in res.items():
+                for unit in validities:
+                    unit["location"] = tree.location(unit_uuid)
         return res
 
     async def _cache_lora_engagements(self):
         obj = await self._fetch_engagements()
         self.engagements.update(obj)
 
-    async def _fetch_engagements(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_engagements(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching engagements")
 
         def collect_extensions(d: dict):
@@ -684,7 +896,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -737,7 +949,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
@@ -750,9 +962,9 @@ class GQLLoraCache:
             "is_primary": "primary_boolean",
         }
 
-        res: dict = {}
+        res: dict = self._new_collection("engagements")
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -768,7 +980,8 @@ class GQLLoraCache:
         obj = await self._fetch_leaves()
         self.leaves.update(obj)
 
-    async def _fetch_leaves(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_leaves(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching leaves")
         if self.full_history:
             query = """
@@ -804,7 +1017,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -843,7 +1056,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
@@ -853,9 +1066,9 @@ class GQLLoraCache:
             "engagement_uuid": "engagement",
         }
 
-        res: dict = {}
+        res: dict = self._new_collection("leaves")
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -870,7 +1083,10 @@ class GQLLoraCache:
         obj = await self._fetch_it_connections()
         self.it_connections.update(obj)
 
-    async def _fetch_it_connections(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_it_connections(
+        self, uuid: UUID | list[UUID] | None = None
+    ) -> dict:
         logger.info("Caching it users")
 
         async def set_primary_boolean(res: dict) -> dict:
@@ -927,7 +1143,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -971,7 +1187,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
@@ -982,9 +1198,9 @@ class GQLLoraCache:
             "user_key": "username",
         }
 
-        res: dict = {}
+        res: dict = self._new_collection("it_connections")
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -1000,7 +1216,8 @@ class GQLLoraCache:
         obj = await self._fetch_kles()
         self.kles.update(obj)
 
-    async def _fetch_kles(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_kles(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching KLEs")
 
         async def format_aspects(d: dict) -> dict:
@@ -1053,7 +1270,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1092,7 +1309,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
@@ -1102,9 +1319,9 @@ class GQLLoraCache:
             "org_unit_uuid": "unit",
         }
 
-        res: dict = {}
+        res: dict = self._new_collection("kles")
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -1120,7 +1337,8 @@ class GQLLoraCache:
         obj = await self._fetch_related()
         self.related.update(obj)
 
-    async def _fetch_related(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_related(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching related")
 
         def format_related(d: dict):
@@ -1164,7 +1382,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1200,13 +1418,13 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
-        res: dict = {}
+        res: dict = self._new_collection("related")
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -1223,7 +1441,8 @@ class GQLLoraCache:
         obj = await self._fetch_managers()
         self.managers.update(obj)
 
-    async def _fetch_managers(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_managers(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching managers")
         if self.full_history:
             query = """
@@ -1260,7 +1479,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1300,7 +1519,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
@@ -1312,9 +1531,9 @@ class GQLLoraCache:
             "org_unit_uuid": "unit",
         }
 
-        res: dict = {}
+        res: dict = self._new_collection("managers")
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -1329,7 +1548,8 @@ class GQLLoraCache:
         obj = await self._fetch_associations()
         self.associations.update(obj)
 
-    async def _fetch_associations(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_associations(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching associations")
 
         async def process_associations_helper(res: dict) -> dict:
@@ -1406,7 +1626,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1456,7 +1676,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
@@ -1468,10 +1688,10 @@ class GQLLoraCache:
             "org_unit_uuid": "unit",
         }
 
-        res: dict = {}
+        res: dict = self._new_collection("associations")
 
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -1488,7 +1708,8 @@ class GQLLoraCache:
         obj = await self._fetch_address()
         self.addresses.update(obj)
 
-    async def _fetch_address(self, uuid: UUID | None = None) -> dict:
+    @batched
+    async def _fetch_address(self, uuid: UUID | list[UUID] | None = None) -> dict:
         logger.info("Caching addresses")
 
         async def prep_address(d: dict) -> dict:
@@ -1559,7 +1780,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1606,7 +1827,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuids_filter(uuid),
                 },
             }
 
@@ -1630,9 +1851,9 @@ class GQLLoraCache:
             "visibility_uuid": "visibility",
         }
 
-        res: dict = {}
+        res: dict = self._new_collection("addresses")
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query, variable_values=variables, do_paged=not isinstance(uuid, UUID)
         ):
             if obj is None:
                 return {}
@@ -1660,156 +1881,521 @@ class GQLLoraCache:
             insert_obj(obj, res)
         return res
 
-    async def populate_cache_async(self, dry_run=None, skip_associations=False):
+    def _cache_suffix(self) -> str:
+        if not self.full_history:
+            return ""
+        if self.skip_past:
+            return "_historic_skip_past"
+        return "_historic"
+
+    def _snapshot(self) -> CacheSnapshot:
+        return CacheSnapshot(f"tmp/loracache{self._cache_suffix()}.db")
+
+    def _legacy_cache_files(self) -> dict[str, str]:
+        """Map each cache attribute to the pickle file it used to be persisted in."""
+        suffix = self._cache_suffix()
+        return {attr: f"tmp/{name}{suffix}.p" for attr, name in CACHE_FILES.items()}
+
+    def _load_legacy_caches(self, skip_associations: bool) -> None:
+        for attr, filename in self._legacy_cache_files().items():
+            if attr == "associations" and skip_associations:
+                continue
+            with open(filename, "rb") as f:
+                setattr(self, attr, pickle.load(f))
+
+    def _open_snapshot(self, snapshot: CacheSnapshot, skip_associations: bool) -> None:
+        """Use the collections of a snapshot, loading each when it is first used."""
+        header = snapshot.read_header()
+        assert header is not None
+        if header["resolve_dar"] != self.resolve_dar:
+            logger.warning(f"Using {snapshot} built with {header['resolve_dar']=}")
+        self._lazy_snapshot = snapshot
+        for attr in CACHE_FILES:
+            if attr == "associations" and skip_associations:
+                continue
+            del self.__dict__[attr]
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for missing attributes, i.e. the collections not yet loaded
+        # from the snapshot opened by `_open_snapshot`.
+        snapshot = self.__dict__.get("_lazy_snapshot")
+        if snapshot is None or name not in CACHE_FILES:
+            raise AttributeError(name)
+        logger.info(f"Loading {name} from {snapshot}")
+        collection = snapshot.load(name)
+        if self.settings.compact_records and name in VALIDITY_COLLECTIONS:
+            compact_collection(name, collection)
+        setattr(self, name, collection)
+        return collection
+
+    def _compact_caches(self) -> None:
+        """Convert all validities to compact records, if enabled in the settings."""
+        if not self.settings.compact_records:
+            return
+        for name in VALIDITY_COLLECTIONS:
+            logger.info(f"Compacting {name}")
+            compact_collection(name, getattr(self, name))
+
+    async def _get_mo_version(self) -> str | None:
+        version_query = compile_query(
+            """
+            query {
+                version {
+                    mo_version
+                }
+            }
+            """
+        )
+        session = await self.gql_client_session()
+        res = await session.execute(version_query)
+        return res["version"]["mo_version"]
+
+    def _cache_header(self, mo_version: str | None) -> dict[str, Any]:
+        """Describe what a persisted cache was built with.
+
+        A cache can only be refreshed incrementally if it was built the same way.
+        """
+        return {
+            "version": CACHE_VERSION,
+            "mo_version": mo_version,
+            "full_history": self.full_history,
+            "skip_past": self.skip_past,
+            "resolve_dar": self.resolve_dar,
+        }
+
+    def _can_refresh(
+        self, state: dict[str, Any] | None, header: dict[str, Any], skip_associations
+    ) -> bool:
+        if state is None:
+            logger.info("No previous cache state found")
+            return False
+        if any(state.get(key) != value for key, value in header.items()):
+            logger.info(f"Previous cache was built differently: {state=}, {header=}")
+            return False
+        if "associations" not in state["collections"] and not skip_associations:
+            logger.info("Previous cache does not contain associations")
+            return False
+        return True
+
+    async def _fetch_changed_uuids(
+        self, since: datetime.datetime
+    ) -> dict[str, set[UUID]] | None:
+        """Find the uuids of objects registered in MO since the given time.
+
+        Returns None if objects of a model unknown to the cache were registered, as
+        the cache cannot tell whether they change any of the cached collections.
+        """
+        logger.info(f"Finding objects changed since {since}")
+        query = """
+            query (
+                $filter: RegistrationFilter
+                $limit: int
+                $cursor: Cursor
+            ) {
+                page: registrations(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {
+                    objects {
+                        uuid
+                        model
+                        start
+                    }
+                    page_info {
+                        next_cursor
+                    }
+                }
+            }
+        """
+        variables = {"filter": {"start": since.isoformat()}}
+        known_models = {
+            model for model, _, _ in INCREMENTAL_COLLECTIONS.values()
+        } | REFETCHED_MODELS
+
+        changed: dict[str, set[UUID]] = defaultdict(set)
+        unknown_models = set()
+        async for obj in self._execute_query(query=query, variable_values=variables):
+            # Registrations overlapping the start may be returned as well
+            if datetime.datetime.fromisoformat(obj["start"]) < since:
+                continue
+            if obj["model"] in UNCACHED_MODELS:
+                continue
+            if obj["model"] not in known_models:
+                unknown_models.add(obj["model"])
+                continue
+            changed[obj["model"]].add(UUID(obj["uuid"]))
+        if unknown_models:
+            logger.warning(f"Objects of unknown models changed: {unknown_models}")
+            return None
+        return changed
+
+    def _ended_uuids(self, attr: str, today: datetime.date) -> set[UUID]:
+        """Find the objects of a cache collection with a validity ending before
+        `today`, which are no longer part of the actual state, or of the history
+        skipping the past."""
+        ended = str(today)
+        return {
+            UUID(uuid)
+            for uuid, validities in getattr(self, attr).items()
+            if any(validity["to_date"] < ended for validity in validities)
+        }
+
+    async def _fetch_started_uuids(
+        self, since: datetime.date, today: datetime.date, attrs: Collection[str]
+    ) -> dict[str, set[UUID]]:
+        """Find the objects of the cache collections `attrs` with a validity starting
+        after `since`, and no later than `today`, by their model.
+
+        Starting validities do not register any changes, so every object valid
+        since then is scanned for them. Only their uuids and start dates are
+        fetched, but the scan still takes a page per `page_size` objects valid in
+        the period, per collection.
+        """
+        logger.info(f"Finding objects started since {since}")
+        started: dict[str, set[UUID]] = {}
+
+        async def fetch_started(model: str, root: str, filter_type: str) -> None:
+            query = f"""
+                query (
+                    $filter: {filter_type}
+                    $limit: int
+                    $cursor: Cursor
+                ) {{
+                    page: {root}(
+                        filter: $filter
+                        limit: $limit
+                        cursor: $cursor
+                    ) {{
+                        objects {{
+                            uuid
+                            validities {{
+                                validity {{
+                                    from
+                                }}
+                            }}
+                        }}
+                        page_info {{
+                            next_cursor
+                        }}
+                    }}
+                }}
+            """
+            one_day = datetime.timedelta(days=1)
+            variables = {
+                "filter": {
+                    "from_date": str(since + one_day),
+                    "to_date": str(today + one_day),
+                }
+            }
+            uuids = started.setdefault(model, set())
+            async for obj in self._execute_query(
+                query=query, variable_values=variables
+            ):
+                for validity in obj["validities"]:
+                    start = validity["validity"]["from"]
+                    if start is None:
+                        continue
+                    start_date = datetime.datetime.fromisoformat(start).date()
+                    if since < start_date <= today:
+                        uuids.add(UUID(obj["uuid"]))
+
+        tasks = []
+        async with asyncio.TaskGroup() as tg:
+            for attr in attrs:
+                tasks.append(
+                    tg.create_task(fetch_started(*INCREMENTAL_COLLECTIONS[attr]))
+                )
+        del tasks
+        return started
+
+    async def _refresh_caches(
+        self,
+        since: datetime.datetime,
+        skip_associations: bool,
+        since_date: datetime.date | None = None,
+    ) -> bool:
+        """Merge objects changed in MO since the given time into the loaded caches.
+
+        The actual state, and history skipping the past, also depend on the date of
+        the export, as validities starting or ending do not register any changes.
+        If the caches are from `since_date` before today, the objects with a
+        validity ending since are refetched, as are the objects of the actual state
+        with a validity starting since.
+
+        Returns False, leaving the caches untouched, if the changes cannot be
+        merged, in which case everything must be fetched instead.
+        """
+        changed = await self._fetch_changed_uuids(since)
+        if changed is None:
+            return False
+
+        async def refetch(attr: str, fetch) -> None:
+            setattr(self, attr, await fetch())
+
+        async def refresh(attr: str, fetch, uuids: set[UUID]) -> None:
+            logger.info(f"Refreshing {len(uuids)} {attr}")
+            cache = getattr(self, attr)
+            for chunk in chunked(uuids, self.page_size):
+                fetched = await fetch(chunk)
+                # Objects deleted or no longer in scope are missing from `fetched`
+                for uuid in chunk:
+                    cache.pop(str(uuid), None)
+                cache.update(fetched)
+
+        incremental = {
+            "users": self._fetch_users,
+            "engagements": self._fetch_engagements,
+            "addresses": self._fetch_address,
+            "managers": self._fetch_managers,
+            "associations": self._fetch_associations,
+            "leaves": self._fetch_leaves,
+            "it_connections": self._fetch_it_connections,
+            "kles": self._fetch_kles,
+            "related": self._fetch_related,
+        }
+        if skip_associations:
+            del incremental["associations"]
+
+        today = datetime.date.today()
+        date_dependent = not self.full_history or self.skip_past
+        if date_dependent and since_date is not None and since_date < today:
+            logger.info(f"Refreshing validities started or ended since {since_date}")
+            rolled_over = {
+                INCREMENTAL_COLLECTIONS[attr][0]: self._ended_uuids(attr, today)
+                for attr in incremental
+            }
+            # History skipping the past already holds the validities starting later
+            if not self.full_history:
+                started = await self._fetch_started_uuids(
+                    since_date, today, list(incremental)
+                )
+                for model, started_uuids in started.items():
+                    rolled_over[model] |= started_uuids
+            for model, rolled_over_uuids in rolled_over.items():
+                changed[model] = set(changed.get(model, ())) | rolled_over_uuids
+
+        tasks = []
+        async with asyncio.TaskGroup() as tg:
+            # Classification is small, and the location and managers of units are
+            # derived from other units, so these are always fetched in full.
+            tasks.append(tg.create_task(refetch("facets", self._fetch_facets)))
+            tasks.append(tg.create_task(refetch("classes", self._fetch_classes)))
+            tasks.append(tg.create_task(refetch("itsystems", self._fetch_itsystems)))
+            tasks.append(tg.create_task(refetch("units", self._fetch_units)))
+            for attr, fetch in incremental.items():
+                model = INCREMENTAL_COLLECTIONS[attr][0]
+                if uuids := changed.get(model):
+                    tasks.append(tg.create_task(refresh(attr, fetch, uuids)))
+        del tasks
+
+        # Fetching addresses adds to the DAR cache, but never removes from it
+        dar_uuids = {
+            address["dar_uuid"]
+            for validities in self.addresses.values()
+            for address in validities
+        }
+        self.dar_cache = {
+            dar_uuid: dar_address
+            for dar_uuid, dar_address in self.dar_cache.items()
+            if dar_uuid in dar_uuids
+        }
+        return True
+
+    async def _fetch_caches(
+        self, skip_associations: bool, collections: Collection[str] | None = None
+    ) -> None:
+        """Fetch all collections, or only the given `collections`."""
+        cache_methods = {
+            "addresses": self._cache_lora_address,
+            "units": self._cache_lora_units,
+            "engagements": self._cache_lora_engagements,
+            "facets": self._cache_lora_facets,
+            "classes": self._cache_lora_classes,
+            "users": self._cache_lora_users,
+            "managers": self._cache_lora_managers,
+            "associations": self._cache_lora_associations,
+            "leaves": self._cache_lora_leaves,
+            "itsystems": self._cache_lora_itsystems,
+            "it_connections": self._cache_lora_it_connections,
+            "kles": self._cache_lora_kles,
+            "related": self._cache_lora_related,
+        }
+        if skip_associations:
+            del cache_methods["associations"]
+        # `tasks` is used to keep strong references. Otherwise, it can be
+        # cleared by the garbage collector mid-execution as the event loop
+        # only keeps weak references.
+        tasks = []
+        async with asyncio.TaskGroup() as tg:
+            for attr, cache_method in cache_methods.items():
+                if collections is None or attr in collections:
+                    tasks.append(tg.create_task(cache_method()))
+        del tasks
+
+    def _new_collection(self, attr: str) -> dict:
+        """Result dict of the `_fetch_*` method of the collection `attr`."""
+        if (sink := self._sinks.get(attr)) is not None:
+            return CollectionSink(sink)
+        return {}
+
+    async def stream_caches_async(
+        self, sinks: dict[str, Sink], skip_associations: bool = False
+    ) -> None:
+        """Fetch the cache, streaming the collections in `sinks`.
+
+        Every object of a streamed collection is passed to its sink, as soon as its
+        page is fetched, instead of being kept in the cache. The classification is
+        fetched and kept first, as the other collections refer to it.
+        """
+        await self._fetch_caches(skip_associations, CLASSIFICATION_COLLECTIONS)
+        self._sinks = sinks
+        try:
+            await self._fetch_caches(
+                skip_associations,
+                [
+                    attr
+                    for attr in CACHE_FILES
+                    if attr not in CLASSIFICATION_COLLECTIONS
+                ],
+            )
+        finally:
+            self._sinks = {}
+
+    @async_to_sync
+    async def stream_caches(
+        self, sinks: dict[str, Sink], skip_associations: bool = False
+    ) -> None:
+        logger.info(f"Streaming cache {list(sinks)} {skip_associations=}")
+        await self.stream_caches_async(sinks, skip_associations)
+
+    async def populate_cache_async(
+        self, dry_run=None, skip_associations=False, incremental=None
+    ):
         """
         Perform the actual data import.
         :param skip_associations: If associations are not needed, they can be
         skipped for increased performance.
         :param dry_run: For testing purposes it is possible to read from cache.
+        :param incremental: Refresh the previously written cache with the objects
+        changed in MO since it was written, instead of fetching everything. A cache
+        from an earlier day also refetches the objects whose validities started or
+        ended since, see `_refresh_caches`. Falls back to fetching everything if the
+        previous cache cannot be refreshed.
         """
         if dry_run is None:
             dry_run = os.environ.get("USE_CACHED_LORACACHE", False)
+        if incremental is None:
+            incremental = os.environ.get("INCREMENTAL_LORACACHE", "").lower() in (
+                "1",
+                "true",
+            )
 
         # Ensure that tmp/ exists
         Path("tmp/").mkdir(exist_ok=True)
+        self.invalidate_indexes()
 
-        if self.full_history:
-            if self.skip_past:
-                facets_file = "tmp/facets_historic_skip_past.p"
-                classes_file = "tmp/classes_historic_skip_past.p"
-                users_file = "tmp/users_historic_skip_past.p"
-                units_file = "tmp/units_historic_skip_past.p"
-                addresses_file = "tmp/addresses_historic_skip_past.p"
-                engagements_file = "tmp/engagements_historic_skip_past.p"
-                managers_file = "tmp/managers_historic_skip_past.p"
-                associations_file = "tmp/associations_historic_skip_past.p"
-                leaves_file = "tmp/leaves_historic_skip_past.p"
-                itsystems_file = "tmp/itsystems_historic_skip_past.p"
-                it_connections_file = "tmp/it_connections_historic_skip_past.p"
-                kles_file = "tmp/kles_historic_skip_past.p"
-                related_file = "tmp/related_historic_skip_past.p"
-                dar_file = "tmp/dar_historic_skip_past.p"
-            else:
-                facets_file = "tmp/facets_historic.p"
-                classes_file = "tmp/classes_historic.p"
-                users_file = "tmp/users_historic.p"
-                units_file = "tmp/units_historic.p"
-                addresses_file = "tmp/addresses_historic.p"
-                engagements_file = "tmp/engagements_historic.p"
-                managers_file = "tmp/managers_historic.p"
-                associations_file = "tmp/associations_historic.p"
-                leaves_file = "tmp/leaves_historic.p"
-                itsystems_file = "tmp/itsystems_historic.p"
-                it_connections_file = "tmp/it_connections_historic.p"
-                kles_file = "tmp/kles_historic.p"
-                related_file = "tmp/related_historic.p"
-                dar_file = "tmp/dar_historic.p"
-        else:
-            facets_file = "tmp/facets.p"
-            classes_file = "tmp/classes.p"
-            users_file = "tmp/users.p"
-            units_file = "tmp/units.p"
-            addresses_file = "tmp/addresses.p"
-            engagements_file = "tmp/engagements.p"
-            managers_file = "tmp/managers.p"
-            associations_file = "tmp/associations.p"
-            leaves_file = "tmp/leaves.p"
-            itsystems_file = "tmp/itsystems.p"
-            it_connections_file = "tmp/it_connections.p"
-            kles_file = "tmp/kles.p"
-            related_file = "tmp/related.p"
-            dar_file = "tmp/dar.p"
-
+        snapshot = self._snapshot()
         if dry_run:
-            with open(facets_file, "rb") as f:
-                self.facets = pickle.load(f)
-            with open(classes_file, "rb") as f:
-                self.classes = pickle.load(f)
-            with open(users_file, "rb") as f:
-                self.users = pickle.load(f)
-            with open(units_file, "rb") as f:
-                self.units = pickle.load(f)
-            with open(addresses_file, "rb") as f:
-                self.addresses = pickle.load(f)
-            with open(engagements_file, "rb") as f:
-                self.engagements = pickle.load(f)
-            with open(managers_file, "rb") as f:
-                self.managers = pickle.load(f)
-
-            if not skip_associations:
-                with open(associations_file, "rb") as f:
-                    self.associations = pickle.load(f)
-
-            with open(leaves_file, "rb") as f:
-                self.leaves = pickle.load(f)
-            with open(itsystems_file, "rb") as f:
-                self.itsystems = pickle.load(f)
-            with open(it_connections_file, "rb") as f:
-                self.it_connections = pickle.load(f)
-            with open(kles_file, "rb") as f:
-                self.kles = pickle.load(f)
-            with open(related_file, "rb") as f:
-                self.related = pickle.load(f)
-            with open(dar_file, "rb") as f:
-                self.dar_cache = pickle.load(f)
+            if snapshot.read_header() is not None:
+                self._open_snapshot(snapshot, skip_associations)
+            else:
+                # Caches written before snapshots were introduced
+                self._load_legacy_caches(skip_associations)
+                self._compact_caches()
             return
 
-        # `tasks` is used to keep strong references. Otherwise, it can be
-        # cleared by the garbage collector mid-execution as the event loop
-        # only keeps weak references.
-        tasks = []
-        async with asyncio.TaskGroup() as tg:
-            tasks.append(tg.create_task(self._cache_lora_address()))
-            tasks.append(tg.create_task(self._cache_lora_units()))
-            tasks.append(tg.create_task(self._cache_lora_engagements()))
-            tasks.append(tg.create_task(self._cache_lora_facets()))
-            tasks.append(tg.create_task(self._cache_lora_classes()))
-            tasks.append(tg.create_task(self._cache_lora_users()))
-            tasks.append(tg.create_task(self._cache_lora_managers()))
-            if not skip_associations:
-                tasks.append(tg.create_task(self._cache_lora_associations()))
-            tasks.append(tg.create_task(self._cache_lora_leaves()))
-            tasks.append(tg.create_task(self._cache_lora_itsystems()))
-            tasks.append(tg.create_task(self._cache_lora_it_connections()))
-            tasks.append(tg.create_task(self._cache_lora_kles()))
-            tasks.append(tg.create_task(self._cache_lora_related()))
-        del tasks
-
-        def write_caches(cache, filename, name):
-            logger.debug(f"writing {name}")
-            if filename:
-                with open(filename, "wb") as fw:
-                    pickle.dump(cache, fw, pickle.DEFAULT_PROTOCOL)
-            logger.debug(f"done with {name}")
-
-        write_caches(self.facets, facets_file, "facets")
-        write_caches(self.engagements, engagements_file, "engagements")
-        write_caches(self.classes, classes_file, "classes")
-        write_caches(self.users, users_file, "users")
-        write_caches(self.units, units_file, "units")
-        write_caches(self.managers, managers_file, "managers")
-        write_caches(self.leaves, leaves_file, "leaves")
-        write_caches(self.addresses, addresses_file, "addresses")
-        write_caches(self.dar_cache, dar_file, "dar_addresses")
-        write_caches(self.itsystems, itsystems_file, "itsystems")
-        write_caches(self.it_connections, it_connections_file, "it_connections")
-        write_caches(self.kles, kles_file, "kles")
-        write_caches(self.related, related_file, "related")
-
-        if not skip_associations:
-            write_caches(self.associations, associations_file, "associations")
+        # Changes registered while fetching are fetched again by the next refresh
+        fetched_at = datetime.datetime.now(datetime.timezone.utc)
+        header = self._cache_header(await self._get_mo_version())
+
+        state = snapshot.read_header() if incremental else None
+        refreshed = False
+        if incremental and self._can_refresh(state, header, skip_associations):
+            assert state is not None
+            for attr in CACHE_FILES:
+                if attr in state["collections"]:
+                    setattr(self, attr, snapshot.load(attr))
+            refreshed = await self._refresh_caches(
+                datetime.datetime.fromisoformat(state["timestamp"]),
+                skip_associations,
+                datetime.date.fromisoformat(state["date"]),
+            )
+            if not refreshed:
+                # The fetches below add to the collections, so start them afresh
+                for attr in CACHE_FILES:
+                    setattr(self, attr, {})
+        if not refreshed:
+            if incremental:
+                logger.info("Cannot refresh cache incrementally, fetching everything")
+            await self._fetch_caches(skip_associations)
+        self._compact_caches()
+
+        collections = {
+            attr: getattr(self, attr)
+            for attr in CACHE_FILES
+            if not (attr == "associations" and skip_associations)
+        }
+        snapshot.write(
+            header={
+                **header,
+                "collections": list(collections),
+                "timestamp": fetched_at.isoformat(),
+                "date": str(datetime.date.today()),
+            },
+            collections=collections,
+        )
 
     @async_to_sync
-    async def populate_cache(self, dry_run=None, skip_associations=False):
-        logger.info(f"Populating cache {dry_run=} {skip_associations=}")
+    async def populate_cache(
+        self, dry_run=None, skip_associations=False, incremental=None
+    ):
+        logger.info(f"Populating cache {dry_run=} {skip_associations=} {incremental=}")
         await self.populate_cache_async(
-            dry_run=dry_run, skip_associations=skip_associations
+            dry_run=dry_run,
+            skip_associations=skip_associations,
+            incremental=incremental,
         )
 
-    def calculate_primary_engagements(self):
-        # Needed for compatibility reasons
-        pass
+    def calculate_primary_engagements(self) -> None:
+        """Find the primary engagement of every user of the actual state.
 
-    def calculate_derived_unit_data(self):
-        # Needed for compatibility reasons
-        pass
+        Sets `primary_engagements` to the uuid of the primary engagement by user.
+        Of several primary engagements, the one starting first is chosen. Nothing is
+        found for a cache of the full history.
+        """
+        if self.full_history:
+            return
+        primary: dict[str, tuple[str, str]] = {}
+        for uuid, validities in self.engagements.items():
+            for engagement in validities:
+                if not engagement.get("primary_boolean"):
+                    continue
+                key = (engagement["from_date"], uuid)
+                user = engagement["user"]
+                if user not in primary or key < primary[user]:
+                    primary[user] = key
+        self.primary_engagements = {user: uuid for user, (_, uuid) in primary.items()}
+
+    def calculate_derived_unit_data(self) -> None:
+        """Find the path and the manager chain of every unit of the actual state.
+
+        Sets `unit_paths` to the uuids of the units from the root to every unit, and
+        `manager_chains` to the uuids of the managers of every unit and the units
+        above it, nearest first. The paths of the `org_tree` are memoised, and the
+        manager chain of a unit reuses that of its parent. Nothing is found for a
+        cache of the full history.
+        """
+        if self.full_history:
+            return
+        tree = self.org_tree()
+        self.unit_paths = {uuid: list(tree.path(uuid)) for uuid in tree.parents}
+
+        chains: dict[str, list[str]] = {}
+        # By depth, so the chain of the parent is always known
+        for uuid in sorted(tree.parents, key=tree.depth):
+            parent = tree.parent(uuid)
+            chain = chains[parent] if parent is not None else []
+            manager = self.units[uuid][0].get("manager_uuid")
+            chains[uuid] = [manager, *chain] if manager is not None else chain
+        self.manager_chains = chains
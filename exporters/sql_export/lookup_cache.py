@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Lookup cache of the event-driven SQL export.
+
+The rows written for an event refer to classes, facets, IT systems and units by
+their uuids, and are generated with the titles and user keys of those looked up in
+the LoRa cache. `LookupCache` loads these collections in full when the exporter
+starts, and the class, facet, itsystem and org_unit events keep them up to date by
+`refresh`ing the objects they fetch, so no event has to fetch a whole collection.
+"""
+
+import asyncio
+from typing import Any
+from uuid import UUID
+
+from prometheus_client import Counter
+
+from .gql_lora_cache_async import GQLLoraCache
+
+lookups = Counter(
+    name="sql_export_lookups",
+    documentation="Lookups in the lookup cache, by whether the object was cached.",
+    labelnames=["state", "collection", "outcome"],
+)
+refreshes = Counter(
+    name="sql_export_lookup_refreshes",
+    documentation="Refreshes of the lookup cache, of a whole collection or an object.",
+    labelnames=["state", "collection", "scope"],
+)
+
+_missing = object()
+
+
+class LookupCollection(dict):
+    """A collection of the lookup cache, counting its hits and misses."""
+
+    def __init__(self, objects: dict, collection: str, state: str):
+        super().__init__(objects)
+        self.collection = collection
+        self.state = state
+        self._hits = lookups.labels(state, collection, "hit")
+        self._misses = lookups.labels(state, collection, "miss")
+
+    def __getitem__(self, uuid: str) -> Any:
+        try:
+            value = super().__getitem__(uuid)
+        except KeyError:
+            self._misses.inc()
+            raise
+        self._hits.inc()
+        return value
+
+    def get(self, uuid: str, default: Any = None) -> Any:
+        value = super().get(uuid, _missing)
+        if value is _missing:
+            self._misses.inc()
+            return default
+        self._hits.inc()
+        return value
+
+
+class LookupCache:
+    def __init__(self, lc: GQLLoraCache, state: str = "actual"):
+        self.lc = lc
+        self.state = state
+
+    async def load(self) -> None:
+        """Fetch the lookup collections in full, replacing those of the LoRa cache."""
+        fetches = {
+            "classes": self.lc._fetch_classes(),
+            "facets": self.lc._fetch_facets(),
+            "itsystems": self.lc._fetch_itsystems(),
+            "units": self.lc._fetch_units(),
+        }
+        results = await asyncio.gather(*fetches.values())
+        for collection, objects in zip(fetches, results):
+            setattr(
+                self.lc,
+                collection,
+                LookupCollection(objects, collection, self.state),
+            )
+            refreshes.labels(self.state, collection, "collection").inc()
+
+
+def refresh(collection: dict, uuid: UUID, result: dict) -> None:
+    """Update the object `uuid` of `collection` from the `result` of fetching it.
+
+    The object is removed if it is not in `result`, i.e. it has been deleted.
+    """
+    if str(uuid) in result:
+        collection[str(uuid)] = result[str(uuid)]
+    else:
+        collection.pop(str(uuid), None)
+    if isinstance(collection, LookupCollection):
+        refreshes.labels(collection.state, collection.collection, "object").inc()
@@ -60,18 +60,25 @@ def fetch_loracache() -> Tuple[GQLLoraCache, GQLLoraCache]:
     help="Resolve DAR addresses",
 )
 @click.option("--read-from-cache", is_flag=True)
-def cli(historic, skip_past, resolve_dar, read_from_cache):
+@click.option(
+    "--incremental",
+    is_flag=True,
+    envvar="INCREMENTAL_LORACACHE",
+    help="Only fetch objects changed since the cache was last written",
+)
+def cli(historic, skip_past, resolve_dar, read_from_cache, incremental):
     get_gql_cache_settings().start_logging_based_on_settings()
     lc = get_cache(
         full_history=historic,
         skip_past=skip_past,
         resolve_dar=resolve_dar,
     )
-    lc.populate_cache(dry_run=read_from_cache)
+    lc.populate_cache(dry_run=read_from_cache, incremental=incremental)
 
-    logger.info("Now calcualate derived data")
-    lc.calculate_derived_unit_data()
-    lc.calculate_primary_engagements()
+    if not historic:
+        logger.info("Now calcualate derived data")
+        lc.calculate_derived_unit_data()
+        lc.calculate_primary_engagements()
 
 
 if __name__ == "__main__":
@@ -6,8 +6,11 @@
 import logging
 import time
 from contextlib import asynccontextmanager
+from functools import partial
 from typing import Annotated
 from typing import AsyncGenerator
+from typing import Type
+from uuid import UUID
 
 import sentry_sdk
 from fastapi import APIRouter
@@ -24,7 +27,12 @@ from fastramqpi.ramqp.mo import PayloadUUID
 
 from .config import DatabaseSettings
 from .config import GqlLoraCacheSettings
+from .event_debounce import EventDebouncer
+from .event_writer import EventWriter
+from .fetch_batcher import FetchBatcher
 from .gql_lora_cache_async import GQLLoraCache
+from .lookup_cache import LookupCache
+from .lookup_cache import refresh
 from .sql_export import SqlExport as _SqlExport
 from .sql_table_defs import KLE
 from .sql_table_defs import Adresse
@@ -43,6 +51,7 @@ from .sql_table_defs import Leder
 from .sql_table_defs import LederAnsvar
 from .sql_table_defs import Orlov
 from .sql_table_defs import Tilknytning
+from .sql_table_defs import sql_type
 from .trigger import trigger_router
 
 logger = logging.getLogger(__name__)
@@ -55,9 +64,35 @@ SqlExport = Annotated[_SqlExport, Depends(from_user_context("sql_exporter"))]
 SqlExportHistoric = Annotated[
     _SqlExport, Depends(from_user_context("sql_exporter_historic"))
 ]
+Writer = Annotated[EventWriter, Depends(from_user_context("event_writer"))]
+WriterHistoric = Annotated[
+    EventWriter, Depends(from_user_context("event_writer_historic"))
+]
+Debouncer = Annotated[EventDebouncer, Depends(from_user_context("event_debouncer"))]
+DebouncerHistoric = Annotated[
+    EventDebouncer, Depends(from_user_context("event_debouncer_historic"))
+]
+
+
+async def update_sql(
+    sql_exporter: _SqlExport,
+    writer: EventWriter | None,
+    uuid: UUID,
+    objects: list[sql_type],
+    table: Type[sql_type],
+) -> None:
+    """Write the rows of an object through `writer`, or directly without one."""
+    if writer is None:
+        sql_exporter.update_sql(uuid, objects, table)
+    else:
+        await writer.update_sql(uuid, objects, table)
 
 
-async def handle_address(uuid: PayloadUUID, sql_exporter: SqlExport):
+async def handle_address(
+    uuid: PayloadUUID,
+    sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
+):
     result = await sql_exporter.lc._fetch_address(uuid)
     address_objects = []
     dar_address_objects = []
@@ -69,13 +104,14 @@ async def handle_address(uuid: PayloadUUID, sql_exporter: SqlExport):
 
         address_objects.append(sql_exporter._generate_sql_addresses(uuid, res, Adresse))
 
-    sql_exporter.update_sql(uuid, dar_address_objects, DARAdresse)
-    sql_exporter.update_sql(uuid, address_objects, Adresse)
+    await update_sql(sql_exporter, writer, uuid, dar_address_objects, DARAdresse)
+    await update_sql(sql_exporter, writer, uuid, address_objects, Adresse)
 
 
 async def handle_association(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_associations(uuid)
 
@@ -84,24 +120,27 @@ async def handle_association(
         for res in result.get(str(uuid), [])
     ]
 
-    sql_exporter.update_sql(uuid, association_objects, Tilknytning)
+    await update_sql(sql_exporter, writer, uuid, association_objects, Tilknytning)
 
 
 async def handle_class(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_classes(uuid)
+    refresh(sql_exporter.lc.classes, uuid, result)
     res = result.get(str(uuid))
     class_objects = (
         [sql_exporter._generate_sql_classes(uuid, res, Klasse)] if res else []
     )
-    sql_exporter.update_sql(uuid, class_objects, Klasse)
+    await update_sql(sql_exporter, writer, uuid, class_objects, Klasse)
 
 
 async def handle_engagement(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_engagements(uuid)
     engagements_objects = [
@@ -109,38 +148,43 @@ async def handle_engagement(
         for res in result.get(str(uuid), [])
     ]
 
-    sql_exporter.update_sql(uuid, engagements_objects, Engagement)
+    await update_sql(sql_exporter, writer, uuid, engagements_objects, Engagement)
 
 
 async def handle_facet(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_facets(uuid)
+    refresh(sql_exporter.lc.facets, uuid, result)
     res = result.get(str(uuid))
     facets_objects = (
         [sql_exporter._generate_sql_facets(uuid, res, Facet)] if res else []
     )
 
-    sql_exporter.update_sql(uuid, facets_objects, Facet)
+    await update_sql(sql_exporter, writer, uuid, facets_objects, Facet)
 
 
 async def handle_it_system(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_itsystems(uuid)
+    refresh(sql_exporter.lc.itsystems, uuid, result)
     res = result.get(str(uuid))
     itsystems_objects = (
         [sql_exporter._generate_sql_it_systems(uuid, res, ItSystem)] if res else []
     )
 
-    sql_exporter.update_sql(uuid, itsystems_objects, ItSystem)
+    await update_sql(sql_exporter, writer, uuid, itsystems_objects, ItSystem)
 
 
 async def handle_it_user(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_it_connections(uuid)
     results = result.get(str(uuid), [])
@@ -154,13 +198,16 @@ async def handle_it_user(
         for res in results
         for engagement_uuid in res.get("engagement_uuids", [])
     ]
-    sql_exporter.update_sql(uuid, it_engagement_objects, ItForbindelseEngagement)
-    sql_exporter.update_sql(uuid, it_connections_objects, ItForbindelse)
+    await update_sql(
+        sql_exporter, writer, uuid, it_engagement_objects, ItForbindelseEngagement
+    )
+    await update_sql(sql_exporter, writer, uuid, it_connections_objects, ItForbindelse)
 
 
 async def handle_kle(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_kles(uuid)
     kle_objects = [
@@ -168,12 +215,13 @@ async def handle_kle(
         for res in result.get(str(uuid), [])
     ]
 
-    sql_exporter.update_sql(uuid, kle_objects, KLE)
+    await update_sql(sql_exporter, writer, uuid, kle_objects, KLE)
 
 
 async def handle_leave(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_leaves(uuid)
     leaves_objects = [
@@ -181,12 +229,13 @@ async def handle_leave(
         for res in result.get(str(uuid), [])
     ]
 
-    sql_exporter.update_sql(uuid, leaves_objects, Orlov)
+    await update_sql(sql_exporter, writer, uuid, leaves_objects, Orlov)
 
 
 async def handle_manager(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_managers(uuid)
     managers_objects = []
@@ -200,13 +249,16 @@ async def handle_manager(
                 )
                 for res in result.get(str(uuid), [])
             ]
-            sql_exporter.update_sql(uuid, manager_responsibility_objects, LederAnsvar)
-    sql_exporter.update_sql(uuid, managers_objects, Leder)
+            await update_sql(
+                sql_exporter, writer, uuid, manager_responsibility_objects, LederAnsvar
+            )
+    await update_sql(sql_exporter, writer, uuid, managers_objects, Leder)
 
 
 async def handle_related(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_related(uuid)
     related_objects = [
@@ -214,25 +266,28 @@ async def handle_related(
         for res in result.get(str(uuid), [])
     ]
 
-    sql_exporter.update_sql(uuid, related_objects, Enhedssammenkobling)
+    await update_sql(sql_exporter, writer, uuid, related_objects, Enhedssammenkobling)
 
 
 async def handle_org_unit(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_units(uuid)
+    refresh(sql_exporter.lc.units, uuid, result)
     units_objects = [
         sql_exporter._generate_sql_units(uuid, res, Enhed)
         for res in result.get(str(uuid), [])
     ]
 
-    sql_exporter.update_sql(uuid, units_objects, Enhed)
+    await update_sql(sql_exporter, writer, uuid, units_objects, Enhed)
 
 
 async def handle_person(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: EventWriter | None = None,
 ):
     result = await sql_exporter.lc._fetch_users(uuid)
     users_objects = [
@@ -240,7 +295,7 @@ async def handle_person(
         for res in result.get(str(uuid), [])
     ]
 
-    sql_exporter.update_sql(uuid, users_objects, Bruger)
+    await update_sql(sql_exporter, writer, uuid, users_objects, Bruger)
 
 
 handle_function_map = {
@@ -276,11 +331,17 @@ handle_function_map = {
 async def trigger_actual_state_event(
     uuid: PayloadUUID,
     sql_exporter: SqlExport,
+    writer: Writer,
+    debouncer: Debouncer,
     key: MORoutingKey,
     _: RateLimit,
 ):
     handle_function = handle_function_map[key]
-    return await handle_function(uuid=uuid, sql_exporter=sql_exporter)
+    return await debouncer.handle(
+        key,
+        uuid,
+        partial(handle_function, uuid=uuid, sql_exporter=sql_exporter, writer=writer),
+    )
 
 
 @historic_router.register("address")
@@ -299,16 +360,32 @@ async def trigger_actual_state_event(
 async def trigger_historic_event(
     uuid: PayloadUUID,
     sql_exporter: SqlExportHistoric,
+    writer: WriterHistoric,
+    debouncer: DebouncerHistoric,
     key: MORoutingKey,
     _: RateLimit,
 ):
     handle_function = handle_function_map[key]
-    return await handle_function(uuid=uuid, sql_exporter=sql_exporter)
+    return await debouncer.handle(
+        key,
+        uuid,
+        partial(handle_function, uuid=uuid, sql_exporter=sql_exporter, writer=writer),
+    )
 
 
 class Settings(DatabaseSettings):
     fastramqpi: FastRAMQPISettings
     eventdriven: bool = False
+    # Changes of events arriving within this many seconds are written together
+    event_batch_latency: float = 0.1
+    # Maximum number of objects written in a single transaction
+    event_batch_size: int = 100
+    # Events of the same object arriving within this many seconds are collapsed
+    event_debounce_interval: float = 0.5
+    # Objects fetched by events within this many seconds are fetched together
+    fetch_batch_delay: float = 0.005
+    # Maximum number of objects fetched in a single query
+    fetch_batch_size: int = 100
 
     class Config:
         frozen = True
@@ -344,14 +421,20 @@ def create_app(**kwargs) -> FastAPI:
     app = fastramqpi.get_app()
     app.include_router(fastapi_router)
 
+    # Shared by the actual state and full history caches
+    batcher = FetchBatcher(
+        delay=settings.fetch_batch_delay, max_batch_size=settings.fetch_batch_size
+    )
+
     @asynccontextmanager
     async def sql_exporter(full_history) -> AsyncGenerator[None, None]:
         lc = GQLLoraCache(
             settings=GqlLoraCacheSettings().to_old_settings(),
             full_history=full_history,
+            batcher=batcher,
         )
-        await lc._cache_lora_classes()
-        await lc._cache_lora_facets()
+        lookup_cache = LookupCache(lc, state="historic" if full_history else "actual")
+        await lookup_cache.load()
 
         sql_exporter = SqlExport(
             settings=settings.to_old_settings(), historic=full_history
@@ -364,18 +447,43 @@ def create_app(**kwargs) -> FastAPI:
         Base.metadata.create_all(
             sql_exporter.engine,
             tables=[
-                table
+                sql_exporter.table_definition(table)
                 for name, table in dict(Base.metadata.tables).items()
                 if name[0] != "w" or name != "kvittering"
             ],
             checkfirst=True,
         )
+        sql_exporter.create_indexes(
+            name
+            for name in Base.metadata.tables
+            if name[0] != "w" and name != "kvittering"
+        )
 
-        if full_history:
-            fastramqpi.add_context(sql_exporter_historic=sql_exporter)
-        else:
-            fastramqpi.add_context(sql_exporter=sql_exporter)
-        yield
+        async with EventWriter(
+            sql_exporter,
+            max_latency=settings.event_batch_latency,
+            max_batch_size=settings.event_batch_size,
+            state="historic" if full_history else "actual",
+        ) as writer:
+            debouncer = EventDebouncer(
+                interval=settings.event_debounce_interval,
+                state="historic" if full_history else "actual",
+            )
+            if full_history:
+                fastramqpi.add_context(
+                    sql_exporter_historic=sql_exporter,
+                    lookup_cache_historic=lookup_cache,
+                    event_writer_historic=writer,
+                    event_debouncer_historic=debouncer,
+                )
+            else:
+                fastramqpi.add_context(
+                    sql_exporter=sql_exporter,
+                    lookup_cache=lookup_cache,
+                    event_writer=writer,
+                    event_debouncer=debouncer,
+                )
+            yield
 
     fastramqpi.add_lifespan_manager(sql_exporter(full_history=False), priority=2100)
     if settings.historic_state is not None:
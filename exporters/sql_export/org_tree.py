@@ -0,0 +1,153 @@
+"""The tree of organisation units of a LoRa cache.
+
+Finding the location, the path or the ancestors of a unit means walking up its
+parents, and a cache of a large organisation has thousands of units sharing the
+same ancestors, whose parents would be walked over and over again. `OrgTree` is
+built once from the parent pointers of the units, and memoises the path and the
+location of every unit it is asked about, reusing those of its parent.
+
+The units are also numbered in the order of a depth-first walk of the tree (an
+Euler tour), so the units below a unit are numbered right after it, which answers
+whether a unit is below another by comparing their numbers.
+"""
+
+import logging
+from collections.abc import Mapping
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class OrgTree:
+    def __init__(
+        self,
+        parents: Mapping[str, str | None],
+        names: Mapping[str, str] | None = None,
+    ):
+        """Build the tree of units, given the parent of every unit.
+
+        Units with a parent that is not one of the units are roots. A cycle of
+        units, which MO should never have, is broken up at an arbitrary unit.
+
+        Args:
+            parents: The parent of every unit, or None for the root units.
+            names: The name of every unit, for `location`.
+        """
+        self.parents: dict[str, str | None] = {
+            uuid: parent if parent in parents else None
+            for uuid, parent in parents.items()
+        }
+        self.names = names or {}
+        dangling = sum(
+            1
+            for parent in parents.values()
+            if parent is not None and parent not in parents
+        )
+        if dangling:
+            logger.info(f"{dangling} units have a parent outside the tree")
+
+        children: dict[str, list[str]] = {uuid: [] for uuid in self.parents}
+        for uuid, parent in self.parents.items():
+            if parent is not None:
+                children[parent].append(uuid)
+
+        self._order: list[str] = []
+        roots = [uuid for uuid, parent in self.parents.items() if parent is None]
+        self._walk(roots, children)
+        # Units not reached from a root are on a cycle, or below one
+        if len(self._order) < len(self.parents):
+            reached = set(self._order)
+            for uuid in self.parents:
+                if uuid not in reached:
+                    logger.warning(f"Unit {uuid} is its own ancestor")
+                    parent = self.parents[uuid]
+                    assert parent is not None
+                    children[parent].remove(uuid)
+                    self.parents[uuid] = None
+                    reached.update(self._walk([uuid], children))
+
+        # Every unit is numbered before the units below it, which are numbered
+        # right after it, up to its last descendant
+        self._entry = {uuid: i for i, uuid in enumerate(self._order)}
+        self._depth = dict.fromkeys(self._order, 0)
+        sizes = dict.fromkeys(self._order, 1)
+        for uuid in self._order:
+            if (parent := self.parents[uuid]) is not None:
+                self._depth[uuid] = self._depth[parent] + 1
+        for uuid in reversed(self._order):
+            if (parent := self.parents[uuid]) is not None:
+                sizes[parent] += sizes[uuid]
+        self._last = {uuid: self._entry[uuid] + sizes[uuid] - 1 for uuid in self._order}
+
+        self._paths: dict[str, tuple[str, ...]] = {}
+        self._locations: dict[str, str] = {}
+
+    @classmethod
+    def from_units(cls, units: Mapping[str, list[dict[str, Any]]]) -> "OrgTree":
+        """Build the tree of the units of a LoRa cache, from their first validity."""
+        current = {
+            uuid: validities[0] for uuid, validities in units.items() if validities
+        }
+        return cls(
+            parents={uuid: unit.get("parent") for uuid, unit in current.items()},
+            names={uuid: unit.get("name") or "" for uuid, unit in current.items()},
+        )
+
+    def _walk(self, roots: list[str], children: dict[str, list[str]]) -> list[str]:
+        """Add the units below `roots` to the depth-first order, and return them."""
+        start = len(self._order)
+        stack = list(reversed(roots))
+        while stack:
+            uuid = stack.pop()
+            self._order.append(uuid)
+            stack.extend(children[uuid])
+        return self._order[start:]
+
+    def __contains__(self, uuid: object) -> bool:
+        return uuid in self.parents
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def parent(self, uuid: str) -> str | None:
+        return self.parents[uuid]
+
+    def depth(self, uuid: str) -> int:
+        """The number of units above `uuid`, 0 for the root units."""
+        return self._depth[uuid]
+
+    def path(self, uuid: str) -> tuple[str, ...]:
+        """The units from the root down to `uuid`, including `uuid` itself."""
+        if (path := self._paths.get(uuid)) is not None:
+            return path
+        # Walk up to the nearest unit with a known path, then fill in the way down
+        walked = [uuid]
+        while (parent := self.parents[walked[-1]]) is not None:
+            if parent in self._paths:
+                break
+            walked.append(parent)
+        path = self._paths[parent] if parent is not None else ()
+        for unit in reversed(walked):
+            path = self._paths[unit] = (*path, unit)
+        return path
+
+    def location(self, uuid: str) -> str:
+        """The names of the units from the root down to `uuid`, separated by \\."""
+        if uuid in self._locations:
+            return self._locations[uuid]
+        walked = [uuid]
+        while (parent := self.parents[walked[-1]]) is not None:
+            if parent in self._locations:
+                break
+            walked.append(parent)
+        prefix = self._locations[parent] + "\\" if parent is not None else ""
+        for unit in reversed(walked):
+            location = self._locations[unit] = prefix + (self.names.get(unit) or "")
+            prefix = location + "\\"
+        return location
+
+    def is_descendant(self, uuid: str, ancestor: str) -> bool:
+        """Whether `uuid` is `ancestor` or a unit below it."""
+        if uuid not in self._entry or ancestor not in self._entry:
+            return False
+        return self._entry[ancestor] <= self._entry[uuid] <= self._last[ancestor]
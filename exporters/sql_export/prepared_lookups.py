@@ -0,0 +1,94 @@
+"""Class and unit lookups of the rows generated by `SqlExport`.
+
+The `_generate_sql_*` methods of `SqlExport` write the titles and user keys of the
+classes and units referred to by every row, found in the LoRa cache by nested dict
+lookups, e.g. `lc.facets[lc.classes[uuid]["facet"]]["user_key"]`, or by indexing
+the validities of a unit. `Lookups` answers these from the cache as it is, which
+suits the event-driven export, whose cache changes between events, while
+`PreparedLookups` flattens every class and unit to a tuple once, for a full export
+of a cache that no longer changes.
+"""
+
+from collections.abc import Mapping
+from typing import Any
+from typing import NamedTuple
+
+
+class ClassInfo(NamedTuple):
+    titel: str | None
+    bvn: str | None
+    facet_bvn: str | None
+    scope: str | None
+
+
+class UnitInfo(NamedTuple):
+    name: str | None
+    user_key: str | None
+    location: str | None
+
+
+def class_info(klasse: Mapping[str, Any], facets: Mapping[Any, Any]) -> ClassInfo:
+    facet = facets.get(klasse.get("facet")) or {}
+    return ClassInfo(
+        titel=klasse.get("title"),
+        bvn=klasse.get("user_key"),
+        facet_bvn=facet.get("user_key"),
+        scope=klasse.get("scope"),
+    )
+
+
+def unit_info(validities: list[Mapping[str, Any]]) -> UnitInfo:
+    """The unit of its first validity, as the cache has no dates to choose by."""
+    unit = validities[0]
+    return UnitInfo(
+        name=unit.get("name"),
+        user_key=unit.get("user_key"),
+        location=unit.get("location"),
+    )
+
+
+class Lookups:
+    """Lookups in the LoRa cache, converting the cached objects on every lookup."""
+
+    def __init__(self, lc: Any):
+        self.lc = lc
+
+    def klass(self, uuid: str) -> ClassInfo:
+        """The class `uuid`, raising KeyError if it is not cached."""
+        return class_info(self.lc.classes[uuid], self.lc.facets)
+
+    def title(self, uuid: str) -> str | None:
+        """The title of the class `uuid`, or the uuid itself if it is not cached."""
+        klasse = self.lc.classes.get(uuid)
+        return klasse["title"] if klasse else uuid
+
+    def unit(self, uuid: str) -> UnitInfo:
+        """The unit `uuid`, raising KeyError if it is not cached."""
+        return unit_info(self.lc.units[uuid])
+
+
+class PreparedLookups(Lookups):
+    """Lookups in tuples prepared from a LoRa cache that does not change anymore.
+
+    The lookups are bound to the dicts of tuples, so calling them is a single dict
+    lookup, and the generators call them through local names.
+    """
+
+    def __init__(self, lc: Any):
+        super().__init__(lc)
+        self.classes: dict[str, ClassInfo] = {
+            uuid: class_info(klasse, lc.facets) for uuid, klasse in lc.classes.items()
+        }
+        self.titles = {
+            uuid: klasse["title"] for uuid, klasse in lc.classes.items() if klasse
+        }
+        self.units: dict[str, UnitInfo] = {
+            uuid: unit_info(validities)
+            for uuid, validities in lc.units.items()
+            if validities
+        }
+        self.klass = self.classes.__getitem__  # type: ignore[assignment]
+        self.unit = self.units.__getitem__  # type: ignore[assignment]
+
+    def title(self, uuid: str) -> str | None:
+        return self.titles.get(uuid, uuid)
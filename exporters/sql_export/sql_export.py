@@ -1,6 +1,21 @@
 import datetime
+import hashlib
+import json
 import logging
+import queue
+import threading
+import time
 import typing
+from collections import Counter
+from collections import defaultdict
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from itertools import chain
+from itertools import starmap
+from typing import Any
 from typing import Tuple
 from typing import Type
 from typing import TypeVar
@@ -13,26 +28,41 @@ from alembic.operations import Operations
 from fastramqpi.ra_utils.job_settings import JobSettings
 from fastramqpi.ra_utils.load_settings import load_settings
 from fastramqpi.ra_utils.tqdm_wrapper import tqdm
-from more_itertools import ichunked
+from more_itertools import chunked
 from more_itertools import one
+from sqlalchemy import Boolean
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+from sqlalchemy import bindparam
 from sqlalchemy import create_engine
+from sqlalchemy import delete
+from sqlalchemy import insert
+from sqlalchemy import inspect
 from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.dialects import mysql
+from sqlalchemy.engine import Connection
 from sqlalchemy.engine import Engine
 from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 
 from .gql_lora_cache_async import GQLLoraCache
 from .lora_cache import get_cache as LoraCache
+from .prepared_lookups import Lookups
+from .prepared_lookups import PreparedLookups
 from .sql_table_defs import KLE
 from .sql_table_defs import WKLE
 from .sql_table_defs import Adresse
 from .sql_table_defs import Base
 from .sql_table_defs import Bruger
+from .sql_table_defs import Compare
 from .sql_table_defs import DARAdresse
 from .sql_table_defs import Engagement
 from .sql_table_defs import Enhed
 from .sql_table_defs import Enhedssammenkobling
+from .sql_table_defs import EnhedSti
 from .sql_table_defs import Facet
 from .sql_table_defs import ItForbindelse
 from .sql_table_defs import ItForbindelseEngagement
@@ -41,7 +71,9 @@ from .sql_table_defs import Klasse
 from .sql_table_defs import Kvittering
 from .sql_table_defs import Leder
 from .sql_table_defs import LederAnsvar
+from .sql_table_defs import LederKaede
 from .sql_table_defs import Orlov
+from .sql_table_defs import PrimaerEngagement
 from .sql_table_defs import Tilknytning
 from .sql_table_defs import WAdresse
 from .sql_table_defs import WBruger
@@ -49,6 +81,7 @@ from .sql_table_defs import WDARAdresse
 from .sql_table_defs import WEngagement
 from .sql_table_defs import WEnhed
 from .sql_table_defs import WEnhedssammenkobling
+from .sql_table_defs import WEnhedSti
 from .sql_table_defs import WFacet
 from .sql_table_defs import WItForbindelse
 from .sql_table_defs import WItForbindelseEngagement
@@ -56,8 +89,12 @@ from .sql_table_defs import WItSystem
 from .sql_table_defs import WKlasse
 from .sql_table_defs import WLeder
 from .sql_table_defs import WLederAnsvar
+from .sql_table_defs import WLederKaede
 from .sql_table_defs import WOrlov
+from .sql_table_defs import WPrimaerEngagement
 from .sql_table_defs import WTilknytning
+from .sql_table_defs import index_name
+from .sql_table_defs import indexes
 from .sql_table_defs import sql_type
 from .sql_url import DatabaseFunction
 from .sql_url import generate_connection_url
@@ -83,6 +120,12 @@ _T_Enhedssammenkobling = TypeVar(
     "_T_Enhedssammenkobling", Enhedssammenkobling, WEnhedssammenkobling
 )
 _T_DARAdresse = TypeVar("_T_DARAdresse", DARAdresse, WDARAdresse)
+_T_EnhedSti = TypeVar("_T_EnhedSti", EnhedSti, WEnhedSti)
+_T_PrimaerEngagement = TypeVar(
+    "_T_PrimaerEngagement", PrimaerEngagement, WPrimaerEngagement
+)
+_T_LederKaede = TypeVar("_T_LederKaede", LederKaede, WLederKaede)
+_T_Model = TypeVar("_T_Model")
 
 
 class SqlExportSettings(JobSettings):
@@ -93,6 +136,58 @@ class SqlExportSettings(JobSettings):
 logger = logging.getLogger(__name__)
 
 
+def row_hash(row: dict[str, Any]) -> str:
+    """Hash of the values of a generated row, stable across exports."""
+    values = json.dumps(row, sort_keys=True, default=str)
+    return hashlib.md5(values.encode(), usedforsecurity=False).hexdigest()
+
+
+def _with_hashes(
+    rows: Iterable[tuple[Table, dict[str, Any]]],
+) -> Iterator[tuple[Table, dict[str, Any]]]:
+    for table, row in rows:
+        row["hash"] = row_hash(row)
+        yield table, row
+
+
+def _without_hash(table: Table) -> Table:
+    """Copy of `table` without the `hash` column of `Compare`."""
+    return Table(
+        table.name,
+        MetaData(),
+        *(column._copy() for column in table.columns if column.name != "hash"),
+    )
+
+
+class _RowFactory:
+    def __init__(self, model):
+        self.__table__ = model.__table__
+
+    def __call__(self, **row: Any) -> tuple[Table, dict[str, Any]]:
+        return self.__table__, row
+
+
+def row_factory(model: Type[_T_Model]) -> Type[_T_Model]:
+    """Stand-in for `model` in the `_generate_sql_*` methods.
+
+    Instead of ORM instances, the methods return the table and a dict of the row,
+    for bulk inserts by `SqlExport._insert_rows`.
+    """
+    return typing.cast(Type[_T_Model], _RowFactory(model))
+
+
+# Types reflected for Boolean columns by MySQL, which has no boolean type. The tables
+# have no other small integer or bit columns.
+_BOOLEAN_ALIASES = (mysql.TINYINT, mysql.BIT)
+
+
+def _type_signature(type_: Any) -> tuple[type, int | None]:
+    """The kind and length of a column type, comparable to a reflected one."""
+    if isinstance(type_, _BOOLEAN_ALIASES):
+        return Boolean, None
+    return type_._type_affinity, getattr(type_, "length", None)
+
+
 class SqlExport:
     def __init__(self, force_sqlite=False, historic=False, settings=None):
         logger.info("Start SQL export")
@@ -101,8 +196,31 @@ class SqlExport:
         self.settings = settings
         self.engine = self._get_engine()
         self.export_cpr = self._get_export_cpr_setting()
+        self.export_workers = self._get_export_workers_setting()
+        self.derived_tables = self._get_derived_tables_setting()
+        self.differential = self._get_differential_setting()
         self.chunk_size = 5000
         self.lc = None
+        # Lookups prepared for the duration of a full export, see `lookups`
+        self._lookups: Lookups | None = None
+        # Lookups in the LoRa cache as it is, made once per cache, see `lookups`
+        self._live_lookups: Lookups | None = None
+        # Whether the last export was applied to the current tables in place
+        self._differential = False
+        # Tables written to by the differential export, see `_apply_rows`
+        self._applied: set[str] = set()
+        # Rows inserted, updated or deleted by the export, by table
+        self._written: Counter[str] = Counter()
+        # Each export worker thread writes through its own connection
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> Connection:
+        return self._local.connection
+
+    @connection.setter
+    def connection(self, connection: Connection) -> None:
+        self._local.connection = connection
 
     def _get_engine(self) -> Engine:
         database_function = DatabaseFunction.ACTUAL_STATE
@@ -119,6 +237,15 @@ class SqlExport:
     def _get_export_cpr_setting(self) -> bool:
         return self.settings.get("exporters.actual_state.export_cpr", True)
 
+    def _get_export_workers_setting(self) -> int:
+        return self.settings.get("exporters.actual_state.export_workers", 1)
+
+    def _get_derived_tables_setting(self) -> bool:
+        return self.settings.get("exporters.actual_state.derived_tables", False)
+
+    def _get_differential_setting(self) -> bool:
+        return self.settings.get("exporters.actual_state.differential", False)
+
     def _get_lora_cache(self, resolve_dar, use_pickle) -> GQLLoraCache:
         if self.historic:
             lc = LoraCache(
@@ -128,22 +255,41 @@ class SqlExport:
         else:
             lc = LoraCache(resolve_dar=resolve_dar, settings=self.settings)
             lc.populate_cache(dry_run=use_pickle)
-            lc.calculate_derived_unit_data()
-            lc.calculate_primary_engagements()
+            if self.derived_tables:
+                lc.calculate_derived_unit_data()
+                lc.calculate_primary_engagements()
         return lc
 
     def _get_db_session(self) -> Session:
         Session = sessionmaker(bind=self.engine, autoflush=False)
         return Session()
 
+    @property
+    def lookups(self) -> Lookups:
+        """Lookups of classes and units, prepared once during a full export.
+
+        Otherwise they look in the LoRa cache as it is, which the event-driven
+        export keeps up to date.
+        """
+        if self._lookups is not None:
+            return self._lookups
+        if self._live_lookups is None or self._live_lookups.lc is not self.lc:
+            self._live_lookups = Lookups(self.lc)
+        return self._live_lookups
+
     def _get_lora_class(self, uuid: str) -> Tuple[str, dict]:
         cls: dict = self.lc.classes.get(uuid) or {"title": uuid}
         return uuid, cls
 
-    def perform_export(self, resolve_dar=True, use_pickle=None):
-        def timestamp():
-            return datetime.datetime.now()
+    def table_definition(self, table: Table) -> Table:
+        """The definition `table` is created with.
 
+        Only the differential export compares the rows by their hash, so the `hash`
+        column is left out of the tables created without the `differential` setting.
+        """
+        return table if self.differential else _without_hash(table)
+
+    def _prepare_work_tables(self) -> None:
         tables = dict(Base.metadata.tables)
 
         logger.info("Dropping work tables")
@@ -155,7 +301,7 @@ class SqlExport:
         Base.metadata.create_all(
             self.engine,
             tables=[
-                table
+                self.table_definition(table)
                 for name, table in tables.items()
                 if name[0] == "w" or name == "kvittering"
             ],
@@ -163,6 +309,73 @@ class SqlExport:
 
         self.session = self._get_db_session()
 
+    def _schema_changed(self) -> bool:
+        """Whether the current tables differ from those the export would create.
+
+        The differential export can only apply rows to current tables with the
+        columns of the work tables, so any other difference, including missing
+        tables, calls for a full rebuild.
+        """
+        inspector = inspect(self.engine)
+        existing = set(inspector.get_table_names())
+        for table_name in self._current_tables():
+            if table_name not in existing:
+                logger.info(f"Table {table_name} does not exist")
+                return True
+            table = Base.metadata.tables[table_name]
+            columns = {
+                column["name"]: _type_signature(column["type"])
+                for column in inspector.get_columns(table_name)
+            }
+            if columns != {c.name: _type_signature(c.type) for c in table.columns}:
+                logger.info(f"The columns of {table_name} have changed")
+                return True
+        return False
+
+    def _log_position(self) -> int | None:
+        """Bytes written to the transaction log of the database, where known.
+
+        On MSSQL this is the log space in use, which shrinks when the log is
+        truncated, so the difference of two positions is only an estimate.
+        """
+        queries = {
+            "postgresql": "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')",
+            "mssql": "SELECT used_log_space_in_bytes FROM sys.dm_db_log_space_usage",
+        }
+        if (query := queries.get(self.engine.dialect.name)) is None:
+            return None
+        try:
+            with self.engine.connect() as connection:
+                return int(connection.execute(text(query)).scalar_one())
+        except DBAPIError:
+            logger.warning("Cannot read the transaction log position", exc_info=True)
+            return None
+
+    def perform_export(self, resolve_dar=True, use_pickle=None):
+        """Export the LoRa cache to the work tables, or to the current tables.
+
+        By default the work tables are rebuilt from scratch, to be swapped with the
+        current tables by `swap_tables`. With the `differential` setting, the rows
+        are instead compared with the current tables, and only the changes are
+        written to them in a single transaction, see `_apply_rows`, unless the
+        schema of the tables has changed since they were written.
+        """
+
+        def timestamp():
+            return datetime.datetime.now()
+
+        start = time.perf_counter()
+        log_start = self._log_position()
+        self._written.clear()
+        self._applied.clear()
+        self._differential = self.differential and not self._schema_changed()
+        if self._differential:
+            logger.info("Exporting the changed rows to the current tables")
+            Base.metadata.tables["kvittering"].create(self.engine, checkfirst=True)
+            self.session = self._get_db_session()
+        else:
+            self._prepare_work_tables()
+
         query_time = timestamp()
         kvittering = self._add_receipt(query_time)
         self.lc = self.lc or self._get_lora_cache(resolve_dar, use_pickle)
@@ -186,12 +399,344 @@ class SqlExport:
             self._add_kles,
             self._add_related,
         ]
-        for task in tqdm(tasks, desc="SQLExport", unit="task"):
-            task()
+        # The derived tables are computed from the actual state only
+        if self.derived_tables and not self.historic:
+            tasks += [
+                self._add_unit_paths,
+                self._add_primary_engagements,
+                self._add_manager_chains,
+            ]
+        # SQLite is much faster writing everything in a single transaction, while
+        # other databases commit every batch to keep their transaction logs small.
+        # The changes of a differential export are applied to the current tables in
+        # a single transaction, so a failing export leaves them as they were.
+        self._commit_batches = (
+            self.engine.dialect.name != "sqlite" and not self._differential
+        )
+        self._lookups = PreparedLookups(self.lc)
+        try:
+            # SQLite only allows a single writer at a time
+            if (
+                self.export_workers > 1
+                and self.engine.dialect.name != "sqlite"
+                and not self._differential
+            ):
+                self._run_tasks_parallel(tasks)
+            else:
+                with self.engine.connect() as self.connection:
+                    for task in tqdm(tasks, desc="SQLExport", unit="task"):
+                        task()
+                    if self._differential:
+                        # Tables without any rows are emptied
+                        tables = set(self._current_tables()) - self._applied
+                        self._apply_rows((), tables=sorted(tables))
+                    self.connection.commit()
+        finally:
+            self._lookups = None
+        if self._differential:
+            self.create_indexes(self._current_tables())
+        else:
+            self.create_indexes(self._work_tables())
 
         end_delivery_time = timestamp()
         self._update_receipt(kvittering, start_delivery_time, end_delivery_time)
 
+        log_end = self._log_position()
+        log_volume = (
+            f", {log_end - log_start} bytes of transaction log"
+            if log_start is not None and log_end is not None
+            else ""
+        )
+        logger.info(
+            f"{'Differential' if self._differential else 'Full'} export wrote "
+            f"{sum(self._written.values())} rows in {time.perf_counter() - start:.2f}s"
+            f"{log_volume}"
+        )
+
+    def _streamed_rows(self) -> dict[str, Callable[[str, list[dict]], Iterable]]:
+        """Row generators of the collections written while the cache is fetched."""
+        return {
+            "units": self._unit_rows,
+            "users": self._user_rows,
+            "addresses": self._address_rows,
+            "engagements": self._engagement_rows,
+            "associations": self._association_rows,
+            "leaves": self._leave_rows,
+            "managers": self._manager_rows,
+            "it_connections": self._it_user_rows,
+            "kles": self._kle_rows,
+            "related": self._related_rows,
+        }
+
+    def perform_streaming_export(self, resolve_dar=True):
+        """Export the LoRa cache while it is being fetched.
+
+        Instead of waiting for the entire cache, the objects of every collection
+        flow from the pages fetched by `GQLLoraCache.stream_caches` through a bounded
+        queue into the work tables. Only the classification, which the rows are
+        generated from, and the DAR addresses are kept in memory.
+        """
+
+        def timestamp():
+            return datetime.datetime.now()
+
+        # The streamed rows are always written to rebuilt work tables
+        self._differential = False
+        self._prepare_work_tables()
+
+        query_time = timestamp()
+        kvittering = self._add_receipt(query_time)
+        self.lc = LoraCache(
+            resolve_dar=resolve_dar, full_history=self.historic, settings=self.settings
+        )
+
+        start_delivery_time = timestamp()
+        self._update_receipt(kvittering, start_delivery_time)
+
+        objects: queue.Queue = queue.Queue(maxsize=self.chunk_size)
+        failed = threading.Event()
+
+        def put(item) -> None:
+            # Gives up if the writer failed, as it will never empty the queue
+            while not failed.is_set():
+                try:
+                    objects.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+            raise RuntimeError("Writing the streamed export failed")
+
+        def sink(rows: Callable) -> Callable[[str, list[dict]], None]:
+            return lambda uuid, validities: put((rows, uuid, validities))
+
+        def fetch() -> None:
+            sinks = {attr: sink(rows) for attr, rows in self._streamed_rows().items()}
+            try:
+                self.lc.stream_caches(sinks)
+            finally:
+                if not failed.is_set():
+                    put(None)
+
+        def streamed_rows():
+            queued = tqdm(iter(objects.get, None), desc="Export stream", unit="object")
+            for rows, uuid, validities in queued:
+                yield from rows(uuid, validities)
+
+        self._commit_batches = self.engine.dialect.name != "sqlite"
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            fetched = executor.submit(fetch)
+            try:
+                with self.engine.connect() as self.connection:
+                    self._insert_rows(streamed_rows())
+                    fetched.result()
+                    for task in tqdm(
+                        [
+                            self._add_facets,
+                            self._add_classes,
+                            self._add_it_systems,
+                            self._add_dar_addresses,
+                        ],
+                        desc="SQLExport",
+                        unit="task",
+                    ):
+                        task()
+                    self.connection.commit()
+            except BaseException:
+                failed.set()
+                raise
+        self.create_indexes(self._work_tables())
+
+        end_delivery_time = timestamp()
+        self._update_receipt(kvittering, start_delivery_time, end_delivery_time)
+
+    def _run_tasks_parallel(self, tasks: list[Callable[[], None]]) -> None:
+        """Run the export tasks in `export_workers` threads.
+
+        The work tables have no foreign keys between them, so they can be written
+        concurrently, each task through its own connection.
+        """
+
+        def run(task: Callable[[], None]) -> None:
+            with self.engine.connect() as self.connection:
+                task()
+                self.connection.commit()
+
+        logger.info(f"Running export tasks in {self.export_workers} workers")
+        with ThreadPoolExecutor(max_workers=self.export_workers) as executor:
+            futures = [executor.submit(run, task) for task in tasks]
+            try:
+                for future in tqdm(
+                    as_completed(futures),
+                    total=len(futures),
+                    desc="SQLExport",
+                    unit="task",
+                ):
+                    future.result()
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+
+    def _insert_rows(self, rows: Iterable[tuple[Table, dict[str, Any]]]) -> None:
+        """Bulk insert rows generated by `row_factory`s, in batches of `chunk_size`.
+
+        Logs the insert throughput of each table. In a differential export, the rows
+        are applied to the current tables by `_apply_rows` instead. With the
+        `differential` setting, every row is given its `row_hash`, also when the
+        tables are rebuilt, so the next export can compare with them.
+        """
+        if self.differential:
+            rows = _with_hashes(rows)
+        if self._differential:
+            self._apply_rows(rows)
+            return
+        row_counts: Counter[str] = Counter()
+        seconds: dict[str, float] = defaultdict(float)
+        for batch in chunked(rows, self.chunk_size):
+            # executemany requires every row to have the same keys
+            statements: dict[tuple[Table, tuple[str, ...]], list[dict]] = {}
+            for table, row in batch:
+                statements.setdefault((table, tuple(row)), []).append(row)
+            for (table, _), table_rows in statements.items():
+                start = time.perf_counter()
+                self.connection.execute(table.insert(), table_rows)
+                seconds[table.name] += time.perf_counter() - start
+                row_counts[table.name] += len(table_rows)
+            if self._commit_batches:
+                self.connection.commit()
+        for table_name, count in row_counts.items():
+            self._written[table_name] += count
+            rate = count / seconds[table_name] if seconds[table_name] else 0
+            logger.info(
+                f"Inserted {count} rows into {table_name} in "
+                f"{seconds[table_name]:.2f}s ({rate:.0f} rows/s)"
+            )
+
+    def _apply_rows(
+        self,
+        rows: Iterable[tuple[Table, dict[str, Any]]],
+        tables: Iterable[str] = (),
+    ) -> None:
+        """Write the changes between the generated rows and the current tables.
+
+        The rows are generated for the work tables, and are compared by their hash
+        with the rows of the current table of the same name. Rows with a known hash
+        are left alone. The rows of an object that have changed replace its old
+        rows with UPDATEs as far as they go, and the rest are inserted or deleted.
+        Nothing is committed, as all tables are applied in a single transaction by
+        `perform_export`.
+
+        Args:
+            rows: The generated rows, of any number of work tables.
+            tables: Current tables to apply, even if no rows are generated for them,
+                which deletes all their rows.
+        """
+        current: dict[str, dict[str | None, list[Any]]] = {}
+        changed: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        unchanged: Counter[str] = Counter()
+
+        def current_hashes(table: Table) -> dict[str | None, list[Any]]:
+            primary_key = one(table.primary_key.columns)
+            hashes: dict[str | None, list[Any]] = defaultdict(list)
+            for key, row_hash in self.connection.execute(
+                select(primary_key, table.c.hash)
+            ):
+                hashes[row_hash].append(key)
+            return hashes
+
+        for table_name in tables:
+            current[table_name] = current_hashes(Base.metadata.tables[table_name])
+        for work_table, row in rows:
+            table_name = work_table.name[1:]
+            if table_name not in current:
+                current[table_name] = current_hashes(Base.metadata.tables[table_name])
+            if keys := current[table_name].get(row["hash"]):
+                keys.pop()
+                unchanged[table_name] += 1
+            else:
+                changed[table_name].append(row)
+
+        for table_name, hashes in current.items():
+            start = time.perf_counter()
+            removed = [key for keys in hashes.values() for key in keys]
+            counts = self._apply_changes(
+                Base.metadata.tables[table_name], removed, changed[table_name]
+            )
+            self._applied.add(table_name)
+            self._written[table_name] += sum(counts.values())
+            logger.info(
+                f"Applied {table_name} in {time.perf_counter() - start:.2f}s: "
+                f"{counts['inserted']} inserted, {counts['updated']} updated, "
+                f"{counts['deleted']} deleted, {unchanged[table_name]} unchanged"
+            )
+
+    def _apply_changes(
+        self, table: Table, removed: list[Any], new: list[dict[str, Any]]
+    ) -> Counter[str]:
+        """Replace the rows `removed`, by primary key, with the `new` rows."""
+        primary_key = one(table.primary_key.columns)
+        # The column identifying the object of a row, pairing old and new rows
+        object_key = next(
+            column
+            for column in table.columns
+            if column.name == "uuid" or column.name.endswith("_uuid")
+        )
+        old: dict[Any, list[Any]] = defaultdict(list)
+        for keys in chunked(removed, self.chunk_size):
+            for key, object_uuid in self.connection.execute(
+                select(primary_key, object_key).where(primary_key.in_(keys))
+            ):
+                old[object_uuid].append(key)
+        updates, inserts = [], []
+        for row in new:
+            if matching := old.get(row[object_key.name]):
+                updates.append({**row, "old_key": matching.pop()})
+            else:
+                inserts.append(row)
+        deletes = [key for keys in old.values() for key in keys]
+
+        for keys in chunked(deletes, self.chunk_size):
+            self.connection.execute(delete(table).where(primary_key.in_(keys)))
+        for statement, batch in (
+            (table.update().where(primary_key == bindparam("old_key")), updates),
+            (table.insert(), inserts),
+        ):
+            for chunk in chunked(batch, self.chunk_size):
+                # executemany requires every row to have the same keys
+                grouped: dict[tuple[str, ...], list[dict]] = defaultdict(list)
+                for row in chunk:
+                    grouped[tuple(row)].append(row)
+                for group in grouped.values():
+                    self.connection.execute(statement, group)
+        return Counter(
+            inserted=len(inserts), updated=len(updates), deleted=len(deletes)
+        )
+
+    @staticmethod
+    def _work_tables() -> list[str]:
+        return [name for name in Base.metadata.tables if name[0] == "w"]
+
+    @classmethod
+    def _current_tables(cls) -> list[str]:
+        """The tables the work tables are swapped to."""
+        return [name[1:] for name in cls._work_tables()]
+
+    def create_indexes(self, table_names: Iterable[str]) -> None:
+        """Create the indexes declared on the tables, skipping those that exist.
+
+        Run on the work tables once they have been written, as maintaining the
+        indexes while bulk loading is much slower than creating them afterwards, and
+        on the tables of the event-driven export, which may predate the indexes.
+        """
+        with self.engine.begin() as connection:
+            for table_name in table_names:
+                for index in indexes(table_name):
+                    start = time.perf_counter()
+                    index.create(connection, checkfirst=True)
+                    logger.info(
+                        f"Created index {index.name} in "
+                        f"{time.perf_counter() - start:.2f}s"
+                    )
+
     def get_actual_tables(self):
         connection = self.engine.connect()
         inspector = Inspector.from_engine(connection)
@@ -203,7 +748,12 @@ class SqlExport:
 
         Swaps the current tables to old tables, then swaps write tables to current.
         Finally drops the old tables leaving just the current tables.
+
+        Does nothing after a differential export, which wrote to the current tables.
         """
+        if self._differential:
+            logger.info("The export was applied to the current tables, not swapping")
+            return
         logger.info("Swapping tables")
         connection = self.engine.connect()
         ctx = MigrationContext.configure(connection)
@@ -243,6 +793,44 @@ class SqlExport:
                 if old_table in actual_tables:
                     op.drop_table(old_table)
 
+        # Rename the indexes created on the write tables, now that the indexes of
+        # the old tables are gone
+        with ctx.begin_transaction():
+            inspector = inspect(connection)
+            for write_table, current_table, _ in tables:
+                existing = {
+                    index["name"] for index in inspector.get_indexes(current_table)
+                }
+                for index in indexes(current_table):
+                    columns = list(index.columns.keys())
+                    name = index_name(write_table, tuple(columns))
+                    new_name = index_name(current_table, tuple(columns))
+                    if name in existing and new_name not in existing:
+                        self._rename_index(op, current_table, name, new_name, columns)
+
+    @staticmethod
+    def _rename_index(
+        op: Operations, table_name: str, name: str, new_name: str, columns: list[str]
+    ) -> None:
+        """Rename the index `name` on `columns` of the table `table_name`."""
+        dialect = op.get_bind().dialect
+        quote = dialect.identifier_preparer.quote
+        if dialect.name == "postgresql":
+            op.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(new_name)}")
+        elif dialect.name == "mssql":
+            op.execute(
+                f"EXEC sp_rename N'{table_name}.{name}', N'{new_name}', N'INDEX'"
+            )
+        elif dialect.name == "mysql":
+            op.execute(
+                f"ALTER TABLE {quote(table_name)} "
+                f"RENAME INDEX {quote(name)} TO {quote(new_name)}"
+            )
+        else:
+            # SQLite cannot rename indexes
+            op.drop_index(name, table_name=table_name)
+            op.create_index(new_name, table_name, columns)
+
     def _generate_sql_facets(self, uuid, facet_info, model: Type[_T_Facet]) -> _T_Facet:
         return model(
             uuid=str(uuid),
@@ -252,11 +840,11 @@ class SqlExport:
     def _add_facets(self) -> None:
         logger.info("Add classification")
         facets = tqdm(self.lc.facets.items(), desc="Export facet", unit="facet")
-        for chunk in ichunked(facets, self.chunk_size):
-            for uuid, facet_info in chunk:
-                sql_facet = self._generate_sql_facets(uuid, facet_info, WFacet)
-                self.session.add(sql_facet)
-            self.session.commit()
+        row = row_factory(WFacet)
+        self._insert_rows(
+            self._generate_sql_facets(uuid, facet_info, row)
+            for uuid, facet_info in facets
+        )
 
     def _generate_sql_classes(
         self, uuid, klasse_info, model: Type[_T_Klasse]
@@ -271,11 +859,11 @@ class SqlExport:
 
     def _add_classes(self) -> None:
         classes = tqdm(self.lc.classes.items(), desc="Export class", unit="class")
-        for chunk in ichunked(classes, self.chunk_size):
-            for uuid, klasse_info in chunk:
-                sql_class = self._generate_sql_classes(uuid, klasse_info, WKlasse)
-                self.session.add(sql_class)
-            self.session.commit()
+        row = row_factory(WKlasse)
+        self._insert_rows(
+            self._generate_sql_classes(uuid, klasse_info, row)
+            for uuid, klasse_info in classes
+        )
 
     def _generate_sql_users(self, uuid, user_info, model: Type[_T_Bruger]) -> _T_Bruger:
         return model(
@@ -290,15 +878,15 @@ class SqlExport:
             slutdato=user_info["to_date"],
         )
 
+    def _user_rows(self, uuid, user_effects):
+        row = row_factory(WBruger)
+        for user_info in user_effects:
+            yield self._generate_sql_users(uuid, user_info, row)
+
     def _add_users(self) -> None:
         logger.info("Add users")
         users = tqdm(self.lc.users.items(), desc="Export user", unit="user")
-        for chunk in ichunked(users, self.chunk_size):
-            for uuid, user_effects in chunk:
-                for user_info in user_effects:
-                    sql_user = self._generate_sql_users(uuid, user_info, WBruger)
-                    self.session.add(sql_user)
-            self.session.commit()
+        self._insert_rows(chain.from_iterable(starmap(self._user_rows, users)))
 
     def _generate_sql_units(self, uuid, unit_info, model: Type[_T_Enhed]) -> _T_Enhed:
         location = unit_info.get("location")
@@ -307,20 +895,18 @@ class SqlExport:
 
         unit_type = unit_info["unit_type"]
 
-        enhedsniveau_titel = ""
+        lookups = self.lookups
+        klass = lookups.klass
+
+        enhedsniveau_titel: str | None = ""
         if unit_info["level"]:
-            enhedsniveau_titel = self.lc.classes[unit_info["level"]]["title"]
+            enhedsniveau_titel = klass(unit_info["level"]).titel
 
-        tidsregistrering_titel = ""
+        tidsregistrering_titel: str | None = ""
         if unit_info["time_planning"]:
-            tidsregistrering_titel = self.lc.classes[unit_info["time_planning"]][
-                "title"
-            ]
+            tidsregistrering_titel = klass(unit_info["time_planning"]).titel
 
-        (
-            org_unit_hierarchy_uuid,
-            org_unit_hierarchy_class,
-        ) = self._get_lora_class(unit_info["org_unit_hierarchy"])
+        org_unit_hierarchy_uuid = unit_info["org_unit_hierarchy"]
 
         return model(
             uuid=str(uuid),
@@ -333,37 +919,36 @@ class SqlExport:
             organisatorisk_sti=location,
             leder_uuid=manager_uuid,
             fungerende_leder_uuid=acting_manager_uuid,
-            enhedstype_titel=self.lc.classes[unit_type]["title"],
+            enhedstype_titel=klass(unit_type).titel,
             enhedsniveau_titel=enhedsniveau_titel,
             tidsregistrering_titel=tidsregistrering_titel,
             opmærkning_uuid=org_unit_hierarchy_uuid,
-            opmærkning_titel=org_unit_hierarchy_class["title"],
+            opmærkning_titel=lookups.title(org_unit_hierarchy_uuid),
             startdato=unit_info["from_date"],
             slutdato=unit_info["to_date"],
         )
 
+    def _unit_rows(self, uuid, unit_validities):
+        row = row_factory(WEnhed)
+        for unit_info in unit_validities:
+            yield self._generate_sql_units(uuid, unit_info, row)
+
     def _add_units(self) -> None:
         logger.info("Add users")
         units = tqdm(self.lc.units.items(), desc="Export unit", unit="unit")
-        for chunk in ichunked(units, self.chunk_size):
-            for uuid, unit_validities in chunk:
-                for unit_info in unit_validities:
-                    sql_unit = self._generate_sql_units(uuid, unit_info, WEnhed)
-                    self.session.add(sql_unit)
-            self.session.commit()
+        self._insert_rows(chain.from_iterable(starmap(self._unit_rows, units)))
 
     def _generate_sql_engagements(
         self, uuid, engagement_info, model: Type[_T_Engagement]
     ) -> _T_Engagement:
+        lookups = self.lookups
         if engagement_info["primary_type"] is not None:
-            primærtype_titel = self.lc.classes[engagement_info["primary_type"]]["title"]
+            primærtype_titel = lookups.klass(engagement_info["primary_type"]).titel
         else:
             primærtype_titel = ""
 
-        engagement_type_uuid = engagement_info["engagement_type"]
-        job_function_uuid, job_function_class = self._get_lora_class(
-            engagement_info["job_function"]
-        )
+        title = lookups.title
+        job_function_uuid = engagement_info["job_function"]
 
         return model(
             uuid=str(uuid),
@@ -373,41 +958,41 @@ class SqlExport:
             engagementstype_uuid=engagement_info["engagement_type"],
             primær_boolean=engagement_info.get("primary_boolean"),
             arbejdstidsfraktion=engagement_info["fraction"],
-            engagementstype_titel=self.lc.classes.get(
-                engagement_type_uuid, {"title": engagement_type_uuid}
-            )["title"],
+            engagementstype_titel=title(engagement_info["engagement_type"]),
             primærtype_titel=primærtype_titel,
             stillingsbetegnelse_uuid=job_function_uuid,
-            stillingsbetegnelse_titel=job_function_class["title"],
+            stillingsbetegnelse_titel=title(job_function_uuid),
             primærtype_uuid=engagement_info["primary_type"],
             startdato=engagement_info["from_date"],
             slutdato=engagement_info["to_date"],
             **engagement_info["extensions"],
         )
 
+    def _engagement_rows(self, uuid, engagement_validity):
+        row = row_factory(WEngagement)
+        for engagement_info in engagement_validity:
+            yield self._generate_sql_engagements(uuid, engagement_info, row)
+
     def _add_engagements(self) -> None:
         logger.info("Add engagements")
         engagements = tqdm(
             self.lc.engagements.items(), desc="Export engagement", unit="engagement"
         )
-        for chunk in ichunked(engagements, self.chunk_size):
-            for uuid, engagement_validity in chunk:
-                for engagement_info in engagement_validity:
-                    sql_engagement = self._generate_sql_engagements(
-                        uuid, engagement_info, WEngagement
-                    )
-                    self.session.add(sql_engagement)
-            self.session.commit()
+        self._insert_rows(
+            chain.from_iterable(starmap(self._engagement_rows, engagements))
+        )
 
     def _generate_sql_addresses(
         self, uuid, address_info, model: Type[_T_Adresse]
     ) -> _T_Adresse:
+        klass = self.lookups.klass
         visibility_text = None
-        if address_info["visibility"] is not None:
-            visibility_text = self.lc.classes[address_info["visibility"]]["title"]
         visibility_scope = None
         if address_info["visibility"] is not None:
-            visibility_scope = self.lc.classes[address_info["visibility"]]["scope"]
+            visibility = klass(address_info["visibility"])
+            visibility_text = visibility.titel
+            visibility_scope = visibility.scope
+        address_type = klass(address_info["adresse_type"])
 
         return model(
             uuid=str(uuid),
@@ -419,9 +1004,9 @@ class SqlExport:
             værdi=address_info["value"],
             dar_uuid=address_info["dar_uuid"],
             adressetype_uuid=address_info["adresse_type"],
-            adressetype_bvn=self.lc.classes[address_info["adresse_type"]]["user_key"],
+            adressetype_bvn=address_type.bvn,
             adressetype_scope=address_info["scope"],
-            adressetype_titel=self.lc.classes[address_info["adresse_type"]]["title"],
+            adressetype_titel=address_type.titel,
             synlighed_uuid=address_info["visibility"],
             synlighed_scope=visibility_scope,
             synlighed_titel=visibility_text,
@@ -429,19 +1014,17 @@ class SqlExport:
             slutdato=address_info["to_date"],
         )
 
+    def _address_rows(self, uuid, address_validities):
+        row = row_factory(WAdresse)
+        for address_info in address_validities:
+            yield self._generate_sql_addresses(uuid, address_info, row)
+
     def _add_addresses(self) -> None:
         logger.info("Add addresses")
         addresses = tqdm(
             self.lc.addresses.items(), desc="Export address", unit="address"
         )
-        for chunk in ichunked(addresses, self.chunk_size):
-            for uuid, address_validities in chunk:
-                for address_info in address_validities:
-                    sql_address = self._generate_sql_addresses(
-                        uuid, address_info, WAdresse
-                    )
-                    self.session.add(sql_address)
-            self.session.commit()
+        self._insert_rows(chain.from_iterable(starmap(self._address_rows, addresses)))
 
     def _generate_sql_dar_addresses(
         self, uuid, address_info, model: Type[_T_DARAdresse]
@@ -458,53 +1041,47 @@ class SqlExport:
     def _add_dar_addresses(self) -> None:
         logger.info("Add DAR addresses")
         dar = tqdm(self.lc.dar_cache.items(), desc="Export DAR", unit="DAR")
-        for chunk in ichunked(dar, self.chunk_size):
-            for uuid, address_info in chunk:
-                sql_address = self._generate_sql_dar_addresses(
-                    uuid, address_info, WDARAdresse
-                )
-                self.session.add(sql_address)
-            self.session.commit()
+        row = row_factory(WDARAdresse)
+        self._insert_rows(
+            self._generate_sql_dar_addresses(uuid, address_info, row)
+            for uuid, address_info in dar
+        )
 
     def _generate_sql_associations(
         self, uuid, association_info, model: Type[_T_Tilknytning]
     ) -> _T_Tilknytning:
-        (
-            association_type_uuid,
-            association_type_class,
-        ) = self._get_lora_class(association_info["association_type"])
-        job_function_uuid, job_function_class = self._get_lora_class(
-            association_info["job_function"]
-        )
+        title = self.lookups.title
+        association_type_uuid = association_info["association_type"]
+        job_function_uuid = association_info["job_function"]
         return model(
             uuid=str(uuid),
             bruger_uuid=association_info["user"],
             enhed_uuid=association_info["unit"],
             bvn=association_info["user_key"],
             tilknytningstype_uuid=association_type_uuid,
-            tilknytningstype_titel=association_type_class["title"],
+            tilknytningstype_titel=title(association_type_uuid),
             startdato=association_info["from_date"],
             slutdato=association_info["to_date"],
             it_forbindelse_uuid=association_info["it_user"],
             stillingsbetegnelse_uuid=job_function_uuid,
-            stillingsbetegnelse_titel=job_function_class["title"],
+            stillingsbetegnelse_titel=title(job_function_uuid),
             primær_boolean=association_info.get("primary_boolean"),
             faglig_organisation=association_info.get("dynamic_class"),
         )
 
+    def _association_rows(self, uuid, association_validity):
+        row = row_factory(WTilknytning)
+        for association_info in association_validity:
+            yield self._generate_sql_associations(uuid, association_info, row)
+
     def _add_associations(self) -> None:
         logger.info("Add associations")
         associations = tqdm(
             self.lc.associations.items(), desc="Export association", unit="association"
         )
-        for chunk in ichunked(associations, self.chunk_size):
-            for uuid, association_validity in chunk:
-                for association_info in association_validity:
-                    sql_association = self._generate_sql_associations(
-                        uuid, association_info, WTilknytning
-                    )
-                    self.session.add(sql_association)
-            self.session.commit()
+        self._insert_rows(
+            chain.from_iterable(starmap(self._association_rows, associations))
+        )
 
     def _generate_sql_leave(self, uuid, leave_info, model: Type[_T_Orlov]) -> _T_Orlov:
         leave_type = leave_info["leave_type"]
@@ -513,21 +1090,21 @@ class SqlExport:
             bvn=leave_info["user_key"],
             bruger_uuid=leave_info["user"],
             orlovstype_uuid=leave_type,
-            orlovstype_titel=self.lc.classes[leave_type]["title"],
+            orlovstype_titel=self.lookups.klass(leave_type).titel,
             engagement_uuid=leave_info["engagement"],
             startdato=leave_info["from_date"],
             slutdato=leave_info["to_date"],
         )
 
+    def _leave_rows(self, uuid, leave_validity):
+        row = row_factory(WOrlov)
+        for leave_info in leave_validity:
+            yield self._generate_sql_leave(uuid, leave_info, row)
+
     def _add_leaves(self) -> None:
         logger.info("Add leaves")
         leaves = tqdm(self.lc.leaves.items(), desc="Export leave", unit="leave")
-        for chunk in ichunked(leaves, self.chunk_size):
-            for uuid, leave_validity in chunk:
-                for leave_info in leave_validity:
-                    sql_leave = self._generate_sql_leave(uuid, leave_info, WOrlov)
-                    self.session.add(sql_leave)
-            self.session.commit()
+        self._insert_rows(chain.from_iterable(starmap(self._leave_rows, leaves)))
 
     def _generate_sql_it_systems(
         self, uuid, itsystem_info, model: Type[_T_ItSystem]
@@ -539,13 +1116,11 @@ class SqlExport:
         itsystems = tqdm(
             self.lc.itsystems.items(), desc="Export itsystem", unit="itsystem"
         )
-        for chunk in ichunked(itsystems, self.chunk_size):
-            for uuid, itsystem_info in chunk:
-                sql_itsystem = self._generate_sql_it_systems(
-                    uuid, itsystem_info, WItSystem
-                )
-                self.session.add(sql_itsystem)
-            self.session.commit()
+        row = row_factory(WItSystem)
+        self._insert_rows(
+            self._generate_sql_it_systems(uuid, itsystem_info, row)
+            for uuid, itsystem_info in itsystems
+        )
 
     def _generate_sql_it_user(
         self, uuid, it_connection_info, model: Type[_T_ItForbindelse]
@@ -576,6 +1151,22 @@ class SqlExport:
             slutdato=it_connection_info["to_date"],
         )
 
+    def _it_user_rows(self, uuid, it_connection_validity):
+        it_connection_row = row_factory(WItForbindelse)
+        engagement_row = row_factory(WItForbindelseEngagement)
+        for it_connection_info in it_connection_validity:
+            yield self._generate_sql_it_user(
+                uuid, it_connection_info, it_connection_row
+            )
+
+            for engagement_uuid in it_connection_info.get("engagement_uuids", []):
+                yield self._generate_sql_it_user_engagement(
+                    uuid,
+                    engagement_uuid,
+                    it_connection_info,
+                    engagement_row,
+                )
+
     def _add_it_users(self):
         logger.info("Add IT users")
         it_connections = tqdm(
@@ -583,52 +1174,35 @@ class SqlExport:
             desc="Export it connection",
             unit="it connection",
         )
-        for chunk in ichunked(it_connections, self.chunk_size):
-            for uuid, it_connection_validity in chunk:
-                for it_connection_info in it_connection_validity:
-                    sql_it_connection = self._generate_sql_it_user(
-                        uuid, it_connection_info, WItForbindelse
-                    )
-                    self.session.add(sql_it_connection)
-
-                    for engagement_uuid in it_connection_info.get(
-                        "engagement_uuids", []
-                    ):
-                        sql_engagement = self._generate_sql_it_user_engagement(
-                            uuid,
-                            engagement_uuid,
-                            it_connection_info,
-                            WItForbindelseEngagement,
-                        )
-                        self.session.add(sql_engagement)
-            self.session.commit()
+        self._insert_rows(
+            chain.from_iterable(starmap(self._it_user_rows, it_connections))
+        )
 
     def _generate_sql_kle(self, uuid, kle_info, model: Type[_T_KLE]) -> _T_KLE:
         # The KLE aspect and number classes may not be valid in the same time
-        # period as the KLE object itself, so we must use the _get_lora_class
-        # helper to ensure a fallback.
-        kle_aspect_uuid, kle_aspect_class = self._get_lora_class(kle_info["kle_aspect"])
-        kle_number_uuid, kle_number_class = self._get_lora_class(kle_info["kle_number"])
+        # period as the KLE object itself, so we must use the title lookup, which
+        # falls back to the uuid.
+        title = self.lookups.title
         return model(
             uuid=str(uuid),
             enhed_uuid=kle_info["unit"],
-            kle_aspekt_uuid=kle_aspect_uuid,
-            kle_aspekt_titel=kle_aspect_class["title"],
-            kle_nummer_uuid=kle_number_uuid,
-            kle_nummer_titel=kle_number_class["title"],
+            kle_aspekt_uuid=kle_info["kle_aspect"],
+            kle_aspekt_titel=title(kle_info["kle_aspect"]),
+            kle_nummer_uuid=kle_info["kle_number"],
+            kle_nummer_titel=title(kle_info["kle_number"]),
             startdato=kle_info["from_date"],
             slutdato=kle_info["to_date"],
         )
 
+    def _kle_rows(self, uuid, kle_validity):
+        row = row_factory(WKLE)
+        for kle_info in kle_validity:
+            yield self._generate_sql_kle(uuid, kle_info, row)
+
     def _add_kles(self) -> None:
         logger.info("Add KLES")
         kles = tqdm(self.lc.kles.items(), desc="Export KLE", unit="KLE")
-        for chunk in ichunked(kles, self.chunk_size):
-            for uuid, kle_validity in chunk:
-                for kle_info in kle_validity:
-                    sql_kle = self._generate_sql_kle(uuid, kle_info, WKLE)
-                    self.session.add(sql_kle)
-            self.session.commit()
+        self._insert_rows(chain.from_iterable(starmap(self._kle_rows, kles)))
 
     def _add_receipt(self, query_time, start_time=None, end_time=None):
         logger.info("Add Receipt")
@@ -658,29 +1232,28 @@ class SqlExport:
             slutdato=related_info["to_date"],
         )
 
+    def _related_rows(self, uuid, related_validity):
+        row = row_factory(WEnhedssammenkobling)
+        for related_info in related_validity:
+            yield self._generate_sql_related(uuid, related_info, row)
+
     def _add_related(self) -> None:
         logger.info("Add Enhedssammenkobling")
         relateds = tqdm(self.lc.related.items(), desc="Export related", unit="related")
-        for chunk in ichunked(relateds, self.chunk_size):
-            for uuid, related_validity in chunk:
-                for related_info in related_validity:
-                    sql_related = self._generate_sql_related(
-                        uuid, related_info, WEnhedssammenkobling
-                    )
-                    self.session.add(sql_related)
-            self.session.commit()
+        self._insert_rows(chain.from_iterable(starmap(self._related_rows, relateds)))
 
     def _generate_sql_managers(
         self, uuid, manager_info, model: Type[_T_Leder]
     ) -> _T_Leder:
+        klass = self.lookups.klass
         return model(
             uuid=str(uuid),
             bruger_uuid=manager_info["user"],
             enhed_uuid=manager_info["unit"],
             niveautype_uuid=manager_info["manager_level"],
             ledertype_uuid=manager_info["manager_type"],
-            niveautype_titel=self.lc.classes[manager_info["manager_level"]]["title"],
-            ledertype_titel=self.lc.classes[manager_info["manager_type"]]["title"],
+            niveautype_titel=klass(manager_info["manager_level"]).titel,
+            ledertype_titel=klass(manager_info["manager_type"]).titel,
             startdato=manager_info["from_date"],
             slutdato=manager_info["to_date"],
         )
@@ -691,46 +1264,129 @@ class SqlExport:
         return model(
             leder_uuid=str(manager_uuid),
             lederansvar_uuid=uuid,
-            lederansvar_titel=self.lc.classes[uuid]["title"],
+            lederansvar_titel=self.lookups.klass(uuid).titel,
             startdato=manager_info["from_date"],
             slutdato=manager_info["to_date"],
         )
 
+    def _manager_rows(self, manager_uuid, manager_validity):
+        manager_row = row_factory(WLeder)
+        responsibility_row = row_factory(WLederAnsvar)
+        for manager_info in manager_validity:
+            yield self._generate_sql_managers(manager_uuid, manager_info, manager_row)
+
+            for responsibility_uuid in manager_info["manager_responsibility"]:
+                yield self._generate_sql_manager_responsibility(
+                    responsibility_uuid,
+                    manager_uuid,
+                    manager_info,
+                    responsibility_row,
+                )
+
     def _add_managers(self) -> None:
         logger.info("Add managers")
         managers = tqdm(self.lc.managers.items(), desc="Export manager", unit="manager")
-        for chunk in ichunked(managers, self.chunk_size):
-            for manager_uuid, manager_validity in chunk:
-                for manager_info in manager_validity:
-                    sql_manager = self._generate_sql_managers(
-                        manager_uuid, manager_info, WLeder
-                    )
-                    self.session.add(sql_manager)
-
-                    for responsibility_uuid in manager_info["manager_responsibility"]:
-                        sql_responsibility = self._generate_sql_manager_responsibility(
-                            responsibility_uuid,
-                            manager_uuid,
-                            manager_info,
-                            WLederAnsvar,
-                        )
-                        self.session.add(sql_responsibility)
-            self.session.commit()
+        self._insert_rows(chain.from_iterable(starmap(self._manager_rows, managers)))
 
-    def export(self, resolve_dar: bool, use_pickle: typing.Any) -> None:
-        self.perform_export(
-            resolve_dar=resolve_dar,
-            use_pickle=use_pickle,
+    def _generate_sql_unit_path(
+        self, uuid, niveau, overenhed_uuid, model: Type[_T_EnhedSti]
+    ) -> _T_EnhedSti:
+        return model(
+            enhed_uuid=uuid,
+            niveau=niveau,
+            overenhed_uuid=overenhed_uuid,
+            overenhed_navn=self.lookups.unit(overenhed_uuid).name,
         )
 
+    def _unit_path_rows(self, uuid, path):
+        row = row_factory(WEnhedSti)
+        for niveau, overenhed_uuid in enumerate(path, start=1):
+            yield self._generate_sql_unit_path(uuid, niveau, overenhed_uuid, row)
+
+    def _add_unit_paths(self) -> None:
+        logger.info("Add unit paths")
+        paths = tqdm(self.lc.unit_paths.items(), desc="Export unit path", unit="unit")
+        self._insert_rows(chain.from_iterable(starmap(self._unit_path_rows, paths)))
+
+    def _generate_sql_primary_engagement(
+        self, user_uuid, engagement_uuid, model: Type[_T_PrimaerEngagement]
+    ) -> _T_PrimaerEngagement:
+        return model(
+            bruger_uuid=user_uuid,
+            engagement_uuid=engagement_uuid,
+            enhed_uuid=self.lc.engagements[engagement_uuid][0]["unit"],
+        )
+
+    def _add_primary_engagements(self) -> None:
+        logger.info("Add primary engagements")
+        primary_engagements = tqdm(
+            self.lc.primary_engagements.items(),
+            desc="Export primary engagement",
+            unit="user",
+        )
+        row = row_factory(WPrimaerEngagement)
+        self._insert_rows(
+            self._generate_sql_primary_engagement(user_uuid, engagement_uuid, row)
+            for user_uuid, engagement_uuid in primary_engagements
+        )
+
+    def _generate_sql_manager_chain(
+        self, uuid, afstand, manager_uuid, model: Type[_T_LederKaede]
+    ) -> _T_LederKaede:
+        manager_info = self.lc.managers[manager_uuid][0]
+        return model(
+            enhed_uuid=uuid,
+            afstand=afstand,
+            leder_uuid=manager_uuid,
+            leder_enhed_uuid=manager_info["unit"],
+            bruger_uuid=manager_info["user"],
+        )
+
+    def _manager_chain_rows(self, uuid, manager_chain):
+        row = row_factory(WLederKaede)
+        for afstand, manager_uuid in enumerate(manager_chain):
+            # Managers without a current validity have no rows
+            if self.lc.managers.get(manager_uuid):
+                yield self._generate_sql_manager_chain(uuid, afstand, manager_uuid, row)
+
+    def _add_manager_chains(self) -> None:
+        logger.info("Add manager chains")
+        chains = tqdm(
+            self.lc.manager_chains.items(), desc="Export manager chain", unit="unit"
+        )
+        self._insert_rows(
+            chain.from_iterable(starmap(self._manager_chain_rows, chains))
+        )
+
+    def export(
+        self, resolve_dar: bool, use_pickle: typing.Any, stream: bool = False
+    ) -> None:
+        if stream:
+            self.perform_streaming_export(resolve_dar=resolve_dar)
+        else:
+            self.perform_export(
+                resolve_dar=resolve_dar,
+                use_pickle=use_pickle,
+            )
+
         self.swap_tables()
 
-    def update_sql(self, uuid: UUID, objects: list[sql_type], table: Type[sql_type]):
+    def update_sql(
+        self,
+        uuid: UUID,
+        objects: list[sql_type],
+        table: Type[sql_type],
+        commit: bool = True,
+    ):
         """Updates sql with the provided objects matching the objects UUID.
 
         Given a UUID, a list of objects and a table  we find any objects currently in sql for the given uuid.
         Then we add the objects that are not allready in sql - either new or changed in MO -  and remove any that
         do not match.
+
+        Rows are matched on their column values (see `Compare`), and the changes are
+        written with bulk statements in a single transaction, which is committed
+        unless `commit` is false.
         """
         if table == LederAnsvar:
             search_key = table.leder_uuid
@@ -739,32 +1395,41 @@ class SqlExport:
         else:
             search_key = table.uuid
         # Lookup engagement in sql
-        current_objects = self.session.execute(
+        current_objects = self.session.scalars(
             select(table).where(search_key == str(uuid))
         ).all()
-        if current_objects is not None:
-            current_objects = [one(c) for c in current_objects]
 
-        unchanged = [n for n in current_objects if n in objects]
+        # Rows currently in sql by their values. Duplicate rows are kept as many
+        # times as they occur in `objects`.
+        current: dict[Compare, list[Compare]] = defaultdict(list)
+        for c in current_objects:
+            current[c].append(c)
+        new = []
+        for n in objects:
+            if matching := current.get(n):
+                matching.pop()
+            else:
+                new.append(n)
 
         # Delete all rows from sql that do not match the found objects
-        removed = [r for r in current_objects if r not in objects]
+        primary_key = one(inspect(table).primary_key)
+        removed = [
+            getattr(r, primary_key.key) for rows in current.values() for r in rows
+        ]
         logger.info(f"Delete {len(removed)} rows to {table} for {uuid=}")
-        for r in removed:
-            self.session.delete(r)
+        for keys in chunked(removed, self.chunk_size):
+            self.session.execute(
+                delete(table).where(primary_key.in_(keys)),
+                execution_options={"synchronize_session": False},
+            )
 
         # Create all rows not currently in sql
-        new = [n for n in objects if n not in current_objects]
         logger.info(f"Add {len(new)} rows to {table} for {uuid=}")
-        for n in new:
-            self.session.add(n)
+        if new:
+            self.session.execute(insert(table), [n.row_values() for n in new])
 
-        # Check that the result is the expected amount of rows in sql.
-        assert len(objects) == len(unchanged) + len(new), (
-            f"expected {len(objects)=} to be equal to {len(unchanged)=} + {len(new)=}"
-        )
-
-        self.session.commit()
+        if commit:
+            self.session.commit()
 
 
 def wrap_export(args: dict, settings: dict) -> None:
@@ -784,6 +1449,7 @@ def wrap_export(args: dict, settings: dict) -> None:
             lock_name=lock_name,
             resolve_dar=args["resolve_dar"],
             use_pickle=args["read_from_cache"],
+            stream=args.get("stream", False),
         )
 
     except fastramqpi.ra_utils.ensure_single_run.LockTaken as name_of_lock:
@@ -795,6 +1461,12 @@ def wrap_export(args: dict, settings: dict) -> None:
 @click.option("--historic", is_flag=True)
 @click.option("--read-from-cache", is_flag=True, envvar="USE_CACHED_LORACACHE")
 @click.option("--force-sqlite", is_flag=True)
+@click.option(
+    "--stream",
+    is_flag=True,
+    envvar="SQL_EXPORT_STREAM",
+    help="Write the tables while fetching the LoRa cache",
+)
 def cli(**args):
     """
     Command line interface.
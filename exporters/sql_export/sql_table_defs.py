@@ -1,29 +1,77 @@
+from functools import cache
+from typing import Any
+
+from more_itertools import one
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import MetaData
 from sqlalchemy import String
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm import declared_attr
+from sqlalchemy.orm import deferred
 
 Base: DeclarativeMeta = declarative_base()  # type: ignore
+# Copies of the tables the indexes are declared on, see `indexes`
+index_metadata = MetaData()
 
 
 class Compare:
-    def __eq__(self, __value: object) -> bool:
-        """When comparing objects we need to disregard the fields:
+    """Rows are identified by their column values.
+
+    The fields disregarded are:
+
+    * ID (as it is auto generated by sql-alchemy)
+    * hash (as it is only written by the full export)
+    * _sa_instance_state
+
+    Rows are hashable on the same values, so sets of rows can be diffed.
+    """
+
+    # Columns, or tuples of columns, to index once the table has been written, see
+    # `indexes`
+    __indexed__: tuple[str | tuple[str, ...], ...] = ()
+
+    @declared_attr
+    def hash(cls):
+        """Hash of the values of the row, see `SqlExport._apply_rows`.
 
-        * ID (as it is auto generated by sql-alchemy)
-        * _sa_instance_state
+        The column is only created with the `exporters.actual_state.differential`
+        setting, see `SqlExport.table_definition`. Deferred, so the tables can be
+        read and written without it.
         """
+        return deferred(Column(String(32)))
 
-        left = dict(self.__dict__)
-        left.pop("id", None)
-        left.pop("_sa_instance_state", None)
-        right = dict(__value.__dict__)
-        right.pop("id", None)
-        right.pop("_sa_instance_state", None)
-        return left == right
+    @classmethod
+    @cache
+    def row_columns(cls) -> tuple[str, ...]:
+        """Names of the attributes of the columns identifying a row."""
+        return tuple(
+            attr.key
+            for attr in class_mapper(cls).column_attrs
+            if attr.key not in ("id", "hash")
+        )
+
+    def row_key(self) -> tuple:
+        return tuple(getattr(self, key) for key in self.row_columns())
+
+    def row_values(self) -> dict[str, Any]:
+        return dict(zip(self.row_columns(), self.row_key()))
+
+    def __eq__(self, __value: object) -> bool:
+        if not isinstance(__value, Compare):
+            return NotImplemented
+        return (
+            self.row_columns() == __value.row_columns()
+            and self.row_key() == __value.row_key()
+        )
+
+    def __hash__(self) -> int:
+        return hash(self.row_key())
 
 
 class BaseFacet(Compare):
@@ -40,6 +88,8 @@ class Facet(Base, BaseFacet):  # type: ignore
 
 
 class BaseKlasse(Compare):
+    __indexed__ = ("facet_uuid",)
+
     uuid = Column(String(36), nullable=False, primary_key=True)
     bvn = Column(String(250), nullable=False)
     titel = Column(String(250), nullable=False)
@@ -56,6 +106,8 @@ class Klasse(Base, BaseKlasse):  # type: ignore
 
 
 class BaseBruger(Compare):
+    __indexed__ = ("uuid", ("startdato", "slutdato"))
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     bvn = Column(String(250), nullable=False)
@@ -77,6 +129,8 @@ class Bruger(Base, BaseBruger):  # type: ignore
 
 
 class BaseEnhed(Compare):
+    __indexed__ = ("uuid", "forældreenhed_uuid", ("startdato", "slutdato"))
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     navn = Column(String(250), nullable=False)
@@ -106,6 +160,15 @@ class Enhed(Base, BaseEnhed):  # type: ignore
 
 
 class BaseAdresse(Compare):
+    __indexed__ = (
+        "uuid",
+        "bruger_uuid",
+        "enhed_uuid",
+        "engagement_uuid",
+        "adressetype_uuid",
+        ("startdato", "slutdato"),
+    )
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     bvn = Column(String(250))
@@ -135,6 +198,8 @@ class Adresse(Base, BaseAdresse):  # type: ignore
 
 
 class BaseEngagement(Compare):
+    __indexed__ = ("uuid", "bruger_uuid", "enhed_uuid", ("startdato", "slutdato"))
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     bruger_uuid = Column(String(36))  # , ForeignKey('brugere.uuid'))
@@ -171,6 +236,8 @@ class Engagement(Base, BaseEngagement):  # type: ignore
 
 
 class BaseTilknytning(Compare):
+    __indexed__ = ("uuid", "bruger_uuid", "enhed_uuid", ("startdato", "slutdato"))
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     bvn = Column(String(250), nullable=False)
@@ -196,6 +263,8 @@ class Tilknytning(Base, BaseTilknytning):  # type: ignore
 
 
 class BaseOrlov(Compare):
+    __indexed__ = ("uuid", "bruger_uuid", "engagement_uuid", ("startdato", "slutdato"))
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     bvn = Column(String(250), nullable=False)
@@ -229,6 +298,14 @@ class ItSystem(Base, BaseItSystem):  # type: ignore
 
 
 class BaseItForbindelse(Compare):
+    __indexed__ = (
+        "uuid",
+        "it_system_uuid",
+        "bruger_uuid",
+        "enhed_uuid",
+        ("startdato", "slutdato"),
+    )
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     it_system_uuid = Column(String(36))  # , ForeignKey('it_systemer.uuid'))
@@ -250,6 +327,8 @@ class ItForbindelse(Base, BaseItForbindelse):  # type: ignore
 
 
 class BaseItForbindelseEngagement(Compare):
+    __indexed__ = ("it_forbindelse_uuid", "engagement_uuid")
+
     id = Column(Integer, nullable=False, primary_key=True)
     it_forbindelse_uuid = Column(String(36))  # , ForeignKey('it_forbindelser.uuid'))
     engagement_uuid = Column(String(36))  # , ForeignKey('engagementer.uuid'))
@@ -266,6 +345,8 @@ class ItForbindelseEngagement(Base, BaseItForbindelseEngagement):  # type: ignor
 
 
 class BaseLeder(Compare):
+    __indexed__ = ("uuid", "bruger_uuid", "enhed_uuid", ("startdato", "slutdato"))
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     bruger_uuid = Column(String(36))  # , ForeignKey('brugere.uuid'))
@@ -287,6 +368,8 @@ class Leder(Base, BaseLeder):  # type: ignore
 
 
 class BaseLederAnsvar(Compare):
+    __indexed__ = ("leder_uuid",)
+
     id = Column(Integer, nullable=False, primary_key=True)
     leder_uuid = Column(String(36))  # , ForeignKey('ledere.uuid'))
     lederansvar_uuid = Column(String(36))  # , ForeignKey('klasser.uuid'))
@@ -304,6 +387,8 @@ class LederAnsvar(Base, BaseLederAnsvar):  # type: ignore
 
 
 class BaseKLE(Compare):
+    __indexed__ = ("uuid", "enhed_uuid", ("startdato", "slutdato"))
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     enhed_uuid = Column(String(36))  # , ForeignKey('enheder.uuid'))
@@ -333,6 +418,8 @@ class Kvittering(Base):  # type: ignore
 
 
 class BaseEnhedssammenkobling(Compare):
+    __indexed__ = ("uuid", "enhed1_uuid", "enhed2_uuid")
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     enhed1_uuid = Column(String(36))  # , ForeignKey('enheder.uuid'))
@@ -350,6 +437,8 @@ class Enhedssammenkobling(Base, BaseEnhedssammenkobling):  # type: ignore
 
 
 class BaseDARAdresse(Compare):
+    __indexed__ = ("uuid",)
+
     id = Column(Integer, nullable=False, primary_key=True)
     uuid = Column(String(36), nullable=False)
     vejkode = Column(String(8))
@@ -372,6 +461,66 @@ class DARAdresse(Base, BaseDARAdresse):  # type: ignore
     __tablename__ = "dar_adresser"
 
 
+class BaseEnhedSti(Compare):
+    """The units on the path from the root to a unit, including the unit itself."""
+
+    __indexed__ = ("enhed_uuid", "overenhed_uuid")
+
+    id = Column(Integer, nullable=False, primary_key=True)
+    enhed_uuid = Column(String(36), nullable=False)
+    niveau = Column(Integer, nullable=False)  # 1 is the root unit
+    overenhed_uuid = Column(String(36), nullable=False)
+    overenhed_navn = Column(String(250))
+
+
+class WEnhedSti(Base, BaseEnhedSti):  # type: ignore
+    __tablename__ = "wenhed_sti"
+
+
+class EnhedSti(Base, BaseEnhedSti):  # type: ignore
+    __tablename__ = "enhed_sti"
+
+
+class BasePrimaerEngagement(Compare):
+    """The primary engagement of a user."""
+
+    __indexed__ = ("bruger_uuid", "engagement_uuid", "enhed_uuid")
+
+    id = Column(Integer, nullable=False, primary_key=True)
+    bruger_uuid = Column(String(36), nullable=False)
+    engagement_uuid = Column(String(36), nullable=False)
+    enhed_uuid = Column(String(36))
+
+
+class WPrimaerEngagement(Base, BasePrimaerEngagement):  # type: ignore
+    __tablename__ = "wprimaer_engagement"
+
+
+class PrimaerEngagement(Base, BasePrimaerEngagement):  # type: ignore
+    __tablename__ = "primaer_engagement"
+
+
+class BaseLederKaede(Compare):
+    """The managers of a unit and the units above it, nearest first."""
+
+    __indexed__ = ("enhed_uuid", "bruger_uuid")
+
+    id = Column(Integer, nullable=False, primary_key=True)
+    enhed_uuid = Column(String(36), nullable=False)
+    afstand = Column(Integer, nullable=False)  # 0 is the manager of the unit itself
+    leder_uuid = Column(String(36), nullable=False)
+    leder_enhed_uuid = Column(String(36), nullable=False)
+    bruger_uuid = Column(String(36))
+
+
+class WLederKaede(Base, BaseLederKaede):  # type: ignore
+    __tablename__ = "wleder_kaede"
+
+
+class LederKaede(Base, BaseLederKaede):  # type: ignore
+    __tablename__ = "leder_kaede"
+
+
 sql_type = (
     Facet
     | Klasse
@@ -389,3 +538,36 @@ sql_type = (
     | Enhedssammenkobling
     | DARAdresse
 )
+
+
+def _columns(columns: str | tuple[str, ...]) -> tuple[str, ...]:
+    return (columns,) if isinstance(columns, str) else columns
+
+
+def index_name(table_name: str, columns: str | tuple[str, ...]) -> str:
+    return "_".join(("ix", table_name, *_columns(columns)))
+
+
+@cache
+def indexes(table_name: str) -> list[Index]:
+    """Indexes of the table `table_name`, declared by `__indexed__` of its model.
+
+    The indexes are not part of `Base.metadata`, so creating the tables does not
+    create them: The work tables are bulk loaded without indexes, which are created
+    once they have been written. As index names are unique in the schema on most
+    databases, they are named after the table they are created on, and renamed when
+    the work tables are swapped, see `SqlExport.swap_tables`.
+    """
+    model = one(
+        mapper.class_
+        for mapper in Base.registry.mappers
+        if mapper.class_.__tablename__ == table_name
+    )
+    table = Base.metadata.tables[table_name].to_metadata(index_metadata)
+    return [
+        Index(
+            index_name(table_name, columns),
+            *(table.c[column] for column in _columns(columns)),
+        )
+        for columns in getattr(model, "__indexed__", ())
+    ]
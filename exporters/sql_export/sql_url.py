@@ -169,4 +169,7 @@ def generate_engine_settings(
     engine_settings: Dict = {"pool_pre_ping": True}
     if db_type == "Mysql":
         engine_settings.update({"pool_recycle": 3600})
+    if db_type == "MS-SQL-ODBC":
+        # Send executemany parameters in bulk, instead of one round trip per row
+        engine_settings.update({"fast_executemany": True})
     return engine_settings
@@ -0,0 +1,51 @@
+from ..gql_lora_cache_async import GQLLoraCache
+
+addresses = {
+    "a1": [{"uuid": "a1", "user": "u1", "unit": None}],
+    "a2": [{"uuid": "a2", "user": None, "unit": "o1"}],
+    "a3": [
+        {"uuid": "a3", "user": "u2", "unit": None},
+        {"uuid": "a3", "user": "u1", "unit": None},
+    ],
+    "a4": [{"uuid": "a4", "user": "u1", "unit": None}],
+}
+
+
+def _lc() -> GQLLoraCache:
+    lc = GQLLoraCache()
+    lc.addresses = addresses
+    return lc
+
+
+def test_index_maps_values_to_uuids_in_collection_order():
+    lc = _lc()
+    assert lc.index("addresses", "user") == {
+        "u1": ["a1", "a3", "a4"],
+        None: ["a2"],
+        "u2": ["a3"],
+    }
+    assert lc.index("addresses", "unit") == {None: ["a1", "a3", "a4"], "o1": ["a2"]}
+
+
+def test_lookup():
+    lc = _lc()
+    assert lc.lookup("addresses", "user", "u1") == [
+        addresses["a1"],
+        addresses["a3"],
+        addresses["a4"],
+    ]
+    assert lc.lookup("addresses", "unit", "o1") == [addresses["a2"]]
+    assert lc.lookup("addresses", "user", "unknown") == []
+    assert lc.lookup("engagements", "user", "u1") == []
+
+
+def test_index_is_cached_until_invalidated():
+    lc = _lc()
+    index = lc.index("addresses", "user")
+    assert lc.index("addresses", "user") is index
+
+    lc.addresses = {**addresses, "a5": [{"uuid": "a5", "user": "u3"}]}
+    assert lc.lookup("addresses", "user", "u3") == []
+
+    lc.invalidate_indexes()
+    assert lc.lookup("addresses", "user", "u3") == [lc.addresses["a5"]]
@@ -0,0 +1,88 @@
+import pickle
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+
+from ..cache_snapshot import CacheSnapshot
+from ..gql_lora_cache_async import CACHE_FILES
+from ..gql_lora_cache_async import GQLLoraCache
+
+users = {"u1": [{"uuid": "u1", "navn": "Anders And"}]}
+engagements = {"e1": [{"uuid": "e1", "user": "u1"}]}
+
+
+def test_snapshot_roundtrip(tmp_path: Path):
+    snapshot = CacheSnapshot(tmp_path / "snapshot.db")
+    assert snapshot.read_header() is None
+
+    snapshot.write(
+        header={"full_history": True},
+        collections={"users": users, "engagements": engagements, "kles": {}},
+    )
+
+    assert snapshot.read_header() == {"full_history": True}
+    assert snapshot.load("users") == users
+    assert snapshot.load("engagements") == engagements
+    assert snapshot.load("kles") == {}
+
+
+def test_snapshot_ignores_other_layouts(tmp_path: Path):
+    snapshot = CacheSnapshot(tmp_path / "snapshot.db")
+    snapshot.write(header={}, collections={})
+    with closing(sqlite3.connect(snapshot.path)) as connection, connection:
+        connection.execute(
+            "UPDATE header SET value = '0' WHERE key = 'snapshot_version'"
+        )
+
+    assert snapshot.read_header() is None
+
+
+def test_snapshot_replaces_previous(tmp_path: Path):
+    snapshot = CacheSnapshot(tmp_path / "snapshot.db")
+    snapshot.write(header={"run": 1}, collections={"users": users})
+    snapshot.write(header={"run": 2}, collections={"users": {}})
+
+    assert snapshot.read_header() == {"run": 2}
+    assert snapshot.load("users") == {}
+    assert list(tmp_path.iterdir()) == [snapshot.path]
+
+
+def _lc_from_snapshot(skip_associations: bool = False) -> GQLLoraCache:
+    lc = GQLLoraCache(full_history=True)
+    lc.populate_cache(dry_run=True, skip_associations=skip_associations)
+    return lc
+
+
+def test_dry_run_loads_collections_lazily(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("tmp").mkdir()
+    lc = GQLLoraCache(full_history=True)
+    CacheSnapshot("tmp/loracache_historic.db").write(
+        header=lc._cache_header(mo_version=None),
+        collections={attr: {} for attr in CACHE_FILES} | {"users": users},
+    )
+
+    lc = _lc_from_snapshot()
+
+    assert "users" not in vars(lc)
+    assert lc.users == users
+    assert "users" in vars(lc)
+    assert "engagements" not in vars(lc)
+    assert lc.engagements == {}
+    with pytest.raises(AttributeError):
+        lc.not_a_collection  # noqa: B018
+
+
+def test_dry_run_reads_legacy_pickles(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("tmp").mkdir()
+    for attr, name in CACHE_FILES.items():
+        with open(f"tmp/{name}_historic.p", "wb") as f:
+            pickle.dump(users if attr == "users" else {}, f)
+
+    lc = _lc_from_snapshot(skip_associations=True)
+
+    assert lc.users == users
+    assert lc.associations == {}
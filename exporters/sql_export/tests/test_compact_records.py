@@ -0,0 +1,87 @@
+import pickle
+from uuid import uuid4
+
+from ..compact_records import CompactRecord
+from ..compact_records import compact_collection
+from ..compact_records import compact_record
+from ..sql_table_defs import WEngagement
+from .test_sql_export import _TestableSqlExport
+
+engagement = {
+    "uuid": str(uuid4()),
+    "user": str(uuid4()),
+    "unit": str(uuid4()),
+    "fraction": None,
+    "user_key": "-",
+    "engagement_type": str(uuid4()),
+    "primary_type": None,
+    "primary_boolean": True,
+    "job_function": str(uuid4()),
+    "extensions": {f"udvidelse_{i}": None for i in range(1, 11)},
+    "from_date": "2000-06-29",
+    "to_date": "9999-12-31",
+}
+
+
+def test_compact_record_reads_like_dict():
+    record = compact_record("engagements", engagement)
+
+    assert isinstance(record, CompactRecord)
+    assert record == engagement
+    assert dict(record) == engagement
+    assert list(record) == list(engagement)
+    assert record["from_date"] == "2000-06-29"
+    assert record.get("primary_boolean") is True
+    assert record.get("not_a_field") is None
+    assert "uuid" in record
+    assert "not_a_field" not in record
+    assert {**record["extensions"]} == engagement["extensions"]
+
+
+def test_compact_records_share_class_and_strings():
+    other = dict(engagement, uuid=str(uuid4()), to_date="".join("9999-12-31"))
+
+    first = compact_record("engagements", engagement)
+    second = compact_record("engagements", other)
+
+    assert type(first) is type(second)
+    assert first["to_date"] is second["to_date"]
+    assert first["user"] is second["user"]
+
+
+def test_compact_record_keeps_unsupported_keys_as_dict():
+    obj = {"not an identifier": 1}
+    assert compact_record("kles", obj) is obj
+
+
+def test_compact_record_pickles():
+    record = compact_record("engagements", engagement)
+    assert pickle.loads(pickle.dumps(record)) == engagement
+
+
+def test_compact_collection_keeps_order():
+    cache = {str(i): [{"uuid": str(i)}] for i in range(10)}
+    compact_collection("users", cache)
+    assert list(cache) == [str(i) for i in range(10)]
+    assert all(isinstance(v, CompactRecord) for vs in cache.values() for v in vs)
+
+
+def test_sql_export_generates_rows_from_compact_records():
+    job_function = engagement["job_function"]
+    engagement_type = engagement["engagement_type"]
+    lc_data = {
+        "classes": {
+            job_function: {"title": "Job function"},
+            engagement_type: {"title": "Engagement type"},
+        }
+    }
+    sql_export = _TestableSqlExport(inject_lc=lc_data)
+
+    from_dict = sql_export._generate_sql_engagements(
+        engagement["uuid"], engagement, WEngagement
+    )
+    from_record = sql_export._generate_sql_engagements(
+        engagement["uuid"], compact_record("engagements", engagement), WEngagement
+    )
+
+    assert from_dict == from_record
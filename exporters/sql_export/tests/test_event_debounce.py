@@ -0,0 +1,132 @@
+import asyncio
+import json
+from typing import Any
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from uuid import UUID
+from uuid import uuid4
+
+import pytest
+from fastramqpi.ramqp.depends import dependency_injected_with_deps
+from fastramqpi.ramqp.mo import MORouter
+
+from ..event_debounce import EventDebouncer
+from ..event_debounce import events
+from ..main import actualstate_router
+from .test_sql_export import _TestableSqlExport
+
+
+class FakeAMQPPublisher:
+    """Delivers published events to the callbacks of a router, like the AMQP system.
+
+    Events are delivered concurrently, as with a prefetching consumer, and an event
+    counts as acknowledged if its callbacks return without raising.
+    """
+
+    def __init__(self, router: MORouter, context: dict[str, Any]):
+        self.router = router
+        self.context = context
+
+    async def _deliver(self, routing_key: str, uuid: UUID) -> None:
+        message = MagicMock(
+            routing_key=routing_key,
+            body=json.dumps(str(uuid)).encode(),
+            message_id=uuid4().hex,
+        )
+        for callback, routing_keys in self.router.registry.items():
+            if routing_key in routing_keys:
+                await dependency_injected_with_deps(callback, [])(
+                    message=message, context=self.context
+                )
+
+    async def replay(self, burst: list[tuple[float, str, UUID]]) -> list[Any]:
+        """Publish the events of `burst` at their offsets in seconds."""
+
+        async def publish(offset: float, routing_key: str, uuid: UUID) -> None:
+            await asyncio.sleep(offset)
+            await self._deliver(routing_key, uuid)
+
+        return await asyncio.gather(
+            *(publish(*event) for event in burst), return_exceptions=True
+        )
+
+
+def _collapsed(type_: str) -> float:
+    return events.labels("actual", type_, "collapsed")._value.get()
+
+
+async def test_replayed_burst_is_collapsed_per_object():
+    person, engagement, address = uuid4(), uuid4(), uuid4()
+    # Recorded from an import changing a single employee
+    burst = [
+        (0.00, "person", person),
+        (0.01, "engagement", engagement),
+        (0.01, "person", person),
+        (0.02, "address", address),
+        (0.02, "engagement", engagement),
+        (0.03, "person", person),
+        (0.03, "engagement", engagement),
+        (0.04, "address", address),
+        # After the debounce interval, so the object must be fetched again
+        (0.30, "person", person),
+    ]
+    sql_exporter = _TestableSqlExport()
+    sql_exporter.lc._fetch_users = AsyncMock(return_value={})  # type: ignore
+    sql_exporter.lc._fetch_engagements = AsyncMock(return_value={})  # type: ignore
+    sql_exporter.lc._fetch_address = AsyncMock(return_value={})  # type: ignore
+    context = {
+        "user_context": {
+            "sql_exporter": sql_exporter,
+            "event_writer": None,
+            "event_debouncer": EventDebouncer(interval=0.1),
+        }
+    }
+    collapsed_before = {t: _collapsed(t) for t in ("person", "engagement", "address")}
+
+    results = await FakeAMQPPublisher(actualstate_router, context).replay(burst)
+
+    # Every event is acknowledged
+    assert results == [None] * len(burst)
+    assert [c.args for c in sql_exporter.lc._fetch_users.await_args_list] == [
+        (person,),
+        (person,),
+    ]
+    sql_exporter.lc._fetch_engagements.assert_awaited_once_with(engagement)
+    sql_exporter.lc._fetch_address.assert_awaited_once_with(address)
+    assert {t: _collapsed(t) - before for t, before in collapsed_before.items()} == {
+        "person": 2,
+        "engagement": 2,
+        "address": 1,
+    }
+
+
+async def test_collapsed_events_share_failure():
+    debouncer = EventDebouncer(interval=0.01)
+    handler = AsyncMock(side_effect=ValueError("BOOM"))
+    uuid = uuid4()
+
+    results = await asyncio.gather(
+        debouncer.handle("person", uuid, handler),
+        debouncer.handle("person", uuid, handler),
+        return_exceptions=True,
+    )
+
+    handler.assert_awaited_once()
+    assert [str(result) for result in results] == ["BOOM", "BOOM"]
+
+
+async def test_collapsed_events_survive_cancelled_event():
+    debouncer = EventDebouncer(interval=0.01)
+    handler = AsyncMock()
+    uuid = uuid4()
+
+    first = asyncio.create_task(debouncer.handle("person", uuid, handler))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(debouncer.handle("person", uuid, handler))
+    await asyncio.sleep(0)
+    second.cancel()
+
+    await first
+    with pytest.raises(asyncio.CancelledError):
+        await second
+    handler.assert_awaited_once()
@@ -0,0 +1,92 @@
+import asyncio
+from unittest.mock import MagicMock
+from unittest.mock import call
+from uuid import uuid4
+
+import pytest
+
+from ..event_writer import EventWriter
+from ..sql_table_defs import KLE
+from ..sql_table_defs import Enhed
+
+
+async def test_event_writer_coalesces_changes_in_one_transaction():
+    sql_exporter = MagicMock()
+    unit, kle = uuid4(), uuid4()
+
+    async with EventWriter(sql_exporter, max_latency=0.05) as writer:
+        await asyncio.gather(
+            writer.update_sql(unit, ["old"], Enhed),  # type: ignore
+            writer.update_sql(kle, ["kle"], KLE),  # type: ignore
+            writer.update_sql(unit, ["new"], Enhed),  # type: ignore
+        )
+
+    assert sql_exporter.update_sql.call_args_list == [
+        call(unit, ["new"], Enhed, commit=False),
+        call(kle, ["kle"], KLE, commit=False),
+    ]
+    sql_exporter.session.commit.assert_called_once()
+
+
+async def test_event_writer_limits_batch_size():
+    sql_exporter = MagicMock()
+
+    async with EventWriter(sql_exporter, max_latency=1, max_batch_size=2) as writer:
+        await asyncio.gather(
+            *(writer.update_sql(uuid4(), [], Enhed) for _ in range(4))  # type: ignore
+        )
+
+    assert sql_exporter.update_sql.call_count == 4
+    assert sql_exporter.session.commit.call_count == 2
+
+
+async def test_event_writer_fails_the_changes_of_a_failed_object():
+    sql_exporter = MagicMock()
+    good, bad, other = uuid4(), uuid4(), uuid4()
+
+    def update_sql(uuid, objects, table, commit):
+        if uuid == bad:
+            raise ValueError("BOOM")
+
+    sql_exporter.update_sql.side_effect = update_sql
+
+    async with EventWriter(sql_exporter, max_latency=0.05) as writer:
+        results = await asyncio.gather(
+            writer.update_sql(good, [], Enhed),  # type: ignore
+            writer.update_sql(bad, [], Enhed),  # type: ignore
+            writer.update_sql(other, [], KLE),  # type: ignore
+            return_exceptions=True,
+        )
+        assert [str(result) for result in results] == ["None", "BOOM", "None"]
+        # The batch, and then the failing object on its own, is rolled back
+        assert sql_exporter.session.rollback.call_count == 2
+        # The other objects are committed one by one
+        assert sql_exporter.session.commit.call_count == 2
+
+        # The writer carries on with the next batch
+        await writer.update_sql(uuid4(), [], Enhed)  # type: ignore
+
+
+async def test_event_writer_fails_a_failed_single_change():
+    sql_exporter = MagicMock()
+    sql_exporter.session.commit.side_effect = [ValueError("BOOM"), None]
+
+    async with EventWriter(sql_exporter, max_latency=0.05) as writer:
+        with pytest.raises(ValueError, match="BOOM"):
+            await writer.update_sql(uuid4(), [], Enhed)  # type: ignore
+        sql_exporter.session.rollback.assert_called_once()
+
+        await writer.update_sql(uuid4(), [], Enhed)  # type: ignore
+
+
+async def test_event_writer_cancels_pending_changes_on_exit():
+    writer = EventWriter(MagicMock(), max_latency=10)
+    async with writer:
+        collected = asyncio.create_task(writer.update_sql(uuid4(), [], Enhed))  # type: ignore
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(writer.update_sql(uuid4(), [], KLE))  # type: ignore
+        await asyncio.sleep(0)
+
+    for pending in (collected, queued):
+        with pytest.raises(asyncio.CancelledError):
+            await pending
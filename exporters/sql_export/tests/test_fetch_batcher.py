@@ -0,0 +1,116 @@
+import asyncio
+from uuid import UUID
+from uuid import uuid4
+
+import pytest
+
+from ..fetch_batcher import FetchBatcher
+from ..gql_lora_cache_async import GQLLoraCache
+
+
+def _user(uuid: str) -> dict:
+    return {
+        "uuid": uuid,
+        "obj": {
+            "uuid": uuid,
+            "cpr_no": "0101011234",
+            "user_key": uuid[:8],
+            "name": "Fornavn Efternavn",
+            "givenname": "Fornavn",
+            "surname": "Efternavn",
+            "nickname": "",
+            "nickname_givenname": "",
+            "nickname_surname": "",
+            "validity": {"from": "2020-01-01T00:00:00+01:00", "to": None},
+        },
+    }
+
+
+def _lc(batcher: FetchBatcher | None, full_history: bool = False) -> GQLLoraCache:
+    lc = GQLLoraCache(full_history=full_history, batcher=batcher)
+    lc.queries = []  # type: ignore
+
+    async def execute_query(query, variable_values, do_paged):
+        uuids = variable_values["filter"]["uuids"]
+        lc.queries.append(uuids)  # type: ignore
+        for uuid in uuids:
+            if uuid != str(missing):
+                user = _user(uuid)
+                if full_history:
+                    user["obj"] = [user["obj"]]
+                yield user
+
+    lc._execute_query = execute_query  # type: ignore
+    return lc
+
+
+missing = uuid4()
+
+
+async def test_single_uuid_fetches_are_batched():
+    lc = _lc(FetchBatcher(delay=0.01))
+    uuids = [uuid4(), uuid4(), uuid4()]
+
+    results = await asyncio.gather(
+        *(lc._fetch_users(uuid) for uuid in [*uuids, uuids[0], missing])
+    )
+
+    assert lc.queries == [[str(uuid) for uuid in [*uuids, missing]]]  # type: ignore
+    assert [list(result) for result in results] == [
+        [str(uuids[0])],
+        [str(uuids[1])],
+        [str(uuids[2])],
+        [str(uuids[0])],
+        [],
+    ]
+    # Like fetching a single uuid without batching
+    assert results[1] == await _lc(None)._fetch_users(uuids[1])
+
+
+async def test_batcher_is_shared_but_queries_are_per_cache():
+    batcher = FetchBatcher(delay=0.01)
+    actual, historic = _lc(batcher), _lc(batcher, full_history=True)
+    uuid = uuid4()
+
+    await asyncio.gather(
+        actual._fetch_users(uuid),
+        historic._fetch_users(uuid),
+        actual._fetch_users(uuid),
+    )
+
+    assert actual.queries == [[str(uuid)]]  # type: ignore
+    assert historic.queries == [[str(uuid)]]  # type: ignore
+
+
+async def test_batch_size_is_limited():
+    lc = _lc(FetchBatcher(delay=10, max_batch_size=2))
+
+    await asyncio.gather(*(lc._fetch_users(uuid4()) for _ in range(4)))
+
+    assert [len(uuids) for uuids in lc.queries] == [2, 2]  # type: ignore
+
+
+async def test_failed_batch_fails_every_fetch():
+    batcher = FetchBatcher(delay=0.01)
+
+    async def fail(uuids: list[UUID]) -> dict:
+        raise ValueError("BOOM")
+
+    results = await asyncio.gather(
+        batcher.load("key", fail, uuid4(), name="fail"),
+        batcher.load("key", fail, uuid4(), name="fail"),
+        return_exceptions=True,
+    )
+
+    assert [str(result) for result in results] == ["BOOM", "BOOM"]
+
+
+async def test_fetching_everything_is_not_batched():
+    lc = _lc(FetchBatcher(delay=10))
+    uuids = [uuid4(), uuid4()]
+
+    result = await asyncio.wait_for(lc._fetch_users(uuids), timeout=1)
+
+    assert list(result) == [str(uuid) for uuid in uuids]
+    with pytest.raises(TimeoutError):
+        await asyncio.wait_for(lc._fetch_users(uuids[0]), timeout=0.01)
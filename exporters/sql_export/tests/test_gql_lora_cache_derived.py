@@ -0,0 +1,76 @@
+from ..gql_lora_cache_async import GQLLoraCache
+
+
+def _unit(parent: str | None, manager: str | None = None) -> list[dict]:
+    return [{"name": "Enhed", "parent": parent, "manager_uuid": manager}]
+
+
+def test_calculate_derived_unit_data():
+    lc = GQLLoraCache()
+    # Children before their parents, and a parent outside of the cache
+    lc.units = {
+        "leaf": _unit("middle"),
+        "middle": _unit("root", manager="middle manager"),
+        "root": _unit(None, manager="root manager"),
+        "sibling": _unit("root"),
+        "orphan": _unit("deleted"),
+    }
+
+    lc.calculate_derived_unit_data()
+
+    assert lc.unit_paths == {
+        "root": ["root"],
+        "middle": ["root", "middle"],
+        "leaf": ["root", "middle", "leaf"],
+        "sibling": ["root", "sibling"],
+        "orphan": ["orphan"],
+    }
+    assert lc.manager_chains == {
+        "root": ["root manager"],
+        "middle": ["middle manager", "root manager"],
+        "leaf": ["middle manager", "root manager"],
+        "sibling": ["root manager"],
+        "orphan": [],
+    }
+
+
+def test_calculate_derived_unit_data_breaks_cycles():
+    lc = GQLLoraCache()
+    lc.units = {"a": _unit("b"), "b": _unit("a")}
+
+    lc.calculate_derived_unit_data()
+
+    assert lc.unit_paths == {"a": ["a"], "b": ["a", "b"]}
+
+
+def test_calculate_primary_engagements():
+    lc = GQLLoraCache()
+    lc.engagements = {
+        "secondary": [
+            {"user": "user", "primary_boolean": False, "from_date": "2000-01-01"}
+        ],
+        "later": [{"user": "user", "primary_boolean": True, "from_date": "2021-01-01"}],
+        "primary": [
+            {"user": "user", "primary_boolean": True, "from_date": "2020-01-01"}
+        ],
+        "other": [{"user": "other", "primary_boolean": None, "from_date": None}],
+    }
+
+    lc.calculate_primary_engagements()
+
+    assert lc.primary_engagements == {"user": "primary"}
+
+
+def test_derived_data_is_not_calculated_for_the_full_history():
+    lc = GQLLoraCache(full_history=True)
+    lc.units = {"root": _unit(None, manager="root manager")}
+    lc.engagements = {
+        "primary": [{"user": "user", "primary_boolean": True, "from_date": None}]
+    }
+
+    lc.calculate_derived_unit_data()
+    lc.calculate_primary_engagements()
+
+    assert lc.unit_paths == {}
+    assert lc.manager_chains == {}
+    assert lc.primary_engagements == {}
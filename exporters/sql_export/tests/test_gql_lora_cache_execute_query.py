@@ -0,0 +1,150 @@
+import asyncio
+from unittest.mock import AsyncMock
+from uuid import UUID
+
+import pytest
+from graphql import ExecutionResult
+from graphql import print_ast
+
+from .. import gql_lora_cache_async
+from ..config import GqlLoraCacheSettings
+from ..gql_lora_cache_async import GQLLoraCache
+from ..gql_lora_cache_async import collection_name
+from ..gql_lora_cache_async import compile_query
+
+query = """
+    query ($limit: int, $cursor: Cursor) {
+        page: facets(limit: $limit, cursor: $cursor) {
+            objects {
+                uuid
+                obj: current {
+                    uuid
+                    user_key
+                }
+            }
+            page_info {
+                next_cursor
+            }
+        }
+    }
+"""
+
+
+def _page(objects: list[dict], next_cursor: str | None) -> ExecutionResult:
+    return ExecutionResult(
+        data={"page": {"objects": objects, "page_info": {"next_cursor": next_cursor}}}
+    )
+
+
+def _pages() -> list[ExecutionResult]:
+    return [
+        _page([{"uuid": "1"}, {"uuid": "2"}], "cursor-1"),
+        _page([{"uuid": "3"}], "cursor-2"),
+        _page([{"uuid": "4"}, {"uuid": "5"}], None),
+    ]
+
+
+def _mock_lc(prefetch_depth: int, side_effect: list) -> GQLLoraCache:
+    settings = GqlLoraCacheSettings(page_prefetch_depth=prefetch_depth)
+    lc = GQLLoraCache(settings=settings)
+    lc.gql_client_session = AsyncMock()  # type: ignore
+    lc.gql_client_session.return_value.execute.side_effect = side_effect
+    return lc
+
+
+def test_collection_name():
+    assert collection_name(query) == "facets"
+    assert collection_name("query { org { uuid } }") == "unknown"
+
+
+@pytest.mark.parametrize("prefetch_depth", [0, 1, 2, 10])
+async def test_execute_query_yields_all_pages_in_order(prefetch_depth: int):
+    lc = _mock_lc(prefetch_depth, _pages())
+
+    result = [obj async for obj in lc._execute_query(query)]
+
+    assert result == [{"uuid": str(i)} for i in range(1, 6)]
+    execute = lc.gql_client_session.return_value.execute  # type: ignore
+    assert [
+        call.kwargs["variable_values"]["cursor"] for call in execute.await_args_list
+    ] == [None, "cursor-1", "cursor-2"]
+
+
+@pytest.mark.parametrize("prefetch_depth", [0, 2])
+async def test_execute_query_not_paged(prefetch_depth: int):
+    lc = _mock_lc(prefetch_depth, [_page([{"uuid": "1"}], None)])
+
+    result = [obj async for obj in lc._execute_query(query, do_paged=False)]
+
+    assert result == [{"uuid": "1"}]
+    execute = lc.gql_client_session.return_value.execute  # type: ignore
+    execute.assert_awaited_once()
+    assert execute.call_args.kwargs["variable_values"]["limit"] is None
+
+
+async def test_execute_query_prefetch_reraises_errors(monkeypatch):
+    monkeypatch.setattr(gql_lora_cache_async, "RETRY_MAX_TIME", 0)
+    lc = _mock_lc(2, [_page([{"uuid": "1"}], "cursor-1"), ValueError("Boom")])
+
+    result = []
+    with pytest.raises(ValueError, match="Boom"):
+        async for obj in lc._execute_query(query):
+            result.append(obj)
+    assert result == [{"uuid": "1"}]
+
+
+async def test_execute_query_prefetch_stops_when_closed():
+    lc = _mock_lc(2, _pages())
+    tasks = asyncio.all_tasks()
+
+    stream = lc._execute_query(query)
+    assert await stream.__anext__() == {"uuid": "1"}
+    await stream.aclose()
+
+    # The producer has been cancelled and awaited, not left pending
+    assert asyncio.all_tasks() == tasks
+
+
+async def test_execute_query_parses_query_once():
+    compile_query.cache_clear()
+    lc = _mock_lc(0, _pages())
+
+    result = [obj async for obj in lc._execute_query(query)]
+
+    assert len(result) == 5
+    assert compile_query.cache_info().misses == 1
+    assert compile_query.cache_info().hits == 2
+    execute = lc.gql_client_session.return_value.execute  # type: ignore
+    documents = {id(call.kwargs["document"]) for call in execute.await_args_list}
+    assert len(documents) == 1
+
+
+@pytest.mark.parametrize(
+    "fetch,filter_type",
+    [
+        ("_fetch_facets", "FacetFilter"),
+        ("_fetch_classes", "ClassFilter"),
+        ("_fetch_itsystems", "ITSystemFilter"),
+    ],
+)
+async def test_fetch_filters_on_uuids(fetch: str, filter_type: str):
+    lc = _mock_lc(0, [_page([], None)])
+    uuid = UUID("00000000-0000-0000-0000-000000000001")
+
+    await getattr(lc, fetch)([uuid])
+
+    execute = lc.gql_client_session.return_value.execute  # type: ignore
+    execute.assert_awaited_once()
+    assert execute.call_args.kwargs["variable_values"]["filter"] == {
+        "uuids": [str(uuid)]
+    }
+    operation = execute.call_args.kwargs["document"].definitions[0]
+    variables = {
+        definition.variable.name.value: print_ast(definition.type)
+        for definition in operation.variable_definitions
+    }
+    assert variables["filter"] == filter_type
+    page = operation.selection_set.selections[0]
+    assert {
+        argument.name.value: print_ast(argument.value) for argument in page.arguments
+    }["filter"] == "$filter"
@@ -0,0 +1,233 @@
+import datetime
+import sqlite3
+from contextlib import closing
+from unittest.mock import AsyncMock
+from uuid import UUID
+from uuid import uuid4
+
+import pytest
+from graphql import ExecutionResult
+from graphql import print_ast
+
+from ..gql_lora_cache_async import GQLLoraCache
+from ..gql_lora_cache_async import collection_name
+
+changed_uuid = uuid4()
+deleted_uuid = uuid4()
+unchanged_uuid = uuid4()
+
+
+def _engagement(uuid: UUID, user_key: str) -> list[dict]:
+    return [{"uuid": str(uuid), "user_key": user_key}]
+
+
+def _mock_lc(mo_version: str = "1.0", full_history: bool = True) -> GQLLoraCache:
+    lc = GQLLoraCache(full_history=full_history)
+    lc._get_mo_version = AsyncMock(return_value=mo_version)  # type: ignore
+    for fetch in (
+        "_fetch_facets",
+        "_fetch_classes",
+        "_fetch_itsystems",
+        "_fetch_users",
+        "_fetch_units",
+        "_fetch_leaves",
+        "_fetch_it_connections",
+        "_fetch_kles",
+        "_fetch_related",
+        "_fetch_managers",
+        "_fetch_associations",
+        "_fetch_address",
+    ):
+        setattr(lc, fetch, AsyncMock(return_value={}))
+    lc._fetch_engagements = AsyncMock(  # type: ignore
+        return_value={
+            str(changed_uuid): _engagement(changed_uuid, "old"),
+            str(deleted_uuid): _engagement(deleted_uuid, "deleted"),
+            str(unchanged_uuid): _engagement(unchanged_uuid, "unchanged"),
+        }
+    )
+    return lc
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+async def test_incremental_refresh_merges_changes():
+    await _mock_lc().populate_cache_async(dry_run=False, incremental=False)
+
+    lc = _mock_lc()
+    lc._fetch_changed_uuids = AsyncMock(  # type: ignore
+        return_value={"engagement": {changed_uuid, deleted_uuid}}
+    )
+    lc._fetch_engagements.return_value = {  # type: ignore
+        str(changed_uuid): _engagement(changed_uuid, "new")
+    }
+    await lc.populate_cache_async(dry_run=False, incremental=True)
+
+    expected = {
+        str(changed_uuid): _engagement(changed_uuid, "new"),
+        str(unchanged_uuid): _engagement(unchanged_uuid, "unchanged"),
+    }
+    assert lc.engagements == expected
+    lc._fetch_engagements.assert_awaited_once()  # type: ignore
+    assert set(lc._fetch_engagements.call_args.args[0]) == {  # type: ignore
+        changed_uuid,
+        deleted_uuid,
+    }
+    lc._fetch_users.assert_not_awaited()  # type: ignore
+    # Classes are always fetched in full
+    lc._fetch_classes.assert_awaited_once_with()  # type: ignore
+
+    # The refreshed cache is persisted
+    reloaded = _mock_lc()
+    await reloaded.populate_cache_async(dry_run=True)
+    assert reloaded.engagements == expected
+
+
+async def test_incremental_refresh_falls_back_on_version_mismatch():
+    await _mock_lc(mo_version="1.0").populate_cache_async(
+        dry_run=False, incremental=False
+    )
+
+    lc = _mock_lc(mo_version="2.0")
+    lc._fetch_changed_uuids = AsyncMock()  # type: ignore
+    await lc.populate_cache_async(dry_run=False, incremental=True)
+
+    lc._fetch_changed_uuids.assert_not_awaited()
+    lc._fetch_users.assert_awaited_once_with()  # type: ignore
+    assert len(lc.engagements) == 3
+
+
+async def test_incremental_refresh_falls_back_without_previous_cache():
+    lc = _mock_lc()
+    lc._fetch_changed_uuids = AsyncMock()  # type: ignore
+    await lc.populate_cache_async(dry_run=False, incremental=True)
+
+    lc._fetch_changed_uuids.assert_not_awaited()
+    assert len(lc.engagements) == 3
+
+
+def _mock_session(lc: GQLLoraCache, objects: dict[str, list[dict]]) -> None:
+    """Serve a single page of the given objects of each collection, through the
+    real `_execute_query`."""
+
+    async def execute(document, variable_values, get_execution_result):
+        collection = collection_name(print_ast(document))
+        return ExecutionResult(
+            data={
+                "page": {
+                    "objects": objects.get(collection, []),
+                    "page_info": {"next_cursor": None},
+                }
+            }
+        )
+
+    lc.gql_client_session = AsyncMock()  # type: ignore
+    lc.gql_client_session.return_value.execute.side_effect = execute
+
+
+def _registration(uuid: UUID, model: str, start: datetime.datetime) -> dict:
+    return {"uuid": str(uuid), "model": model, "start": start.isoformat()}
+
+
+async def test_incremental_refresh_reads_the_registrations():
+    await _mock_lc().populate_cache_async(dry_run=False, incremental=False)
+
+    lc = _mock_lc()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    _mock_session(
+        lc,
+        {
+            "registrations": [
+                _registration(changed_uuid, "engagement", now + datetime.timedelta(1)),
+                # Registered before the previous cache
+                _registration(
+                    unchanged_uuid, "engagement", now - datetime.timedelta(1)
+                ),
+                # Not part of the cache
+                _registration(uuid4(), "owner", now + datetime.timedelta(1)),
+            ]
+        },
+    )
+    await lc.populate_cache_async(dry_run=False, incremental=True)
+
+    lc._fetch_engagements.assert_awaited_once_with([changed_uuid])  # type: ignore
+    lc._fetch_users.assert_not_awaited()  # type: ignore
+
+
+async def test_incremental_refresh_falls_back_on_unknown_models():
+    await _mock_lc().populate_cache_async(dry_run=False, incremental=False)
+
+    lc = _mock_lc()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    _mock_session(
+        lc,
+        {"registrations": [_registration(uuid4(), "unknown", now)]},
+    )
+    lc._fetch_engagements.return_value = {  # type: ignore
+        str(changed_uuid): _engagement(changed_uuid, "new")
+    }
+    await lc.populate_cache_async(dry_run=False, incremental=True)
+
+    lc._fetch_engagements.assert_awaited_once_with()  # type: ignore
+    lc._fetch_users.assert_awaited_once_with()  # type: ignore
+    assert lc.engagements == {str(changed_uuid): _engagement(changed_uuid, "new")}
+
+
+def _validity(uuid: UUID, from_date: datetime.date, to_date: str) -> list[dict]:
+    return [{"uuid": str(uuid), "from_date": str(from_date), "to_date": to_date}]
+
+
+async def test_incremental_refresh_of_actual_state_from_another_day():
+    today = datetime.date.today()
+    long_ago = datetime.date(2000, 1, 1)
+    ended_uuid, started_uuid = uuid4(), uuid4()
+    engagements = {
+        str(unchanged_uuid): _validity(unchanged_uuid, long_ago, "9999-12-31"),
+        str(ended_uuid): _validity(
+            ended_uuid, long_ago, str(today - datetime.timedelta(1))
+        ),
+    }
+    first = _mock_lc(full_history=False)
+    first._fetch_engagements.return_value = engagements  # type: ignore
+    await first.populate_cache_async(dry_run=False, incremental=False)
+    # Pretend the cache was written two days ago
+    with closing(sqlite3.connect("tmp/loracache.db")) as connection, connection:
+        connection.execute(
+            "UPDATE header SET value = ? WHERE key = 'date'",
+            (f'"{today - datetime.timedelta(2)}"',),
+        )
+
+    lc = _mock_lc(full_history=False)
+    lc._fetch_changed_uuids = AsyncMock(return_value={})  # type: ignore
+    started = _validity(started_uuid, today, "9999-12-31")
+    lc._fetch_engagements.side_effect = lambda uuids: {  # type: ignore
+        str(uuid): started for uuid in uuids if uuid == started_uuid
+    }
+    _mock_session(
+        lc,
+        {
+            "engagements": [
+                {
+                    "uuid": str(unchanged_uuid),
+                    "validities": [{"validity": {"from": "2000-01-01T00:00:00+01:00"}}],
+                },
+                {
+                    "uuid": str(started_uuid),
+                    "validities": [{"validity": {"from": f"{today}T00:00:00+01:00"}}],
+                },
+            ]
+        },
+    )
+    await lc.populate_cache_async(dry_run=False, incremental=True)
+
+    assert set(lc._fetch_engagements.call_args.args[0]) == {  # type: ignore
+        ended_uuid,
+        started_uuid,
+    }
+    assert lc.engagements == {
+        str(unchanged_uuid): engagements[str(unchanged_uuid)],
+        str(started_uuid): started,
+    }
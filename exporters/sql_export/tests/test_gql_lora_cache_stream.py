@@ -0,0 +1,50 @@
+from unittest.mock import AsyncMock
+
+from ..gql_lora_cache_async import GQLLoraCache
+
+
+async def test_stream_caches_passes_objects_to_sinks():
+    lc = GQLLoraCache()
+    streamed: list[tuple[str, list[dict]]] = []
+
+    async def fetch_classes():
+        # The classification is kept, and fetched before anything is streamed
+        assert streamed == []
+        res = lc._new_collection("classes")
+        res["c1"] = {"title": "Klasse"}
+        return res
+
+    async def fetch_users():
+        assert lc.classes == {"c1": {"title": "Klasse"}}
+        res = lc._new_collection("users")
+        res["u1"] = [{"uuid": "u1"}]
+        res["u2"] = [{"uuid": "u2"}]
+        return res
+
+    lc._fetch_classes = fetch_classes  # type: ignore
+    lc._fetch_users = fetch_users  # type: ignore
+    for fetch in (
+        "_fetch_facets",
+        "_fetch_itsystems",
+        "_fetch_units",
+        "_fetch_engagements",
+        "_fetch_leaves",
+        "_fetch_it_connections",
+        "_fetch_kles",
+        "_fetch_related",
+        "_fetch_managers",
+        "_fetch_associations",
+        "_fetch_address",
+    ):
+        setattr(lc, fetch, AsyncMock(return_value={}))
+
+    await lc.stream_caches_async(
+        {"users": lambda uuid, validities: streamed.append((uuid, validities))}
+    )
+
+    assert streamed == [("u1", [{"uuid": "u1"}]), ("u2", [{"uuid": "u2"}])]
+    assert lc.users == {}
+    assert lc.classes == {"c1": {"title": "Klasse"}}
+    # Fetching normally afterwards keeps the objects again
+    assert lc._new_collection("users") == {}
+    assert type(lc._new_collection("users")) is dict
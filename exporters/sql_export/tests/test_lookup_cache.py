@@ -0,0 +1,78 @@
+from unittest.mock import AsyncMock
+from uuid import uuid4
+
+import pytest
+
+from ..gql_lora_cache_async import GQLLoraCache
+from ..lookup_cache import LookupCache
+from ..lookup_cache import LookupCollection
+from ..lookup_cache import lookups
+from ..lookup_cache import refresh
+from ..main import handle_class
+from .test_sql_export import _TestableSqlExport
+
+
+def _count(collection: str, outcome: str) -> float:
+    return lookups.labels("test", collection, outcome)._value.get()
+
+
+async def test_load_fetches_lookup_collections():
+    lc = GQLLoraCache()
+    lc._fetch_classes = AsyncMock(return_value={"c1": {"title": "Klasse"}})  # type: ignore
+    lc._fetch_facets = AsyncMock(return_value={"f1": {"user_key": "facet"}})  # type: ignore
+    lc._fetch_itsystems = AsyncMock(return_value={"i1": {"name": "AD"}})  # type: ignore
+    lc._fetch_units = AsyncMock(return_value={"u1": [{"name": "Enhed"}]})  # type: ignore
+
+    await LookupCache(lc, state="test").load()
+
+    assert isinstance(lc.classes, LookupCollection)
+    assert lc.classes == {"c1": {"title": "Klasse"}}
+    assert lc.facets == {"f1": {"user_key": "facet"}}
+    assert lc.itsystems == {"i1": {"name": "AD"}}
+    assert lc.units == {"u1": [{"name": "Enhed"}]}
+
+
+def test_lookups_are_counted():
+    classes = LookupCollection({"c1": {"title": "Klasse"}}, "classes", "test")
+    hits, misses = _count("classes", "hit"), _count("classes", "miss")
+
+    assert classes["c1"] == {"title": "Klasse"}
+    assert classes.get("c1") == {"title": "Klasse"}
+    assert classes.get("c2") is None
+    with pytest.raises(KeyError):
+        classes["c2"]
+
+    assert _count("classes", "hit") - hits == 2
+    assert _count("classes", "miss") - misses == 2
+
+
+def test_refresh_updates_in_place():
+    c1, c2 = uuid4(), uuid4()
+    classes = LookupCollection({str(c1): {"title": "Gammel"}}, "classes", "test")
+
+    refresh(classes, c1, {str(c1): {"title": "Ny"}})
+    refresh(classes, c2, {str(c2): {"title": "Anden"}})
+    refresh(classes, uuid4(), {})
+    assert classes[str(c1)] == {"title": "Ny"}
+    assert classes[str(c2)] == {"title": "Anden"}
+
+    refresh(classes, c1, {})
+    assert str(c1) not in classes
+
+
+async def test_class_event_refreshes_lookup_cache():
+    uuid, facet_uuid = uuid4(), uuid4()
+    klasse = {"user_key": "klasse", "title": "Ny titel", "facet": str(facet_uuid)}
+    sql_export = _TestableSqlExport(
+        inject_lc={"facets": {str(facet_uuid): {"user_key": "facet"}}}
+    )
+    sql_export.lc.classes = LookupCollection(
+        {str(uuid): {**klasse, "title": "Gammel titel"}}, "classes", "test"
+    )
+    sql_export.lc._fetch_classes = AsyncMock(  # type: ignore
+        return_value={str(uuid): klasse}
+    )
+
+    await handle_class(uuid=uuid, sql_exporter=sql_export)
+
+    assert sql_export.lc.classes[str(uuid)]["title"] == "Ny titel"
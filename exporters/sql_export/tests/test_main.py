@@ -37,9 +37,10 @@ async def test_handle_person():
     await handle_person(uuid=uuid, sql_exporter=sql_export)
 
     # Assert
-    sql_export.session.add.assert_called_once()
-    sql_export.session.delete.assert_not_called()
-    assert sql_export.session.add.call_args[0][0] == user_model
+    sql_export.session.execute.assert_called_once()
+    statement, rows = sql_export.session.execute.call_args.args
+    assert statement.table.name == Bruger.__tablename__
+    assert rows == [user_model.row_values()]
 
 
 @pytest.mark.asyncio
@@ -67,6 +68,7 @@ async def test_handle_class():
     await handle_class(uuid=uuid, sql_exporter=sql_export)
 
     # Assert
-    sql_export.session.add.assert_called_once()
-    sql_export.session.delete.assert_not_called()
-    assert sql_export.session.add.call_args[0][0] == class_model
+    sql_export.session.execute.assert_called_once()
+    statement, rows = sql_export.session.execute.call_args.args
+    assert statement.table.name == Klasse.__tablename__
+    assert rows == [class_model.row_values()]
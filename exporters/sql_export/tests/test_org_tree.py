@@ -0,0 +1,91 @@
+from collections.abc import AsyncIterator
+
+from ..gql_lora_cache_async import GQLLoraCache
+from ..org_tree import OrgTree
+
+
+def test_org_tree():
+    tree = OrgTree(
+        parents={"root": None, "a": "root", "b": "root", "a1": "a", "orphan": "x"},
+        names={"root": "Kommune", "a": "A", "b": "B", "a1": "A1", "orphan": "O"},
+    )
+
+    assert tree.path("a1") == ("root", "a", "a1")
+    assert tree.path("orphan") == ("orphan",)
+    assert tree.location("a1") == "Kommune\\A\\A1"
+    assert tree.location("root") == "Kommune"
+    assert [tree.depth(uuid) for uuid in ("root", "a", "a1", "orphan")] == [0, 1, 2, 0]
+    assert tree.is_descendant("a1", "root")
+    assert tree.is_descendant("a1", "a1")
+    assert not tree.is_descendant("a1", "b")
+    assert not tree.is_descendant("root", "a")
+    assert not tree.is_descendant("orphan", "root")
+    assert not tree.is_descendant("a1", "unknown")
+
+
+def test_org_tree_breaks_cycles():
+    tree = OrgTree(parents={"a": "b", "b": "a", "c": "b"})
+
+    assert tree.path("c") == ("a", "b", "c")
+    assert tree.is_descendant("c", "a")
+
+
+def test_org_tree_is_not_recursive():
+    depth = 2_000
+    tree = OrgTree(
+        parents={str(i): str(i - 1) if i else None for i in range(depth)},
+        names={str(i): "x" for i in range(depth)},
+    )
+
+    assert len(tree.path(str(depth - 1))) == depth
+    assert len(tree.location(str(depth - 1)).split("\\")) == depth
+    assert tree.is_descendant(str(depth - 1), "0")
+
+
+def _unit(uuid: str, parent: str | None) -> dict:
+    return {
+        "uuid": uuid,
+        "obj": {
+            "uuid": uuid,
+            "user_key": uuid,
+            "name": uuid.upper(),
+            "unit_type_uuid": None,
+            "org_unit_level_uuid": None,
+            "time_planning_uuid": None,
+            "parent_uuid": parent,
+            "org_unit_hierarchy_uuid": None,
+            "manager_uuid": [],
+            "acting_manager_uuid": [],
+            "validity": {"from": "2020-01-01T00:00:00+01:00", "to": None},
+        },
+    }
+
+
+class FakeUnitsCache(GQLLoraCache):
+    variables: dict
+
+    async def _get_org_uuid(self) -> str:
+        return "org"
+
+    async def _execute_query(self, query, variable_values, do_paged) -> AsyncIterator:  # type: ignore
+        self.variables = variable_values
+        for unit in (
+            _unit("leaf", "unit"),
+            _unit("unit", "root"),
+            _unit("root", "org"),
+        ):
+            yield unit
+
+
+async def test_fetch_units_derives_locations():
+    lc = FakeUnitsCache()
+
+    units = await lc._fetch_units()
+
+    # MO is not asked for the ancestors of every unit
+    assert lc.variables["ancestors"] is False
+    assert {uuid: unit["location"] for uuid, (unit,) in units.items()} == {
+        "root": "ROOT",
+        "unit": "ROOT\\UNIT",
+        "leaf": "ROOT\\UNIT\\LEAF",
+    }
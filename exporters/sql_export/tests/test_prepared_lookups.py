@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ..prepared_lookups import ClassInfo
+from ..prepared_lookups import Lookups
+from ..prepared_lookups import PreparedLookups
+from ..prepared_lookups import UnitInfo
+
+
+def _lc() -> SimpleNamespace:
+    return SimpleNamespace(
+        facets={"facet": {"user_key": "facet_bvn"}},
+        classes={
+            "class": {
+                "title": "Titel",
+                "user_key": "bvn",
+                "facet": "facet",
+                "scope": "TEXT",
+            },
+            "empty": {},
+        },
+        units={
+            "unit": [
+                {"name": "Enhed", "user_key": "enhed", "location": "Kommune\\Enhed"},
+                {"name": "Gammel enhed", "user_key": "enhed", "location": None},
+            ],
+            "no validities": [],
+        },
+    )
+
+
+@pytest.mark.parametrize("lookups_class", [Lookups, PreparedLookups])
+def test_lookups(lookups_class: type[Lookups]) -> None:
+    lookups = lookups_class(_lc())
+
+    assert lookups.klass("class") == ClassInfo("Titel", "bvn", "facet_bvn", "TEXT")
+    assert lookups.unit("unit") == UnitInfo("Enhed", "enhed", "Kommune\\Enhed")
+    with pytest.raises(KeyError):
+        lookups.klass("missing")
+    with pytest.raises((KeyError, IndexError)):
+        lookups.unit("no validities")
+    # Titles fall back to the uuid of classes that are missing or empty
+    assert lookups.title("class") == "Titel"
+    assert lookups.title("missing") == "missing"
+    assert lookups.title("empty") == "empty"
+    assert lookups.title(None) is None  # type: ignore[arg-type]
+
+
+def test_prepared_lookups_do_not_follow_the_cache() -> None:
+    lc = _lc()
+    lookups, prepared = Lookups(lc), PreparedLookups(lc)
+
+    lc.classes["class"] = {**lc.classes["class"], "title": "Ny titel"}
+
+    assert lookups.klass("class").titel == "Ny titel"
+    assert prepared.klass("class").titel == "Titel"
@@ -1,29 +1,41 @@
 import os
 import unittest.mock
 from collections import ChainMap
+from collections import Counter
 from typing import Any
 from typing import Dict
 from typing import Optional
 from typing import Tuple
 from unittest.mock import MagicMock
 from unittest.mock import patch
+from uuid import UUID
 from uuid import uuid4
 
+import pytest
 from hypothesis import given
 from hypothesis.strategies import booleans
 from more_itertools import one
 from parameterized import parameterized
+from sqlalchemy import Boolean
 from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.dialects import mysql
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
 from ..sql_export import SqlExport
 from ..sql_export import wrap_export
-from ..sql_table_defs import Base
+from ..sql_table_defs import KLE
+from ..sql_table_defs import Bruger
+from ..sql_table_defs import Facet
 from ..sql_table_defs import WAdresse
 from ..sql_table_defs import WBruger
 from ..sql_table_defs import WEnhed
+from ..sql_table_defs import WEnhedSti
 from ..sql_table_defs import WItForbindelse
+from ..sql_table_defs import WLederKaede
+from ..sql_table_defs import WPrimaerEngagement
 from ..sql_table_defs import WTilknytning
 
 
@@ -47,6 +59,9 @@ class FakeLC:
     it_connections: Dict[str, Any] = {}
     kles: Dict[str, Any] = {}
     related: Dict[str, Any] = {}
+    unit_paths: Dict[str, Any] = {}
+    manager_chains: Dict[str, Any] = {}
+    primary_engagements: Dict[str, Any] = {}
 
     def calculate_primary_engagements(self):
         raise NotImplementedError()
@@ -129,6 +144,7 @@ def test_sql_export_tables():
             "wbrugere",
             "wdar_adresser",
             "wengagementer",
+            "wenhed_sti",
             "wenheder",
             "wenhedssammenkobling",
             "wfacetter",
@@ -138,8 +154,10 @@ def test_sql_export_tables():
             "wklasser",
             "wkle",
             "wleder_ansvar",
+            "wleder_kaede",
             "wledere",
             "worlover",
+            "wprimaer_engagement",
             "wtilknytninger",
         ],
     )
@@ -152,6 +170,7 @@ def test_sql_export_tables():
             "brugere",
             "dar_adresser",
             "engagementer",
+            "enhed_sti",
             "enheder",
             "enhedssammenkobling",
             "facetter",
@@ -162,13 +181,317 @@ def test_sql_export_tables():
             "kle",
             "kvittering",
             "leder_ansvar",
+            "leder_kaede",
             "ledere",
             "orlover",
+            "primaer_engagement",
             "tilknytninger",
         ],
     )
 
 
+def test_sql_export_indexes_tables():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+    }
+    sql_export = FakeLCSqlExport(force_sqlite=False, historic=False, settings=settings)
+
+    def index_names(table_name: str) -> set[str]:
+        return {
+            index["name"]
+            for index in inspect(sql_export.engine).get_indexes(table_name)
+        }
+
+    # Exporting again checks that the indexes of the current tables do not clash
+    # with those created on the work tables
+    for _ in range(2):
+        sql_export.perform_export(resolve_dar=False, use_pickle=False)
+        assert index_names("wengagementer") == {
+            "ix_wengagementer_uuid",
+            "ix_wengagementer_bruger_uuid",
+            "ix_wengagementer_enhed_uuid",
+            "ix_wengagementer_startdato_slutdato",
+        }
+        sql_export.swap_tables()
+        assert index_names("engagementer") == {
+            "ix_engagementer_uuid",
+            "ix_engagementer_bruger_uuid",
+            "ix_engagementer_enhed_uuid",
+            "ix_engagementer_startdato_slutdato",
+        }
+
+    # Creating the indexes of existing tables is a no-op
+    sql_export.create_indexes(["engagementer"])
+    assert len(index_names("engagementer")) == 4
+
+
+def test_sql_export_bulk_inserts_rows():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+    }
+    sql_export = FakeLCSqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.chunk_size = 5
+    sql_export.lc = FakeLC()
+    sql_export.lc.users = {
+        str(uuid): [
+            {
+                "user_key": f"user{i}",
+                "fornavn": "Fornavn",
+                "efternavn": "Efternavn",
+                "kaldenavn_fornavn": None,
+                "kaldenavn_efternavn": None,
+                "cpr": "0101011234",
+                "from_date": "2020-01-01",
+                "to_date": None,
+            }
+        ]
+        for i, uuid in enumerate(uuid4() for _ in range(12))
+    }
+
+    sql_export.perform_export(resolve_dar=False, use_pickle=False)
+
+    with Session(sql_export.engine) as session:
+        users = session.scalars(select(WBruger).order_by(WBruger.id)).all()
+    assert [user.uuid for user in users] == list(sql_export.lc.users)
+    assert [user.bvn for user in users] == [f"user{i}" for i in range(12)]
+
+
+def _user(user_key: str) -> list[dict]:
+    return [
+        {
+            "user_key": user_key,
+            "fornavn": "Fornavn",
+            "efternavn": "Efternavn",
+            "kaldenavn_fornavn": None,
+            "kaldenavn_efternavn": None,
+            "cpr": "0101011234",
+            "from_date": "2020-01-01",
+            "to_date": None,
+        }
+    ]
+
+
+def test_sql_export_differential():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+        "exporters.actual_state.differential": True,
+    }
+    sql_export = FakeLCSqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.lc = FakeLC()
+    sql_export.lc.facets = {"facet": {"user_key": "facet"}}
+    sql_export.lc.users = {
+        uuid: _user(uuid) for uuid in ("unchanged", "changed", "removed")
+    }
+
+    def users() -> dict[str, tuple[int, str]]:
+        with Session(sql_export.engine) as session:
+            rows = session.execute(select(Bruger.uuid, Bruger.id, Bruger.bvn)).all()
+        return {uuid: (id, bvn) for uuid, id, bvn in rows}
+
+    # Without current tables, the work tables are rebuilt and swapped
+    sql_export.export(resolve_dar=False, use_pickle=False)
+    assert not sql_export._differential
+    before = users()
+
+    sql_export.lc.facets = {}
+    sql_export.lc.users = {
+        "unchanged": _user("unchanged"),
+        "changed": _user("new user key"),
+        "added": _user("added"),
+    }
+    sql_export.export(resolve_dar=False, use_pickle=False)
+
+    # The changes are applied to the current tables, and no work tables are made
+    assert sql_export._differential
+    assert "wbrugere" not in inspect(sql_export.engine).get_table_names()
+    after = users()
+    assert after["unchanged"] == before["unchanged"]
+    assert after["changed"] == (before["changed"][0], "new user key")
+    assert after["added"][1] == "added"
+    assert "removed" not in after
+    with Session(sql_export.engine) as session:
+        assert session.scalars(select(Facet)).all() == []
+    assert sql_export._written == Counter(brugere=3, facetter=1)
+
+
+def test_sql_export_differential_failure_leaves_current_tables():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+        "exporters.actual_state.differential": True,
+    }
+    sql_export = FakeLCSqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.lc = FakeLC()
+    sql_export.lc.facets = {"facet": {"user_key": "facet"}}
+    sql_export.lc.users = {"user": _user("user")}
+    sql_export.export(resolve_dar=False, use_pickle=False)
+
+    sql_export.lc.facets = {}
+    sql_export.lc.users = {"user": _user("new user key")}
+    # Fails after the facets and users have been applied
+    sql_export._add_kles = MagicMock(side_effect=RuntimeError("Export failed"))
+    with pytest.raises(RuntimeError):
+        sql_export.perform_export(resolve_dar=False, use_pickle=False)
+
+    # The event-driven export writes the tables either way
+    user = one(sql_export.session.scalars(select(Bruger)))
+    changed = Bruger(**{**user.row_values(), "bvn": "new user key"})
+    sql_export.update_sql(UUID(int=0), [], Bruger)
+    sql_export.update_sql(user.uuid, [changed], Bruger)  # type: ignore
+    with Session(sql_export.engine) as session:
+        assert session.scalars(select(Bruger.bvn)).all() == ["new user key"]
+        assert len(session.scalars(select(Facet)).all()) == 1
+
+
+def test_sql_export_differential_rebuilds_changed_schema():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+        "exporters.actual_state.differential": True,
+    }
+    sql_export = FakeLCSqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.lc = FakeLC()
+    sql_export.lc.users = {"user": _user("user")}
+    sql_export.export(resolve_dar=False, use_pickle=False)
+    # Tables written before the rows were hashed
+    with sql_export.engine.begin() as connection:
+        connection.execute(text("ALTER TABLE brugere DROP COLUMN hash"))
+
+    sql_export.export(resolve_dar=False, use_pickle=False)
+
+    assert not sql_export._differential
+    columns = inspect(sql_export.engine).get_columns("brugere")
+    assert "hash" in {column["name"] for column in columns}
+    sql_export.export(resolve_dar=False, use_pickle=False)
+    assert sql_export._differential
+    assert sql_export._written.total() == 0
+
+
+def test_sql_export_differential_with_reflected_tinyint():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+        "exporters.actual_state.differential": True,
+    }
+    sql_export = FakeLCSqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.lc = FakeLC()
+    sql_export.export(resolve_dar=False, use_pickle=False)
+
+    class MySQLInspector:
+        """Reflects the Boolean columns like MySQL, as TINYINT(1)."""
+
+        def __init__(self, engine):
+            self.inspector = inspect(engine)
+
+        def get_table_names(self):
+            return self.inspector.get_table_names()
+
+        def get_columns(self, table_name):
+            columns = self.inspector.get_columns(table_name)
+            for column in columns:
+                if isinstance(column["type"], Boolean):
+                    column["type"] = mysql.TINYINT(display_width=1)
+            return columns
+
+    with patch(f"{SqlExport.__module__}.inspect", MySQLInspector):
+        reflected = MySQLInspector(sql_export.engine).get_columns("engagementer")
+        assert isinstance(
+            one(c for c in reflected if c["name"] == "primær_boolean")["type"],
+            mysql.TINYINT,
+        )
+        assert not sql_export._schema_changed()
+
+
+@parameterized.expand([(False,), (True,)])
+def test_sql_export_hashes_only_when_differential(differential: bool):
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+        "exporters.actual_state.differential": differential,
+    }
+    sql_export = FakeLCSqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.lc = FakeLC()
+    sql_export.lc.users = {"user": _user("user")}
+    sql_export.export(resolve_dar=False, use_pickle=False)
+
+    # The hash column is only created for the differential export
+    columns = inspect(sql_export.engine).get_columns("brugere")
+    assert ("hash" in {column["name"] for column in columns}) == differential
+    if differential:
+        with sql_export.engine.connect() as connection:
+            hashes = connection.execute(text("SELECT hash FROM brugere")).scalars()
+            assert one(hashes) is not None
+    # The event-driven export writes the tables either way
+    user = one(sql_export.session.scalars(select(Bruger)))
+    changed = Bruger(**{**user.row_values(), "bvn": "new user key"})
+    sql_export.update_sql(UUID(int=0), [], Bruger)
+    sql_export.update_sql(user.uuid, [changed], Bruger)  # type: ignore
+    with Session(sql_export.engine) as session:
+        assert session.scalars(select(Bruger.bvn)).all() == ["new user key"]
+
+
+def test_sql_export_lookups_are_made_once_per_cache():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+    }
+    sql_export = FakeLCSqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.lc = FakeLC()
+    lookups = sql_export.lookups
+    assert sql_export.lookups is lookups
+    assert lookups.lc is sql_export.lc
+
+    sql_export.lc = FakeLC()
+    assert sql_export.lookups is not lookups
+    assert sql_export.lookups.lc is sql_export.lc
+
+
+class FakeStreamingLC(FakeLC):
+    def __init__(self, users: dict[str, list[dict]]):
+        self.streamed_users = users
+
+    def stream_caches(self, sinks):
+        for uuid, validities in self.streamed_users.items():
+            sinks["users"](uuid, validities)
+
+
+def test_sql_export_streams_rows():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+    }
+    sql_export = SqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.chunk_size = 5
+    users = {
+        str(uuid): [
+            {
+                "user_key": f"user{i}",
+                "fornavn": "Fornavn",
+                "efternavn": "Efternavn",
+                "kaldenavn_fornavn": None,
+                "kaldenavn_efternavn": None,
+                "cpr": "0101011234",
+                "from_date": "2020-01-01",
+                "to_date": None,
+            }
+        ]
+        for i, uuid in enumerate(uuid4() for _ in range(12))
+    }
+
+    with patch(
+        f"{SqlExport.__module__}.LoraCache", return_value=FakeStreamingLC(users)
+    ):
+        sql_export.perform_streaming_export(resolve_dar=False)
+
+    with Session(sql_export.engine) as session:
+        streamed = session.scalars(select(WBruger).order_by(WBruger.id)).all()
+    assert [user.uuid for user in streamed] == list(users)
+    assert [user.bvn for user in streamed] == [f"user{i}" for i in range(12)]
+
+
 def _mk_uuid() -> str:
     return str(uuid4())
 
@@ -198,16 +521,15 @@ def _join_dicts(*dicts: dict) -> ChainMap:
     return ChainMap(*dicts)
 
 
-def _assert_db_session_add(session: MagicMock, cls: Base, **expected: Any) -> None:  # type: ignore
-    session_add_calls = [
-        call
-        for call in session.method_calls
-        if len(call.args) > 0 and isinstance(one(call.args), cls)
+def _assert_row_inserted(connection: MagicMock, cls: Any, **expected: Any) -> None:
+    inserts = [
+        call.args[1]
+        for call in connection.execute.call_args_list
+        if call.args[0].table is cls.__table__
     ]
-    assert len(session_add_calls) == 1
-    model = one(one(session_add_calls).args)
+    row = one(one(inserts))
     for name, value in expected.items():
-        assert getattr(model, name) == value
+        assert row[name] == value
 
 
 def test_get_lora_class_returns_uuid_as_title_if_none():
@@ -246,8 +568,8 @@ def test_sql_export_writes_users(cpr: Optional[str]):
     sql_export.perform_export()
 
     # Assert
-    _assert_db_session_add(
-        sql_export.session,  # type: ignore
+    _assert_row_inserted(
+        sql_export.connection,  # type: ignore
         WBruger,
         uuid=user_uuid,
         cpr=cpr,
@@ -293,8 +615,8 @@ def test_sql_export_writes_org_units():
     sql_export.perform_export()
 
     # Assert
-    _assert_db_session_add(
-        sql_export.session,  # type: ignore
+    _assert_row_inserted(
+        sql_export.connection,  # type: ignore
         WEnhed,
         uuid=unit_uuid,
         navn=unit["name"],
@@ -358,8 +680,8 @@ def test_sql_export_writes_associations(assoc_type_present: bool):
     sql_export.perform_export()
 
     # Assert
-    _assert_db_session_add(
-        sql_export.session,  # type: ignore
+    _assert_row_inserted(
+        sql_export.connection,  # type: ignore
         WTilknytning,
         uuid=assoc_uuid,
         bruger_uuid=assoc["user"],
@@ -408,8 +730,8 @@ def test_sql_export_writes_addresses():
     sql_export.perform_export()
 
     # Assert
-    _assert_db_session_add(
-        sql_export.session,  # type: ignore
+    _assert_row_inserted(
+        sql_export.connection,  # type: ignore
         WAdresse,
         uuid=address_uuid,
         bruger_uuid=address["user"],
@@ -453,8 +775,8 @@ def test_sql_export_writes_it_users(primary_boolean: Optional[bool]):
     sql_export.perform_export()
 
     # Assert
-    _assert_db_session_add(
-        sql_export.session,  # type: ignore
+    _assert_row_inserted(
+        sql_export.connection,  # type: ignore
         WItForbindelse,
         uuid=it_user_uuid,
         it_system_uuid=it_user["itsystem"],
@@ -467,6 +789,162 @@ def test_sql_export_writes_it_users(primary_boolean: Optional[bool]):
     )
 
 
+def test_sql_export_writes_tables_in_parallel():
+    # Arrange
+    user_uuid = _mk_uuid()
+    user = {
+        "cpr": "0101011234",
+        "user_key": user_uuid,
+        "fornavn": "Fornavn",
+        "efternavn": "Efternavn",
+        "kaldenavn_fornavn": None,
+        "kaldenavn_efternavn": None,
+        "from_date": "2020-01-01",
+        "to_date": None,
+    }
+    it_user_uuid = _mk_uuid()
+    it_user = {
+        "user": user_uuid,
+        "unit": None,
+        "username": "username",
+        "itsystem": _mk_uuid(),
+        "from_date": "2020-01-01",
+        "to_date": None,
+    }
+    lc_data = {
+        "users": {user_uuid: [user]},
+        "it_connections": {it_user_uuid: [it_user]},
+    }
+    sql_export = _TestableSqlExport(inject_lc=lc_data)
+    sql_export.export_workers = 4
+    sql_export.derived_tables = True
+    # The call counts of a mock are not thread-safe, so every connection is its own
+    connections: list[MagicMock] = []
+
+    def connect() -> MagicMock:
+        connection = MagicMock()
+        connections.append(connection.__enter__.return_value)
+        return connection
+
+    sql_export.engine.connect.side_effect = connect  # type: ignore
+
+    # Act
+    sql_export.perform_export()
+
+    # Assert
+    # Every task, including the derived tables, writes through its own connection
+    assert len(connections) == 17
+    for connection in connections:
+        connection.commit.assert_called()
+
+    def writer(cls: Any) -> MagicMock:
+        return one(
+            connection
+            for connection in connections
+            if any(
+                call.args[0].table is cls.__table__
+                for call in connection.execute.call_args_list
+            )
+        )
+
+    _assert_row_inserted(writer(WBruger), WBruger, uuid=user_uuid, bvn=user_uuid)
+    _assert_row_inserted(
+        writer(WItForbindelse),
+        WItForbindelse,
+        uuid=it_user_uuid,
+        bruger_uuid=user_uuid,
+    )
+
+
+def test_sql_export_writes_derived_tables():
+    # Arrange
+    lc_data = {
+        "units": {"unit": [{"name": "Enhedsnavn"}]},
+        "engagements": {"engagement": [{"unit": "unit"}]},
+        "managers": {"manager": [{"unit": "unit", "user": "boss"}]},
+        "unit_paths": {"unit": ["unit"]},
+        "primary_engagements": {"user": "engagement"},
+        "manager_chains": {"unit": ["manager"]},
+    }
+    sql_export = _TestableSqlExport(inject_lc=lc_data)
+    sql_export.connection = MagicMock()
+    sql_export._commit_batches = False
+
+    # Act
+    sql_export._add_unit_paths()
+    sql_export._add_primary_engagements()
+    sql_export._add_manager_chains()
+
+    # Assert
+    _assert_row_inserted(
+        sql_export.connection,  # type: ignore
+        WEnhedSti,
+        enhed_uuid="unit",
+        niveau=1,
+        overenhed_uuid="unit",
+        overenhed_navn="Enhedsnavn",
+    )
+    _assert_row_inserted(
+        sql_export.connection,  # type: ignore
+        WPrimaerEngagement,
+        bruger_uuid="user",
+        engagement_uuid="engagement",
+        enhed_uuid="unit",
+    )
+    _assert_row_inserted(
+        sql_export.connection,  # type: ignore
+        WLederKaede,
+        enhed_uuid="unit",
+        afstand=0,
+        leder_uuid="manager",
+        leder_enhed_uuid="unit",
+        bruger_uuid="boss",
+    )
+
+
+def _kle(title: str, unit: str | None = None) -> KLE:
+    return KLE(
+        uuid="kle",
+        enhed_uuid=unit,
+        kle_aspekt_titel=title,
+        kle_nummer_titel=title,
+        startdato="2020-01-01",
+    )
+
+
+def test_update_sql_diffs_rows():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+    }
+    sql_export = SqlExport(force_sqlite=False, historic=False, settings=settings)
+    sql_export.chunk_size = 2
+    sql_export.session = sql_export._get_db_session()
+    KLE.__table__.create(sql_export.engine)
+    sql_export.session.add_all(
+        [_kle("unchanged"), _kle("duplicate"), _kle("duplicate")]
+        + [_kle(f"removed{i}") for i in range(3)]
+    )
+    sql_export.session.commit()
+    ids = dict(sql_export.session.execute(select(KLE.kle_aspekt_titel, KLE.id)).all())
+
+    sql_export.update_sql(
+        uuid="kle",  # type: ignore
+        objects=[_kle("unchanged"), _kle("duplicate"), _kle("unchanged", unit="new")],
+        table=KLE,
+    )
+
+    rows = sql_export.session.execute(
+        select(KLE.id, KLE.kle_aspekt_titel, KLE.enhed_uuid).order_by(KLE.id)
+    ).all()
+    # Unchanged rows are kept, the rest is replaced
+    assert [tuple(row) for row in rows[:2]] == [
+        (ids["unchanged"], "unchanged", None),
+        (ids["duplicate"], "duplicate", None),
+    ]
+    assert tuple(rows[2])[1:] == ("unchanged", "new")
+
+
 class TestEnsureSingleRun(unittest.TestCase):
     @patch("fastramqpi.ra_utils.load_settings.load_settings")
     @patch.object(SqlExport, "_get_engine")
@@ -531,5 +1009,5 @@ class TestEnsureSingleRun(unittest.TestCase):
             wrap_export(args=args, settings=settings)
 
             mock_perform_export.assert_called_once_with(
-                resolve_dar=resolve_dar, use_pickle=use_pickle
+                resolve_dar=resolve_dar, use_pickle=use_pickle, stream=False
             )
@@ -0,0 +1,78 @@
+import threading
+import time
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from .. import trigger
+from ..trigger import trigger_router
+
+
+class FakeSqlExport:
+    # Both targets must be exporting at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    release = threading.Event()
+
+    def __init__(self, force_sqlite, historic, settings):
+        self.historic = historic
+
+    def perform_export(self, resolve_dar, use_pickle):
+        self.barrier.wait()
+        self.release.wait(timeout=5)
+
+    def swap_tables(self):
+        pass
+
+
+def _wait_for_job(client: TestClient, job_id: str) -> dict:
+    for _ in range(100):
+        status = client.get(f"/trigger/{job_id}").json()
+        if status["status"] in ("done", "failed"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError("Job did not finish")
+
+
+@patch.object(trigger, "DatabaseSettings")
+@patch.object(trigger, "SqlExport", FakeSqlExport)
+def test_trigger_runs_targets_concurrently(_) -> None:
+    app = FastAPI()
+    app.include_router(trigger_router)
+    FakeSqlExport.release.clear()
+
+    with TestClient(app) as client:
+        response = client.post("/trigger?target=actual&target=historic")
+        assert response.status_code == 200
+        job_id = response.json()["id"]
+
+        # Both targets are running, so neither can be started again
+        assert client.post("/trigger").status_code == 409
+        assert client.post("/trigger?historic=true").status_code == 409
+        running = client.get(f"/trigger/{job_id}").json()
+        assert running["status"] == "running"
+
+        FakeSqlExport.release.set()
+        status = _wait_for_job(client, job_id)
+
+    assert status["status"] == "done"
+    assert status["targets"] == ["actual", "historic"]
+    assert list(status["phases"]) == [
+        "actual.export",
+        "actual.swap",
+        "historic.export",
+        "historic.swap",
+    ]
+    for phase in status["phases"].values():
+        assert phase["status"] == "done"
+        assert phase["seconds"] >= 0
+    assert not trigger.lock_actual.locked()
+    assert not trigger.lock_historic.locked()
+
+
+def test_trigger_status_of_unknown_job() -> None:
+    app = FastAPI()
+    app.include_router(trigger_router)
+    with TestClient(app) as client:
+        response = client.get("/trigger/00000000-0000-0000-0000-000000000000")
+    assert response.status_code == 404
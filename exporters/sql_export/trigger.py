@@ -1,10 +1,27 @@
 # SPDX-FileCopyrightText: Magenta ApS
 #
 # SPDX-License-Identifier: MPL-2.0
-"""Integration endpoints."""
+"""Integration endpoints.
 
+`POST /trigger` starts a job exporting to the actual state and/or the historic
+database, and returns its id at once. The targets are exported concurrently, as
+they are written to different databases, while a target can only be exported by
+one job at a time. `GET /trigger/{id}` reports the progress of a job, with the
+timings of every phase of every target.
+"""
+
+import asyncio
+import datetime
 import logging
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from dataclasses import field
 from threading import Lock
+from typing import Any
+from typing import Literal
+from uuid import UUID
+from uuid import uuid4
 
 from fastapi import APIRouter
 from fastapi import HTTPException
@@ -20,10 +37,94 @@ trigger_router = APIRouter()
 lock_actual = Lock()
 lock_historic = Lock()
 
+Target = Literal["actual", "historic"]
+Status = Literal["pending", "running", "done", "failed"]
+
+# Number of finished jobs to keep the status of
+MAX_JOBS = 100
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(tz=datetime.timezone.utc)
+
+
+@dataclass
+class Phase:
+    status: Status = "pending"
+    started: datetime.datetime | None = None
+    ended: datetime.datetime | None = None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "status": self.status,
+            "started": self.started,
+            "ended": self.ended,
+            "seconds": (
+                (self.ended - self.started).total_seconds()
+                if self.started and self.ended
+                else None
+            ),
+        }
+
+
+@dataclass
+class Job:
+    id: UUID
+    targets: list[Target]
+    status: Status = "pending"
+    error: str | None = None
+    phases: dict[str, Phase] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        for target in self.targets:
+            for phase in ("export", "swap"):
+                self.phases[f"{target}.{phase}"] = Phase()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "targets": self.targets,
+            "status": self.status,
+            "error": self.error,
+            "phases": {name: phase.as_dict() for name, phase in self.phases.items()},
+        }
+
+
+jobs: dict[UUID, Job] = {}
+# Strong references to the running jobs, see `asyncio.create_task`
+_tasks: set[asyncio.Task] = set()
+
+
+def _lock(target: Target) -> Lock:
+    return lock_historic if target == "historic" else lock_actual
+
+
+@contextmanager
+def timed(job: Job, name: str) -> Iterator[None]:
+    """Record the status and timings of the phase `name` of `job`."""
+    phase = job.phases[name]
+    phase.status = "running"
+    phase.started = now()
+    try:
+        yield
+    except BaseException:
+        phase.status = "failed"
+        raise
+    else:
+        phase.status = "done"
+    finally:
+        phase.ended = now()
+
 
 def refresh_db(
-    resolve_dar: bool, historic: bool, read_from_cache: bool, lock: Lock
+    resolve_dar: bool,
+    historic: bool,
+    read_from_cache: bool,
+    lock: Lock,
+    job: Job | None = None,
 ) -> None:
+    target: Target = "historic" if historic else "actual"
+    job = job or Job(id=uuid4(), targets=[target])
     try:
         logger.info("*SQL export started*")
         database_settings = DatabaseSettings()  # type: ignore
@@ -33,12 +134,14 @@ def refresh_db(
             historic=historic,
             settings=database_settings.to_old_settings(),
         )
-        sql_export.perform_export(
-            resolve_dar=resolve_dar,
-            use_pickle=read_from_cache,
-        )
+        with timed(job, f"{target}.export"):
+            sql_export.perform_export(
+                resolve_dar=resolve_dar,
+                use_pickle=read_from_cache,
+            )
 
-        sql_export.swap_tables()
+        with timed(job, f"{target}.swap"):
+            sql_export.swap_tables()
         logger.info("*SQL export ended*")
         dipex_last_success_timestamp.set_to_current_time()
     finally:
@@ -46,19 +149,64 @@ def refresh_db(
         lock.release()
 
 
+async def run_job(job: Job, resolve_dar: bool, read_from_cache: bool) -> None:
+    """Export the targets of `job` concurrently, holding their locks."""
+    job.status = "running"
+    results = await asyncio.gather(
+        *(
+            asyncio.to_thread(
+                refresh_db,
+                resolve_dar,
+                target == "historic",
+                read_from_cache,
+                _lock(target),
+                job,
+            )
+            for target in job.targets
+        ),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        logger.error("SQL export failed", exc_info=error)
+    job.status = "failed" if errors else "done"
+    job.error = "; ".join(map(repr, errors)) or None
+
+
 @trigger_router.post("/trigger")
-def trigger(
+async def trigger(
     resolve_dar: bool = Query(False),
     historic: bool = Query(False),
     read_from_cache: bool = Query(False),
-) -> dict[str, str]:
-    if historic:
-        lock = lock_historic
-    else:
-        lock = lock_actual
-    acquired = lock.acquire(blocking=False)
-    if not acquired:
-        raise HTTPException(409, "Already running")
+    target: list[Target] | None = Query(
+        None, description="Targets to export, defaults to the one chosen by historic"
+    ),
+) -> dict[str, Any]:
+    targets: list[Target] = list(dict.fromkeys(target or []))
+    if not targets:
+        targets = ["historic" if historic else "actual"]
+
+    acquired: list[Lock] = []
+    for t in targets:
+        if not _lock(t).acquire(blocking=False):
+            for lock in acquired:
+                lock.release()
+            raise HTTPException(409, f"Already running: {t}")
+        acquired.append(_lock(t))
+
+    job = Job(id=uuid4(), targets=targets)
+    jobs[job.id] = job
+    finished = [i for i, j in jobs.items() if j.status in ("done", "failed")]
+    for job_id in finished[: max(len(jobs) - MAX_JOBS, 0)]:
+        del jobs[job_id]
+    task = asyncio.create_task(run_job(job, resolve_dar, read_from_cache))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return {"id": job.id, "detail": "Started"}
+
 
-    refresh_db(resolve_dar, historic, read_from_cache, lock)
-    return {"detail": "Done"}
+@trigger_router.get("/trigger/{job_id}")
+async def trigger_status(job_id: UUID) -> dict[str, Any]:
+    if (job := jobs.get(job_id)) is None:
+        raise HTTPException(404, "No such job")
+    return job.as_dict()
@@ -0,0 +1,208 @@
+"""Run the PowerShell commands of many AD users in one WinRM round-trip.
+
+Every call of `AD._run_ps_script` is a WinRM command of its own, starting with the
+credential of `AD._build_user_credential`, so writing to every user of an AD one by
+one takes a round-trip per user. `PowerShellBatch` collects the commands of many
+users, e.g. the `Set-ADUser` and `New-ADUser` commands templated by
+`ad_template_engine`, and runs them as one script. The script defines the credential
+once, runs every command in a try/catch of its own, and writes the outcome of every
+command as JSON, so a failing command only fails its own `BatchItem`. As WinRM
+sends the script on a command line, a batch is also cut short before the script
+grows longer than a command line may be.
+
+If the AD has a session pool, batches are run in parallel on its threads, while the
+next batch is collected.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any
+from typing import Callable
+from typing import List
+from typing import Optional
+
+from .ad_exceptions import CommandFailure
+
+logger = logging.getLogger("AdBatch")
+
+# PowerShell ends single-quoted strings at typographic single quotes as well
+_SINGLE_QUOTES = "'‘’‚‛"
+
+# `winrm.Session.run_ps` sends the script base64 encoded as UTF-16 on the command
+# line, which cmd limits to 8191 characters
+MAX_COMMAND_LINE = 8000
+_COMMAND_PREFIX = "powershell -encodedcommand "
+
+
+def ps_quote(text: str) -> str:
+    """Quote `text` as a single-quoted (verbatim) PowerShell string."""
+    return "'" + "".join(c * 2 if c in _SINGLE_QUOTES else c for c in text) + "'"
+
+
+def command_line_length(script: str) -> int:
+    """The length of the command line running `script` through `run_ps`."""
+    encoded = len(script.encode("utf_16_le"))
+    return len(_COMMAND_PREFIX) + 4 * -(-encoded // 3)
+
+
+class BatchItem:
+    """The commands of a single AD user in a batch, and their outcome."""
+
+    def __init__(self, command: str, key: Any = None):
+        self.command = command
+        self.key = key
+        self.done = False
+        self.error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.done and self.error is None
+
+    def result(self) -> None:
+        """Raise `CommandFailure` if the commands failed."""
+        if not self.done:
+            raise RuntimeError("The batch of %r has not been run" % self.key)
+        if self.error is not None:
+            raise CommandFailure(self.error)
+
+
+class PowerShellBatch:
+    """Collect PowerShell commands, and run them `size` at a time.
+
+    Commands are run when `size` commands have been added, or when adding another
+    command would make the script longer than `max_length` on the command line, and
+    when the batch is flushed, which leaving it as a context manager does. `on_done` is called with
+    every item once it has been run, succeeded or not, from the thread running it,
+    but never for two items at once.
+
+    Example:
+        with PowerShellBatch(writer, size=50, on_done=report) as batch:
+            for user in users:
+                batch.add(writer._get_sync_user_command(...), key=user["uuid"])
+    """
+
+    def __init__(
+        self,
+        ad,
+        size: int = 50,
+        on_done: Optional[Callable[[BatchItem], None]] = None,
+        max_length: int = MAX_COMMAND_LINE,
+    ):
+        self.ad = ad
+        self.size = size
+        self.max_length = max_length
+        self.on_done = on_done
+        self.pending: List[BatchItem] = []
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "PowerShellBatch":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.flush()
+
+    def add(self, *commands: str, key: Any = None) -> BatchItem:
+        """Add the commands of a single user, which fail or succeed together.
+
+        The commands are built for `AD._run_ps_script`, and the credential they
+        start with is only defined once by the batch.
+        """
+        credential = self.ad._build_user_credential()
+        item = BatchItem(
+            "\n".join(command.removeprefix(credential) for command in commands),
+            key=key,
+        )
+        # A command too long to share a script with others is run by itself
+        if self.pending and (
+            command_line_length(self.script(self.pending + [item])) > self.max_length
+        ):
+            self._submit()
+        self.pending.append(item)
+        if len(self.pending) >= self.size:
+            self._submit()
+        return item
+
+    def flush(self) -> None:
+        """Run the pending commands, and wait for all commands to have run."""
+        self._submit()
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def _submit(self) -> None:
+        items, self.pending = self.pending, []
+        if not items:
+            return
+        if self.ad.pool is None:
+            self._run(items)
+        else:
+            self._futures.append(self.ad.pool.submit(self._run, items))
+
+    def script(self, items: List[BatchItem]) -> str:
+        """The script running `items`, and writing their outcome as a JSON list.
+
+        Every command is parsed when it is run, so a command which is not even valid
+        PowerShell fails by itself, rather than failing the whole script.
+        """
+        lines = [
+            self.ad._build_user_credential(),
+            '$ErrorActionPreference = "Stop"',
+            "$results = @()",
+        ]
+        for i, item in enumerate(items):
+            lines.append(
+                "try { $null = & ([scriptblock]::Create(%s)); "
+                "$results += @{id=%d; ok=$true} } "
+                "catch { $results += @{id=%d; ok=$false; error=$_.Exception.Message} }"
+                % (ps_quote(item.command), i, i)
+            )
+        lines.append("ConvertTo-Json -InputObject $results -Compress")
+        return "\n".join(lines)
+
+    def _run(self, items: List[BatchItem]) -> None:
+        try:
+            response = self.ad._run_ps_script(self.script(items))
+        except (CommandFailure, ValueError) as exc:
+            # The script failed as a whole, find the commands that made it fail
+            if len(items) == 1:
+                self._finish(items[0], str(exc))
+                return
+            logger.warning(
+                "Batch of %d commands failed, running them one by one: %s",
+                len(items),
+                exc,
+            )
+            for item in items:
+                self._run([item])
+            return
+        except Exception as exc:
+            logger.exception("Batch of %d commands failed", len(items))
+            for item in items:
+                self._finish(item, str(exc))
+            return
+
+        # A single result may be written as an object rather than a list
+        if isinstance(response, dict) and "id" in response:
+            response = [response]
+        results = {}
+        if isinstance(response, list):
+            results = {result.get("id"): result for result in response}
+        for i, item in enumerate(items):
+            result = results.get(i)
+            if result is None:
+                self._finish(item, "No result from the batch")
+            elif result.get("ok"):
+                self._finish(item, None)
+            else:
+                self._finish(item, result.get("error") or "Unknown error")
+
+    def _finish(self, item: BatchItem, error: Optional[str]) -> None:
+        item.error = error
+        item.done = True
+        if error is not None:
+            logger.error("Command of %r failed: %s", item.key, error)
+        if self.on_done is not None:
+            with self._lock:
+                self.on_done(item)
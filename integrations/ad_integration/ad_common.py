@@ -4,8 +4,9 @@ import random
 import subprocess
 import time
 from typing import Dict
+from typing import Iterable
 from typing import List
-from typing import Optional
+from typing import Union
 
 import more_itertools
 
@@ -17,9 +18,13 @@ try:
 except ImportError:
     pass
 
+from .ad_dump import ADDump
+from .ad_dump import strip_cpr_separator
 from .ad_exceptions import CommandFailure
 from .ad_exceptions import CprNotFoundInADException
 from .ad_exceptions import CprNotNotUnique
+from .ad_exceptions import ServerUnavailable
+from .ad_session_pool import SessionPool
 from .read_ad_conf_settings import read_settings
 
 logger = logging.getLogger("AdCommon")
@@ -132,6 +137,7 @@ def generate_kerberos_session(hostname, username=None, password=None):
 
 class AD:
     _encoding = "utf-8"
+    pool = None
 
     def __init__(self, all_settings=None, index=0, **kwargs):
         self.all_settings = all_settings
@@ -139,6 +145,7 @@ class AD:
             self.all_settings = read_settings(index=index)
         self.session = self._create_session()
         self.retry_exceptions = self._get_retry_exceptions()
+        self.pool = self._create_pool()
         self.results = {}
 
     def _get_retry_exceptions(self):
@@ -179,7 +186,81 @@ class AD:
 
         return session
 
-    def _run_ps_script(self, ps_script):
+    def _create_pool(self):
+        """Pool of WinRM sessions spread across the AD servers, used instead of the
+        single session if `integrations.ad.sessions_per_server` is set.
+
+        Returns:
+            SessionPool or None
+        """
+        per_server = self.all_settings["global"].get("sessions_per_server")
+        if not per_server:
+            return None
+        servers = self._get_setting().get("servers") or self.all_settings["global"].get(
+            "servers"
+        )
+        pool = SessionPool(
+            self._create_session,
+            servers=servers or [],
+            per_server=per_server,
+            retry_exceptions=self.retry_exceptions,
+            health_script=self._get_health_check_command,
+        )
+        # Servers which cannot be reached are not chosen until they can again
+        health = pool.health_check()
+        logger.info("Health of the AD servers: %r", health)
+        return pool
+
+    def close(self):
+        """Log the statistics of the session pool, if any, and shut it down."""
+        if self.pool is not None:
+            self.pool.log_stats()
+            self.pool.close()
+
+    def _get_health_check_command(self, server):
+        return (
+            self._build_user_credential()
+            + "Get-ADDomain -Server {} -Credential $usercredential | Out-Null".format(
+                server
+            )
+        )
+
+    def _choose_server(self, servers):
+        """The AD server to run a script against, if any servers are configured.
+
+        The session pool chooses the least busy of its available servers, otherwise
+        a server is chosen at random.
+        """
+        if not servers:
+            return None
+        if self.pool is not None:
+            return self.pool.choose_server(servers)
+        return random.choice(servers)
+
+    def _run_ps(self, ps_script, failover=True):
+        """Run a PowerShell script on the session, or the session pool.
+
+        If the server named by the script is unavailable, the script is run against
+        another server instead, unless not `failover`, in which case
+        `ServerUnavailable` is raised.
+        """
+        if self.pool is None:
+            return self.session.run_ps(ps_script)
+        try:
+            return self.pool.run_ps(ps_script)
+        except ServerUnavailable:
+            if not failover:
+                raise
+            # Run the script against another server, if any is available
+            server = self.pool.server_of(ps_script)
+            others = [other for other in self.pool.servers if other != server]
+            if not others:
+                raise
+            other = self.pool.choose_server(others)
+            logger.warning("AD server %r is unavailable, using %r", server, other)
+            return self.pool.run_ps(self.pool.with_server(ps_script, other))
+
+    def _run_ps_script(self, ps_script, failover=True):
         """Run a PowerShell script and return the result.
 
         If the script fails, a `CommandFailure` exception is raised.
@@ -187,6 +268,8 @@ class AD:
         is raised.
 
         :param ps_script: The PowerShell script to run.
+        :param failover: Run the script against another server, if the server it
+        names is unavailable. Otherwise `ServerUnavailable` is raised.
         :return: A dictionary with the returned parameters.
         """
 
@@ -197,21 +280,23 @@ class AD:
 
         logger.debug("Attempting to run script: {}".format(ps_script))
         response = {}
-        if not self.session:
+        if self.pool is None and not self.session:
             return response
 
         retries = 0
         try_again = True
         while try_again and retries < 10:
             try:
-                r = self.session.run_ps(ps_script)
+                r = self._run_ps(ps_script, failover=failover)
                 try_again = False
             except self.retry_exceptions:
                 logger.error("AD read error: {}".format(retries))
                 time.sleep(5)
                 retries += 1
-                # The existing session is now dead, create a new.
-                self.session = self._create_session()
+                # The existing session is now dead, create a new. The pool throws
+                # away its dead sessions by itself.
+                if self.pool is None:
+                    self.session = self._create_session()
 
         # TODO: We will need better error handling than this.
         assert retries < 10
@@ -329,19 +414,42 @@ class AD:
         return ad_values["SamAccountName"]
 
     def _find_ad_user(
-        self, cpr: str, ad_dump: Optional[List[Dict[str, str]]] = None
+        self, cpr: str, ad_dump: Union[ADDump, List[Dict[str, str]], None] = None
     ) -> ADUser:
-        """Find a unique AD account from cpr, otherwise raise an exception."""
-        if ad_dump:
+        """Find a unique AD account from cpr, otherwise raise an exception.
+
+        An `ADDump` is looked up by its CPR index, any other list of AD users is
+        searched from one end to the other. Either way the CPR numbers are compared
+        without the `cpr_separator` of the AD.
+        """
+        ad_users: Iterable[ADUser]
+        if isinstance(ad_dump, ADDump):
+            ad_users = ad_dump.find_by_cpr(cpr)
+        elif ad_dump:
             cpr_field = self.all_settings["primary"]["cpr_field"]
-            ad_users = filter(lambda ad_user: ad_user.get(cpr_field) == cpr, ad_dump)
+            separator = self.all_settings["primary"].get("cpr_separator", "")
+            stripped_cpr = strip_cpr_separator(cpr, separator)
+            ad_users = filter(
+                lambda ad_user: stripped_cpr is not None
+                and strip_cpr_separator(ad_user.get(cpr_field), separator)
+                == stripped_cpr,
+                ad_dump,
+            )
         else:
             logger.debug("No AD information supplied, will look it up")
             ad_users = self.get_from_ad(cpr=cpr)
 
         return more_itertools.one(ad_users, CprNotFoundInADException, CprNotNotUnique)
 
-    def get_from_ad(self, user=None, cpr=None, server=None):
+    def get_from_ad(
+        self,
+        user=None,
+        cpr=None,
+        server=None,
+        result_set_size=None,
+        usn_changed=None,
+        failover=True,
+    ):
         """
         Read all properties of an AD user. The user can be retrived either by cpr
         or by AD user name.
@@ -393,6 +501,11 @@ class AD:
         :param cpr: cpr number of the user to retrive.
         :param server: Add an explcit server to the query. Mostly needed to check
         if replication is finished.
+        :param result_set_size: Read at most this many users.
+        :param usn_changed: Read the users changed on `server` since its update
+        sequence number (USN) was this, rather than a single user.
+        :param failover: Read from another server, if `server` is unavailable.
+        Otherwise `ServerUnavailable` is raised.
         :return: All properties listed in AD for the user.
         """
         settings = self._get_setting()
@@ -416,13 +529,18 @@ class AD:
             ps_template = "Get-ADUser -Filter '{field} {operator} \"{val}\"'"
             get_command = ps_template.format(field=field, operator=operator, val=val)
 
+        if usn_changed is not None:
+            get_command = "Get-ADUser -Filter 'uSNChanged -gt {}'".format(
+                int(usn_changed)
+            )
+
+        if server is None:
+            server = self._choose_server(self.all_settings["global"].get("servers"))
         server_string = ""
         if server is not None:
             server_string = " -Server {}".format(server)
-        elif self.all_settings["global"].get("servers"):
-            server_string = " -Server {}".format(
-                random.choice(self.all_settings["global"]["servers"])
-            )
+        if result_set_size is not None:
+            server_string += " -ResultSetSize {}".format(result_set_size)
 
         ps_script = (
             self._ps_boiler_plate()["encoding"]
@@ -434,7 +552,7 @@ class AD:
             + " | ConvertTo-Json"
         )
 
-        response = self._run_ps_script(ps_script)
+        response = self._run_ps_script(ps_script, failover=failover)
 
         if not response:
             return_val = []
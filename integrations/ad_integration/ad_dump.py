@@ -0,0 +1,147 @@
+"""The users of a full AD dump, indexed by the fields they are looked up by.
+
+`ADParameterReader.read_it_all` returns a list of every AD user, and the MO to AD
+sync looks up the AD user of every MO user (and of their manager) in it by CPR
+number, which took a pass over the whole list per lookup. `ADDump` is built once
+from the list, and keeps a hash index of the users by:
+
+* Their CPR number, with the `cpr_separator` of the AD removed.
+* Their SamAccountName, regardless of case, like AD itself.
+* Their ObjectGUID.
+* The field holding the UUID of their MO user, if any.
+
+An index may hold several users by the same value, which `duplicates` tells about.
+The dump is a read-only sequence of the users, in the order they were read.
+"""
+
+import logging
+from collections.abc import Sequence
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+logger = logging.getLogger("AdDump")
+
+ADUser = Dict[str, Any]
+
+
+def strip_cpr_separator(cpr: Optional[str], separator: str) -> Optional[str]:
+    """The CPR number `cpr` without the `cpr_separator` of the AD, if any."""
+    if not cpr:
+        return None
+    if separator:
+        cpr = cpr.replace(separator, "")
+    return cpr
+
+
+class ADDump(Sequence):
+    """Read-only sequence of AD users, with hash indexes of their key fields.
+
+    Example:
+        dump = ADDump(reader.read_it_all(), cpr_field="extensionAttribute1")
+        dump.find_by_cpr("0101011234")
+    """
+
+    def __init__(
+        self,
+        users: Iterable[ADUser] = (),
+        cpr_field: str = "cpr",
+        cpr_separator: str = "",
+        uuid_field: Optional[str] = None,
+    ):
+        self._users = list(users)
+        self.cpr_field = cpr_field
+        self.cpr_separator = cpr_separator or ""
+        self.uuid_field = uuid_field
+
+        self._indexes: Dict[str, Dict[str, List[ADUser]]] = {
+            "cpr": {},
+            "sam": {},
+            "guid": {},
+            "uuid": {},
+        }
+        for user in self._users:
+            for index, value in self._keys(user).items():
+                if value:
+                    self._indexes[index].setdefault(value, []).append(user)
+
+    @classmethod
+    def from_settings(
+        cls,
+        users: Iterable[ADUser],
+        settings: dict,
+        uuid_field: Optional[str] = None,
+    ) -> "ADDump":
+        """Build the dump of `users` with the fields of the `primary` AD settings."""
+        return cls(
+            users,
+            cpr_field=settings["cpr_field"],
+            cpr_separator=settings.get("cpr_separator", ""),
+            uuid_field=uuid_field,
+        )
+
+    def _keys(self, user: ADUser) -> Dict[str, Optional[str]]:
+        uuid = user.get(self.uuid_field) if self.uuid_field else None
+        return {
+            "cpr": self._cpr(user.get(self.cpr_field)),
+            "sam": _lower(user.get("SamAccountName")),
+            "guid": _lower(user.get("ObjectGUID")),
+            "uuid": _lower(uuid),
+        }
+
+    def _cpr(self, cpr: Optional[str]) -> Optional[str]:
+        return strip_cpr_separator(cpr, self.cpr_separator)
+
+    def __getitem__(self, index):
+        return self._users[index]
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __repr__(self) -> str:
+        return "<ADDump of %d users>" % len(self._users)
+
+    def find_by_cpr(self, cpr: str) -> List[ADUser]:
+        """The users of the CPR number `cpr`, with or without its separator."""
+        return list(self._indexes["cpr"].get(self._cpr(cpr) or "", []))
+
+    def find_by_sam(self, sam: str) -> List[ADUser]:
+        return list(self._indexes["sam"].get(_lower(sam) or "", []))
+
+    def find_by_guid(self, guid: Any) -> List[ADUser]:
+        return list(self._indexes["guid"].get(_lower(guid) or "", []))
+
+    def find_by_uuid(self, uuid: Any) -> List[ADUser]:
+        """The users whose `uuid_field` holds the MO user UUID `uuid`."""
+        return list(self._indexes["uuid"].get(_lower(uuid) or "", []))
+
+    def duplicates(self) -> Dict[str, Dict[str, List[ADUser]]]:
+        """The values held by more than one user, by the name of their index."""
+        return {
+            index: {value: users for value, users in values.items() if len(users) > 1}
+            for index, values in self._indexes.items()
+        }
+
+    def log_duplicates(self) -> int:
+        """Log a warning for every value held by more than one user, and return
+        the number of such values."""
+        count = 0
+        for index, values in self.duplicates().items():
+            for value, users in values.items():
+                count += 1
+                logger.warning(
+                    "%d AD users share the %s %r: %s",
+                    len(users),
+                    index,
+                    value if index != "cpr" else value[:6] + "-xxxx",
+                    ", ".join(str(user.get("SamAccountName")) for user in users),
+                )
+        return count
+
+
+def _lower(value: Any) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return str(value).lower()
@@ -56,3 +56,7 @@ class CommandFailure(ADError):
 
 class ImproperlyConfigured(ADError):
     pass
+
+
+class ServerUnavailable(ADError):
+    """No AD server (domain controller) can currently be reached."""
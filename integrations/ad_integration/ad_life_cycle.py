@@ -181,33 +181,15 @@ class AdLifeCycle:
 
         logger.debug("Primary found, now find org unit location")
 
-        try:
-            unit = self.lc.units[eng_org_unit_uuid][0]
-        except KeyError:
+        tree = self.lc.org_tree()
+        if eng_org_unit_uuid not in tree:
             logger.warning(
                 "cannot find unit %r (user=%r)", eng_org_unit_uuid, user["uuid"]
             )
             return False
 
-        # Walk up the organisation unit tree, starting at `unit["parent"]`.
-        # Stop when we find an allowed root node, or if we encounter a node
-        # without a parent (must be root?)
-        looking = True
-        while looking:
-            if unit["uuid"] in self.roots:
-                return True
-            if unit["parent"] is None:
-                return False
-
-            if unit["parent"] in self.lc.units:
-                unit = self.lc.units[unit["parent"]][0]
-            else:
-                logger.warning(
-                    "cannot find parent unit %r (user=%r)", unit["parent"], user["uuid"]
-                )
-                looking = False
-
-        return False
+        # Whether the unit is one of the allowed root units, or below one
+        return any(tree.is_descendant(eng_org_unit_uuid, root) for root in self.roots)
 
     def _get_filter_users_outside_unit_tree(self):
         """Return predicate which filter MO users outside the specified unit tree (aka.
@@ -543,6 +525,9 @@ def ad_life_cycle(
         stats = sync.disable_ad_accounts(dry_run)
         logger.info("Stats: {}".format(stats))
 
+    sync.ad_reader.close()
+    sync.ad_writer.close()
+
 
 if __name__ == "__main__":
     start_logging()
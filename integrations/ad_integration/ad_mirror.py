@@ -0,0 +1,137 @@
+"""A local SQLite mirror of the AD users read by `ADParameterReader.cache_all`.
+
+Reading every user of an AD takes minutes of WinRM traffic, although few of them
+change between two runs. The mirror holds the users of the last full read, by their
+ObjectGUID, along with a header telling:
+
+* `high_water_mark`: The `highestCommittedUSN` of the DC the mirror was read from,
+  as of when the mirror was last refreshed. Every change to an AD object gives it
+  a `uSNChanged` above the highest USN of the DC so far, so the users changed since
+  are those with a `uSNChanged` above the mark.
+* `server`: The DC the mirror is read from. USNs are local to each DC, so the mirror
+  must be refreshed from the same DC.
+* `fingerprint`: The settings the users were read with, e.g. their properties.
+* `full_refresh` and `refreshed`: When the mirror was last read in full, and when it
+  was last refreshed at all, as UNIX timestamps.
+
+Deleted users are not returned by a query for the changed users, so the mirror must
+be read in full once in a while to get rid of them, see `ADParameterReader`.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Union
+
+logger = logging.getLogger("AdMirror")
+
+# Bump when the layout of the mirror file changes
+MIRROR_VERSION = 1
+
+ADUser = Dict[str, Any]
+
+
+def user_key(user: ADUser) -> str:
+    return str(user["ObjectGUID"]).lower()
+
+
+class ADMirror:
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+
+    def __repr__(self) -> str:
+        return "ADMirror(%r)" % str(self.path)
+
+    def _connect(self, path: Optional[Path] = None) -> sqlite3.Connection:
+        return sqlite3.connect(path or self.path)
+
+    def read_header(self) -> Optional[Dict[str, Any]]:
+        """Read the header of the mirror.
+
+        Returns:
+            The header, or None if there is no mirror, or it cannot be read, or was
+            written in another layout than the current.
+        """
+        if not self.path.exists():
+            return None
+        try:
+            with closing(self._connect()) as connection:
+                rows = connection.execute("SELECT key, value FROM header").fetchall()
+        except sqlite3.DatabaseError as exc:
+            logger.warning("Unable to read %s: %s", self, exc)
+            return None
+        header = {key: json.loads(value) for key, value in rows}
+        if header.pop("mirror_version", None) != MIRROR_VERSION:
+            logger.info("Ignoring %s written in another layout", self)
+            return None
+        return header
+
+    def users(self) -> List[ADUser]:
+        """All users of the mirror, in the order they were first read."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT value FROM users ORDER BY rowid")
+            return [json.loads(value) for (value,) in rows]
+
+    def replace(self, users: Iterable[ADUser], **header: Any) -> None:
+        """Replace the mirror by `users` read in full, replacing any previous mirror
+        atomically."""
+        now = time.time()
+        header = {"full_refresh": now, "refreshed": now, **header}
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.unlink(missing_ok=True)
+        with closing(self._connect(tmp_path)) as connection:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE header (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE TABLE users (guid TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+                self._write_header(
+                    connection, {**header, "mirror_version": MIRROR_VERSION}
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO users VALUES (?, ?)",
+                    ((user_key(user), json.dumps(user)) for user in users),
+                )
+        os.replace(tmp_path, self.path)
+
+    def update(
+        self,
+        changed: Iterable[ADUser],
+        removed: Iterable[ADUser] = (),
+        **header: Any,
+    ) -> None:
+        """Store the `changed` users, and remove the `removed` users, in a single
+        transaction."""
+        header = {"refreshed": time.time(), **header}
+        with closing(self._connect()) as connection:
+            with connection:
+                # Upserting keeps the rowid, and thus the order, of existing users
+                connection.executemany(
+                    "INSERT INTO users VALUES (?, ?)"
+                    " ON CONFLICT (guid) DO UPDATE SET value = excluded.value",
+                    ((user_key(user), json.dumps(user)) for user in changed),
+                )
+                connection.executemany(
+                    "DELETE FROM users WHERE guid = ?",
+                    ((user_key(user),) for user in removed),
+                )
+                self._write_header(connection, header)
+
+    def _write_header(
+        self, connection: sqlite3.Connection, header: Dict[str, Any]
+    ) -> None:
+        connection.executemany(
+            "INSERT OR REPLACE INTO header VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in header.items()],
+        )
@@ -1,11 +1,17 @@
 import logging
-import random
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import wait
 from operator import itemgetter
 
 from fastramqpi.ra_utils.tqdm_wrapper import tqdm
 
 from .ad_common import AD
+from .ad_dump import ADDump
+from .ad_exceptions import ServerUnavailable
+from .ad_mirror import ADMirror
 
 logger = logging.getLogger("AdReader")
 
@@ -37,6 +43,8 @@ def first_included(settings, users):
 
 
 class ADParameterReader(AD):
+    dump = None
+
     def read_encoding(self):
         """
         Read the character encoding of the Power Shell session.
@@ -71,20 +79,22 @@ class ADParameterReader(AD):
         # with found users - this way the function replaces the old
         # 'read it all' function, so there is now only one function
         # reading from AD.
+        logger.debug(f"Uncached AD read, user {user}")
+
+        server = self._choose_server(self.all_settings["primary"]["servers"])
+
+        response = self.get_from_ad(user=user, cpr=cpr, server=server)
+        self._store_users(response, ria)
+
+    def _store_users(self, response, ria=None):
+        """Store the users of a response from `get_from_ad` in `results`, by their
+        SamAccountName and their CPR number."""
         settings = self._get_setting()
         cpr_field = settings["cpr_field"]
         cpr_separator = settings.get("cpr_separator", "")
         caseless_samname = settings.get("caseless_samname", False)
         sam_filter = settings.get("sam_filter", "")
 
-        logger.debug(f"Uncached AD read, user {user}")
-
-        server = None
-        if self.all_settings["primary"]["servers"]:
-            server = random.choice(self.all_settings["primary"]["servers"])
-
-        response = self.get_from_ad(user=user, cpr=cpr, server=server)
-
         users_by_cpr = {}
         for user in response:
             users_by_cpr.setdefault(user[settings["cpr_field"]], []).append(user)
@@ -120,20 +130,231 @@ class ADParameterReader(AD):
             raise
 
     def cache_all(self, print_progress=False):
+        """Read all AD users into `results`, and return them.
+
+        The users are read by shards of the CPR numbers starting with each day of the
+        month, and each of the `pseudo_cprs`. With a session pool, `dump_width`
+        shards (by default the size of the pool) are read at a time, and the users of
+        each shard are stored as soon as it has been read. A shard of more than
+        `dump_max_shard_size` users is split into the ten shards of its prefix
+        followed by a digit, so no single response is larger than that.
+
+        With a `mirror_path`, the users are read from a local mirror of the AD
+        instead, see `_read_mirror`.
+
+        The users are returned as an `ADDump`, which is also kept as `dump`.
+        """
         logger.info("Caching all users")
+        settings = self._get_setting()
+        if settings.get("mirror_path"):
+            users = self._read_mirror(print_progress)
+        else:
+            _, users = self._read_shards(print_progress)
+
+        self.dump = ADDump.from_settings(
+            users,
+            settings,
+            uuid_field=self.all_settings.get("primary_write", {}).get("uuid_field"),
+        )
+        # Users are looked up by their CPR number, which should have a single user
+        self.dump.log_duplicates()
+        if self.pool is not None:
+            self.pool.log_stats()
+        return self.dump
+
+    def _shard_prefixes(self):
+        settings = self._get_setting()
+        prefixes = [str(day).zfill(2) for day in range(1, 32)]
+        prefixes.extend(
+            str(pseudo).zfill(2) for pseudo in settings.get("pseudo_cprs") or []
+        )
+        return prefixes
+
+    def _read_shards(self, print_progress=False, server=None):
+        """Read the shards of all users, and store them in `results`.
+
+        Returns the users of the responses, and the users stored, in the order of
+        their shards. Every shard is read from `server`, if given.
+        """
         t = time.time()
-        return_value = []
-        date_range = list(range(1, 32))
-        if pseudo_cprs := self.all_settings["primary"].get("pseudo_cprs"):
-            date_range.extend(pseudo_cprs)
+        settings = self._get_setting()
+        max_shard_size = settings.get("dump_max_shard_size")
+        width = settings.get("dump_width") or (self.pool.size if self.pool else 1)
+
+        # Shards are returned in the order of their prefixes, split shards in the
+        # place of the shard they were split from
+        shards = deque(enumerate(self._shard_prefixes()))
+        progress = None
         if print_progress:
-            date_range = tqdm(date_range, desc="Fetching AD accounts")
-        for i in date_range:
-            day = str(i).zfill(2)
-            self.uncached_read_user(cpr="{}*".format(day), ria=return_value)
-            logger.debug(len(self.results))
-            logger.debug("Read time: {}".format(time.time() - t))
-        return return_value
+            progress = tqdm(total=len(shards), desc="Fetching AD accounts")
+
+        running = {}
+        read = {}
+        while shards or running:
+            while shards and len(running) < width:
+                position, prefix = shards.popleft()
+                future = self._submit(self._read_shard, prefix, max_shard_size, server)
+                running[future] = (position, prefix)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                position, prefix = running.pop(future)
+                response = future.result()
+                if response is None:
+                    logger.info("Splitting the AD shard of CPR prefix %r", prefix)
+                    shards.extend(
+                        (position, prefix + str(digit)) for digit in range(10)
+                    )
+                    if progress is not None:
+                        progress.total += 10
+                else:
+                    users = []
+                    read[(position, prefix)] = (response, users)
+                    self._store_users(response, ria=users)
+                    logger.debug(len(self.results))
+                    logger.debug("Read time: {}".format(time.time() - t))
+                if progress is not None:
+                    progress.update()
+        if progress is not None:
+            progress.close()
+
+        in_order = [read[shard] for shard in sorted(read)]
+        return (
+            [user for response, _ in in_order for user in response],
+            [user for _, users in in_order for user in users],
+        )
+
+    def _mirror_fingerprint(self):
+        """The settings deciding which users are read, and what is read of them."""
+        settings = self._get_setting()
+        return {
+            "search_base": settings.get("search_base"),
+            "cpr_field": settings.get("cpr_field"),
+            "properties": sorted(settings.get("properties") or []),
+            "prefixes": self._shard_prefixes(),
+        }
+
+    def _read_mirror(self, print_progress=False):
+        """Read all AD users from the local mirror at `mirror_path`, and store them
+        in `results`.
+
+        The mirror is read in full from a single DC, when there is no mirror, or it
+        was read with other settings, or from a DC that is no longer configured, or
+        when `mirror_full_interval` seconds have passed since it was last read in
+        full. That gets rid of users deleted from AD in the meantime. Otherwise, only
+        the users changed since the last refresh are read from the same DC, and
+        updated in the mirror. Changed users which are no longer found by the
+        shards, e.g. as their CPR number was removed, are removed from the mirror.
+        If the DC is unavailable, the mirror is read in full from another DC, as
+        the USNs of one DC mean nothing on another.
+        """
+        settings = self._get_setting()
+        mirror = ADMirror(settings["mirror_path"])
+        header = mirror.read_header()
+        fingerprint = self._mirror_fingerprint()
+        servers = settings.get("servers") or self.all_settings["global"].get("servers")
+        full_interval = settings.get("mirror_full_interval", 24 * 60 * 60)
+
+        if header is None:
+            reason = "there is no mirror"
+        elif header["fingerprint"] != fingerprint:
+            reason = "the settings have changed"
+        elif servers and header["server"] not in servers:
+            reason = "its DC is no longer configured"
+        elif time.time() - header["full_refresh"] >= full_interval:
+            reason = "it is due"
+        else:
+            reason = None
+
+        if reason is not None:
+            logger.info("Reading %s in full, as %s", mirror, reason)
+            return self._replace_mirror(mirror, fingerprint, servers, print_progress)
+
+        # USNs are local to each DC, so the changes must be read from the DC the
+        # mirror was read from, and never from another DC in its place
+        server = header["server"]
+        try:
+            high_water_mark = self._highest_committed_usn(server)
+            changed = self.get_from_ad(
+                usn_changed=header["high_water_mark"], server=server, failover=False
+            )
+        except ServerUnavailable:
+            logger.warning(
+                "Reading %s in full, as its DC %r is unavailable", mirror, server
+            )
+            return self._replace_mirror(mirror, fingerprint, servers, print_progress)
+        cpr_field = settings["cpr_field"]
+        prefixes = tuple(self._shard_prefixes())
+        in_shards, removed = [], []
+        for user in changed:
+            if str(user.get(cpr_field) or "").startswith(prefixes):
+                in_shards.append(user)
+            else:
+                removed.append(user)
+        logger.info(
+            "Refreshing %s with %d changed and %d removed users",
+            mirror,
+            len(in_shards),
+            len(removed),
+        )
+        mirror.update(in_shards, removed, high_water_mark=high_water_mark)
+
+        users = []
+        self._store_users(mirror.users(), ria=users)
+        return users
+
+    def _replace_mirror(self, mirror, fingerprint, servers, print_progress=False):
+        """Read all AD users from a single DC, replace `mirror` by them, and return
+        the users stored."""
+        server = self._choose_server(servers)
+        # Changes made while the shards are read are read again by the next
+        # refresh, as they are above the highest USN from before
+        high_water_mark = self._highest_committed_usn(server)
+        response, users = self._read_shards(print_progress, server=server)
+        mirror.replace(
+            response,
+            high_water_mark=high_water_mark,
+            server=server,
+            fingerprint=fingerprint,
+        )
+        return users
+
+    def _highest_committed_usn(self, server):
+        """The highest update sequence number (USN) of `server` so far."""
+        server_string = " -Server {}".format(server) if server else ""
+        ps_script = (
+            self._build_user_credential()
+            + "(Get-ADRootDSE"
+            + server_string
+            + " -Credential $usercredential).highestCommittedUSN | ConvertTo-Json"
+        )
+        return int(self._run_ps_script(ps_script, failover=False))
+
+    def _submit(self, fn, *args):
+        """Call `fn` on the session pool, or right away if there is no pool."""
+        if self.pool is not None:
+            return self.pool.submit(fn, *args)
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def _read_shard(self, prefix, max_shard_size=None, server=None):
+        """Read the AD users whose CPR number starts with `prefix`.
+
+        Returns None if there are more than `max_shard_size` users, unless the prefix
+        is the entire date part of the CPR number, which cannot be split further.
+        """
+        kwargs = {}
+        if max_shard_size and len(prefix) < 6:
+            kwargs["result_set_size"] = max_shard_size + 1
+        if server is None:
+            server = self._choose_server(self.all_settings["primary"]["servers"])
+        response = self.get_from_ad(cpr=prefix + "*", server=server, **kwargs)
+        if kwargs and len(response) > max_shard_size:
+            return None
+        return response
 
     def read_user(self, user=None, cpr=None, cache_only=False):
         """Read all properties of an AD user.
@@ -0,0 +1,397 @@
+"""A pool of WinRM sessions, running PowerShell scripts against several DCs at once.
+
+An `AD` runs its scripts through a single WinRM session, one at a time, although the
+scripts name the domain controller (DC) they run against by their `-Server` argument,
+and most ADs have several DCs. `SessionPool` runs the scripts of many threads on a
+bounded number of sessions, at most `per_server` scripts at a time against each DC,
+and keeps track of every DC:
+
+* The latency of the scripts run against it, see `SessionPool.stats`.
+* A circuit breaker, which is opened by `failure_threshold` failures in a row telling
+  that the DC cannot be reached. The DC is then not chosen by `choose_server`, and
+  scripts naming it fail right away, until `reset_timeout` seconds have passed, when
+  a single script or health check may try it again.
+
+`SessionPool.map` and `SessionPool.submit` run functions on a thread pool as large as
+the session pool, for callers that want to run many scripts at once.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Type
+
+from .ad_exceptions import ServerUnavailable
+
+logger = logging.getLogger("AdSessionPool")
+
+# The `-Server` argument of AD cmdlets, naming the DC a script runs against
+_SERVER_ARGUMENT = re.compile(r"-Server\s+['\"]?([^\s'\"|;]+)", re.IGNORECASE)
+
+# Errors of AD cmdlets telling that the DC could not be reached
+_SERVER_DOWN = ("ADServerDownException", "Unable to contact the server")
+
+
+@dataclass
+class ServerStats:
+    """Number of scripts, failures and latencies of the scripts run against a DC."""
+
+    calls: int = 0
+    failures: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+    recent: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+
+    def record(self, latency: float, failed: bool) -> None:
+        self.calls += 1
+        self.failures += failed
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.recent.append(latency)
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.calls if self.calls else 0.0
+
+    def percentile(self, q: float) -> float:
+        """The `q` percentile (0-100) of the latency of the recent scripts."""
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class CircuitBreaker:
+    """Stop using a DC after `failure_threshold` failures in a row.
+
+    The breaker is closed while the DC works, and opened by the failures. After
+    `reset_timeout` seconds, it is half-open, and lets a single script through to try
+    the DC, closing the breaker if it succeeds and opening it again if not.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        reset_timeout: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trying = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def available(self) -> bool:
+        """Whether a script may run against the DC, without trying it."""
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self._trying)
+
+    def allow(self) -> bool:
+        """Whether a script may run against the DC, which it then tries."""
+        if not self.available():
+            return False
+        if self.state == self.HALF_OPEN:
+            self._trying = True
+        return True
+
+    def release(self) -> None:
+        """Let another script try the DC, as this one did not tell whether it works."""
+        self._trying = False
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trying = False
+
+    def trip(self) -> None:
+        """Open the breaker right away."""
+        self._trying = False
+        self.opened_at = self.clock()
+
+    def failure(self) -> None:
+        self.failures += 1
+        self._trying = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+
+
+class _Server:
+    def __init__(self, per_server: int, breaker: CircuitBreaker):
+        self.slots = threading.BoundedSemaphore(per_server)
+        self.in_flight = 0
+        self.breaker = breaker
+        self.stats = ServerStats()
+
+
+class SessionPool:
+    def __init__(
+        self,
+        create_session: Callable[[], Any],
+        servers: Sequence[str] = (),
+        per_server: int = 1,
+        retry_exceptions: Tuple[Type[BaseException], ...] = (),
+        failure_threshold: int = 3,
+        reset_timeout: float = 60.0,
+        health_script: Optional[Callable[[str], str]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Pool of sessions made by `create_session`, for scripts against `servers`.
+
+        Args:
+            create_session: Makes a new session, which has a `run_ps` method.
+            servers: The DCs to choose between, and health check.
+            per_server: The number of scripts which may run against each DC at a
+                time. Scripts not naming a DC are limited as if they named the same.
+            retry_exceptions: Exceptions of `run_ps` telling that the session is
+                dead, which is then thrown away rather than reused.
+            failure_threshold: Failures in a row which open the breaker of a DC.
+            reset_timeout: Seconds before an opened breaker lets a script try again.
+            health_script: The script checking whether a DC can be reached.
+            clock: Time in seconds, for the latencies and the breakers.
+        """
+        self.create_session = create_session
+        self.servers = list(servers)
+        self.per_server = per_server
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.health_script = health_script
+        self.clock = clock
+        self.size = per_server * max(len(self.servers), 1)
+
+        self._lock = threading.Lock()
+        self._servers: Dict[Optional[str], _Server] = {}
+        self._idle: List[Any] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _server(self, server: Optional[str]) -> _Server:
+        with self._lock:
+            if server not in self._servers:
+                breaker = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, self.clock
+                )
+                self._servers[server] = _Server(self.per_server, breaker)
+            return self._servers[server]
+
+    def server_of(self, script: str) -> Optional[str]:
+        """The DC named by the last `-Server` argument of `script`, if any."""
+        servers = _SERVER_ARGUMENT.findall(script)
+        return servers[-1] if servers else None
+
+    def choose_server(self, servers: Optional[Sequence[str]] = None) -> str:
+        """The available DC with the fewest running scripts, and the lowest latency.
+
+        A DC whose breaker has timed out is health checked before it is chosen again.
+        Raises `ServerUnavailable` if the breakers of all the DCs are open.
+        """
+        servers = servers or self.servers
+        for server in servers:
+            state = self._server(server)
+            with self._lock:
+                # A single thread tries the DC
+                check = (
+                    self.health_script is not None
+                    and state.breaker.state == CircuitBreaker.HALF_OPEN
+                    and state.breaker.allow()
+                )
+            if check:
+                self._health_check(server)
+        candidates = [
+            (state.in_flight, state.stats.mean_latency, i, server)
+            for i, server in enumerate(servers)
+            if (state := self._server(server)).breaker.available()
+        ]
+        if not candidates:
+            raise ServerUnavailable("No available AD server of %r" % (servers,))
+        return min(candidates)[-1]
+
+    @contextmanager
+    def _session(self) -> Iterator[Any]:
+        with self._lock:
+            session = self._idle.pop() if self._idle else None
+        if session is None:
+            session = self.create_session()
+        try:
+            yield session
+        except self.retry_exceptions:
+            # The session is dead, a new one is made when needed
+            raise
+        except Exception:
+            self._release(session)
+            raise
+        self._release(session)
+
+    def _release(self, session: Any) -> None:
+        with self._lock:
+            self._idle.append(session)
+
+    def run_ps(self, script: str) -> Any:
+        """Run `script` on a session of the pool, against the DC it names.
+
+        Raises `ServerUnavailable` without running the script, if the breaker of
+        the DC is open.
+        """
+        server = self.server_of(script)
+        return self._run(server, script, check_breaker=server is not None)
+
+    def with_server(self, script: str, server: str) -> str:
+        """`script`, with its `-Server` arguments naming `server` instead."""
+        return _SERVER_ARGUMENT.sub(
+            lambda match: match.group(0)[: match.start(1) - match.start(0)] + server,
+            script,
+        )
+
+    def _run(self, server: Optional[str], script: str, check_breaker: bool) -> Any:
+        state = self._server(server)
+        with self._lock:
+            allowed = not check_breaker or state.breaker.allow()
+        if not allowed:
+            raise ServerUnavailable("AD server %r is unavailable" % server)
+
+        with state.slots:
+            with self._lock:
+                state.in_flight += 1
+            start = self.clock()
+            response = None
+            try:
+                with self._session() as session:
+                    response = session.run_ps(script)
+            finally:
+                failed = response is None or response.status_code != 0
+                # Only errors of the DC itself count against its breaker, and not
+                # those of the session, which are errors of the WinRM host
+                server_down = response is not None and _is_server_down(response)
+                with self._lock:
+                    state.in_flight -= 1
+                    state.stats.record(self.clock() - start, failed)
+                    if server is None:
+                        pass
+                    elif server_down:
+                        state.breaker.failure()
+                    elif response is not None:
+                        state.breaker.success()
+                    else:
+                        state.breaker.release()
+        if server_down and state.breaker.state != CircuitBreaker.CLOSED:
+            logger.warning("AD server %r is unavailable", server)
+        return response
+
+    def health_check(self) -> Dict[str, bool]:
+        """Run the health script against every DC, whether its breaker is open
+        or not, and return whether each DC could be reached."""
+        if self.health_script is None:
+            return {}
+        return {server: self._health_check(server) for server in self.servers}
+
+    def _health_check(self, server: str) -> bool:
+        if self.health_script is None:
+            return True
+        state = self._server(server)
+        try:
+            response = self._run(
+                server, self.health_script(server), check_breaker=False
+            )
+        except Exception as exc:
+            logger.warning("Health check of AD server %r failed: %s", server, exc)
+            healthy = False
+        else:
+            healthy = response.status_code == 0
+        with self._lock:
+            if healthy:
+                state.breaker.success()
+            else:
+                state.breaker.trip()
+        return healthy
+
+    def stats(self) -> Dict[Optional[str], Dict[str, Any]]:
+        """The state of the breaker and the latencies of every DC used so far."""
+        with self._lock:
+            servers = list(self._servers.items())
+        return {
+            server: {
+                "state": state.breaker.state,
+                "calls": state.stats.calls,
+                "failures": state.stats.failures,
+                "mean_latency": state.stats.mean_latency,
+                "p95_latency": state.stats.percentile(95),
+                "max_latency": state.stats.max_latency,
+            }
+            for server, state in servers
+        }
+
+    def log_stats(self) -> None:
+        for server, stats in self.stats().items():
+            logger.info(
+                "AD server %r: %s, %d scripts, %d failed, latency mean %.3fs, "
+                "p95 %.3fs, max %.3fs",
+                server,
+                stats["state"],
+                stats["calls"],
+                stats["failures"],
+                stats["mean_latency"],
+                stats["p95_latency"],
+                stats["max_latency"],
+            )
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.size, thread_name_prefix="winrm"
+                )
+            return self._executor
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Call `fn` on a thread of the pool."""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def map(self, fn: Callable[[Any], Any], iterable: Iterable[Any]) -> Iterator[Any]:
+        """Call `fn` with every item of `iterable` on the threads of the pool, and
+        return the results in order."""
+        return self.executor.map(fn, iterable)
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+def _is_server_down(response: Any) -> bool:
+    if response.status_code == 0:
+        return False
+    std_err = response.std_err
+    if isinstance(std_err, bytes):
+        std_err = std_err.decode("utf-8", errors="replace")
+    return any(error in str(std_err) for error in _SERVER_DOWN)
@@ -234,7 +234,8 @@ class AdMoSync:
     def _read_itconnections_raw(self, uuid, it_system_uuid=None):
         logger.debug(f"Read it-system for user {uuid}")
         if self.lc:
-            itconnections = map(itemgetter(0), self.lc.it_connections.values())
+            itconnections = self.lc.lookup("it_connections", "user", uuid)
+            itconnections = map(itemgetter(0), itconnections)
             itconnections = filter(lambda it: it["user"] == uuid, itconnections)
             if it_system_uuid:
                 itconnections = filter(
@@ -278,7 +279,7 @@ class AdMoSync:
         # Populate list of `user_addresses`
         if self.lc:
             # Retrieve user addresses from LoraCache
-            user_addresses = self.lc.addresses.values()
+            user_addresses = self.lc.lookup("addresses", "user", uuid)
             user_addresses = map(itemgetter(0), user_addresses)
             user_addresses = filter(lambda addr: addr["user"] == uuid, user_addresses)
             user_addresses = map(to_mo_address, user_addresses)
@@ -369,7 +370,7 @@ class AdMoSync:
         if self.lc:
             # Read user's current engagements, e.g. exclude engagements that
             # ended in the past.
-            engagements = self.lc.engagements.values()
+            engagements = self.lc.lookup("engagements", "user", uuid)
             engagements = map(itemgetter(0), engagements)
             engagements = filter(lambda eng: eng["user"] == uuid, engagements)
             # Skip engagements beginning in the future
@@ -845,6 +846,7 @@ class AdMoSync:
                     self._terminate_single_user(mo_object["uuid"], ad_object)
 
             logger.info("Stats: {}".format(self.stats))
+            ad_reader.close()
 
 
 @click.command()
@@ -3,7 +3,6 @@ import copy
 import json
 import logging
 import os
-import random
 import re
 import time
 from abc import ABC
@@ -189,7 +188,7 @@ class LoraCacheSource(MODataSource):
 
     def get_email_address(self, uuid):
         mail_dict = {}
-        for addr in self.lc.addresses.values():
+        for addr in self.lc.lookup("addresses", "user", uuid):
             if addr[0]["user"] == uuid and addr[0]["scope"] == "E-mail":
                 mail_dict = addr[0]
         return dict_subset(mail_dict, ["uuid", "value"])
@@ -201,12 +200,15 @@ class LoraCacheSource(MODataSource):
         def filter_primary(engagements):
             return filter(lambda eng: eng[0]["primary_boolean"], engagements)
 
-        user_engagements = list(filter_for_user(self.lc.engagements.values()))
+        user_engagements = list(
+            filter_for_user(self.lc.lookup("engagements", "user", uuid))
+        )
         # No user engagements
         if not user_engagements:
             # But we may still have future engagements
             future_engagement = next(
-                filter_for_user(self.lc_historic.engagements.values()), None
+                filter_for_user(self.lc_historic.lookup("engagements", "user", uuid)),
+                None,
             )
             # We do not have any engagements at all
             if future_engagement is None:
@@ -274,7 +276,7 @@ class LoraCacheSource(MODataSource):
     def get_it_systems(self, uuid):
         user_itsystems = filter(
             lambda eng: eng["user"] == uuid,
-            map(itemgetter(0), self.lc.it_connections.values()),
+            map(itemgetter(0), self.lc.lookup("it_connections", "user", uuid)),
         )
         return {it_system["itsystem"]: it_system for it_system in user_itsystems}
 
@@ -593,17 +595,16 @@ class ADWriter(AD):
             unit_user_key = self.lc.units[eng_org_unit][0]["user_key"]
             location = self.lc.units[eng_org_unit][0]["location"]
 
-            # We initialize parent as the unit itself to ensure to catch if
-            # a person is engaged directly in a level2org
-            parent_uuid = self.lc.units[eng_org_unit][0]["uuid"]
-            while parent_uuid is not None:
+            # The path includes the unit itself, to catch if a person is engaged
+            # directly in a level2org. The topmost match wins.
+            for parent_uuid in self.lc.org_tree().path(eng_org_unit):
                 parent_unit = self.lc.units[parent_uuid][0]
                 if write_settings["level2orgunit_type"] in (
                     parent_unit["unit_type"],
                     parent_unit["level"],
                 ):
                     level2orgunit = parent_unit["name"]
-                parent_uuid = parent_unit["parent"]
+                    break
         else:
             mo_unit_info = self.helper.read_ou(eng_org_unit)
             unit_name = mo_unit_info["name"]
@@ -639,7 +640,7 @@ class ADWriter(AD):
         if self.lc:
             email = []
             postal = {}
-            for addr in self.lc.addresses.values():
+            for addr in self.lc.lookup("addresses", "unit", eng_org_unit):
                 if addr[0]["unit"] == eng_org_unit:
                     if addr[0]["scope"] == "DAR":
                         postal = {"Adresse": addr[0]["value"]}
@@ -904,10 +905,9 @@ class ADWriter(AD):
         )
         rename_user_string = self.remove_redundant(rename_user_string)
         server_string = ""
-        if self.all_settings["global"].get("servers") is not None:
-            server_string = " -Server {} ".format(
-                random.choice(self.all_settings["global"]["servers"])
-            )
+        server = self._choose_server(self.all_settings["global"].get("servers"))
+        if server is not None:
+            server_string = " -Server {} ".format(server)
         ps_script = self._build_user_credential() + rename_user_string + server_string
         return ps_script
 
@@ -1090,9 +1090,15 @@ class ADWriter(AD):
 
         return mismatch
 
-    def sync_user(self, mo_uuid, ad_dump=None, sync_manager=True):
+    def sync_user(
+        self, mo_uuid, ad_dump=None, sync_manager=True, batch=None, batch_key=None
+    ):
         """
         Sync MO information into AD
+
+        If a `PowerShellBatch` is given, the writes to AD are added to it with
+        `batch_key` as their key, by default `mo_uuid`, and happen when the batch
+        is run.
         """
         mo_values = self.read_ad_information_from_mo(
             mo_uuid, ad_dump=ad_dump, read_manager=sync_manager
@@ -1127,6 +1133,17 @@ class ADWriter(AD):
         ps_script = self._get_sync_user_command(ad_values, mo_values, user_sam)
         logger.debug("Sync user, ps_script: {}".format(ps_script))
 
+        if batch is not None:
+            commands = [ps_script]
+            if sync_manager and "manager" in mismatch:
+                commands.append(
+                    self._get_add_manager_command(
+                        user_sam=user_sam, manager_sam=mo_values["manager_sam"]
+                    )
+                )
+            batch.add(*commands, key=mo_uuid if batch_key is None else batch_key)
+            return (True, "Sync completed", mo_values["read_manager"])
+
         response = self._run_ps_script(ps_script)
         logger.debug("Response from sync: {}".format(response))
 
@@ -1153,10 +1170,9 @@ class ADWriter(AD):
         edit_user_string = self.remove_redundant(edit_user_string)
 
         server_string = ""
-        if self.all_settings["global"].get("servers") is not None:
-            server_string = " -Server {} ".format(
-                random.choice(self.all_settings["global"]["servers"])
-            )
+        server = self._choose_server(self.all_settings["global"].get("servers"))
+        if server is not None:
+            server_string = " -Server {} ".format(server)
 
         ps_script = self._build_user_credential() + edit_user_string + server_string
         return ps_script
@@ -1223,10 +1239,9 @@ class ADWriter(AD):
 
         # Should this go to self._ps_boiler_plate()?
         server_string = ""
-        if self.all_settings["global"].get("servers"):
-            server_string = " -Server {} ".format(
-                random.choice(self.all_settings["global"]["servers"])
-            )
+        server = self._choose_server(self.all_settings["global"].get("servers"))
+        if server is not None:
+            server_string = " -Server {} ".format(server)
 
         ps_script = (
             self._build_user_credential()
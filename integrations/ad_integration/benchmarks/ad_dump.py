@@ -0,0 +1,129 @@
+"""Benchmark of the sharded full AD dump of `ADParameterReader.cache_all`.
+
+Reads a synthetic AD through a fake WinRM session, which answers the `Get-ADUser`
+of each CPR prefix shard after a fixed latency, plus a latency per user returned,
+with the users as JSON. The dump is run one shard at a time on a single session,
+and in parallel on session pools of increasing width, once for an AD whose users
+are spread evenly over the days of the month, and once for an AD where a third of
+the users have the CPR numbers of the 1st (e.g. as the default date of imported
+users), which is split into smaller shards with `dump_max_shard_size`.
+
+Run with: python -m integrations.ad_integration.benchmarks.ad_dump --users 100000
+"""
+
+import bisect
+import json
+import random
+import re
+import time
+from collections import Counter
+
+import click
+
+from ..ad_reader import ADParameterReader
+from ..utils import AttrDict
+
+SERVERS = ["dc1", "dc2", "dc3", "dc4"]
+
+
+class FakeADSession:
+    def __init__(self, users: list, latency: float, per_user: float):
+        self.users = sorted(users, key=lambda user: user["cpr"])
+        self.cprs = [user["cpr"] for user in self.users]
+        self.latency = latency
+        self.per_user = per_user
+
+    def run_ps(self, script: str) -> AttrDict:
+        prefix = re.findall(r'-like "(\d+)\*"', script)[0]
+        size = re.search(r"-ResultSetSize (\d+)", script)
+        start = bisect.bisect_left(self.cprs, prefix)
+        end = bisect.bisect_left(self.cprs, prefix + ":")  # ":" follows "9"
+        if size:
+            end = min(end, start + int(size.group(1)))
+        users = self.users[start:end]
+        time.sleep(self.latency + self.per_user * len(users))
+        return AttrDict(status_code=0, std_out=json.dumps(users).encode(), std_err=b"")
+
+
+class BenchmarkADParameterReader(ADParameterReader):
+    def __init__(self, session: FakeADSession, width=None, max_shard_size=None):
+        self.fake_session = session
+        self.shard_sizes: Counter = Counter()
+        super().__init__(
+            all_settings={
+                "global": {
+                    "servers": SERVERS,
+                    "sessions_per_server": (width or 0) // len(SERVERS) or None,
+                },
+                "primary": {
+                    "servers": SERVERS,
+                    "search_base": "",
+                    "system_user": "user",
+                    "password": "password",
+                    "properties": ["SamAccountName", "cpr"],
+                    "cpr_field": "cpr",
+                    "cpr_separator": "",
+                    "sam_filter": "",
+                    "caseless_samname": True,
+                    "dump_width": width,
+                    "dump_max_shard_size": max_shard_size,
+                },
+            }
+        )
+
+    def _create_session(self):
+        return self.fake_session
+
+    def _get_retry_exceptions(self):
+        return ()
+
+    def _read_shard(self, prefix, max_shard_size=None, server=None):
+        response = super()._read_shard(prefix, max_shard_size, server)
+        self.shard_sizes[prefix] = -1 if response is None else len(response)
+        return response
+
+
+def synthetic_users(users: int, skewed: bool) -> list:
+    def cpr(i: int) -> str:
+        if skewed and i % 3 == 0:
+            day = 1
+        else:
+            day = random.randint(1, 28)
+        return "%02d%02d%02d%04d" % (day, random.randint(1, 12), i % 100, i % 10000)
+
+    return [{"SamAccountName": "user%d" % i, "cpr": cpr(i)} for i in range(users)]
+
+
+@click.command()
+@click.option("--users", default=100_000)
+@click.option("--latency", default=0.1, help="Seconds per shard")
+@click.option("--per-user", default=0.00002, help="Seconds per user in a shard")
+@click.option("--max-shard-size", default=2000)
+def cli(users: int, latency: float, per_user: float, max_shard_size: int) -> None:
+    random.seed(0)
+    click.echo(
+        f"{users} AD users, {latency * 1000:.0f} ms per shard, "
+        f"{per_user * 1e6:.0f} µs per user"
+    )
+    click.echo(f"{'AD':<8}{'dump':<26}{'runtime':>9}{'shards':>8}{'largest':>9}")
+    for name, skewed in (("even", False), ("skewed", True)):
+        session = FakeADSession(synthetic_users(users, skewed), latency, per_user)
+        runs: list[tuple[str, int | None, int | None]] = [("sequential", None, None)]
+        runs += [(f"width {width}", width, None) for width in (8, 32)]
+        runs += [(f"width 32, max {max_shard_size}", 32, max_shard_size)]
+        for dump, width, max_size in runs:
+            reader = BenchmarkADParameterReader(session, width, max_size)
+            start = time.perf_counter()
+            read = reader.cache_all()
+            elapsed = time.perf_counter() - start
+            if reader.pool is not None:
+                reader.pool.close()
+            assert len(read) == len({user["cpr"] for user in session.users})
+            click.echo(
+                f"{name:<8}{dump:<26}{elapsed:>8.2f}s{len(reader.shard_sizes):>8}"
+                f"{max(reader.shard_sizes.values()):>9}"
+            )
+
+
+if __name__ == "__main__":
+    cli()
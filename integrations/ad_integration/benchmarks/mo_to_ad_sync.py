@@ -0,0 +1,125 @@
+"""Benchmark of the AD user lookups of `run_mo_to_ad_sync`.
+
+Runs the sync loop over a synthetic AD dump, with a writer whose `sync_user` looks
+up AD users by CPR number like `ADWriter.sync_user` does: the user itself, and its
+manager, both when reading the user from MO and when comparing it to AD. Nothing is
+read from MO, or written to AD, so the runtime is that of the loop and the lookups.
+
+The lookups are run in the indexed `ADDump` built by the sync, and in the plain list
+of users it was given before. The plain list takes a pass over the whole dump per
+lookup, so it is only run for the smaller dumps.
+
+Run with: python -m integrations.ad_integration.benchmarks.mo_to_ad_sync
+"""
+
+import contextlib
+import io
+import logging
+import random
+import time
+import uuid
+
+import click
+
+from ..ad_common import AD
+from ..mo_to_ad_sync import run_mo_to_ad_sync
+
+SETTINGS = {
+    "global": {"servers": ["dc1"]},
+    "primary": {
+        "servers": ["dc1"],
+        "cpr_field": "cpr",
+        "cpr_separator": "",
+        "system_user": "user",
+        "password": "password",
+    },
+}
+
+
+class BenchmarkReader:
+    def __init__(self, users: list):
+        self.users = users
+
+    def read_it_all(self, print_progress=False):
+        return self.users
+
+
+class BenchmarkWriter(AD):
+    """Writer looking up the AD users of `ADWriter.sync_user`, in the dump it is
+    given, or in a plain list of the same users if not `indexed`."""
+
+    def __init__(self, managers: dict, indexed: bool):
+        self.managers = managers
+        self.indexed = indexed
+        self.plain = None
+        super().__init__(all_settings=SETTINGS)
+
+    def _create_session(self):
+        return None
+
+    def _get_retry_exceptions(self):
+        return ()
+
+    def sync_user(self, mo_uuid, ad_dump=None, sync_manager=True, batch=None):
+        if not self.indexed:
+            if self.plain is None:
+                self.plain = list(ad_dump)
+            ad_dump = self.plain
+        cpr, manager_cpr = self.managers[mo_uuid]
+        # read_ad_information_from_mo, _find_ad_user and _sync_compare
+        self._find_ad_user(manager_cpr, ad_dump=ad_dump)
+        self._find_ad_user(cpr, ad_dump=ad_dump)
+        self._find_ad_user(cpr, ad_dump=ad_dump)
+        self._find_ad_user(manager_cpr, ad_dump=ad_dump)
+        return (True, "Nothing to edit", True)
+
+
+def synthetic_dump(users: int) -> tuple:
+    """AD users with a CPR number and an MO UUID each, and the CPR numbers of every
+    MO user and their manager, by MO UUID."""
+    cprs = random.sample(range(10**9), users)
+    dump = [
+        {
+            "SamAccountName": "user%d" % i,
+            "Name": "User %d" % i,
+            "ObjectGUID": str(uuid.uuid4()),
+            "cpr": "%010d" % cpr,
+            "mo_uuid": str(uuid.uuid4()),
+        }
+        for i, cpr in enumerate(cprs)
+    ]
+    managers = {
+        user["mo_uuid"]: (user["cpr"], random.choice(dump)["cpr"]) for user in dump
+    }
+    return dump, managers
+
+
+@click.command()
+@click.option("--users", "sizes", multiple=True, default=[1000, 2000, 5000, 50_000])
+@click.option("--max-plain", default=5000, help="Largest dump to search as a list")
+def cli(sizes: tuple, max_plain: int) -> None:
+    random.seed(0)
+    logging.disable(logging.INFO)
+    click.echo(f"{'users':>7}{'lookup':>8}{'runtime':>10}{'users/s':>10}")
+    for size in sizes:
+        dump, managers = synthetic_dump(size)
+        for indexed in (False, True):
+            if not indexed and size > max_plain:
+                continue
+            writer = BenchmarkWriter(managers, indexed)
+            start = time.perf_counter()
+            # The sync prints its stats when it is done
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = run_mo_to_ad_sync(
+                    BenchmarkReader(dump),  # type: ignore[arg-type]
+                    writer,  # type: ignore[arg-type]
+                    "mo_uuid",
+                )
+            elapsed = time.perf_counter() - start
+            assert stats["nothing_to_edit"] == size
+            lookup = "index" if indexed else "list"
+            click.echo(f"{size:>7}{lookup:>8}{elapsed:>9.2f}s{size / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,135 @@
+"""Load test of `SessionPool` against a local fake WinRM endpoint.
+
+Starts an HTTP server on localhost, which plays the WinRM host of an AD with a few
+domain controllers: it takes the script posted to it, waits for the latency of the
+DC named by the `-Server` argument of the script, and answers with the status code
+and output of the script. One DC is slow, and one cannot be reached. Every session
+is an HTTP connection of its own, like the sessions of `winrm`.
+
+The same scripts are then run one at a time on a single session, as `AD` does
+without a pool, and on session pools with an increasing number of sessions per DC.
+
+Run with: python -m integrations.ad_integration.benchmarks.session_pool --scripts 600
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import click
+import requests
+
+from ..ad_exceptions import ServerUnavailable
+from ..ad_session_pool import SessionPool
+from ..utils import AttrDict
+
+SERVERS = ["dc1", "dc2", "dc3", "dc4"]
+
+
+def fake_winrm_endpoint(latencies: dict, down: set) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            script = self.rfile.read(int(self.headers["Content-Length"])).decode()
+            server = script.split("-Server ")[-1].split()[0]
+            time.sleep(latencies.get(server, 0))
+            if server in down:
+                result = {
+                    "status_code": 1,
+                    "std_out": "",
+                    "std_err": "Unable to contact the server. (ADServerDownException)",
+                }
+            else:
+                result = {"status_code": 0, "std_out": "{}", "std_err": ""}
+            body = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    return Server(("127.0.0.1", 0), Handler)
+
+
+class HTTPSession:
+    """Session of the fake endpoint, with the `run_ps` of a `winrm.Session`."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.http = requests.Session()
+
+    def run_ps(self, script: str) -> AttrDict:
+        response = self.http.post(self.url, data=script.encode())
+        return AttrDict(response.json())
+
+
+def run(pool: SessionPool, scripts: int) -> tuple:
+    """Run `scripts` scripts against DCs chosen by the pool, and return the seconds
+    taken and the number of scripts that failed."""
+
+    def run_script(i: int) -> bool:
+        try:
+            server = pool.choose_server()
+            response = pool.run_ps("Get-ADUser -Filter '*' -Server %s" % server)
+        except ServerUnavailable:
+            return False
+        return response.status_code == 0
+
+    start = time.perf_counter()
+    failed = sum(not ok for ok in pool.map(run_script, range(scripts)))
+    return time.perf_counter() - start, failed
+
+
+@click.command()
+@click.option("--scripts", default=600)
+@click.option("--latency", default=0.02, help="Seconds per script of a normal DC")
+def cli(scripts: int, latency: float) -> None:
+    latencies = {"dc1": latency, "dc2": latency, "dc3": 3 * latency, "dc4": latency}
+    endpoint = fake_winrm_endpoint(latencies, down={"dc4"})
+    threading.Thread(target=endpoint.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/wsman" % endpoint.server_address[1]
+
+    click.echo(
+        f"{scripts} scripts, {latency * 1000:.0f} ms per script, dc3 is 3 times "
+        "slower, dc4 is down"
+    )
+    click.echo(f"{'sessions':<22}{'runtime':>9}{'scripts/s':>11}{'failed':>8}")
+    session = HTTPSession(url)
+    start = time.perf_counter()
+    for i in range(scripts):
+        session.run_ps("Get-ADUser -Filter '*' -Server %s" % SERVERS[i % 3])
+    elapsed = time.perf_counter() - start
+    click.echo(f"{'1 (no pool)':<22}{elapsed:>8.2f}s{scripts / elapsed:>11.0f}{0:>8}")
+
+    for per_server in (1, 2, 4, 8):
+        pool = SessionPool(
+            lambda: HTTPSession(url),
+            servers=SERVERS,
+            per_server=per_server,
+            health_script=lambda server: "Get-ADDomain -Server %s" % server,
+        )
+        health = pool.health_check()
+        elapsed, failed = run(pool, scripts)
+        pool.close()
+        name = f"{pool.size} ({per_server} per DC)"
+        click.echo(f"{name:<22}{elapsed:>8.2f}s{scripts / elapsed:>11.0f}{failed:>8}")
+
+    click.echo(f"Health of the last pool: {health}")
+    click.echo(f"{'DC':<6}{'state':>10}{'calls':>7}{'mean ms':>9}{'p95 ms':>8}")
+    for server, stats in sorted(pool.stats().items()):
+        click.echo(
+            f"{server:<6}{stats['state']:>10}{stats['calls']:>7}"
+            f"{stats['mean_latency'] * 1000:>9.1f}{stats['p95_latency'] * 1000:>8.1f}"
+        )
+    endpoint.shutdown()
+
+
+if __name__ == "__main__":
+    cli()
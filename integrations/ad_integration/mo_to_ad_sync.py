@@ -2,6 +2,7 @@ import json
 import logging
 import uuid
 from typing import Dict
+from typing import List
 from typing import Optional
 from typing import Tuple
 
@@ -12,6 +13,9 @@ from fastramqpi.ra_utils.tqdm_wrapper import tqdm
 
 from exporters.sql_export.lora_cache import fetch_loracache
 
+from .ad_batch import BatchItem
+from .ad_batch import PowerShellBatch
+from .ad_dump import ADDump
 from .ad_exceptions import CprNotFoundInADException
 from .ad_exceptions import CprNotNotUnique
 from .ad_exceptions import ManagerNotUniqueFromCprException
@@ -31,6 +35,7 @@ def run_mo_to_ad_sync(
     sync_cpr: Optional[str] = None,
     sync_username: Optional[str] = None,
     dry_run: Optional[bool] = False,
+    batch_size: int = 1,
 ):
     if sync_cpr or sync_username:
         print("Warning: --sync-cpr/--sync-username is for testing only")
@@ -39,9 +44,9 @@ def run_mo_to_ad_sync(
         print("         Instead it runs another piece of code, which is NOT equivalent")
         print("         Thus this codepath may fail when the cronjob does not")
 
-        all_users = [reader.read_user(user=sync_username, cpr=sync_cpr)]
+        ad_users = [reader.read_user(user=sync_username, cpr=sync_cpr)]
     else:
-        all_users = reader.read_it_all(print_progress=True)
+        ad_users = reader.read_it_all(print_progress=True)
 
     def filter_missing_uuid_field(user):
         if mo_uuid_field.lower() not in set(k.lower() for k in user):
@@ -84,9 +89,38 @@ def run_mo_to_ad_sync(
         "no_active_engagement": 0,
     }
 
-    all_users = list(filter(filter_missing_uuid_field, all_users))
+    # The AD users of MO users and their managers are looked up by CPR number for
+    # every user synced, which the indexes of `ADDump` make a dictionary lookup
+    all_users = ADDump.from_settings(
+        filter(filter_missing_uuid_field, ad_users),
+        writer.all_settings["primary"],
+        uuid_field=mo_uuid_field,
+    )
+    all_users.log_duplicates()
     logger.info("Will now attempt to sync {} users".format(len(all_users)))
 
+    # With a batch size above 1, the writes of `batch_size` users are run by a
+    # single PowerShell script, and the users are counted once it has run. They
+    # are queued by their SamAccountName, as several AD users may hold the same MO
+    # user UUID.
+    batch = None
+    finished: List[BatchItem] = []
+    queued: Dict[str, tuple] = {}
+    if batch_size > 1 and not dry_run:
+        batch = PowerShellBatch(writer, size=batch_size, on_done=finished.append)
+
+    def count_finished():
+        while finished:
+            item = finished.pop()
+            user, response = queued.pop(item.key)
+            if item.ok:
+                update_stats(stats, response)
+            else:
+                stats["critical_error"] += 1
+                export_logger.error(
+                    "Error updating AD user %r: %s", user["SamAccountName"], item.error
+                )
+
     for user in tqdm(all_users, unit="user"):
         if dry_run:
             stats["attempted_users"] += 1
@@ -115,9 +149,17 @@ def run_mo_to_ad_sync(
         msg = "Now syncing: {}, {}".format(user["SamAccountName"], user[mo_uuid_field])
         logger.info(msg)
         try:
-            response = writer.sync_user(user[mo_uuid_field], ad_dump=all_users)
+            response = writer.sync_user(
+                user[mo_uuid_field],
+                ad_dump=all_users,
+                batch=batch,
+                batch_key=user["SamAccountName"],
+            )
             logger.debug("Respose to sync: {}".format(response))
-            stats = update_stats(stats, response)
+            if batch is not None and response[1] == "Sync completed":
+                queued[user["SamAccountName"]] = (user, response)
+            else:
+                stats = update_stats(stats, response)
         except ManagerNotUniqueFromCprException:
             stats["unknown_manager_failure"] += 1
             msg = "Did not find a unique manager for {}".format(user[mo_uuid_field])
@@ -146,6 +188,11 @@ def run_mo_to_ad_sync(
                 "Error updating AD user %r: %s", user["SamAccountName"], e
             )
             print("Unhandled exception: {}".format(e))
+        count_finished()
+
+    if batch is not None:
+        batch.flush()
+        count_finished()
 
     print()
     print(json.dumps(stats, indent=4))
@@ -222,6 +269,12 @@ def run_preview_command_for_uuid(
     is_flag=True,
     default=False,
 )
+@click.option(
+    "--batch-size",
+    help="Number of AD users to write to by each PowerShell script",
+    type=click.INT,
+    default=lambda: load_settings().get("integrations.ad.batch_size", 1),
+)
 def main(
     lora_speedup: bool,
     mo_uuid_field: str,
@@ -230,6 +283,7 @@ def main(
     ignore_occupied_names: bool,
     preview_command_for_uuid: Optional[uuid.UUID],
     dry_run: bool,
+    batch_size: int,
 ):
     start_logging()
 
@@ -264,14 +318,19 @@ def main(
         )
         return
 
-    run_mo_to_ad_sync(
-        reader,
-        writer,
-        mo_uuid_field,
-        sync_cpr=sync_cpr,
-        sync_username=sync_username,
-        dry_run=dry_run,
-    )
+    try:
+        run_mo_to_ad_sync(
+            reader,
+            writer,
+            mo_uuid_field,
+            sync_cpr=sync_cpr,
+            sync_username=sync_username,
+            dry_run=dry_run,
+            batch_size=batch_size,
+        )
+    finally:
+        reader.close()
+        writer.close()
 
 
 if __name__ == "__main__":
@@ -19,6 +19,12 @@ def _read_global_settings(top_settings):
     global_settings["winrm_host"] = top_settings.get("integrations.ad.winrm_host")
     global_settings["system_user"] = top_settings["integrations.ad"][0]["system_user"]
     global_settings["password"] = top_settings["integrations.ad"][0]["password"]
+    # Number of AD users written to by each PowerShell script, see `ad_batch`
+    global_settings["batch_size"] = top_settings.get("integrations.ad.batch_size", 1)
+    # Number of WinRM sessions per AD server, see `ad_session_pool`
+    global_settings["sessions_per_server"] = top_settings.get(
+        "integrations.ad.sessions_per_server"
+    )
     if not global_settings["winrm_host"]:
         msg = "Missing hostname for remote management server"
         logger.error(msg)
@@ -88,6 +94,16 @@ def _read_primary_ad_settings(top_settings, index=0):
     primary_settings["sam_filter"] = index_settings.get("sam_filter", "")
     primary_settings["cpr_separator"] = index_settings.get("cpr_separator", "")
     primary_settings["pseudo_cprs"] = index_settings.get("pseudo_cprs", [])
+    # Number of shards of `ADParameterReader.cache_all` to read at a time, and the
+    # number of users above which a shard is split
+    primary_settings["dump_width"] = index_settings.get("dump_width")
+    primary_settings["dump_max_shard_size"] = index_settings.get("dump_max_shard_size")
+    # Local mirror of the AD users read by `cache_all`, and the number of seconds
+    # between reading it in full
+    primary_settings["mirror_path"] = index_settings.get("mirror_path")
+    primary_settings["mirror_full_interval"] = index_settings.get(
+        "mirror_full_interval", 24 * 60 * 60
+    )
 
     primary_settings["method"] = index_settings.get("method", "kerberos")
 
@@ -1,5 +1,4 @@
 import logging
-import random
 from operator import itemgetter
 
 import click
@@ -11,6 +10,7 @@ from fastramqpi.ra_utils.load_settings import load_settings
 from fastramqpi.ra_utils.tqdm_wrapper import tqdm
 from os2mo_helpers.mora_helpers import MoraHelper
 
+from .ad_batch import PowerShellBatch
 from .ad_common import AD
 from .ad_exceptions import ImproperlyConfigured
 from .ad_logger import start_logging
@@ -84,17 +84,11 @@ class SyncMoUuidToAd(AD):
             )
             return True
 
-        server_strings = [""]
-        if self.all_settings["global"].get("servers"):
-            server_strings = [
-                " -Server {} ".format(server)
-                for server in self.all_settings["global"].get("servers")
-            ]
-
         @apply
         def construct_powershell_script(ad_user, mo_uuid):
             logger.debug("Syncronizing uuid {} into AD".format(mo_uuid))
-            server_string = random.choice(server_strings)
+            server = self._choose_server(self.all_settings["global"].get("servers"))
+            server_string = " -Server {} ".format(server) if server else ""
             ps_script = (
                 self._build_user_credential()
                 + "Get-ADUser "
@@ -111,7 +105,7 @@ class SyncMoUuidToAd(AD):
                 + server_string
             )
             logger.debug("PS-script: {}".format(ps_script))
-            return ps_script
+            return ad_user, ps_script
 
         logger.info("Will now process {} users".format(len(ad_users)))
 
@@ -129,8 +123,15 @@ class SyncMoUuidToAd(AD):
         users = tqdm(users)
         users = map(construct_powershell_script, users)
 
+        batch_size = self.all_settings["global"].get("batch_size", 1)
+        if batch_size > 1:
+            self._write_batched(users, batch_size)
+            print(self.stats)
+            logger.info(self.stats)
+            return
+
         # Actually fire the powershell scripts, and trigger side-effects
-        for ps_script in users:
+        for _, ps_script in users:
             try:
                 response = self._run_ps_script(ps_script)
             except Exception:
@@ -145,6 +146,19 @@ class SyncMoUuidToAd(AD):
         print(self.stats)
         logger.info(self.stats)
 
+    def _write_batched(self, users, batch_size):
+        """Write the MO UUIDs of `batch_size` users by each PowerShell script."""
+
+        def written(item):
+            if item.ok:
+                self.stats["updated"] += 1
+            else:
+                logger.error("failed to write MO UUID of %r: %s", item.key, item.error)
+
+        with PowerShellBatch(self, size=batch_size, on_done=written) as batch:
+            for ad_user, ps_script in users:
+                batch.add(ps_script, key=ad_user["SamAccountName"])
+
     def sync_one(self, cprno):
         print("Fetch AD User")
         ad_user = self.reader.read_user(cpr=cprno)
@@ -229,10 +243,14 @@ def cli(**args):
     if "crontab.SENTRY_DSN" in sync.settings:
         sentry_sdk.init(dsn=sync.settings["crontab.SENTRY_DSN"])
 
-    if args.get("sync_all"):
-        sync.sync_all()
-    if args.get("sync_cpr"):
-        sync.sync_one(args["sync_cpr"])
+    try:
+        if args.get("sync_all"):
+            sync.sync_all()
+        if args.get("sync_cpr"):
+            sync.sync_one(args["sync_cpr"])
+    finally:
+        sync.reader.close()
+        sync.close()
     logger.info("Sync done")
 
 
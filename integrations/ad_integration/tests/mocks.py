@@ -1,5 +1,6 @@
 import copy
 import json
+import re
 import uuid
 from contextlib import ExitStack
 from unittest.mock import MagicMock
@@ -11,8 +12,11 @@ import requests
 from os2mo_helpers.mora_helpers import MoraHelper
 from winrm import Session
 
+from exporters.sql_export.cache_indexes import CacheIndexes
+
 from ..ad_common import AD
 from ..ad_writer import MORESTSource
+from ..utils import AttrDict
 from .test_utils import TestADWriterMixin
 
 MO_ROOT_ORG_UNIT_UUID = "not-a-mo-org-unit-uuid"
@@ -39,6 +43,35 @@ class MockAD(AD):
         self.all_settings = {"primary": {"search_base": ""}}
 
 
+class MockBatchSession:
+    """Fake WinRM session which records scripts, and runs the commands of
+    `PowerShellBatch` scripts by failing those containing `fail`, and the whole
+    script if a command contains `broken`."""
+
+    _command = re.compile(r"\[scriptblock\]::Create\('((?:[^']|'')*)'\)")
+
+    def __init__(self, fail="FAIL", broken="BROKEN"):
+        self.fail = fail
+        self.broken = broken
+        self.scripts = []
+
+    def run_ps(self, script):
+        self.scripts.append(script)
+        commands = [
+            command.replace("''", "'") for command in self._command.findall(script)
+        ]
+        if any(self.broken in command for command in commands):
+            return AttrDict(status_code=1, std_out=b"", std_err=b"ParseException")
+        results = [
+            {"id": i, "ok": False, "error": "Failed: %s" % command}
+            if self.fail in command
+            else {"id": i, "ok": True}
+            for i, command in enumerate(commands)
+        ]
+        std_out = json.dumps(results).encode() if commands else b""
+        return AttrDict(status_code=0, std_out=std_out, std_err=b"")
+
+
 class MockADParameterReader(TestADWriterMixin):
     """Mock implementation of `ADParameterReader` which always returns the same
     AD user."""
@@ -66,6 +99,9 @@ class MockADParameterReader(TestADWriterMixin):
     def get_all_samaccountname_values(self):
         return {self.read_user()["SamAccountName"]}
 
+    def close(self):
+        pass
+
 
 class MockEmptyADReader(MockADParameterReader):
     """Mock implementation of `ADParameterReader` which simulates an empty AD"""
@@ -165,7 +201,7 @@ class MockMORESTSourcePreview(MORESTSource):
         return [None], [None]
 
 
-class MockLoraCache:
+class MockLoraCache(CacheIndexes):
     # This implements enough of the real `LoraCache` to make
     # `ad_sync.AdMoSync._edit_engagement` happy.
 
@@ -220,6 +256,10 @@ class MockLoraCache:
             }
 
 
+class MockLoraCacheDict(CacheIndexes, AttrDict):
+    """Mocks `LoraCache` by a dict of its collections"""
+
+
 class MockLoraCacheExtended(MockLoraCache):
     """Mocks enough of `LoraCache` to test `AdLifeCycle`"""
 
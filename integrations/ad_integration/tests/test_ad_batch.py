@@ -0,0 +1,124 @@
+from unittest import TestCase
+
+from ..ad_batch import MAX_COMMAND_LINE
+from ..ad_batch import PowerShellBatch
+from ..ad_batch import command_line_length
+from ..ad_batch import ps_quote
+from ..ad_exceptions import CommandFailure
+from ..ad_session_pool import SessionPool
+from .mocks import MockAD
+from .mocks import MockBatchSession
+
+
+class _MockAD(MockAD):
+    def __init__(self):
+        super().__init__()
+        self.session = MockBatchSession()
+        self.retry_exceptions = ()
+        self.all_settings["primary"].update(system_user="user", password="secret")
+
+
+class TestPowerShellBatch(TestCase):
+    def setUp(self):
+        super().setUp()
+        self._ad = _MockAD()
+        self._done = []
+
+    def _batch(self, size=10):
+        return PowerShellBatch(self._ad, size=size, on_done=self._done.append)
+
+    def test_commands_are_run_in_batches(self):
+        with self._batch(size=2) as batch:
+            items = [
+                batch.add(self._ad._build_user_credential() + "Set-ADUser %d" % i)
+                for i in range(3)
+            ]
+            # The first two commands are run as soon as they are added
+            self.assertEqual(len(self._ad.session.scripts), 1)
+
+        scripts = self._ad.session.scripts
+        self.assertEqual(len(scripts), 2)
+        # The credential is defined once by each script, and not by the commands
+        for script in scripts:
+            self.assertEqual(script.count("$UserCredential = New-Object"), 1)
+        self.assertIn("Set-ADUser 0", scripts[0])
+        self.assertIn("Set-ADUser 1", scripts[0])
+        self.assertIn("Set-ADUser 2", scripts[1])
+        self.assertTrue(all(item.ok for item in items))
+        self.assertEqual(self._done, items)
+
+    def test_failing_command_only_fails_its_own_item(self):
+        with self._batch() as batch:
+            ok = batch.add("Set-ADUser ok", key="ok")
+            failed = batch.add("Set-ADUser FAIL", key="failed")
+
+        self.assertEqual(len(self._ad.session.scripts), 1)
+        self.assertTrue(ok.ok)
+        ok.result()
+        self.assertFalse(failed.ok)
+        self.assertEqual(failed.error, "Failed: Set-ADUser FAIL")
+        with self.assertRaises(CommandFailure):
+            failed.result()
+        self.assertEqual([item.key for item in self._done], ["ok", "failed"])
+
+    def test_failing_script_is_run_one_command_at_a_time(self):
+        with self._batch() as batch:
+            items = [batch.add("Set-ADUser 1"), batch.add("Set-ADUser BROKEN")]
+
+        # The batch, and then each command by itself
+        self.assertEqual(len(self._ad.session.scripts), 3)
+        self.assertEqual([item.ok for item in items], [True, False])
+        self.assertIn("ParseException", items[1].error)
+
+    def test_commands_of_an_item_fail_together(self):
+        with self._batch() as batch:
+            item = batch.add("Set-ADUser 1", "Set-ADUser FAIL")
+
+        self.assertFalse(item.ok)
+        self.assertIn("Set-ADUser 1\nSet-ADUser FAIL", self._ad.session.scripts[0])
+
+    def test_item_has_no_result_before_its_batch_is_run(self):
+        batch = self._batch()
+        item = batch.add("Set-ADUser 1")
+        with self.assertRaises(RuntimeError):
+            item.result()
+        batch.flush()
+        item.result()
+
+    def test_batches_run_on_the_session_pool(self):
+        self._ad.pool = SessionPool(lambda: self._ad.session, per_server=4)
+        with self._batch(size=2) as batch:
+            items = [batch.add("Set-ADUser %d" % i, key=i) for i in range(9)]
+        self._ad.pool.close()
+
+        self.assertEqual(len(self._ad.session.scripts), 5)
+        self.assertTrue(all(item.ok for item in items))
+        self.assertEqual(sorted(item.key for item in self._done), list(range(9)))
+
+    def test_scripts_are_capped_by_their_command_line_length(self):
+        # Commands with quotes, which are doubled in the script
+        command = "Set-ADUser %d -Replace @{'description'='" + "x" * 600 + "'}"
+        with self._batch(size=50) as batch:
+            items = [batch.add(command % i, key=i) for i in range(20)]
+
+        scripts = self._ad.session.scripts
+        self.assertGreater(len(scripts), 1)
+        for script in scripts:
+            self.assertLessEqual(command_line_length(script), MAX_COMMAND_LINE)
+        self.assertEqual(sum(script.count("Set-ADUser") for script in scripts), 20)
+        self.assertTrue(all(item.ok for item in items))
+
+    def test_command_longer_than_the_cap_is_run_by_itself(self):
+        with self._batch() as batch:
+            batch.add("Set-ADUser 1")
+            long = batch.add("Set-ADUser " + "x" * 5000)
+            batch.add("Set-ADUser 3")
+
+        self.assertEqual(len(self._ad.session.scripts), 3)
+        self.assertIn("x" * 5000, self._ad.session.scripts[1])
+        self.assertTrue(long.ok)
+
+    def test_quoting(self):
+        self.assertEqual(ps_quote("O'Brien"), "'O''Brien'")
+        self.assertEqual(ps_quote("O’Brien"), "'O’’Brien'")
+        self.assertEqual(ps_quote('"$name"'), "'\"$name\"'")
@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from ..ad_dump import ADDump
+
+MO_UUID = "1f87c5c1-2fe8-4a38-8a9b-3e6f1a4c2f10"
+
+
+def _user(sam, cpr, guid, mo_uuid=None):
+    user = {"SamAccountName": sam, "cpr": cpr, "ObjectGUID": guid}
+    if mo_uuid is not None:
+        user["mo_uuid"] = mo_uuid
+    return user
+
+
+class TestADDump(TestCase):
+    def setUp(self):
+        super().setUp()
+        self._users = [
+            _user("alice", "010101-1234", "guid-a", MO_UUID.upper()),
+            _user("Bob", "0202021234", "guid-b"),
+            _user("carol", None, "guid-c"),
+        ]
+        self._dump = ADDump(
+            self._users, cpr_field="cpr", cpr_separator="-", uuid_field="mo_uuid"
+        )
+
+    def test_dump_is_a_sequence_of_the_users(self):
+        self.assertEqual(len(self._dump), 3)
+        self.assertEqual(list(self._dump), self._users)
+        self.assertEqual(self._dump[1], self._users[1])
+        self.assertTrue(self._dump)
+        self.assertFalse(ADDump())
+
+    def test_find_by_cpr_ignores_the_separator(self):
+        alice = [self._users[0]]
+        self.assertEqual(self._dump.find_by_cpr("0101011234"), alice)
+        self.assertEqual(self._dump.find_by_cpr("010101-1234"), alice)
+        self.assertEqual(self._dump.find_by_cpr("0303031234"), [])
+        # Users without a CPR number cannot be found by one
+        self.assertEqual(self._dump.find_by_cpr(""), [])
+
+    def test_find_by_other_fields(self):
+        self.assertEqual(self._dump.find_by_sam("BOB"), [self._users[1]])
+        self.assertEqual(self._dump.find_by_guid("GUID-C"), [self._users[2]])
+        self.assertEqual(self._dump.find_by_uuid(MO_UUID), [self._users[0]])
+        self.assertEqual(self._dump.find_by_uuid(None), [])
+
+    def test_duplicates(self):
+        self.assertEqual(
+            self._dump.duplicates(), {"cpr": {}, "sam": {}, "guid": {}, "uuid": {}}
+        )
+        users = self._users + [
+            _user("ALICE", "0101011234", "guid-d", MO_UUID),
+        ]
+        dump = ADDump(users, cpr_separator="-", uuid_field="mo_uuid")
+        duplicates = dump.duplicates()
+        self.assertEqual(duplicates["cpr"], {"0101011234": [users[0], users[3]]})
+        self.assertEqual(duplicates["sam"], {"alice": [users[0], users[3]]})
+        self.assertEqual(duplicates["uuid"], {MO_UUID: [users[0], users[3]]})
+        self.assertEqual(duplicates["guid"], {})
+        with self.assertLogs("AdDump", "WARNING") as logs:
+            self.assertEqual(dump.log_duplicates(), 3)
+        # CPR numbers are not logged in full
+        self.assertNotIn("0101011234", "\n".join(logs.output))
+
+    def test_from_settings(self):
+        settings = {"cpr_field": "cpr", "cpr_separator": "-"}
+        dump = ADDump.from_settings(self._users, settings, uuid_field="mo_uuid")
+        self.assertEqual(dump.find_by_cpr("0101011234"), [self._users[0]])
+        self.assertEqual(dump.find_by_uuid(MO_UUID), [self._users[0]])
@@ -0,0 +1,295 @@
+import json
+import re
+import sqlite3
+import tempfile
+import threading
+from contextlib import closing
+from pathlib import Path
+from unittest import TestCase
+
+from ..ad_exceptions import ServerUnavailable
+from ..ad_mirror import ADMirror
+from ..ad_reader import ADParameterReader
+from ..ad_session_pool import CircuitBreaker
+from ..utils import AttrDict
+from .mocks import MockAD
+
+
+class _FakeAD:
+    """AD whose users are changed by the tests between refreshes of the mirror, and
+    which keeps the `uSNChanged` of every user like a DC would."""
+
+    def __init__(self, users=10):
+        self.usn = 1000
+        self.users = {}
+        self.usn_changed = {}
+        for i in range(users):
+            self.add("user%d" % i, "%02d01011234" % (i + 1))
+
+    def _changed(self, guid):
+        self.usn += 1
+        self.usn_changed[guid] = self.usn
+
+    def add(self, sam, cpr):
+        guid = "guid-%s" % sam
+        self.users[guid] = {"ObjectGUID": guid, "SamAccountName": sam, "cpr": cpr}
+        self._changed(guid)
+
+    def change(self, sam, **fields):
+        self.users["guid-%s" % sam].update(fields)
+        self._changed("guid-%s" % sam)
+
+    def delete(self, sam):
+        del self.users["guid-%s" % sam]
+        self.usn += 1
+
+    def get_users(self, cpr=None, usn_changed=None):
+        if usn_changed is not None:
+            guids = [g for g in self.users if self.usn_changed[g] > usn_changed]
+        else:
+            prefix = cpr.rstrip("*")
+            guids = [g for g, u in self.users.items() if u["cpr"].startswith(prefix)]
+        return [dict(self.users[guid]) for guid in guids]
+
+
+class _MirroredADParameterReader(MockAD, ADParameterReader):
+    def __init__(self, ad, mirror_path, **overridden_settings):
+        super().__init__()
+        self.results = {}
+        self.all_settings = {
+            "global": {"servers": ["dc1"]},
+            "primary": {
+                "servers": ["dc1"],
+                "search_base": "",
+                "properties": ["SamAccountName", "cpr"],
+                "cpr_field": "cpr",
+                "cpr_separator": "",
+                "sam_filter": "",
+                "mirror_path": str(mirror_path),
+                **overridden_settings,
+            },
+        }
+        self.ad = ad
+        self.reads = []
+
+    def _build_user_credential(self):
+        return ""
+
+    def _run_ps_script(self, ps_script, failover=True):
+        assert not failover
+        assert re.search(r"Get-ADRootDSE -Server dc1\b", ps_script)
+        return str(self.ad.usn)
+
+    def get_from_ad(
+        self, cpr=None, server=None, usn_changed=None, failover=True, **kwargs
+    ):
+        assert server == "dc1"
+        # Changes are only read from the DC the mirror was read from
+        assert failover or usn_changed is not None
+        self.reads.append(cpr or "uSNChanged > %d" % usn_changed)
+        return self.ad.get_users(cpr=cpr, usn_changed=usn_changed)
+
+
+class TestADMirror(TestCase):
+    def setUp(self):
+        super().setUp()
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._path = Path(self._dir.name) / "ad.db"
+        self._ad = _FakeAD()
+
+    def _cache_all(self, **overridden_settings):
+        reader = _MirroredADParameterReader(self._ad, self._path, **overridden_settings)
+        users = reader.cache_all()
+        return reader, {user["SamAccountName"]: user for user in users}
+
+    def test_first_read_is_full(self):
+        reader, users = self._cache_all()
+
+        self.assertEqual(reader.reads, ["%02d*" % day for day in range(1, 32)])
+        self.assertEqual(len(users), 10)
+        header = ADMirror(self._path).read_header()
+        self.assertEqual(header["high_water_mark"], self._ad.usn)
+        self.assertEqual(header["server"], "dc1")
+        self.assertEqual(len(ADMirror(self._path).users()), 10)
+
+    def test_refresh_reads_the_changed_users(self):
+        self._cache_all()
+        usn = self._ad.usn
+        self._ad.change("user1", SamAccountName="renamed1")
+        self._ad.add("new", "1501014321")
+        # No longer found by the shards of CPR numbers
+        self._ad.change("user2", cpr="")
+
+        reader, users = self._cache_all()
+
+        self.assertEqual(reader.reads, ["uSNChanged > %d" % usn])
+        self.assertEqual(
+            sorted(users),
+            ["new", "renamed1", "user0"] + ["user%d" % i for i in range(3, 10)],
+        )
+        self.assertEqual(reader.results["1501014321"]["SamAccountName"], "new")
+        self.assertEqual(reader.dump.find_by_sam("renamed1"), [users["renamed1"]])
+        self.assertEqual(ADMirror(self._path).read_header()["high_water_mark"], usn + 3)
+
+        # Nothing has changed since
+        reader, again = self._cache_all()
+        self.assertEqual(reader.reads, ["uSNChanged > %d" % (usn + 3)])
+        self.assertEqual(again, users)
+
+    def test_deleted_users_are_removed_by_a_full_read(self):
+        self._cache_all()
+        self._ad.delete("user3")
+
+        # Deleted users are not changed users
+        reader, users = self._cache_all()
+        self.assertEqual(len(reader.reads), 1)
+        self.assertIn("user3", users)
+
+        reader, users = self._cache_all(mirror_full_interval=0)
+        self.assertEqual(len(reader.reads), 31)
+        self.assertNotIn("user3", users)
+        self.assertEqual(len(ADMirror(self._path).users()), 9)
+
+    def test_changed_settings_read_the_mirror_in_full(self):
+        self._cache_all()
+        reader, _ = self._cache_all(properties=["SamAccountName", "cpr", "mail"])
+        self.assertEqual(len(reader.reads), 31)
+
+    def test_unreadable_mirror_is_read_in_full(self):
+        self._path.write_bytes(b"not a database")
+        reader, users = self._cache_all()
+        self.assertEqual(len(reader.reads), 31)
+        self.assertEqual(len(users), 10)
+
+    def test_mirror_in_another_layout_is_ignored(self):
+        ADMirror(self._path).replace([], high_water_mark=1)
+        with closing(sqlite3.connect(self._path)) as connection, connection:
+            connection.execute(
+                "UPDATE header SET value = '0' WHERE key = 'mirror_version'"
+            )
+        self.assertIsNone(ADMirror(self._path).read_header())
+
+
+class _FakeWinRM:
+    """WinRM endpoint of the DCs of a `_FakeAD`, whose USNs differ by DC, failing
+    every script against the DCs in `down` as if they could not be reached."""
+
+    def __init__(self, ad, offsets):
+        self.ad = ad
+        self.offsets = offsets
+        self.down = set()
+        self.scripts = []
+        self._lock = threading.Lock()
+
+    def create_session(self):
+        return AttrDict(run_ps=self.run_ps)
+
+    def run_ps(self, script):
+        server = script.split("-Server ")[-1].split()[0]
+        with self._lock:
+            self.scripts.append((server, script))
+        if server in self.down:
+            return AttrDict(
+                status_code=1,
+                std_out=b"",
+                std_err=b"Unable to contact the server.",
+            )
+        offset = self.offsets[server]
+        if "Get-ADRootDSE" in script:
+            result = self.ad.usn + offset
+        elif match := re.search(r"uSNChanged -gt (\d+)", script):
+            result = self.ad.get_users(usn_changed=int(match.group(1)) - offset)
+        elif match := re.search(r'-like "(\d+\*)"', script):
+            result = self.ad.get_users(cpr=match.group(1))
+        else:
+            result = {}
+        return AttrDict(status_code=0, std_out=json.dumps(result).encode(), std_err=b"")
+
+
+class _PooledMirroredADParameterReader(MockAD, ADParameterReader):
+    """Reader of a mirror through a real session pool of the DCs of `winrm`."""
+
+    def __init__(self, winrm, mirror_path):
+        super().__init__()
+        self.results = {}
+        servers = sorted(winrm.offsets)
+        self.all_settings = {
+            "global": {"servers": servers, "sessions_per_server": 1},
+            "primary": {
+                "servers": servers,
+                "search_base": "",
+                "properties": ["SamAccountName", "cpr"],
+                "cpr_field": "cpr",
+                "cpr_separator": "",
+                "sam_filter": "",
+                "mirror_path": str(mirror_path),
+            },
+        }
+        self.retry_exceptions = ()
+        self._winrm = winrm
+        self.pool = self._create_pool()
+
+    def _create_session(self):
+        return self._winrm.create_session()
+
+    def _build_user_credential(self):
+        return ""
+
+
+class TestPooledADMirror(TestCase):
+    def setUp(self):
+        super().setUp()
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._path = Path(self._dir.name) / "ad.db"
+        self._ad = _FakeAD()
+        self._winrm = _FakeWinRM(self._ad, {"dc1": 0, "dc2": 50000})
+
+    def _cache_all(self):
+        reader = _PooledMirroredADParameterReader(self._winrm, self._path)
+        self._winrm.scripts.clear()
+        users = reader.cache_all()
+        reader.close()
+        return reader, {user["SamAccountName"]: user for user in users}
+
+    def test_refresh_is_pinned_to_the_dc_of_the_mirror(self):
+        self._cache_all()
+        pinned = ADMirror(self._path).read_header()["server"]
+        other = {"dc1": "dc2", "dc2": "dc1"}[pinned]
+        self._ad.change("user1", SamAccountName="renamed1")
+
+        # The DC of the mirror is found unavailable by the health check of the pool
+        self._winrm.down = {pinned}
+        reader = _PooledMirroredADParameterReader(self._winrm, self._path)
+        self.assertEqual(reader.pool.stats()[pinned]["state"], CircuitBreaker.OPEN)
+        # Its USN, and the changes since, are not read from another DC in its place
+        with self.assertRaises(ServerUnavailable):
+            reader._highest_committed_usn(pinned)
+        with self.assertRaises(ServerUnavailable):
+            reader.get_from_ad(usn_changed=1, server=pinned, failover=False)
+
+        # The mirror is read in full from the other DC instead
+        _, users = self._cache_all()
+        self.assertIn("renamed1", users)
+        self.assertEqual(len(users), 10)
+        self.assertEqual({server for server, _ in self._winrm.scripts}, {other})
+        self.assertFalse(
+            any("uSNChanged" in script for _, script in self._winrm.scripts)
+        )
+        header = ADMirror(self._path).read_header()
+        self.assertEqual(header["server"], other)
+        self.assertEqual(
+            header["high_water_mark"], self._ad.usn + self._winrm.offsets[other]
+        )
+
+        # And refreshed from that DC from then on
+        self._winrm.down = set()
+        self._ad.change("user2", SamAccountName="renamed2")
+        _, users = self._cache_all()
+        self.assertIn("renamed2", users)
+        self.assertIn("renamed1", users)
+        refreshes = [
+            server for server, script in self._winrm.scripts if "uSNChanged" in script
+        ]
+        self.assertEqual(refreshes, [other])
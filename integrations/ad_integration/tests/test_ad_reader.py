@@ -113,3 +113,58 @@ class TestADParameterReader(TestCase):
             return mock.patch(path, return_value={})
         else:
             return nullcontext()
+
+
+class _ShardedADParameterReader(_TestableADParameterReader):
+    """Reader of an AD with 400 users born on the 1st, and one on every other day
+    of the month."""
+
+    def __init__(self, **overridden_settings):
+        super().__init__(None, **overridden_settings)
+        self.all_settings["primary"].update(cpr_separator="", sam_filter="")
+        self.cprs = ["01%02d%02d1234" % (i // 20 + 1, i % 20) for i in range(400)]
+        self.cprs += ["%02d01001234" % day for day in range(2, 32)]
+        self.reads = []
+
+    def get_from_ad(self, user=None, cpr=None, server=None, result_set_size=None):
+        self.reads.append((cpr, result_set_size))
+        users = [
+            {AD_SAM_ACCOUNT_NAME: "user%s" % c, AD_CPR_FIELD_NAME: c}
+            for c in self.cprs
+            if c.startswith(cpr.rstrip("*"))
+        ]
+        return users[:result_set_size]
+
+
+class TestCacheAll(TestCase):
+    def test_cache_all_reads_a_shard_per_day(self):
+        reader = _ShardedADParameterReader(pseudo_cprs=["00"])
+        users = reader.cache_all()
+        self.assertEqual(
+            [cpr for cpr, _ in reader.reads],
+            ["%02d*" % day for day in range(1, 32)] + ["00*"],
+        )
+        self.assertEqual([u[AD_CPR_FIELD_NAME] for u in users], reader.cprs)
+        self.assertEqual(
+            reader.results["0101001234"][AD_SAM_ACCOUNT_NAME], "user0101001234"
+        )
+        self.assertIs(users, reader.dump)
+        self.assertEqual(
+            users.find_by_cpr("0101001234"), [reader.results["0101001234"]]
+        )
+
+    def test_cache_all_splits_large_shards(self):
+        reader = _ShardedADParameterReader(dump_max_shard_size=50)
+        users = reader.cache_all()
+
+        # The shard of the 1st (400 users) is split into 010*-019*, and those of more
+        # than 50 users into a shard per month (20 users each)
+        reads = dict(reader.reads)
+        self.assertEqual(reads["01*"], 51)
+        self.assertEqual(reads["010*"], 51)
+        self.assertEqual(reads["0101*"], 51)
+        self.assertNotIn("01010*", reads)
+        self.assertTrue(all(size <= 51 for size in reads.values()))
+        # All users are read once, in the order of their shards
+        self.assertEqual([u[AD_CPR_FIELD_NAME] for u in users], reader.cprs)
+        self.assertEqual(len(reader.results), 2 * len(reader.cprs))
@@ -0,0 +1,309 @@
+import threading
+import time
+from collections import Counter
+from unittest import TestCase
+
+from ..ad_exceptions import ServerUnavailable
+from ..ad_reader import ADParameterReader
+from ..ad_session_pool import CircuitBreaker
+from ..ad_session_pool import SessionPool
+from ..utils import AttrDict
+from .mocks import MockAD
+
+SERVERS = ["dc1", "dc2", "dc3"]
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class _FakeWinRM:
+    """Fake WinRM endpoint, whose sessions take `latency` seconds to run a script,
+    and fail scripts against the DCs in `down` as if they could not be reached."""
+
+    def __init__(self, latency=0.0, down=()):
+        self.latency = latency
+        self.down = set(down)
+        self.sessions = 0
+        self.running = Counter()
+        self.max_running = Counter()
+        self.max_total = 0
+        self.servers = []
+        self._lock = threading.Lock()
+
+    def create_session(self):
+        with self._lock:
+            self.sessions += 1
+        return AttrDict(run_ps=self.run_ps)
+
+    def run_ps(self, script):
+        server = script.split("-Server ")[-1].split()[0]
+        with self._lock:
+            self.servers.append(server)
+            self.running[server] += 1
+            self.max_running[server] = max(
+                self.max_running[server], self.running[server]
+            )
+            self.max_total = max(self.max_total, sum(self.running.values()))
+        time.sleep(self.latency)
+        with self._lock:
+            self.running[server] -= 1
+        if server in self.down:
+            return AttrDict(
+                status_code=1,
+                std_out=b"",
+                std_err=b"Get-ADUser : Unable to contact the server.",
+            )
+        return AttrDict(status_code=0, std_out=b"{}", std_err=b"")
+
+
+class TestSessionPool(TestCase):
+    def setUp(self):
+        super().setUp()
+        self._winrm = _FakeWinRM()
+        self._clock = _Clock()
+
+    def _pool(self, **kwargs):
+        return SessionPool(
+            self._winrm.create_session,
+            servers=SERVERS,
+            health_script=lambda server: "Get-ADDomain -Server %s" % server,
+            clock=self._clock,
+            **kwargs,
+        )
+
+    def test_scripts_are_limited_per_server(self):
+        self._winrm.latency = 0.01
+        pool = self._pool(per_server=2)
+        scripts = ["Get-ADUser -Server %s" % SERVERS[i % 3] for i in range(60)]
+
+        responses = list(pool.map(pool.run_ps, scripts))
+        pool.close()
+
+        self.assertEqual(len(responses), 60)
+        self.assertEqual(pool.size, 6)
+        self.assertLessEqual(self._winrm.sessions, 6)
+        self.assertEqual(set(self._winrm.max_running), set(SERVERS))
+        self.assertTrue(all(n <= 2 for n in self._winrm.max_running.values()))
+        self.assertEqual({s["calls"] for s in pool.stats().values()}, {20})
+
+    def test_sessions_are_reused(self):
+        pool = self._pool()
+        for _ in range(10):
+            pool.run_ps("Get-ADUser -Server dc1")
+        self.assertEqual(self._winrm.sessions, 1)
+
+    def test_dead_sessions_are_thrown_away(self):
+        class Dead(Exception):
+            pass
+
+        def run_ps(script):
+            raise Dead()
+
+        pool = SessionPool(lambda: AttrDict(run_ps=run_ps), retry_exceptions=(Dead,))
+        for _ in range(2):
+            with self.assertRaises(Dead):
+                pool.run_ps("Get-ADUser")
+        self.assertEqual(pool._idle, [])
+
+    def test_choose_server_prefers_idle_and_fast_servers(self):
+        pool = self._pool()
+        pool._server("dc1").in_flight = 1
+        pool._server("dc2").stats.record(2.0, failed=False)
+        pool._server("dc3").stats.record(1.0, failed=False)
+        self.assertEqual(pool.choose_server(), "dc3")
+        self.assertEqual(pool.choose_server(["dc1", "dc2"]), "dc2")
+
+    def test_failing_server_is_circuit_broken(self):
+        self._winrm.down = {"dc2"}
+        pool = self._pool(failure_threshold=3, reset_timeout=60)
+
+        for _ in range(3):
+            response = pool.run_ps("Get-ADUser -Server dc2")
+            self.assertEqual(response.status_code, 1)
+        self.assertEqual(pool.stats()["dc2"]["state"], CircuitBreaker.OPEN)
+        self.assertEqual(pool.stats()["dc2"]["failures"], 3)
+        with self.assertRaises(ServerUnavailable):
+            pool.run_ps("Get-ADUser -Server dc2")
+        self.assertNotIn("dc2", {pool.choose_server() for _ in range(10)})
+
+        # After the timeout, a single script may try the server again
+        self._winrm.down = set()
+        self._clock.now += 60
+        self.assertEqual(pool.stats()["dc2"]["state"], CircuitBreaker.HALF_OPEN)
+        self.assertTrue(pool._server("dc2").breaker.allow())
+        self.assertFalse(pool._server("dc2").breaker.allow())
+        pool._server("dc2").breaker.success()
+        self.assertEqual(pool.choose_server(["dc2"]), "dc2")
+
+    def test_command_errors_do_not_break_the_circuit(self):
+        def run_ps(script):
+            return AttrDict(status_code=1, std_out=b"", std_err=b"User not found")
+
+        pool = SessionPool(lambda: AttrDict(run_ps=run_ps), servers=["dc1"])
+        for _ in range(5):
+            pool.run_ps("Get-ADUser -Server dc1")
+        self.assertEqual(pool.stats()["dc1"]["state"], CircuitBreaker.CLOSED)
+
+    def test_session_errors_do_not_break_the_circuit(self):
+        class Transport(Exception):
+            pass
+
+        def run_ps(script):
+            raise Transport()
+
+        pool = SessionPool(
+            lambda: AttrDict(run_ps=run_ps),
+            servers=["dc1"],
+            retry_exceptions=(Transport,),
+            clock=self._clock,
+        )
+        for script in ["Get-ADUser -Server dc1", "Get-ADUser"] * 5:
+            with self.assertRaises(Transport):
+                pool.run_ps(script)
+        self.assertEqual(pool.stats()["dc1"]["state"], CircuitBreaker.CLOSED)
+        self.assertEqual(pool.stats()["dc1"]["failures"], 5)
+        self.assertEqual(pool.choose_server(), "dc1")
+
+    def test_scripts_without_a_server_are_not_circuit_broken(self):
+        def run_ps(script):
+            return AttrDict(
+                status_code=1, std_out=b"", std_err=b"Unable to contact the server."
+            )
+
+        pool = SessionPool(lambda: AttrDict(run_ps=run_ps), clock=self._clock)
+        for _ in range(5):
+            self.assertEqual(pool.run_ps("Get-ADUser").status_code, 1)
+        self.assertEqual(pool.stats()[None]["state"], CircuitBreaker.CLOSED)
+
+    def test_timed_out_server_is_health_checked_before_it_is_chosen(self):
+        self._winrm.down = {"dc2"}
+        pool = self._pool(reset_timeout=60)
+        pool.health_check()
+
+        # Still down
+        self._clock.now += 60
+        with self.assertRaises(ServerUnavailable):
+            pool.choose_server(["dc2"])
+        self.assertEqual(self._winrm.servers, SERVERS + ["dc2"])
+
+        # Up again
+        self._winrm.down = set()
+        self._clock.now += 60
+        self.assertEqual(pool.choose_server(["dc2"]), "dc2")
+        self.assertEqual(pool.stats()["dc2"]["state"], CircuitBreaker.CLOSED)
+
+    def test_with_server(self):
+        pool = self._pool()
+        self.assertEqual(
+            pool.with_server(
+                'Get-ADUser -Server "dc1" | Set-ADUser -Server dc1', "dc2"
+            ),
+            'Get-ADUser -Server "dc2" | Set-ADUser -Server dc2',
+        )
+
+    def test_health_check(self):
+        self._winrm.down = {"dc3"}
+        pool = self._pool()
+        self.assertEqual(pool.health_check(), {"dc1": True, "dc2": True, "dc3": False})
+        self.assertEqual(pool.stats()["dc3"]["state"], CircuitBreaker.OPEN)
+
+        # Health checks run against open breakers, and close them again
+        self._winrm.down = set()
+        self.assertTrue(all(pool.health_check().values()))
+        self.assertEqual(pool.stats()["dc3"]["state"], CircuitBreaker.CLOSED)
+
+    def test_all_servers_unavailable(self):
+        self._winrm.down = set(SERVERS)
+        pool = self._pool()
+        pool.health_check()
+        with self.assertRaises(ServerUnavailable):
+            pool.choose_server()
+
+
+class _PooledADParameterReader(MockAD, ADParameterReader):
+    """Reader with a session pool of two sessions per server of the `winrm`, which
+    health checks them when it is made."""
+
+    def __init__(self, winrm, dump_width=None):
+        super().__init__()
+        self.results = {}
+        self.all_settings = {
+            "global": {"servers": SERVERS, "sessions_per_server": 2},
+            "primary": {
+                "servers": SERVERS,
+                "search_base": "",
+                "properties": ["SamAccountName", "cpr"],
+                "cpr_field": "cpr",
+                "cpr_separator": "",
+                "dump_width": dump_width,
+            },
+        }
+        self.retry_exceptions = ()
+        self._winrm = winrm
+        self.pool = self._create_pool()
+
+    def _create_session(self):
+        return self._winrm.create_session()
+
+    def _build_user_credential(self):
+        return ""
+
+    def get_from_ad(self, user=None, cpr=None, server=None):
+        self._run_ps_script("Get-ADUser -Server %s" % server)
+        day = cpr[:2]
+        return [{"SamAccountName": "user%s" % day, "cpr": "%s01011234" % day}]
+
+
+class TestPooledADParameterReader(TestCase):
+    def test_cache_all_reads_the_days_in_parallel(self):
+        winrm = _FakeWinRM(latency=0.01)
+        reader = _PooledADParameterReader(winrm)
+
+        users = reader.cache_all()
+        reader.pool.close()
+
+        # All days are read in order, spread across the servers
+        self.assertEqual(
+            [user["SamAccountName"] for user in users],
+            ["user%02d" % day for day in range(1, 32)],
+        )
+        self.assertEqual(set(winrm.max_running), set(SERVERS))
+        self.assertGreater(sum(winrm.max_running.values()), len(SERVERS))
+        # A script per day, and a health check of every server
+        self.assertEqual(
+            sum(s["calls"] for s in reader.pool.stats().values()), 31 + len(SERVERS)
+        )
+
+    def test_cache_all_reads_dump_width_days_at_a_time(self):
+        winrm = _FakeWinRM(latency=0.01)
+        reader = _PooledADParameterReader(winrm, dump_width=2)
+
+        users = reader.cache_all()
+        reader.pool.close()
+
+        self.assertEqual(len(users), 31)
+        self.assertEqual(winrm.max_total, 2)
+
+    def test_pool_is_health_checked_when_it_is_made(self):
+        winrm = _FakeWinRM(down={"dc3"})
+        reader = _PooledADParameterReader(winrm)
+        self.assertEqual(sorted(winrm.servers), SERVERS)
+        self.assertEqual(reader.pool.stats()["dc3"]["state"], CircuitBreaker.OPEN)
+
+    def test_script_against_an_unavailable_server_runs_against_another(self):
+        winrm = _FakeWinRM(down={"dc1", "dc2"})
+        reader = _PooledADParameterReader(winrm)
+        winrm.servers.clear()
+
+        self.assertEqual(reader._run_ps_script("Get-ADUser -Server dc1"), {})
+        self.assertEqual(winrm.servers, ["dc3"])
+
+        winrm.down = set(SERVERS)
+        reader.pool.health_check()
+        with self.assertRaises(ServerUnavailable):
+            reader._run_ps_script("Get-ADUser -Server dc1")
@@ -17,6 +17,7 @@ from more_itertools import only
 from os2mo_helpers.mora_helpers import MoraHelper
 from parameterized import parameterized
 
+from ..ad_dump import ADDump
 from ..ad_exceptions import CommandFailure
 from ..ad_exceptions import CprNotFoundInADException
 from ..ad_exceptions import CprNotNotUnique
@@ -27,7 +28,6 @@ from ..ad_template_engine import illegal_parameters
 from ..ad_writer import ADWriter
 from ..ad_writer import LoraCacheSource
 from ..user_names import UserNameSetInAD
-from ..utils import AttrDict
 from .mocks import MO_MANAGER_CPR
 from .mocks import MO_MANAGER_SAM
 from .mocks import MO_MANAGER_UUID
@@ -37,6 +37,7 @@ from .mocks import MO_USER_SAM
 from .mocks import MO_UUID
 from .mocks import MockADParameterReaderWithManager
 from .mocks import MockADWriterContext
+from .mocks import MockLoraCacheDict
 from .mocks import MockLoraCacheUnitAddress
 from .mocks import MockLoraCacheWithManager
 from .mocks import MockMOGraphqlSource
@@ -829,13 +830,30 @@ class TestADWriter(TestCase, TestADWriterMixin):
                 [{"cpr": "112233-4455"}, {"cpr": "112233-4455"}],
                 CprNotNotUnique,
             ),
+            # AD dump has a user whose CPR only differs by its separator
+            ([{"cpr": "1122334455"}], None, "-"),
+            # AD dump has users whose CPRs only differ by their separator
+            ([{"cpr": "112233-4455"}, {"cpr": "1122334455"}], CprNotNotUnique, "-"),
+            # Indexed AD dump has user without CPR
+            (ADDump([{"foo": "bar"}]), CprNotFoundInADException),
+            # Indexed AD dump has exactly one matching user
+            (ADDump([{"cpr": "112233-4455"}], cpr_separator="-"), None),
+            # Indexed AD dump has users whose CPRs only differ by their separator
+            (
+                ADDump(
+                    [{"cpr": "112233-4455"}, {"cpr": "1122334455"}], cpr_separator="-"
+                ),
+                CprNotNotUnique,
+            ),
         ]
     )
-    def test_find_ad_user_ad_dump(self, ad_dump, expected_exception):
+    def test_find_ad_user_ad_dump(self, ad_dump, expected_exception, cpr_separator=""):
         cpr = "112233-4455"
 
         def settings_transformer(settings):
-            settings["integrations.ad"][0].update({"cpr_field": "cpr"})
+            settings["integrations.ad"][0].update(
+                {"cpr_field": "cpr", "cpr_separator": cpr_separator}
+            )
             return settings
 
         self._setup_adwriter(
@@ -847,7 +865,7 @@ class TestADWriter(TestCase, TestADWriterMixin):
                 self.ad_writer._find_ad_user(cpr, ad_dump=ad_dump)
         else:
             ad_user = self.ad_writer._find_ad_user(cpr, ad_dump=ad_dump)
-            self.assertDictEqual(ad_user, {"cpr": "112233-4455"})
+            self.assertEqual([ad_user], list(ad_dump))
 
     def test_template_fails_on_undefined_variable(self):
         settings_transformer = dict_modifier(
@@ -876,7 +894,7 @@ class TestADWriter(TestCase, TestADWriterMixin):
                 "kaldenavn_efternavn": nickname_surname,
                 "cpr": "some_cpr",
             }
-            mock_lora_cache = AttrDict(
+            mock_lora_cache = MockLoraCacheDict(
                 {
                     "users": {user["uuid"]: [user]},
                     "engagements": {
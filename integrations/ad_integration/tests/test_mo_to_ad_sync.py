@@ -10,6 +10,7 @@ from .mocks import MO_UUID
 from .mocks import MockADParameterReader
 from .mocks import MockADParameterReaderWithManager
 from .mocks import MockADWriterContext
+from .mocks import MockBatchSession
 from .mocks import MockLoraCacheExtended
 from .mocks import MockLoraCacheWithManager
 from .test_utils import TestADWriterMixin
@@ -32,7 +33,7 @@ class TestMoToAdSync(TestCase, TestADWriterMixin):
         )
 
         def remove_manager_cpr(mo_values, *args, **kwargs):
-            del mo_values["manager_cpr"]
+            mo_values.pop("manager_cpr", None)
             return mo_values
 
         self._setup_adwriter(
@@ -72,6 +73,40 @@ class TestMoToAdSync(TestCase, TestADWriterMixin):
                     cm.records[0].message, r"Error updating AD user '.*?': .*"
                 )
 
+    def test_batched_sync(self, *args):
+        self.ad_writer.session = MockBatchSession()
+        self._assert_stats_ok(self._run(batch_size=10))
+        # The Set-ADUser command is run by a batch script
+        script = self.ad_writer.session.scripts[-1]
+        self.assertIn("Set-ADUser", script)
+        self.assertIn("ConvertTo-Json -InputObject $results", script)
+
+    def test_batched_sync_failure(self, *args):
+        self.ad_writer.session = MockBatchSession(fail="Set-ADUser")
+        with self.assertLogs("export") as cm:
+            self._assert_stats_ok(
+                self._run(batch_size=10),
+                num_successful=0,
+                num_critical_error=1,
+            )
+        self.assertRegex(cm.records[0].message, r"Error updating AD user '.*?': .*")
+
+    def test_batched_sync_of_ad_users_with_the_same_mo_user(self, *args):
+        self.ad_writer.session = MockBatchSession()
+        cpr_field = self.ad_writer.all_settings["primary"]["cpr_field"]
+        ad_user = self._mock_reader.read_user()
+        other_ad_user = {
+            **ad_user,
+            "SamAccountName": "other",
+            cpr_field: "0101010000",
+        }
+        with mock.patch.object(
+            self._mock_reader, "read_it_all", return_value=[ad_user, other_ad_user]
+        ):
+            self._assert_stats_ok(
+                self._run(batch_size=10), num_attempted=2, num_successful=2
+            )
+
     def _run(self, mo_uuid_field="ObjectGUID", **kwargs):
         return run_mo_to_ad_sync(
             self._mock_reader,
@@ -13,6 +13,7 @@ from .mocks import AD_UUID_FIELD
 from .mocks import MO_UUID
 from .mocks import UNKNOWN_CPR_NO
 from .mocks import MockADParameterReader
+from .mocks import MockBatchSession
 from .mocks import MockMoraHelper
 from .mocks import MockUnknownCPRADParameterReader
 
@@ -44,6 +45,21 @@ class _SyncMoUuidToAdRunPSScriptFails(_SyncMoUuidToAd):
         raise Exception("an exception!")
 
 
+class _SyncMoUuidToAdBatched(sync_mo_uuid_to_ad.SyncMoUuidToAd):
+    def __init__(self, ad_cpr_no):
+        super().__init__()
+        self.retry_exceptions = ()
+
+    def _get_mora_helper(self):
+        return MockMoraHelper(None)
+
+    def _create_session(self):
+        return MockBatchSession()
+
+    def _build_user_credential(self):
+        return ""
+
+
 # Based on this example:
 # https://docs.pytest.org/en/stable/example/parametrize.html#parametrizing-conditional-raising
 
@@ -127,6 +143,26 @@ class TestSyncMoUuidToAd(TestCase):
             instance.perform_sync(ad_users, mo_users)
             self.assertIn("failed to write MO UUID", cm.records[0].message)
 
+    def test_perform_sync_batched(self):
+        ad_users = [
+            {self._ad_cpr_field_name: cpr_no, "SamAccountName": sam}
+            for cpr_no, sam in (("1", "ok"), ("2", "FAIL"), ("3", "ok too"))
+        ]
+        mo_users = {"1": MO_UUID, "2": MO_UUID, "3": MO_UUID}
+        instance = self._get_instance(
+            settings={
+                "global": {"batch_size": 2},
+                "primary": {"cpr_field": self._ad_cpr_field_name, "search_base": ""},
+            },
+            cls=_SyncMoUuidToAdBatched,
+        )
+        with self.assertLogs("MoUuidAdSync", ERROR) as cm:
+            instance.perform_sync(ad_users, mo_users)
+        self.assertEqual(len(instance.session.scripts), 2)
+        self.assertEqual(instance.stats["updated"], 2)
+        self.assertEqual(len(cm.records), 1)
+        self.assertIn("failed to write MO UUID of 'FAIL'", cm.records[0].message)
+
     def _get_instance(self, settings=None, reader=None, cls=_SyncMoUuidToAd):
         _settings = {
             "integrations.ad.write.uuid_field": AD_UUID_FIELD,
@@ -462,6 +462,7 @@ class AdMoSyncTestSubclass(AdMoSync):
             {
                 "_get_setting": get_settings,
                 "read_user": read_user,
+                "close": lambda: None,
             }
         )
         return ad_reader
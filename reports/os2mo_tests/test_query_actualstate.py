@@ -12,6 +12,7 @@ from exporters.sql_export.sql_table_defs import WAdresse as Adresse
 from exporters.sql_export.sql_table_defs import WBruger as Bruger
 from exporters.sql_export.sql_table_defs import WEngagement as Engagement
 from exporters.sql_export.sql_table_defs import WEnhed as Enhed
+from exporters.sql_export.sql_table_defs import WEnhedSti as EnhedSti
 from exporters.sql_export.sql_table_defs import WTilknytning as Tilknytning
 from reports.query_actualstate import XLSXExporter
 from reports.query_actualstate import get_engine
@@ -22,6 +23,7 @@ from reports.query_actualstate import merge_trade_unions
 from reports.query_actualstate import rearrange
 from reports.query_actualstate import sessionmaker
 from reports.query_actualstate import set_of_org_units
+from reports.query_actualstate import unit_paths_are_current
 
 
 class Tests_xlxs(unittest.TestCase):
@@ -400,6 +402,42 @@ class Tests_db(unittest.TestCase):
         alle_enheder = set_of_org_units(self.session, "Hoved-MED")
         self.assertEqual(alle_enheder, set(["E2", "E3"]))
 
+    def add_unit_paths(self):
+        for enhed_uuid, sti in (
+            ("LE1", ["LE1"]),
+            ("LE2", ["LE1", "LE2"]),
+            ("E1", ["E1"]),
+            ("E2", ["E1", "E2"]),
+            ("E3", ["E1", "E2", "E3"]),
+        ):
+            for niveau, overenhed_uuid in enumerate(sti, start=1):
+                self.session.add(
+                    EnhedSti(
+                        enhed_uuid=enhed_uuid,
+                        niveau=niveau,
+                        overenhed_uuid=overenhed_uuid,
+                    )
+                )
+        self.session.commit()
+
+    def test_set_of_org_units_from_unit_paths(self):
+        self.assertFalse(unit_paths_are_current(self.session))
+        self.add_unit_paths()
+        self.assertTrue(unit_paths_are_current(self.session))
+        alle_enheder = set_of_org_units(self.session, "Under-MED")
+        self.assertEqual(alle_enheder, set(["E3"]))
+
+    def test_set_of_org_units_with_stale_unit_paths(self):
+        self.add_unit_paths()
+        # Move E3 from under E2 to under E1 after the paths were written
+        self.session.query(Enhed).filter(Enhed.uuid == "E3").update(
+            {"forældreenhed_uuid": "E1"}
+        )
+        self.session.commit()
+        self.assertFalse(unit_paths_are_current(self.session))
+        self.assertEqual(set_of_org_units(self.session, "Under-MED"), set())
+        self.assertEqual(set_of_org_units(self.session, "Hoved-MED"), {"E2", "E3"})
+
     def test_EMP_data(self):
         # hoved_enhed = self.session.query(Enhed).all()
         data = list_employees(self.session, "LØN-org")
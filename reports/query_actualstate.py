@@ -18,7 +18,11 @@ from fastramqpi.raclients.graph.client import GraphQLClient
 from gql import gql
 from more_itertools import prepend
 from pydantic import BaseSettings
+from sqlalchemy import and_
+from sqlalchemy import exists
+from sqlalchemy import inspect
 from sqlalchemy import or_
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm import sessionmaker
 
 from exporters.sql_export.lc_for_jobs_db import get_engine
@@ -26,6 +30,7 @@ from exporters.sql_export.sql_table_defs import WAdresse as Adresse
 from exporters.sql_export.sql_table_defs import WBruger as Bruger
 from exporters.sql_export.sql_table_defs import WEngagement as Engagement
 from exporters.sql_export.sql_table_defs import WEnhed as Enhed
+from exporters.sql_export.sql_table_defs import WEnhedSti as EnhedSti
 from exporters.sql_export.sql_table_defs import WTilknytning as Tilknytning
 
 
@@ -84,6 +89,60 @@ def expand_org_path(df: pd.DataFrame, path_col: str) -> pd.DataFrame:
     return df.join(org_paths)
 
 
+def unit_paths_are_current(session) -> bool:
+    """Whether the unit paths materialised by the export match the units.
+
+    The paths are only written by full exports, so units created, moved or deleted
+    since, e.g. by the event-driven export, leave them stale. The path of every unit
+    must be the path of its parent followed by the unit itself.
+    """
+    if not inspect(session.get_bind()).has_table(EnhedSti.__tablename__):
+        return False
+    own = aliased(EnhedSti)
+    parent_own = aliased(EnhedSti)
+    parent_path = aliased(EnhedSti)
+    parent = aliased(Enhed)
+    has_own_path = exists().where(
+        own.enhed_uuid == Enhed.uuid, own.overenhed_uuid == Enhed.uuid
+    )
+    below_parent = exists().where(
+        own.enhed_uuid == Enhed.uuid,
+        own.overenhed_uuid == Enhed.uuid,
+        parent_own.enhed_uuid == Enhed.forældreenhed_uuid,
+        parent_own.overenhed_uuid == Enhed.forældreenhed_uuid,
+        own.niveau == parent_own.niveau + 1,
+    )
+    has_parent = exists().where(parent.uuid == Enhed.forældreenhed_uuid)
+    misplaced_unit = (
+        session.query(Enhed.uuid)
+        .filter(or_(~has_own_path, and_(has_parent, ~below_parent)))
+        .first()
+    )
+    if misplaced_unit is not None:
+        return False
+    # Every row above a unit must also be a row of the path of its parent
+    unit = aliased(Enhed)
+    stale_path = (
+        session.query(EnhedSti.id)
+        .outerjoin(unit, unit.uuid == EnhedSti.enhed_uuid)
+        .filter(
+            or_(
+                unit.uuid.is_(None),
+                and_(
+                    EnhedSti.overenhed_uuid != EnhedSti.enhed_uuid,
+                    ~exists().where(
+                        parent_path.enhed_uuid == unit.forældreenhed_uuid,
+                        parent_path.overenhed_uuid == EnhedSti.overenhed_uuid,
+                        parent_path.niveau == EnhedSti.niveau,
+                    ),
+                ),
+            )
+        )
+        .first()
+    )
+    return stale_path is None
+
+
 def set_of_org_units(session, org_name: str) -> set:
     """Find all uuids of org_units under the organisation  :code:`org_name`."""
     query_result = (
@@ -96,6 +155,18 @@ def set_of_org_units(session, org_name: str) -> set:
     else:
         hoved_enhed = query_result[0]
 
+    # Use the unit paths materialised by the export, if they match the units
+    if unit_paths_are_current(session):
+        under_enheder = (
+            session.query(EnhedSti.enhed_uuid)
+            .filter(
+                EnhedSti.overenhed_uuid == hoved_enhed,
+                EnhedSti.enhed_uuid != hoved_enhed,
+            )
+            .all()
+        )
+        return set(enhed[0] for enhed in under_enheder)
+
     # Find all children of the unit and collect in a set
     def find_children(enheder):
         """Return a set of children under :code:`enheder`."""